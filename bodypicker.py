@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""Picking bodies along a view ray with a spatial index
+
+BodyPicker keeps a KD-tree (scipy.spatial.cKDTree) over the positions of
+all bodies. A pick walks the cone around the ray through the clicked
+pixel from the camera outwards; each piece of the cone is covered by one
+ball query, and the first piece that holds a body within the angular
+tolerance gives the result. It does not use VTK's per-actor pickers, so
+it works for instanced glyphs as well.
+
+The tree is not rebuilt for every change of time. Every body moves at
+most v_max * |t - t_tree| from its indexed position, so queries are
+widened by that amount and only the candidates are located exactly. The
+tree is rebuilt when this widening exceeds max_slack.
+
+Nor is it rebuilt when bodies are added, removed or changed (replace,
+extend, delete). Removed bodies are dropped from the query results, and
+the added and changed ones are kept out of the tree: they are located
+exactly at every pick, until there are more than max_loose of them.
+"""
+
+import math
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits
+
+
+def orbit_locator(orbits):
+    """Returns locate(index, t) and v_max for a set of orbits
+
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+    Returns: locate, vmax
+        locate: Function returning the positions (n, 3) of the orbits with
+            the given indices at time t
+        vmax: Largest speed of each orbit (speed at periapsis)
+    """
+    r0, v0, t0, mu = [np.array(v, dtype=float) for v in stack_orbits(orbits)]
+    rlen = np.sqrt((r0 ** 2).sum(axis=1))
+    energy = (v0 ** 2).sum(axis=1) * 0.5 - mu / rlen
+    h2 = (np.cross(r0, v0) ** 2).sum(axis=1)
+    ecc = np.sqrt(np.maximum(1.0 + 2.0 * energy * h2 / mu ** 2, 0.0))
+    vmax = mu * (1.0 + ecc) / np.sqrt(h2)
+
+    def locate(index, t):
+        index = np.asarray(index, dtype=int)
+        dt = np.full((index.shape[0], 1), float(t)) - t0[index, None]
+        pos, vel = twobodykernels.kepler(r0[index], v0[index], mu[index], dt)
+        return pos[:, 0]
+    return locate, vmax
+
+
+class BodyPicker:
+    """Spatial index of moving bodies for ray picking
+
+    """
+    def __init__(self, locate, vmax, max_slack=1.0e10, leafsize=32,
+                 max_loose=256):
+        """
+        Args:
+            locate: Function locate(index, t) returning positions (n, 3)
+                of the bodies with the given indices at time t
+            vmax: Largest speed of each body, shape (n,)
+            max_slack: Largest widening of queries before the tree is
+                rebuilt (length)
+            leafsize: Leaf size of the KD-tree
+            max_loose: Largest number of added or changed bodies kept out
+                of the tree before it is rebuilt
+        """
+        self.locate = locate
+        self.vmax = np.asarray(vmax, dtype=float)
+        self.max_slack = max_slack
+        self.leafsize = leafsize
+        self.max_loose = max_loose
+        self.tree = None
+        self.t_tree = None
+        self.t = None
+        self.slack = 0.0
+        self.rebuilds = 0
+        # Body of each point of the tree (-1 once removed), and the bodies
+        # whose point is missing or out of date
+        self.rows = np.zeros(0, dtype=int)
+        self.loose = np.zeros(len(self), dtype=bool)
+
+    def __len__(self):
+        return self.vmax.shape[0]
+
+    def set_time(self, t):
+        """Sets the time of the following picks
+
+        The tree is rebuilt only if bodies may have moved by more than
+        max_slack since it was built, or if more than max_loose bodies
+        were added or changed.
+        """
+        self.t = t
+        if self.tree is not None and \
+                np.count_nonzero(self.loose) <= self.max_loose:
+            self.slack = float(self.vmax.max() * abs(t - self.t_tree)) \
+                if len(self) else 0.0
+            if self.slack <= self.max_slack:
+                return
+        from scipy.spatial import cKDTree
+        self.tree = cKDTree(self.locate(np.arange(len(self)), t),
+                            leafsize=self.leafsize)
+        self.t_tree = t
+        self.slack = 0.0
+        self.rows = np.arange(len(self))
+        self.loose = np.zeros(len(self), dtype=bool)
+        self.rebuilds += 1
+
+    def replace(self, index, vmax):
+        """Changes the orbits of some bodies
+
+        Args:
+            index: Indices of the bodies
+            vmax: Their new largest speeds
+        """
+        index = np.asarray(index, dtype=int)
+        self.vmax[index] = vmax
+        self.loose[index] = True
+
+    def extend(self, vmax):
+        """Appends bodies after the existing ones
+
+        Args:
+            vmax: Largest speeds of the new bodies, shape (n,)
+        """
+        vmax = np.asarray(vmax, dtype=float).reshape(-1)
+        self.vmax = np.concatenate([self.vmax, vmax])
+        self.loose = np.concatenate([self.loose,
+                                     np.ones(vmax.shape[0], dtype=bool)])
+
+    def delete(self, index):
+        """Removes bodies; the following ones move down to fill the gaps
+
+        Args:
+            index: Indices of the bodies to remove
+        """
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(index, dtype=int)] = False
+        moved = np.where(keep, np.cumsum(keep) - 1, -1)
+        self.rows = np.where(self.rows >= 0,
+                             moved[np.maximum(self.rows, 0)], -1)
+        self.vmax = self.vmax[keep]
+        self.loose = self.loose[keep]
+
+    def pick(self, origin, direction, angle, near=None, far=None,
+             nsegment=512, batch=32):
+        """Returns the body closest to a ray within an angular tolerance
+
+        Args:
+            origin: Origin of the ray (camera position)
+            direction: Direction of the ray
+            angle: Angular tolerance in radians (e.g. a few pixels)
+            near, far: Range along the ray. Default is the extent of the
+                indexed bodies
+            nsegment: Largest number of pieces of the cone
+            batch: Number of pieces queried at once
+        Returns: index
+            index: Index of the picked body, or None
+        """
+        if self.tree is None or len(self) == 0:
+            return None
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        direction = direction / math.sqrt(float(direction @ direction))
+        tan = math.tan(angle)
+        # Bodies out of the tree are located exactly
+        loose = np.nonzero(self.loose)[0]
+        lrel = self.locate(loose, self.t) - origin if loose.shape[0] else \
+            np.zeros((0, 3))
+        lalong = lrel @ direction
+        lperp = np.sqrt(np.maximum((lrel ** 2).sum(axis=1) - lalong ** 2,
+                                   0.0))
+        # Distances from the origin to the bounding box of the bodies
+        lo = self.tree.mins - self.slack - origin
+        hi = self.tree.maxes + self.slack - origin
+        if far is None:
+            far = math.sqrt(float((np.maximum(np.abs(lo), np.abs(hi))
+                                   ** 2).sum()))
+            if loose.shape[0]:
+                far = max(far, float(np.sqrt((lrel ** 2).sum(axis=1)).max()))
+        if near is None:
+            # No body is closer than the nearest indexed one minus slack
+            dnn = float(self.tree.query(origin)[0]) - self.slack
+            near = max(dnn, self.slack, far * 1e-9)
+        # Pieces of the cone grow geometrically with distance; they are
+        # queried in batches from the camera outwards
+        ratio = max(1.0 + 4.0 * tan, (far / near) ** (1.0 / nsegment))
+        count = max(int(math.ceil(math.log(far / near) / math.log(ratio))), 1)
+        # The first piece covers the cone from the origin to near
+        d0 = np.concatenate([[0.0], near * ratio ** np.arange(count)])
+        d1 = np.concatenate([[near], d0[1:] * ratio])
+        count += 1
+        centers = origin + direction * (0.5 * (d0 + d1))[:, None]
+        radii = np.hypot(0.5 * (d1 - d0), d1 * tan) + self.slack
+        linside = (lalong > 0.0) & (lperp <= lalong * tan)
+        lpiece = np.minimum(np.searchsorted(d1, lalong, side='right'),
+                            count - 1)
+        for start in range(0, count, batch):
+            found = self.tree.query_ball_point(centers[start:start + batch],
+                                               radii[start:start + batch])
+            sizes = [len(index) for index in found]
+            mine = linside & (lpiece >= start) & (lpiece < start + batch)
+            if not any(sizes) and not mine.any():
+                continue
+            piece = np.repeat(np.arange(len(found)), sizes)
+            row = np.fromiter((j for f in found for j in f), dtype=int,
+                              count=piece.shape[0])
+            # Points of removed bodies and old points of changed ones
+            index = self.rows[row]
+            valid = index >= 0
+            valid[valid] = ~self.loose[index[valid]]
+            piece = piece[valid]
+            index = index[valid]
+            pos = self.tree.data[row[valid]]
+            if self.slack > 0.0 and index.shape[0]:
+                # Keep bodies whose indexed positions are within slack of
+                # the cone, then locate them at the current time
+                rel = pos - origin
+                along = rel @ direction
+                perp = np.sqrt(np.maximum((rel ** 2).sum(axis=1)
+                                          - along ** 2, 0.0))
+                keep = (along > (-1.0) * self.slack) & \
+                    (perp <= along * tan + self.slack * (1.0 + tan))
+                piece = piece[keep]
+                index = index[keep]
+                pos = self.locate(index, self.t) if index.shape[0] else \
+                    np.zeros((0, 3))
+            rel = pos - origin
+            along = rel @ direction
+            perp = np.sqrt(np.maximum((rel ** 2).sum(axis=1) - along ** 2,
+                                      0.0))
+            inside = (along > 0.0) & (perp <= along * tan)
+            if mine.any():
+                piece = np.concatenate([piece, lpiece[mine] - start])
+                index = np.concatenate([index, loose[mine]])
+                along = np.concatenate([along, lalong[mine]])
+                perp = np.concatenate([perp, lperp[mine]])
+                inside = np.concatenate([inside, linside[mine]])
+            if inside.any():
+                # Nearest piece first, then the smallest angle to the ray
+                first = piece[inside].min()
+                score = np.where(inside & (piece == first),
+                                 perp / np.maximum(along, 1e-300), np.inf)
+                return int(index[np.argmin(score)])
+        return None
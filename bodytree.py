@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Hierarchy of bodies: planets about the Sun, moons about planets
+
+BodyTree places every body of a tree rooted at the Sun. The planets
+(children of the Sun) come from SecularElements; the other bodies are
+two-body orbits about their parent, named by the orbit's mothername
+(e.g. moon_orbit() of solarsystem). A moon of a moon is allowed.
+
+Positions are computed level by level: all planets in one SecularElements
+call, the relative states of all requested satellites in one
+twobodykernels.kepler call, and then one vectorized addition of the
+parent positions per level of the tree.
+
+resolved() selects the satellites whose orbits are large enough on screen
+to be worth drawing; it only needs the planet positions, so satellites
+are not propagated at all while the camera is far away.
+"""
+
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits
+
+
+class BodyTree:
+    """Positions of the Sun, the planets and their satellites
+
+    """
+    def __init__(self, planets, satellites=(), root='Sun', precision=None):
+        """
+        Args:
+            planets: SecularElements of the bodies orbiting the root
+            satellites: Sequence of TwoBodyOrbit objects; the mothername
+                of each orbit is the name of its parent (a planet or
+                another satellite)
+            root: Name of the central body
+            precision: Accuracy tier of the satellite propagation (see
+                twobodykernels.PRECISIONS)
+        Exception:
+            ValueError: If a parent is unknown or the satellites form a
+                cycle, raises ValueError
+        """
+        satellites = list(satellites)
+        self.planets = planets
+        self.precision = precision
+        self.names = [root] + list(planets.names) + \
+            [orbit.bodyname for orbit in satellites]
+        self.nplanets = len(planets.names)
+        self.first = 1 + self.nplanets
+        index = {name: k for k, name in enumerate(self.names)}
+        n = len(self.names)
+        self.parent = np.full(n, -1, dtype=int)
+        self.parent[1:self.first] = 0
+        for k, orbit in enumerate(satellites):
+            if orbit.mothername not in index:
+                raise(ValueError('Unknown parent {}: '.format(
+                    orbit.mothername) + 'bodytree.BodyTree'))
+            self.parent[self.first + k] = index[orbit.mothername]
+        self.level = np.zeros(n, dtype=int)
+        self.level[1:self.first] = 1
+        for k in range(self.first, n):
+            node, depth = k, 0
+            while node != 0:
+                node = self.parent[node]
+                depth += 1
+                if depth > n:
+                    raise(ValueError('Cycle in the body tree: ' +
+                                     'bodytree.BodyTree'))
+            self.level[k] = depth
+        # Planet (child of the root) that each body belongs to
+        self.planet_of = np.arange(n)
+        while (self.level[self.planet_of] > 1).any():
+            deep = self.level[self.planet_of] > 1
+            self.planet_of[deep] = self.parent[self.planet_of[deep]]
+        if satellites:
+            self.r0, self.v0, self.t0, self.mu = stack_orbits(satellites)
+        else:
+            self.r0 = self.v0 = np.zeros((0, 3))
+            self.t0 = self.mu = np.zeros(0)
+        # Apoapsis distance of each satellite from its parent
+        rlen = np.sqrt((self.r0 ** 2).sum(axis=1))
+        energy = (self.v0 ** 2).sum(axis=1) * 0.5 - self.mu / rlen
+        h2 = (np.cross(self.r0, self.v0) ** 2).sum(axis=1)
+        ecc = np.sqrt(np.maximum(1.0 + 2.0 * energy * h2 / self.mu ** 2,
+                                 0.0))
+        with np.errstate(divide='ignore'):
+            self.apoapsis = np.where(energy < 0.0, (-1.0) * self.mu / energy
+                                     * 0.5 * (1.0 + ecc), np.inf)
+
+    def __len__(self):
+        return len(self.names)
+
+    def ancestors(self, index):
+        """Returns the indices of the bodies and of all their ancestors
+        """
+        needed = np.zeros(len(self), dtype=bool)
+        index = np.asarray(index, dtype=int)
+        while index.shape[0]:
+            index = index[~needed[index]]
+            needed[index] = True
+            index = self.parent[index]
+            index = index[index >= 0]
+        return np.nonzero(needed)[0]
+
+    def positions(self, t, index=None):
+        """Returns heliocentric positions of bodies at time t
+
+        Args:
+            t: Time
+            index: Indices of the bodies (in names). Default is all
+        Returns: pos
+            pos: Numpy array of shape (n, 3), in the order of index
+        """
+        pos, vel = self.states(t, index)
+        return pos
+
+    def states(self, t, index=None):
+        """Returns heliocentric positions and velocities at time t
+
+        Args:
+            t: Time
+            index: Indices of the bodies (in names). Default is all
+        Returns: pos, vel
+            pos, vel: Numpy arrays of shape (n, 3), in the order of index
+        """
+        n = len(self)
+        if index is None:
+            index = np.arange(n)
+            needed = index
+        else:
+            index = np.asarray(index, dtype=int)
+            needed = self.ancestors(index)
+        pos = np.zeros((n, 3))
+        vel = np.zeros((n, 3))
+        ppos, pvel = self.planets.posvelatt(float(t))
+        pos[1:self.first] = ppos
+        vel[1:self.first] = pvel
+        sat = needed[needed >= self.first]
+        if sat.shape[0]:
+            # Relative states of all satellites at once
+            k = sat - self.first
+            dt = np.full((k.shape[0], 1), float(t)) - self.t0[k, None]
+            rpos, rvel = twobodykernels.kepler(self.r0[k], self.v0[k],
+                                               self.mu[k], dt,
+                                               precision=self.precision)
+            pos[sat] = rpos[:, 0]
+            vel[sat] = rvel[:, 0]
+            # Parents are placed before their children
+            for level in range(2, int(self.level[sat].max()) + 1):
+                nodes = sat[self.level[sat] == level]
+                pos[nodes] += pos[self.parent[nodes]]
+                vel[nodes] += vel[self.parent[nodes]]
+        return pos[index], vel[index]
+
+    def resolved(self, t, eye, pixel_angle, min_pixels=4.0):
+        """Returns a mask of the satellites whose orbits are resolved
+
+        A satellite is drawn if its apoapsis distance, seen from the eye
+        at the distance of the planet it belongs to, spans at least
+        min_pixels pixels. Only the planets are placed for this test.
+
+        Args:
+            t: Time
+            eye: Camera position
+            pixel_angle: Angle subtended by one pixel (radians)
+            min_pixels: Smallest size of a drawn orbit in pixels
+        Returns: mask
+            mask: Boolean Numpy array over the satellites (bodies from
+                index self.first on)
+        """
+        ppos, pvel = self.planets.posvelatt(float(t))
+        planet = self.planet_of[self.first:] - 1
+        eye = np.asarray(eye, dtype=float)
+        dist = np.sqrt(((ppos[planet] - eye) ** 2).sum(axis=1))
+        return self.apoapsis >= dist * pixel_angle * min_pixels
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Hot reload of the catalog files, diffed body by body
+
+The viewer reads three pairs of catalog files (physical characteristics
+and Keplerian elements of the planets, asteroids and moons). When one of
+them is edited, reading it again is cheap, but rebuilding every orbit,
+polyline and sphere is not. CatalogWatcher polls the files, and when they
+change, compares the new rows with the old ones by body name, so that the
+caller only rebuilds the bodies that were added, removed or changed:
+
+    watcher = CatalogWatcher()
+    ...
+    for kind, (rows, added, removed, changed) in watcher.poll().items():
+        ...
+
+Rows are paired the same way as in solarsystem.read_planets() and the
+other readers (row k of the physical file with row k of the Keplerian
+one), and a body is identified by the name in its physical row. Polling
+only stats the files; they are read when their size or modification time
+changes and has then stayed the same for a moment, so that a file is not
+read half written.
+"""
+
+import os
+import time
+
+from solarsystem import _read_rows
+
+
+CATALOGS = {
+    'planets': ('Data/planets_physical_characteristics.csv',
+                'Data/planets_keplerian_elements.csv'),
+    'asteroids': ('Data/asteroids_physical_characteristics.csv',
+                  'Data/asteroids_keplerian_elements.csv'),
+    'moons': ('Data/moons_physical_characteristics.csv',
+              'Data/moons_keplerian_elements.csv'),
+}
+
+
+def read_catalog(physical, keplerian):
+    """Returns the rows of a pair of catalog files by body name
+
+    Args:
+        physical: File name of the physical characteristics
+        keplerian: File name of the Keplerian elements
+    Returns: rows
+        rows: dict of name: (physical row, Keplerian row), in file order.
+            Names are stripped of surrounding spaces
+    Exception:
+        ValueError: If two bodies have the same name
+    """
+    rows = {}
+    for p, k in zip(_read_rows(physical), _read_rows(keplerian)):
+        name = p[0].strip()
+        if name in rows:
+            raise(ValueError('Duplicate body ' + name
+                             + ': catalogreload.read_catalog'))
+        rows[name] = (p, k)
+    return rows
+
+
+def diff_catalog(old, new):
+    """Compares two versions of a catalog by body name
+
+    Args:
+        old: Previous rows, as returned by read_catalog()
+        new: Current rows
+    Returns: added, removed, changed
+        added: Names only in new, in the order of new
+        removed: Names only in old, in the order of old
+        changed: Names in both whose rows differ, in the order of new
+    """
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    changed = [name for name, rows in new.items()
+               if name in old and old[name] != rows]
+    return added, removed, changed
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileWatcher:
+    """Polls files for changes of size or modification time
+
+    """
+    def __init__(self, paths, settle=0.5):
+        """
+        Args:
+            paths: File names to watch
+            settle: A change is only reported once the file has stayed
+                the same for this long (seconds)
+        """
+        self.settle = settle
+        self.signatures = {path: _signature(path) for path in paths}
+        self.pending = {}
+
+    def poll(self, now=None):
+        """Returns the files that changed since they were last reported
+
+        Args:
+            now: Current time (seconds), default time.monotonic()
+        Returns: paths
+            paths: List of file names
+        """
+        now = time.monotonic() if now is None else now
+        paths = []
+        for path, known in self.signatures.items():
+            signature = _signature(path)
+            if signature == known:
+                self.pending.pop(path, None)
+                continue
+            seen = self.pending.get(path)
+            if seen is None or seen[0] != signature:
+                # Still being written; wait until it settles
+                self.pending[path] = (signature, now)
+            elif now - seen[1] >= self.settle:
+                del self.pending[path]
+                self.signatures[path] = signature
+                paths.append(path)
+        return paths
+
+
+class CatalogWatcher:
+    """Rows of the catalog files, kept up to date by polling
+
+    """
+    def __init__(self, catalogs=None, settle=0.5):
+        """
+        Args:
+            catalogs: dict of kind: (physical file, Keplerian file),
+                default CATALOGS
+            settle: See FileWatcher
+        """
+        self.catalogs = dict(CATALOGS if catalogs is None else catalogs)
+        self.rows = {kind: read_catalog(*files)
+                     for kind, files in self.catalogs.items()}
+        self.watcher = FileWatcher(
+            [path for files in self.catalogs.values() for path in files],
+            settle)
+
+    def poll(self, now=None):
+        """Reads the catalogs whose files changed and diffs them
+
+        A catalog that cannot be read (e.g. a missing file) is skipped
+        and kept at its previous rows until it is changed again.
+
+        Args:
+            now: See FileWatcher.poll()
+        Returns: changes
+            changes: dict of kind: (rows, added, removed, changed) for the
+                catalogs with at least one added, removed or changed body;
+                see diff_catalog()
+        """
+        paths = set(self.watcher.poll(now))
+        changes = {}
+        for kind, files in self.catalogs.items():
+            if paths.isdisjoint(files):
+                continue
+            try:
+                rows = read_catalog(*files)
+            except (OSError, ValueError):
+                continue
+            diff = diff_catalog(self.rows[kind], rows)
+            self.rows[kind] = rows
+            if any(diff):
+                changes[kind] = (rows,) + diff
+        return changes
+
+
+if __name__ == '__main__':
+    # Cost of a reload against rebuilding every orbit, on a large
+    # synthetic asteroid catalog where a few bodies change
+    import shutil
+    import tempfile
+    from solarsystem import Asteroid, asteroid_orbit
+    folder = tempfile.mkdtemp()
+    physical = os.path.join(folder, 'physical.csv')
+    keplerian = os.path.join(folder, 'keplerian.csv')
+    m, edits = 50000, 50
+
+    def write(shift):
+        with open(physical, 'w') as f:
+            f.write('Asteroid,H,G,diameter (km),x,x,x,Texture\n')
+            for i in range(m):
+                f.write('A{},10,0.15,{},0,0,0,Data\\2k_default.jpg\n'.format(
+                    i, 1 + i % 7))
+        with open(keplerian, 'w') as f:
+            f.write('Num,Name,Epoch,a,e,i,w,Node,M\n')
+            for i in range(m):
+                moved = shift if i % (m // edits) == 0 else 0.0
+                f.write('{0},A{0},59200,{1},0.1,{2},10,20,{3}\n'.format(
+                    i, 2.0 + i * 1e-5, i % 30, (i + moved) % 360))
+
+    try:
+        write(0.0)
+        watcher = CatalogWatcher({'asteroids': (physical, keplerian)},
+                                 settle=0.0)
+        start = time.perf_counter()
+        rows = read_catalog(physical, keplerian)
+        orbits = [asteroid_orbit(Asteroid(p, k)) for p, k in rows.values()]
+        full = time.perf_counter() - start
+        write(1.0)
+        start = time.perf_counter()
+        watcher.poll(now=0.0)
+        rows, added, removed, changed = watcher.poll(now=1.0)['asteroids']
+        for name in changed:
+            asteroid_orbit(Asteroid(*rows[name]))
+        part = time.perf_counter() - start
+        print('{} bodies, {} changed: full rebuild {:.2f} s, '
+              'reload {:.3f} s'.format(m, len(changed), full, part))
+    finally:
+        shutil.rmtree(folder)
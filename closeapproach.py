@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""Close-approach and MOID screening between orbits
+
+This module provides:
+  moid, moid_batch: Minimum orbit intersection distance (MOID) of pairs of
+      elliptic orbits. A coarse grid over both eccentric anomalies is
+      refined by successive zooms around the best cells and finished by
+      Newton steps, for all pairs at once. moid_batch first drops pairs
+      whose distance ranges [q, Q] from the central body are farther apart
+      than the threshold, using the sorted periapsis distances of one set
+      as index.
+  close_approaches: Encounters closer than a distance within a time window.
+      Positions are batch-propagated epoch by epoch, candidate pairs come
+      from a KD-tree over the positions, and the time and distance of
+      closest approach are refined by golden-section search.
+  golden_section: The vectorized golden-section search, also used by
+      ensemble.CloneEnsemble.closest_approach.
+
+Orbits can be given as sequences of TwoBodyOrbit objects or as an
+OrbitCatalog. Both functions report throughput statistics.
+"""
+
+import math
+import time
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits
+
+_GOLDEN = (math.sqrt(5.0) - 1.0) / 2.0
+
+
+def _frames(orbits):
+    """Returns a, e, P, Q (unit vectors to periapsis and 90 deg ahead)
+    """
+    if hasattr(orbits, 'column'):
+        a = orbits.column('a')
+        e = orbits.column('e')
+        pv = orbits.column('evd')
+        i = orbits.column('i')
+        lan = orbits.column('lan')
+        wv = np.column_stack([np.sin(lan) * np.sin(i),
+                              (-1.0) * np.cos(lan) * np.sin(i), np.cos(i)])
+    else:
+        a = np.array([orbit.a for orbit in orbits], dtype=float)
+        e = np.array([orbit.e for orbit in orbits], dtype=float)
+        pv = np.array([orbit.evd for orbit in orbits], dtype=float)
+        wv = np.array([orbit.hv for orbit in orbits], dtype=float)
+        wv = wv / np.linalg.norm(wv, axis=1)[:, None]
+    if np.any(e >= 1.0):
+        raise(ValueError('MOID needs elliptic orbits: closeapproach'))
+    return a, e, pv, np.cross(wv, pv)
+
+
+def _points(a, e, pv, qv, ecc_anm):
+    """Positions at eccentric anomalies; ecc_anm has shape (n, ...)
+    """
+    shape = (-1,) + (1,) * (ecc_anm.ndim - 1)
+    xp = (a.reshape(shape) * (np.cos(ecc_anm) - e.reshape(shape)))[..., None]
+    yp = (a.reshape(shape) * np.sqrt(1.0 - e.reshape(shape) ** 2)
+          * np.sin(ecc_anm))[..., None]
+    shape3 = (-1,) + (1,) * (ecc_anm.ndim - 1) + (3,)
+    return xp * pv.reshape(shape3) + yp * qv.reshape(shape3)
+
+
+def _newton(f1, f2, e1, e2, niter=6):
+    """Newton steps towards a stationary point of the squared distance
+    between the points at eccentric anomalies e1, e2 of frames f1, f2.
+    Steps that do not shorten the distance are not taken
+    """
+    def derivatives(a, e, pv, qv, ecc_anm):
+        b = a * np.sqrt(1.0 - e * e)
+        c = np.cos(ecc_anm)
+        s = np.sin(ecc_anm)
+        pos = (a * (c - e))[:, None] * pv + (b * s)[:, None] * qv
+        d1 = ((-1.0) * a * s)[:, None] * pv + (b * c)[:, None] * qv
+        d2 = ((-1.0) * a * c)[:, None] * pv - (b * s)[:, None] * qv
+        return pos, d1, d2
+
+    r1, t1, c1 = derivatives(*f1, e1)
+    r2, t2, c2 = derivatives(*f2, e2)
+    for it in range(niter):
+        dr = r1 - r2
+        g1 = (dr * t1).sum(axis=1)
+        g2 = (-1.0) * (dr * t2).sum(axis=1)
+        h11 = (t1 * t1).sum(axis=1) + (dr * c1).sum(axis=1)
+        h22 = (t2 * t2).sum(axis=1) - (dr * c2).sum(axis=1)
+        h12 = (-1.0) * (t1 * t2).sum(axis=1)
+        det = h11 * h22 - h12 * h12
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n1 = e1 - (h22 * g1 - h12 * g2) / det
+            n2 = e2 - (h11 * g2 - h12 * g1) / det
+        s1, u1, v1 = derivatives(*f1, n1)
+        s2, u2, v2 = derivatives(*f2, n2)
+        better = (((s1 - s2) ** 2).sum(axis=1) <= (dr ** 2).sum(axis=1)) \
+            & (det > 0.0) & (h11 > 0.0)
+        e1 = np.where(better, n1, e1)
+        e2 = np.where(better, n2, e2)
+        r1, t1, c1 = [np.where(better[:, None], x, y)
+                      for x, y in ((s1, r1), (u1, t1), (v1, c1))]
+        r2, t2, c2 = [np.where(better[:, None], x, y)
+                      for x, y in ((s2, r2), (u2, t2), (v2, c2))]
+    return e1, e2
+
+
+def _moid_frames(f1, f2, ngrid=48, nzoom=9, nlevel=16, ncand=6):
+    """MOID of the pairs of orbits given by frames f1[j], f2[j]
+    """
+    npair = f1[0].shape[0]
+    grid = np.linspace(0.0, math.pi * 2.0, ngrid, endpoint=False)
+    p1 = _points(*f1, np.broadcast_to(grid, (npair, ngrid)))
+    p2 = _points(*f2, np.broadcast_to(grid, (npair, ngrid)))
+    d2 = ((p1[:, :, None, :] - p2[:, None, :, :]) ** 2).sum(axis=-1)
+    flat = d2.reshape(npair, -1)
+    ncand = min(ncand, flat.shape[1])
+    best = np.argpartition(flat, ncand - 1, axis=1)[:, :ncand]
+
+    # Refine each candidate cell by zooming in
+    rows = np.repeat(np.arange(npair), ncand)
+    e1 = grid[best.ravel() // ngrid]
+    e2 = grid[best.ravel() % ngrid]
+    g1 = tuple(v[rows] for v in f1)
+    g2 = tuple(v[rows] for v in f2)
+    half = math.pi * 2.0 / ngrid
+    offsets = np.linspace(-1.0, 1.0, nzoom)
+    for level in range(nlevel):
+        s1 = e1[:, None] + offsets * half
+        s2 = e2[:, None] + offsets * half
+        q1 = _points(*g1, s1)
+        q2 = _points(*g2, s2)
+        d2 = ((q1[:, :, None, :] - q2[:, None, :, :]) ** 2).sum(axis=-1)
+        k = d2.reshape(rows.shape[0], -1).argmin(axis=1)
+        e1 = s1[np.arange(rows.shape[0]), k // nzoom]
+        e2 = s2[np.arange(rows.shape[0]), k % nzoom]
+        half *= 2.0 / (nzoom - 1)
+    # The zoom can stop short of the minimum in a long, narrow valley of
+    # the distance (nearly coplanar orbits); Newton steps finish it
+    e1, e2 = _newton(g1, g2, e1, e2)
+    dist = np.linalg.norm(_points(*g1, e1[:, None])[:, 0]
+                          - _points(*g2, e2[:, None])[:, 0], axis=1)
+    return dist.reshape(npair, ncand).min(axis=1)
+
+
+def moid(orbit1, orbit2):
+    """Returns the minimum orbit intersection distance of two orbits
+
+    Args:
+        orbit1, orbit2: TwoBodyOrbit objects (elliptic, same central body)
+    Returns: dist
+        dist: MOID in the length unit of the orbits
+    Exception:
+        ValueError: If an orbit is not elliptic, raises ValueError
+    """
+    return float(_moid_frames(_frames([orbit1]), _frames([orbit2]))[0])
+
+
+def moid_batch(orbits1, orbits2=None, threshold=None, chunk=2048):
+    """Computes MOIDs between two sets of orbits
+
+    Pairs whose distance ranges [q, Q] are farther apart than threshold
+    cannot have a MOID below it and are skipped.
+
+    Args:
+        orbits1: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        orbits2: Second set. If None, pairs within orbits1 (i < j) are used
+        threshold: Only pairs with MOID <= threshold are returned. If None,
+                   every pair is computed
+        chunk: Number of pairs evaluated per vectorized pass
+    Returns: i, j, dist, stats
+        i, j: Indices of the pairs in orbits1 and orbits2
+        dist: MOID of each pair
+        stats: Dictionary with 'pairs' (number of pairs in the input),
+               'refined' (pairs left after pruning), 'seconds' and
+               'pairs_per_second'
+    """
+    start = time.perf_counter()
+    f1 = _frames(orbits1)
+    same = orbits2 is None
+    f2 = f1 if same else _frames(orbits2)
+    n1 = f1[0].shape[0]
+    n2 = f2[0].shape[0]
+    npairs = n1 * (n1 - 1) // 2 if same else n1 * n2
+    limit = np.inf if threshold is None else threshold
+
+    # Radial pruning: MOID >= max(q2 - Q1, q1 - Q2). Loop over the
+    # smaller set and search the sorted periapsis distances of the other
+    swap = (not same) and n1 > n2
+    fo, fi = (f2, f1) if swap else (f1, f2)
+    q_in = fi[0] * (1.0 - fi[1])
+    big_in = fi[0] * (1.0 + fi[1])
+    order = np.argsort(q_in)
+    q_sorted = q_in[order]
+    pairs_o = []
+    pairs_n = []
+    for o in range(fo[0].shape[0]):
+        q_o = fo[0][o] * (1.0 - fo[1][o])
+        big_o = fo[0][o] * (1.0 + fo[1][o])
+        stop = np.searchsorted(q_sorted, big_o + limit, side='right')
+        j = order[:stop]
+        j = j[big_in[j] >= q_o - limit]
+        if same:
+            j = j[j > o]
+        pairs_o.append(np.full(j.shape[0], o))
+        pairs_n.append(j)
+    po = np.concatenate(pairs_o) if pairs_o else np.zeros(0, dtype=int)
+    pn = np.concatenate(pairs_n) if pairs_n else np.zeros(0, dtype=int)
+    pi, pj = (pn, po) if swap else (po, pn)
+
+    dist = np.empty(pi.shape[0])
+    for s in range(0, pi.shape[0], chunk):
+        sl = slice(s, s + chunk)
+        dist[sl] = _moid_frames(tuple(v[pi[sl]] for v in f1),
+                                tuple(v[pj[sl]] for v in f2))
+    keep = dist <= limit
+    seconds = time.perf_counter() - start
+    stats = {'pairs': npairs, 'refined': int(pi.shape[0]),
+             'seconds': seconds,
+             'pairs_per_second': npairs / seconds if seconds > 0 else np.inf}
+    return pi[keep], pj[keep], dist[keep], stats
+
+
+def _propagate(states, t):
+    """Positions and velocities of stacked states at times t, (m, k, 3)
+    """
+    r0, v0, t0, mu = states
+    pos, vel = twobodykernels.kepler(r0, v0, mu, t[None, :] - t0[:, None])
+    if not (np.isfinite(pos).all() and np.isfinite(vel).all()):
+        raise(RuntimeError('Could not compute position and velocity: ' +
+                           'closeapproach.close_approaches'))
+    return pos, vel
+
+
+def _separation(r1, v1, mu1, t01, r2, v2, mu2, t02, t):
+    pos1, vel1 = twobodykernels.kepler(r1, v1, mu1, (t - t01)[:, None])
+    pos2, vel2 = twobodykernels.kepler(r2, v2, mu2, (t - t02)[:, None])
+    return np.linalg.norm(pos1[:, 0] - pos2[:, 0], axis=1)
+
+
+def golden_section(func, lo, hi, step):
+    """Minimizes many functions of one variable at once by golden-section
+    search
+
+    Args:
+        func: Function taking x of shape (n,) and returning n values
+        lo, hi: Brackets of the minima, shape (n,)
+        step: Half width of the widest bracket in units of x. The brackets
+            shrink until they are about two units wide
+    Returns: x
+        x: Midpoints of the final brackets, shape (n,)
+    """
+    x1 = hi - _GOLDEN * (hi - lo)
+    x2 = lo + _GOLDEN * (hi - lo)
+    f1 = func(x1)
+    f2 = func(x2)
+    niter = int(math.ceil(math.log(max(step, 1.0)) / (-math.log(_GOLDEN))))
+    for it in range(niter):
+        left = f1 < f2
+        hi = np.where(left, x2, hi)
+        lo = np.where(left, lo, x1)
+        x1, x2 = np.where(left, hi - _GOLDEN * (hi - lo), x2), \
+            np.where(left, x1, lo + _GOLDEN * (hi - lo))
+        fnew = func(np.where(left, x1, x2))
+        f1, f2 = np.where(left, fnew, f2), np.where(left, f1, fnew)
+    return 0.5 * (lo + hi)
+
+
+def close_approaches(orbits1, orbits2, tstart, tend, step, distance,
+                     epochs_per_block=16):
+    """Finds encounters closer than distance between tstart and tend
+
+    Args:
+        orbits1: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        orbits2: Second set. If None, encounters within orbits1 are searched
+        tstart, tend: Time window
+        step: Sampling step. Encounters are caught as long as the relative
+              motion is close to linear over one step
+        distance: Encounter distance
+        epochs_per_block: Number of epochs propagated at once
+    Returns: events, stats
+        events: Structured Numpy array with fields 'i', 'j', 't', 'dist'
+                sorted by time
+        stats: Dictionary with 'pair_epochs' (pairs x epochs screened),
+               'candidates', 'seconds' and 'pair_epochs_per_second'
+    """
+    from scipy.spatial import cKDTree
+    start = time.perf_counter()
+    same = orbits2 is None
+    s1 = stack_orbits(orbits1)
+    s2 = s1 if same else stack_orbits(orbits2)
+    n1 = s1[0].shape[0]
+    n2 = s2[0].shape[0]
+    times = np.arange(tstart, tend + step * 0.5, step, dtype=float)
+
+    cand_i = []
+    cand_j = []
+    cand_t = []
+    for b in range(0, times.shape[0], epochs_per_block):
+        tb = times[b:b + epochs_per_block]
+        # The epoch states are stacked once above and reused by each block
+        pos1, vel1 = _propagate(s1, tb)
+        if same:
+            pos2, vel2 = pos1, vel1
+        else:
+            pos2, vel2 = _propagate(s2, tb)
+        for k in range(tb.shape[0]):
+            vmax = np.sqrt((vel1[:, k] ** 2).sum(axis=1)).max() \
+                + np.sqrt((vel2[:, k] ** 2).sum(axis=1)).max()
+            radius = distance + vmax * step * 0.5
+            if same:
+                pairs = cKDTree(pos1[:, k]).query_pairs(radius,
+                                                        output_type='ndarray')
+                ii, jj = pairs[:, 0], pairs[:, 1]
+            else:
+                # Index the larger set, query with the smaller one
+                if n2 >= n1:
+                    hits = cKDTree(pos2[:, k]).query_ball_point(pos1[:, k],
+                                                                radius)
+                    ii = np.repeat(np.arange(n1), [len(h) for h in hits])
+                    jj = np.fromiter((j for h in hits for j in h), dtype=int,
+                                     count=ii.shape[0])
+                else:
+                    hits = cKDTree(pos1[:, k]).query_ball_point(pos2[:, k],
+                                                                radius)
+                    jj = np.repeat(np.arange(n2), [len(h) for h in hits])
+                    ii = np.fromiter((i for h in hits for i in h), dtype=int,
+                                     count=jj.shape[0])
+            cand_i.append(ii)
+            cand_j.append(jj)
+            cand_t.append(np.full(ii.shape[0], tb[k]))
+
+    ci = np.concatenate(cand_i).astype(int) if cand_i else np.zeros(0, int)
+    cj = np.concatenate(cand_j).astype(int) if cand_j else np.zeros(0, int)
+    ct = np.concatenate(cand_t) if cand_t else np.zeros(0)
+
+    # Golden-section search for the closest approach around each sample
+    args = (s1[0][ci], s1[1][ci], s1[3][ci], s1[2][ci],
+            s2[0][cj], s2[1][cj], s2[3][cj], s2[2][cj])
+    lo = np.maximum(ct - step, tstart)
+    hi = np.minimum(ct + step, tend)
+    tmin = 0.5 * (lo + hi)
+    if ci.shape[0]:
+        tmin = golden_section(lambda t: _separation(*args, t), lo, hi, step)
+    dmin = _separation(*args, tmin) if ci.shape[0] else np.zeros(0)
+
+    events = np.zeros(0, dtype=[('i', int), ('j', int), ('t', float),
+                                ('dist', float)])
+    hit = dmin <= distance
+    if hit.any():
+        ev = np.zeros(int(hit.sum()), dtype=events.dtype)
+        ev['i'], ev['j'], ev['t'], ev['dist'] = ci[hit], cj[hit], \
+            tmin[hit], dmin[hit]
+        # The same encounter is found from neighbouring samples; keep the
+        # closest point of each run of samples
+        ev = np.sort(ev, order=['i', 'j', 't'])
+        new = np.ones(ev.shape[0], dtype=bool)
+        new[1:] = (ev['i'][1:] != ev['i'][:-1]) | \
+            (ev['j'][1:] != ev['j'][:-1]) | \
+            (ev['t'][1:] - ev['t'][:-1] > step * 2.0)
+        run = np.cumsum(new)
+        order = np.lexsort((ev['dist'], run))
+        first = np.ones(order.shape[0], dtype=bool)
+        first[1:] = run[order][1:] != run[order][:-1]
+        events = np.sort(ev[order[first]], order='t')
+
+    seconds = time.perf_counter() - start
+    pair_epochs = (n1 * (n1 - 1) // 2 if same else n1 * n2) * times.shape[0]
+    stats = {'pair_epochs': pair_epochs, 'candidates': int(ci.shape[0]),
+             'seconds': seconds,
+             'pair_epochs_per_second': pair_epochs / seconds
+             if seconds > 0 else np.inf}
+    return events, stats
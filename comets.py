@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Comet catalogs: perihelion elements, parabolic and near-parabolic orbits
+
+Comet orbits are given by perihelion distance q, eccentricity e and
+perihelion time T, and a large part of them are parabolic (e = 1) or
+within 1e-3 of it. read_mpc() reads the Minor Planet Center export file
+of cometary orbits (CometEls.txt) into an OrbitCatalog, with all rows
+computed at once by OrbitCatalog.from_perihelion().
+
+Near e = 1 the elliptic and hyperbolic initial guesses of the universal
+anomaly are poor, and the iteration used to take bisection steps (and
+TwoBodyOrbit.posvelatt its bracketing and bisection fallback) on a large
+share of such orbits. The kernels now start from the solution of Barker's
+equation there; run this module for the iteration counts, bisection rates
+and throughput on a catalog of comets:
+
+    python comets.py [CometEls.txt]
+
+Without a file, synthetic_elements() makes a catalog of the size and mix
+of the MPC one.
+"""
+
+import numpy as np
+
+from orbitcatalog import OrbitCatalog
+
+AU = 1.496e11
+DAY = 86400.0
+
+
+def read_mpc(filename, mname='Sun', mu=1.32712440041e20, au=AU):
+    """Reads the MPC export file of cometary orbits
+
+    Args:
+        filename: Path of the file (CometEls.txt). Columns 15-29 hold the
+            perihelion date (TT), 31-39 q (AU), 42-49 e, 52-59 the
+            argument of perihelion, 62-69 the node, 72-79 the inclination
+            (degrees, J2000 ecliptic) and 103-158 the designation and name
+        mname: Name of the central body
+        mu: Gravitational parameter of the central body
+        au: Length of the astronomical unit in the units of mu
+    Returns: catalog
+        catalog: OrbitCatalog with times in seconds from MJD 0
+    """
+    # solarsystem is only needed here
+    from solarsystem import date_to_mjd
+    names = []
+    values = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if len(line) < 80 or not line[14:18].strip():
+                continue
+            mjd = date_to_mjd(int(line[14:18]), int(line[19:21]),
+                              float(line[22:29]))
+            values.append((mjd, line[30:39], line[41:49], line[51:59],
+                           line[61:69], line[71:79]))
+            names.append(line[102:158].strip())
+    T, q, e, w, node, i = np.array(values, dtype=float).reshape(-1, 6).T
+    return OrbitCatalog.from_perihelion(names, q * au, e, i, node, w,
+                                        T * DAY, mname, mu)
+
+
+def synthetic_elements(n=4000, seed=0):
+    """Returns perihelion elements of a synthetic comet catalog
+
+    The mix follows the MPC catalog: 15% short-period (e 0.2 to 0.9), 30%
+    long-period (1 - e from 1e-5 to 0.1), 35% parabolic, 40% of them Kreutz
+    sungrazers (q = 0.0055 au), and 20% hyperbolic (e - 1 from 1e-5 to
+    0.05), with perihelia within 10 years of MJD 60000.
+
+    Args:
+        n: Number of comets
+        seed: Seed of the random generator
+    Returns: names, q, e, i, node, w, T
+        Arguments of OrbitCatalog.from_perihelion(); q in m, angles in
+        degrees, T in seconds from MJD 0
+    """
+    rng = np.random.default_rng(seed)
+    kind = rng.choice(4, n, p=[0.15, 0.3, 0.35, 0.2])
+    q = np.exp(rng.uniform(np.log(0.3), np.log(8.0), n))
+    e = np.ones(n)
+    e[kind == 0] = rng.uniform(0.2, 0.9, (kind == 0).sum())
+    e[kind == 1] = 1.0 - 10.0 ** rng.uniform(-5.0, -1.0, (kind == 1).sum())
+    e[kind == 3] = 1.0 + 10.0 ** rng.uniform(-5.0, -1.3, (kind == 3).sum())
+    q[(kind == 2) & (rng.random(n) < 0.4)] = 0.0055
+    names = ['C/{}'.format(j) for j in range(n)]
+    T = (60000.0 + rng.uniform(-3652.5, 3652.5, n)) * DAY
+    return names, q * AU, e, rng.uniform(0.0, 180.0, n), \
+        rng.uniform(0.0, 360.0, n), rng.uniform(0.0, 360.0, n), T
+
+
+if __name__ == '__main__':
+    # Iterations, bisection rates and throughput on a comet catalog, 16
+    # epochs within 20 years of each perihelion
+    import sys
+    import time
+    import warnings
+    import scipy.optimize
+    import twobodykernels
+    from pytwobodyorbit import TwoBodyOrbit
+    start = time.perf_counter()
+    if len(sys.argv) > 1:
+        catalog = read_mpc(sys.argv[1])
+    else:
+        catalog = OrbitCatalog.from_perihelion(*synthetic_elements())
+    e = catalog.column('e')
+    m = len(catalog)
+    print('{} comets read in {:.3f} s: {} elliptic, {} parabolic, '
+          '{} hyperbolic'.format(m, time.perf_counter() - start,
+                                 (e < 1.0).sum(), (e == 1.0).sum(),
+                                 (e > 1.0).sum()))
+    r0, v0, t0, mu = [np.ascontiguousarray(v) for v in catalog.states()]
+    dt = np.random.default_rng(1).uniform(-20.0, 20.0, (m, 16)) \
+        * 365.25 * DAY
+    groups = (('e < 0.9', e < 0.9), ('0.9 <= e < 1', (e >= 0.9) & (e < 1.0)),
+              ('e = 1', e == 1.0), ('e > 1', e > 1.0))
+
+    print('kernel (numpy)  mean iterations / elements with bisection steps')
+    for tier, settings in twobodykernels.PRECISIONS.items():
+        counts = np.zeros((2,) + dt.shape, dtype=np.int64)
+        twobodykernels._anomaly_numpy(
+            r0, v0, mu, dt, settings['kepler_tol'], settings['kepler_rtol'],
+            settings['kepler_maxiter'], settings['guess'], counts)
+        print('  {:8s} '.format(tier) + '  '.join(
+            '{}: {:.1f} / {:.2%}'.format(name, counts[0][sel].mean(),
+                                         (counts[1][sel] > 0).mean())
+            for name, sel in groups if sel.any()))
+
+    print('kernel throughput (states/s)')
+    for backend in twobodykernels.BACKENDS:
+        twobodykernels.set_backend(backend)
+        for tier in twobodykernels.PRECISIONS:
+            twobodykernels.kepler(r0, v0, mu, dt, precision=tier)
+            start = time.perf_counter()
+            twobodykernels.kepler(r0, v0, mu, dt, precision=tier)
+            print('  {:8s} {:6s} {:.3g}'.format(
+                tier, backend, dt.size / (time.perf_counter() - start)))
+
+    # TwoBodyOrbit.posvelatt: count the calls that end in scipy's bisect
+    fallbacks = [0]
+    bisect = scipy.optimize.bisect
+
+    def counted(*args, **kwargs):
+        fallbacks[0] += 1
+        return bisect(*args, **kwargs)
+    scipy.optimize.bisect = counted
+    calls = 0
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for row in range(0, m, 10):
+            orbit = TwoBodyOrbit(catalog.names[row])
+            orbit.setOrbCart(t0[row], r0[row], v0[row])
+            for t in dt[row, :4]:
+                orbit.posvelatt(t0[row] + t)
+                calls += 1
+    seconds = time.perf_counter() - start
+    scipy.optimize.bisect = bisect
+    print('TwoBodyOrbit.posvelatt: {} calls, {:.2%} bisection fallbacks, '
+          '{:.0f} calls/s'.format(calls, fallbacks[0] / calls,
+                                  calls / seconds))
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""Monte Carlo clone ensembles for orbital uncertainty
+
+CloneEnsemble draws n clones of each of m objects from a covariance of
+their orbital elements (a, e, i, node, argument of periapsis, mean
+anomaly) or of their epoch states, and keeps the clones as epoch state
+arrays. All m * n clones are propagated in one twobodykernels.kepler call.
+
+An ensemble has a states() method like OrbitCatalog, so it can be passed
+wherever orbits are accepted (pytwobodyorbit.propagate,
+closeapproach.close_approaches, VisibilityCuller, ...). Clones of object j
+are rows j * n to (j + 1) * n.
+
+Units of covariances: meters for a, degrees for the angles; meters and
+m/s for states.
+"""
+
+import numpy as np
+
+import twobodykernels
+from closeapproach import golden_section
+from pytwobodyorbit import stack_orbits
+from secularelements import solve_kepler
+
+SPREAD_DTYPE = np.dtype([('mean', float, 3), ('offset', float, 3),
+                         ('radial', float), ('along', float),
+                         ('cross', float), ('major', float)])
+
+
+def nominal_elements(orbits):
+    """Returns a, e, i, node, argument of periapsis, mean anomaly
+
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog, on
+            elliptic orbits
+    Returns: elements, t0, mu
+        elements: Numpy array (m, 6); a in meters, angles in degrees
+        t0: Epochs, shape (m,)
+        mu: Gravitational parameters, shape (m,)
+    """
+    keys = ('a', 'e', 'i', 'lan', 'parg', 'ma')
+    if hasattr(orbits, 'column'):
+        cols = [orbits.column(key) for key in keys]
+        t0 = orbits.column('t0').copy()
+        mu = np.full(len(orbits), orbits.mu)
+    else:
+        orbits = list(orbits)
+        cols = [np.array([getattr(orbit, key) for orbit in orbits],
+                         dtype=float) for key in keys]
+        t0 = np.array([orbit.t0 for orbit in orbits], dtype=float)
+        mu = np.array([orbit.mu for orbit in orbits], dtype=float)
+    elements = np.stack(cols, axis=1)
+    elements[:, 2:] = np.degrees(elements[:, 2:])
+    return elements, t0, mu
+
+
+def elements_to_states(elements, mu):
+    """Converts elliptic orbital elements to states, vectorized
+
+    Args:
+        elements: Array (..., 6) of a (meters), e, i, node, argument of
+            periapsis and mean anomaly (degrees)
+        mu: Gravitational parameter, scalar or broadcast with elements[..., 0]
+    Returns: pos, vel
+        pos, vel: Numpy arrays of shape (..., 3)
+    """
+    elements = np.asarray(elements, dtype=float)
+    a = elements[..., 0]
+    e = elements[..., 1]
+    i, lan, parg, ma = [np.radians(elements[..., k]) for k in range(2, 6)]
+    ecc_anm = solve_kepler(ma, e)
+    cos_e = np.cos(ecc_anm)
+    sin_e = np.sin(ecc_anm)
+    b_over_a = np.sqrt(1.0 - e * e)
+    xp = a * (cos_e - e)
+    yp = a * b_over_a * sin_e
+    edot = np.sqrt(mu / a ** 3) / (1.0 - e * cos_e)
+    vxp = (-1.0) * a * sin_e * edot
+    vyp = a * b_over_a * cos_e * edot
+    cl, sl = np.cos(lan), np.sin(lan)
+    cw, sw = np.cos(parg), np.sin(parg)
+    ci, si = np.cos(i), np.sin(i)
+    pvec = np.stack([cl * cw - sl * sw * ci, sl * cw + cl * sw * ci,
+                     sw * si], axis=-1)
+    qvec = np.stack([(-1.0) * cl * sw - sl * cw * ci,
+                     (-1.0) * sl * sw + cl * cw * ci, cw * si], axis=-1)
+    pos = pvec * xp[..., None] + qvec * yp[..., None]
+    vel = pvec * vxp[..., None] + qvec * vyp[..., None]
+    return pos, vel
+
+
+def _covariances(cov, m):
+    # (6,) sigmas, (6, 6) or (m, 6, 6) covariances -> (m, 6, 6)
+    cov = np.asarray(cov, dtype=float)
+    if cov.shape == (6,):
+        cov = np.diag(cov ** 2)
+    if cov.shape == (6, 6):
+        cov = np.broadcast_to(cov, (m, 6, 6))
+    if cov.shape != (m, 6, 6):
+        raise(ValueError('Covariance must have shape (6,), (6, 6) or ' +
+                         '(m, 6, 6): ensemble.CloneEnsemble'))
+    return cov
+
+
+def _sample(center, cov, n, rng):
+    # n samples around each center (m, 6) -> (m, n, 6)
+    m = center.shape[0]
+    # eigh rather than cholesky accepts singular (e.g. diagonal with zeros)
+    # covariances
+    w, v = np.linalg.eigh(cov)
+    scale = v * np.sqrt(np.maximum(w, 0.0))[:, None, :]
+    z = rng.standard_normal((m, n, 6))
+    return center[:, None, :] + np.einsum('mij,mnj->mni', scale, z)
+
+
+class CloneEnsemble:
+    """Clones of m objects, n per object, as epoch state arrays
+
+    """
+    def __init__(self, r0, v0, t0, mu, nominal, names=None):
+        """
+        Args:
+            r0, v0: Epoch states of the clones, shape (m * n, 3)
+            t0: Epoch of the clones, shape (m * n,)
+            mu: Gravitational parameters, shape (m * n,)
+            nominal: Epoch states of the nominal orbits (r0, v0, t0, mu)
+                with arrays of shape (m, 3), (m, 3), (m,), (m,)
+            names: Names of the objects
+        """
+        self.r0 = np.ascontiguousarray(r0, dtype=float)
+        self.v0 = np.ascontiguousarray(v0, dtype=float)
+        self.t0 = np.ascontiguousarray(t0, dtype=float)
+        self.mu = np.ascontiguousarray(mu, dtype=float)
+        self.nominal = tuple(np.asarray(v, dtype=float) for v in nominal)
+        self.m = self.nominal[0].shape[0]
+        self.n = self.r0.shape[0] // max(self.m, 1)
+        self.names = list(names) if names is not None else [''] * self.m
+
+    @classmethod
+    def from_elements(cls, orbits, cov, n, seed=None):
+        """Samples clones from a covariance of orbital elements
+
+        Args:
+            orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+                (elliptic orbits)
+            cov: Sigmas (6,), covariance (6, 6), or covariances (m, 6, 6)
+                of a (meters), e, i, node, argument of periapsis and mean
+                anomaly (degrees) at the epoch of each orbit
+            n: Number of clones per object
+            seed: Seed of the random generator
+        """
+        rng = np.random.default_rng(seed)
+        elements, t0, mu = nominal_elements(orbits)
+        m = elements.shape[0]
+        samples = _sample(elements, _covariances(cov, m), n, rng)
+        samples[..., 1] = np.clip(samples[..., 1], 0.0, 1.0 - 1e-9)
+        pos, vel = elements_to_states(samples, mu[:, None])
+        return cls(pos.reshape(-1, 3), vel.reshape(-1, 3),
+                   np.repeat(t0, n), np.repeat(mu, n), stack_orbits(orbits),
+                   _names(orbits))
+
+    @classmethod
+    def from_states(cls, orbits, cov, n, seed=None):
+        """Samples clones from a covariance of the epoch states
+
+        Args:
+            orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+            cov: Sigmas (6,), covariance (6, 6), or covariances (m, 6, 6)
+                of position (meters) and velocity (m/s) at the epoch of
+                each orbit
+            n: Number of clones per object
+            seed: Seed of the random generator
+        """
+        rng = np.random.default_rng(seed)
+        r0, v0, t0, mu = [np.asarray(v, dtype=float)
+                          for v in stack_orbits(orbits)]
+        m = r0.shape[0]
+        samples = _sample(np.concatenate([r0, v0], axis=1),
+                          _covariances(cov, m), n, rng)
+        return cls(samples[..., :3].reshape(-1, 3),
+                   samples[..., 3:].reshape(-1, 3), np.repeat(t0, n),
+                   np.repeat(mu, n), (r0, v0, t0, mu), _names(orbits))
+
+    def __len__(self):
+        return self.r0.shape[0]
+
+    def states(self):
+        """Returns epoch states of all clones (r0, v0, t0, mu)
+        """
+        return self.r0, self.v0, self.t0, self.mu
+
+    def _rows(self, index):
+        # Rows of the clones of the given objects
+        index = np.asarray(index, dtype=int).reshape(-1)
+        return (index[:, None] * self.n + np.arange(self.n)).ravel()
+
+    def replace(self, index, clones):
+        """Replaces the clones of some objects, e.g. after a catalog update
+
+        Args:
+            index: Indices of the objects, shape (k,)
+            clones: CloneEnsemble of their new clones, k objects with n
+                clones each
+        """
+        index = np.asarray(index, dtype=int).reshape(-1)
+        if clones.m != index.shape[0] or clones.n != self.n:
+            raise(ValueError('One object of n clones is needed per index: '
+                             'ensemble.CloneEnsemble.replace'))
+        rows = self._rows(index)
+        self.r0[rows], self.v0[rows] = clones.r0, clones.v0
+        self.t0[rows], self.mu[rows] = clones.t0, clones.mu
+        for mine, theirs in zip(self.nominal, clones.nominal):
+            mine[index] = theirs
+        for i, name in zip(index, clones.names):
+            self.names[i] = name
+
+    def extend(self, clones):
+        """Appends the objects of another ensemble with n clones each
+
+        Args:
+            clones: CloneEnsemble of the new objects
+        """
+        if clones.m and clones.n != self.n:
+            raise(ValueError('Ensembles must have the same number of clones: '
+                             'ensemble.CloneEnsemble.extend'))
+        self.r0 = np.concatenate([self.r0, clones.r0])
+        self.v0 = np.concatenate([self.v0, clones.v0])
+        self.t0 = np.concatenate([self.t0, clones.t0])
+        self.mu = np.concatenate([self.mu, clones.mu])
+        self.nominal = tuple(np.concatenate([mine, theirs]) for mine, theirs
+                             in zip(self.nominal, clones.nominal))
+        self.names += clones.names
+        self.m += clones.m
+
+    def delete(self, index):
+        """Removes objects; the following ones move down to fill the gaps
+
+        Args:
+            index: Indices of the objects to remove
+        """
+        keep = np.ones(self.m, dtype=bool)
+        keep[np.asarray(index, dtype=int)] = False
+        rows = np.repeat(keep, self.n)
+        self.r0, self.v0 = self.r0[rows], self.v0[rows]
+        self.t0, self.mu = self.t0[rows], self.mu[rows]
+        self.nominal = tuple(v[keep] for v in self.nominal)
+        self.names = [name for name, k in zip(self.names, keep) if k]
+        self.m = int(keep.sum())
+
+    def propagate(self, t):
+        """Returns positions and velocities of all clones at times t
+
+        Args:
+            t: Time, or array-like object of times of shape (k,)
+        Returns: pos, vel
+            pos, vel: Numpy arrays of shape (m, n, k, 3)
+        """
+        ts = np.atleast_1d(np.asarray(t, dtype=float))
+        pos, vel = twobodykernels.kepler(self.r0, self.v0, self.mu,
+                                         ts[None, :] - self.t0[:, None])
+        shape = (self.m, self.n, ts.shape[0], 3)
+        return pos.reshape(shape), vel.reshape(shape)
+
+    def positions(self, t):
+        """Returns positions of all clones at time t, shape (m * n, 3)
+        """
+        pos, vel = twobodykernels.kepler(
+            self.r0, self.v0, self.mu,
+            np.full((len(self), 1), float(t)) - self.t0[:, None])
+        return pos[:, 0]
+
+    def spread(self, t):
+        """Returns statistics of each cloud at time t
+
+        Args:
+            t: Time
+        Returns: stats
+            stats: Structured Numpy array of shape (m,) with fields 'mean'
+                (mean position), 'offset' (mean minus nominal position),
+                'radial', 'along', 'cross' (standard deviations in the
+                radial / along-track / cross-track frame of the nominal
+                orbit) and 'major' (largest principal standard deviation)
+        """
+        pos = self.positions(t).reshape(self.m, self.n, 3)
+        r0, v0, t0, mu = self.nominal
+        npos, nvel = twobodykernels.kepler(r0, v0, mu,
+                                           float(t) - t0[:, None])
+        npos, nvel = npos[:, 0], nvel[:, 0]
+        radial = npos / np.sqrt((npos ** 2).sum(axis=1))[:, None]
+        normal = np.cross(npos, nvel)
+        normal /= np.sqrt((normal ** 2).sum(axis=1))[:, None]
+        along = np.cross(normal, radial)
+        mean = pos.mean(axis=1)
+        dev = pos - mean[:, None, :]
+        cov = np.einsum('mni,mnj->mij', dev, dev) / max(self.n - 1, 1)
+        stats = np.zeros(self.m, dtype=SPREAD_DTYPE)
+        stats['mean'] = mean
+        stats['offset'] = mean - npos
+        for name, axis in (('radial', radial), ('along', along),
+                           ('cross', normal)):
+            stats[name] = np.sqrt(np.einsum('mi,mij,mj->m', axis, cov, axis))
+        stats['major'] = np.sqrt(np.maximum(np.linalg.eigvalsh(cov)[:, -1],
+                                            0.0))
+        return stats
+
+    def closest_approach(self, target, tstart, tend, step,
+                         epochs_per_block=16):
+        """Time and distance of the closest approach of each clone to a target
+
+        The clones are sampled every step, all at once, and the time of the
+        smallest sampled distance is refined by golden-section search
+        within one step on either side. Unlike close_approaches, no
+        screening radius is needed, which would take in whole clouds at a
+        time when they are much smaller than the distance travelled in one
+        step.
+
+        Args:
+            target: TwoBodyOrbit of the target (e.g. the osculating orbit
+                of the Earth from SecularElements.orbit)
+            tstart, tend: Time window
+            step: Sampling step. Short enough that the distance has one
+                minimum within two steps
+            epochs_per_block: Number of epochs propagated at once
+        Returns: t, dist
+            t, dist: Numpy arrays of shape (m, n)
+        """
+        times = np.arange(tstart, tend + step * 0.5, step, dtype=float)
+        tr0, tv0, tt0, tmu = stack_orbits([target])
+        tpos, tvel = twobodykernels.kepler(tr0, tv0, tmu,
+                                           times[None, :] - tt0[:, None])
+        best = np.full(len(self), np.inf)
+        tbest = np.full(len(self), float(tstart))
+        for b in range(0, times.shape[0], epochs_per_block):
+            tb = times[b:b + epochs_per_block]
+            pos, vel = twobodykernels.kepler(self.r0, self.v0, self.mu,
+                                             tb[None, :] - self.t0[:, None])
+            d2 = ((pos - tpos[:, b:b + epochs_per_block]) ** 2).sum(axis=-1)
+            k = d2.argmin(axis=1)
+            d2 = d2[np.arange(len(self)), k]
+            closer = d2 < best
+            best[closer] = d2[closer]
+            tbest[closer] = tb[k[closer]]
+
+        def separation(t):
+            pos, vel = twobodykernels.kepler(self.r0, self.v0, self.mu,
+                                             (t - self.t0)[:, None])
+            ref, vel = twobodykernels.kepler(
+                np.broadcast_to(tr0, (t.shape[0], 3)),
+                np.broadcast_to(tv0, (t.shape[0], 3)),
+                np.broadcast_to(tmu, t.shape), (t - tt0[0])[:, None])
+            return np.sqrt(((pos[:, 0] - ref[:, 0]) ** 2).sum(axis=1))
+
+        lo = np.maximum(tbest - step, tstart)
+        hi = np.minimum(tbest + step, tend)
+        tmin = golden_section(separation, lo, hi, step)
+        dmin = separation(tmin)
+        # The search can end off the minimum (e.g. two minima within the
+        # bracket); the sample is kept then, with its own time
+        coarse = np.sqrt(best) < dmin
+        tmin[coarse] = tbest[coarse]
+        dmin[coarse] = np.sqrt(best[coarse])
+        shape = (self.m, self.n)
+        return tmin.reshape(shape), dmin.reshape(shape)
+
+    def approach_probability(self, target, tstart, tend, step, distance):
+        """Fraction of the clones of each object passing within distance
+
+        Args:
+            target: TwoBodyOrbit of the target
+            tstart, tend: Time window
+            step: Sampling step (see closest_approach)
+            distance: Encounter distance (e.g. the radius of the target)
+        Returns: probability
+            probability: Numpy array of shape (m,)
+        """
+        t, dist = self.closest_approach(target, tstart, tend, step)
+        return (dist <= distance).mean(axis=1)
+
+
+def _names(orbits):
+    if hasattr(orbits, 'names'):
+        return list(orbits.names)
+    return [orbit.bodyname for orbit in orbits]
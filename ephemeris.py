@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Observer-centric ephemeris tables with light-time correction
+
+Ephemeris combines the positions of an observer (by default the
+Earth-Moon barycenter from Data/planets_keplerian_elements.csv) with batch
+propagation of target orbits and returns right ascension, declination,
+range and range-rate of every target at every epoch.
+
+The light-time equation
+    tau = |r_target(t - tau) - r_observer(t)| / c
+is iterated for a whole block of targets and epochs at once. Tables are
+produced block by block (chunks()), so memory is bounded by the block
+size and not by the number of targets times the number of epochs.
+
+Positions are geometric (no aberration or deflection); coordinates are
+rotated from the ecliptic of J2000 to the equator by the J2000 obliquity.
+"""
+
+import math
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits
+from secularelements import SecularElements
+
+SPEED_OF_LIGHT = 299792458.0        # m/s
+OBLIQUITY_J2000 = math.radians(23.4392911)
+
+TABLE_DTYPE = np.dtype([('ra', float), ('dec', float), ('range', float),
+                        ('range_rate', float), ('light_time', float)])
+
+
+def ecliptic_to_equatorial(vec, obliquity=OBLIQUITY_J2000):
+    """Rotates vectors (..., 3) from ecliptic to equatorial coordinates
+    """
+    c = math.cos(obliquity)
+    s = math.sin(obliquity)
+    out = np.empty_like(vec)
+    out[..., 0] = vec[..., 0]
+    out[..., 1] = c * vec[..., 1] - s * vec[..., 2]
+    out[..., 2] = s * vec[..., 1] + c * vec[..., 2]
+    return out
+
+
+class Ephemeris:
+    """Ephemeris tables of many targets seen from one observer
+
+    """
+    def __init__(self, targets, observer='EM Bary', elements=None,
+                 c=SPEED_OF_LIGHT, tol=1e-6, maxiter=10):
+        """
+        Args:
+            targets: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+            observer: Name of a body in elements, or a TwoBodyOrbit
+            elements: SecularElements holding the observer. Default is
+                read from Data/planets_keplerian_elements.csv
+            c: Speed of light in the units of the orbits
+            tol: Light-time convergence tolerance
+            maxiter: Maximum number of light-time iterations
+        Exception:
+            ValueError: If observer is not found in elements, raises
+                ValueError
+        """
+        self.r0, self.v0, self.t0, self.mu = stack_orbits(targets)
+        self.c = c
+        self.tol = tol
+        self.maxiter = maxiter
+        self.niter = 0
+        if isinstance(observer, str):
+            if elements is None:
+                elements = SecularElements.from_csv(
+                    'Data/planets_keplerian_elements.csv', mu=self.mu[0]
+                    if self.mu.shape[0] else 1.32712440041e20)
+            if observer not in elements.names:
+                raise(ValueError('Observer {} not found: '.format(observer) +
+                                 'Ephemeris'))
+            self._obs_elements = elements
+            self._obs_index = elements.names.index(observer)
+            self._obs_orbit = None
+        else:
+            self._obs_elements = None
+            self._obs_orbit = stack_orbits([observer])
+
+    def __len__(self):
+        return self.r0.shape[0]
+
+    def observer_states(self, t):
+        """Returns positions and velocities of the observer
+
+        Args:
+            t: Times, array-like object of shape (k,)
+        Returns: pos, vel
+            pos: Positions, Numpy array of shape (k, 3)
+            vel: Velocities, Numpy array of shape (k, 3)
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        if self._obs_elements is not None:
+            pos, vel = self._obs_elements.posvelatt(t)
+            return pos[self._obs_index], vel[self._obs_index]
+        r0, v0, t0, mu = self._obs_orbit
+        pos, vel = twobodykernels.kepler(r0, v0, mu, t[None, :] - t0[:, None])
+        return pos[0], vel[0]
+
+    def _block(self, rows, t, opos, ovel):
+        """Table of targets rows at times t for observer states opos, ovel
+        """
+        r0 = self.r0[rows]
+        v0 = self.v0[rows]
+        mu = self.mu[rows]
+        dt = t[None, :] - self.t0[rows, None]
+        tau = np.zeros(dt.shape)
+        for it in range(self.maxiter):
+            pos, vel = twobodykernels.kepler(r0, v0, mu, dt - tau)
+            rel = pos - opos[None]
+            dist = np.sqrt((rel ** 2).sum(axis=-1))
+            new = dist / self.c
+            delta = np.abs(new - tau).max() if new.size else 0.0
+            tau = new
+            self.niter = it + 1
+            if delta <= self.tol:
+                break
+        # pos and vel are from the last iteration; they are off by less
+        # than tol in time
+        relv = vel - ovel[None]
+        table = np.empty(dt.shape, dtype=TABLE_DTYPE)
+        eq = ecliptic_to_equatorial(rel)
+        table['ra'] = np.degrees(np.remainder(np.arctan2(eq[..., 1],
+                                                         eq[..., 0]),
+                                              math.pi * 2.0))
+        table['dec'] = np.degrees(np.arcsin(np.clip(eq[..., 2] / dist,
+                                                    -1.0, 1.0)))
+        table['range'] = dist
+        table['range_rate'] = (rel * relv).sum(axis=-1) / dist
+        table['light_time'] = tau
+        return table
+
+    def chunks(self, t, bodies_per_chunk=512, epochs_per_chunk=512):
+        """Generates the ephemeris table block by block
+
+        Args:
+            t: Times, array-like object of shape (k,)
+            bodies_per_chunk: Number of targets per block
+            epochs_per_chunk: Number of epochs per block
+        Yields: rows, cols, table
+            rows: slice of the targets in the block
+            cols: slice of the epochs in the block
+            table: Structured Numpy array (TABLE_DTYPE) of shape
+                (targets in block, epochs in block) with 'ra', 'dec'
+                (degrees, equator of J2000), 'range', 'range_rate' and
+                'light_time'
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        m = len(self)
+        for k0 in range(0, t.shape[0], epochs_per_chunk):
+            cols = slice(k0, min(k0 + epochs_per_chunk, t.shape[0]))
+            opos, ovel = self.observer_states(t[cols])
+            for m0 in range(0, m, bodies_per_chunk):
+                rows = slice(m0, min(m0 + bodies_per_chunk, m))
+                yield rows, cols, self._block(rows, t[cols], opos, ovel)
+
+    def table(self, t):
+        """Returns the whole ephemeris table
+
+        Args:
+            t: Times, array-like object of shape (k,)
+        Returns: table
+            table: Structured Numpy array (TABLE_DTYPE) of shape (m, k)
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        table = np.empty((len(self), t.shape[0]), dtype=TABLE_DTYPE)
+        for rows, cols, block in self.chunks(t):
+            table[rows, cols] = block
+        return table
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Streaming export of state vectors to CSV, NPZ or Parquet
+
+state_chunks() walks an epoch range for a set of orbits and yields
+(epochs, states) chunks from the batch propagator. export() hands each
+chunk to a writer running in a background thread, so the next chunk is
+computed while the previous one is written. At most a few chunks are held
+at any time, so peak memory depends on the chunk size only, not on the
+length of the span.
+
+Command line:
+  python ephemerisexport.py START END STEP -o states.csv
+      [--catalog Data/asteroids_keplerian_elements.csv] [--planets]
+      [--format csv|npz|parquet] [--chunk N]
+START and END are MJD, STEP is in days. Parquet needs pyarrow.
+"""
+
+import argparse
+import csv
+import queue
+import sys
+import threading
+import time
+import zipfile
+import numpy as np
+
+from pytwobodyorbit import propagate
+from orbitcatalog import OrbitCatalog
+from secularelements import SecularElements
+
+# Imported by ParquetWriter when Parquet output is requested
+pyarrow = None
+
+STATE_COLUMNS = ('x', 'y', 'z', 'vx', 'vy', 'vz')
+
+
+def state_chunks(orbits, tstart, tend, step, epochs_per_chunk=256):
+    """Generates states of all orbits over an epoch range chunk by chunk
+
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, an OrbitCatalog, or a
+            SecularElements object
+        tstart, tend: Time range (tend included if on the step grid)
+        step: Time step
+        epochs_per_chunk: Number of epochs per chunk
+    Yields: epochs, states
+        epochs: Times of the chunk, Numpy array of shape (k,)
+        states: Positions and velocities, Numpy array of shape (m, k, 6)
+    """
+    nstep = int(np.floor((tend - tstart) / step + 1e-9)) + 1
+    for k0 in range(0, nstep, epochs_per_chunk):
+        epochs = tstart + step * np.arange(k0, min(k0 + epochs_per_chunk,
+                                                   nstep))
+        if isinstance(orbits, SecularElements):
+            pos, vel = orbits.posvelatt(epochs)
+        else:
+            pos, vel = propagate(orbits, epochs)
+        yield epochs, np.concatenate([pos, vel], axis=-1)
+
+
+class CsvWriter:
+    """Writes chunks as rows of name, t, x, y, z, vx, vy, vz
+
+    """
+    def __init__(self, filename, names):
+        self.names = list(names)
+        self._file = open(filename, 'w', newline='')
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(('name', 't') + STATE_COLUMNS)
+
+    def write(self, epochs, states):
+        for t, rows in zip(epochs.tolist(), states.transpose(1, 0, 2)):
+            self._csv.writerows([name, t] + row
+                                for name, row in zip(self.names,
+                                                     rows.tolist()))
+
+    def close(self):
+        self._file.close()
+
+
+class NpzWriter:
+    """Writes chunks as arrays epochs_NNNNN, states_NNNNN of one .npz file
+
+    The file is written incrementally; numpy.load() reads it as usual and
+    the arrays 'names', 'epochs_00000', 'states_00000', ... are listed in
+    its files attribute.
+    """
+    def __init__(self, filename, names):
+        self._zip = zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED,
+                                    allowZip64=True)
+        self._count = 0
+        self._put('names', np.array(list(names), dtype=str))
+
+    def _put(self, key, arr):
+        with self._zip.open(key + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(arr),
+                                      allow_pickle=False)
+
+    def write(self, epochs, states):
+        self._put('epochs_{:05d}'.format(self._count), epochs)
+        self._put('states_{:05d}'.format(self._count), states)
+        self._count += 1
+
+    def close(self):
+        self._zip.close()
+
+
+class ParquetWriter:
+    """Writes chunks as row groups of a Parquet file (needs pyarrow)
+
+    """
+    def __init__(self, filename, names):
+        global pyarrow
+        if pyarrow is None:
+            try:
+                import pyarrow.parquet
+            except ImportError:
+                raise(ImportError('pyarrow is needed for Parquet output: ' +
+                                  'ParquetWriter'))
+        self.names = np.array(list(names), dtype=object)
+        schema = pyarrow.schema([('name', pyarrow.string()),
+                                 ('t', pyarrow.float64())] +
+                                [(c, pyarrow.float64())
+                                 for c in STATE_COLUMNS])
+        self._writer = pyarrow.parquet.ParquetWriter(filename, schema)
+
+    def write(self, epochs, states):
+        m, k = states.shape[:2]
+        flat = states.transpose(1, 0, 2).reshape(-1, 6)
+        columns = [pyarrow.array(np.tile(self.names, k)),
+                   pyarrow.array(np.repeat(epochs, m))] + \
+            [pyarrow.array(flat[:, c]) for c in range(6)]
+        self._writer.write_table(pyarrow.Table.from_arrays(
+            columns, names=['name', 't'] + list(STATE_COLUMNS)))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {'csv': CsvWriter, 'npz': NpzWriter, 'parquet': ParquetWriter}
+
+
+def export(chunks, writer, depth=2):
+    """Streams chunks to a writer while the next chunk is computed
+
+    Args:
+        chunks: Iterable of (epochs, states) as from state_chunks()
+        writer: Object with write(epochs, states) and close()
+        depth: Number of chunks that may wait for the writer
+    Returns: stats
+        stats: Dictionary with 'states' (state vectors written),
+               'seconds' and 'states_per_second'
+    """
+    start = time.perf_counter()
+    pending = queue.Queue(maxsize=depth)
+    failure = []
+
+    def _drain():
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            if failure:
+                # Keep taking chunks so that the producer never blocks
+                continue
+            try:
+                writer.write(*item)
+            except Exception as exc:
+                failure.append(exc)
+
+    thread = threading.Thread(target=_drain, daemon=True)
+    thread.start()
+    nstates = 0
+    try:
+        for epochs, states in chunks:
+            if failure:
+                break
+            pending.put((epochs, states))
+            nstates += states.shape[0] * states.shape[1]
+    finally:
+        pending.put(None)
+        thread.join()
+        writer.close()
+    if failure:
+        raise failure[0]
+    seconds = time.perf_counter() - start
+    return {'states': nstates, 'seconds': seconds,
+            'states_per_second': nstates / seconds if seconds > 0
+            else np.inf}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export state vectors of catalog bodies')
+    parser.add_argument('start', type=float, help='First epoch (MJD)')
+    parser.add_argument('end', type=float, help='Last epoch (MJD)')
+    parser.add_argument('step', type=float, help='Step (days)')
+    parser.add_argument('-o', '--output', type=str, metavar='filename',
+                        required=True, help='Output file')
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS),
+                        help='Output format. Default is from the extension')
+    parser.add_argument('-c', '--catalog', type=str, metavar='filename',
+                        default='Data/asteroids_keplerian_elements.csv',
+                        help='Catalog of orbits')
+    parser.add_argument('-p', '--planets', action='store_true',
+                        help='Export the planets instead of the catalog')
+    parser.add_argument('--chunk', type=int, metavar='int', default=256,
+                        help='Epochs per chunk')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or args.output.rsplit('.', 1)[-1].lower()
+    if fmt not in WRITERS:
+        parser.error('unknown format: {}'.format(fmt))
+    if args.planets:
+        orbits = SecularElements.from_csv(
+            'Data/planets_keplerian_elements.csv')
+    else:
+        orbits = OrbitCatalog.from_csv(args.catalog)
+    try:
+        writer = WRITERS[fmt](args.output, orbits.names)
+    except ImportError as exc:
+        parser.error(str(exc))
+    stats = export(state_chunks(orbits, args.start * 86400.0,
+                                args.end * 86400.0, args.step * 86400.0,
+                                args.chunk), writer)
+    print('{} state vectors in {:.3f} s ({:.3g} states/s)'.format(
+        stats['states'], stats['seconds'], stats['states_per_second']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Load generator for ephemerisservice
+
+Opens many concurrent client connections, each sending a sequence of
+random state queries, and reports client-side latency, throughput and the
+server's batching metrics. Without --port it starts a service in the same
+process.
+
+Run:
+  python ephemerisload.py [--clients 200] [--requests 20] [--bodies 3]
+      [--times 4] [--port PORT] [--window 0.005]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import numpy as np
+
+from ephemerisservice import EphemerisService
+
+
+async def _client(host, port, names, nrequest, nbody, ntime, latency, seed):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port,
+                                                   limit=2 ** 24)
+    try:
+        for k in range(nrequest):
+            request = {'id': k, 'bodies': rng.sample(names, nbody),
+                       't': [(59200.0 + rng.uniform(0.0, 3650.0)) * 86400.0
+                             for j in range(ntime)]}
+            start = time.perf_counter()
+            writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+            reply = json.loads(await reader.readline())
+            latency.append(time.perf_counter() - start)
+            if 'error' in reply:
+                raise(RuntimeError(reply['error']))
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def _metrics(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"metrics": true}\n')
+    await writer.drain()
+    reply = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return reply['metrics']
+
+
+async def run(args):
+    """Runs the load test and returns (client summary, server metrics)
+    """
+    server = None
+    host, port = args.host, args.port
+    if port is None:
+        service = EphemerisService(window=args.window)
+        server = await service.serve(host, 0)
+        port = server.sockets[0].getsockname()[1]
+        names = service.names
+    else:
+        names = None
+    if names is None:
+        # Ask the server for its body names
+        reader, writer = await asyncio.open_connection(host, port,
+                                                       limit=2 ** 24)
+        writer.write(b'{"id": 0, "list": true}\n')
+        await writer.drain()
+        names = json.loads(await reader.readline())['names']
+        writer.close()
+        await writer.wait_closed()
+
+    latency = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, names, args.requests,
+                                   min(args.bodies, len(names)), args.times,
+                                   latency, seed)
+                           for seed in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    metrics = await _metrics(host, port)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+    lat = np.array(latency) * 1000.0
+    nrequest = args.clients * args.requests
+    summary = {'clients': args.clients, 'requests': nrequest,
+               'seconds': elapsed,
+               'requests_per_second': nrequest / elapsed,
+               'states_per_second': nrequest * args.bodies * args.times
+               / elapsed,
+               'latency_p50_ms': float(np.percentile(lat, 50)),
+               'latency_p95_ms': float(np.percentile(lat, 95)),
+               'latency_p99_ms': float(np.percentile(lat, 99))}
+    return summary, metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load generator for ephemerisservice')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Port of a running service. Default starts one')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20,
+                        help='Requests per client')
+    parser.add_argument('--bodies', type=int, default=3,
+                        help='Bodies per request')
+    parser.add_argument('--times', type=int, default=4,
+                        help='Times per request')
+    parser.add_argument('--window', type=float, default=0.005,
+                        help='Batching window of the started service')
+    summary, metrics = asyncio.run(run(parser.parse_args()))
+    print('client:')
+    for key, val in summary.items():
+        print('  {:22s} {:.6g}'.format(key, val))
+    print('server:')
+    for key, val in metrics.items():
+        print('  {:22s} {:.6g}'.format(key, val))
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Local asyncio service answering "states of bodies X at times T" queries
+
+The catalog (planets from Data/planets_keplerian_elements.csv and the
+objects of Data/asteroids_keplerian_elements.csv) is loaded once.
+Requests that arrive within a short batching window are answered
+together: all (body, time) pairs of the window are propagated in one
+vectorized call per catalog.
+
+Protocol: one JSON object per line over TCP.
+  request:  {"id": 1, "bodies": ["Mars", "Ceres"], "t": [5114880000.0]}
+            "bodies" is a list of names, or omitted for all bodies; "t" is
+            in seconds from MJD 0 (a finite scalar or a flat list)
+  response: {"id": 1, "names": [...], "pos": [[[x, y, z], ...], ...],
+             "vel": [...]}  (shape bodies x times x 3, meters and m/s)
+            or {"id": 1, "error": "message"}
+  {"id": 1, "list": true} returns {"id": 1, "names": [...]}, the names of
+  all bodies; {"metrics": true} returns the current metrics instead.
+
+Run:
+  python ephemerisservice.py [--port 8765] [--window 0.005]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import sys
+import time
+import numpy as np
+
+import twobodykernels
+from orbitcatalog import OrbitCatalog
+from secularelements import SecularElements
+
+sunmu = 1.32712440041e20
+
+
+class EphemerisService:
+    """Catalog of bodies with batched state queries
+
+    """
+    def __init__(self, planets=None, catalog=None, window=0.005,
+                 max_batch=100000):
+        """
+        Args:
+            planets: SecularElements of the planets. Default is read from
+                Data/planets_keplerian_elements.csv
+            catalog: OrbitCatalog of other bodies. Default is read from
+                Data/asteroids_keplerian_elements.csv
+            window: Batching window in seconds
+            max_batch: Number of (body, time) pairs that flushes a batch
+                before the window ends
+        """
+        if planets is None:
+            planets = SecularElements.from_csv(
+                'Data/planets_keplerian_elements.csv', mu=sunmu)
+        if catalog is None:
+            catalog = OrbitCatalog.from_csv(
+                'Data/asteroids_keplerian_elements.csv', mu=sunmu)
+        self.planets = planets
+        self.catalog = catalog
+        self.states = catalog.states() if len(catalog) else None
+        self.names = list(planets.names) + list(catalog.names)
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._npairs = 0
+        self._timer = None
+        self._started = time.perf_counter()
+        self._latency = collections.deque(maxlen=10000)
+        self._counts = {'requests': 0, 'batches': 0, 'states': 0,
+                        'errors': 0}
+
+    def lookup(self, bodies):
+        """Returns body indices for a list of names (None for all)
+
+        Exception:
+            TypeError: If bodies is not a list, raises TypeError
+            KeyError: If a name is not in the catalog, raises KeyError
+        """
+        if bodies is None:
+            return np.arange(len(self.names))
+        if not isinstance(bodies, (list, tuple)):
+            raise(TypeError('bodies must be a list of names: ' +
+                            'EphemerisService.lookup'))
+        return np.array([self.index[name] for name in bodies], dtype=int)
+
+    def compute(self, rows, t):
+        """Returns states for pairs of body indices and times
+
+        Args:
+            rows: Body indices, shape (n,)
+            t: Times, shape (n,)
+        Returns: pos, vel
+            pos, vel: Numpy arrays of shape (n, 3)
+        """
+        pos = np.empty((rows.shape[0], 3))
+        vel = np.empty((rows.shape[0], 3))
+        nplanets = len(self.planets)
+        planet = rows < nplanets
+        if planet.any():
+            times, inverse = np.unique(t[planet], return_inverse=True)
+            ppos, pvel = self.planets.posvelatt(times)
+            pos[planet] = ppos[rows[planet], inverse]
+            vel[planet] = pvel[rows[planet], inverse]
+        other = ~planet
+        if other.any():
+            r0, v0, t0, mu = self.states
+            cat = rows[other] - nplanets
+            cpos, cvel = twobodykernels.kepler(
+                r0[cat], v0[cat], mu[cat], (t[other] - t0[cat])[:, None])
+            pos[other] = cpos[:, 0]
+            vel[other] = cvel[:, 0]
+        return pos, vel
+
+    async def query(self, bodies, t):
+        """Returns states of bodies at times t
+
+        Args:
+            bodies: List of body names, or None for all bodies
+            t: Time or list of times in seconds from MJD 0
+        Returns: pos, vel
+            pos, vel: Numpy arrays of shape (bodies, times, 3)
+        Exception:
+            ValueError: If t is nested or not finite, raises ValueError
+                before the request joins a batch
+        """
+        start = time.perf_counter()
+        rows = self.lookup(bodies)
+        times = np.atleast_1d(np.asarray(t, dtype=float))
+        if times.ndim > 1:
+            raise(ValueError('t must be a time or a list of times: ' +
+                             'EphemerisService.query'))
+        if not np.isfinite(times).all():
+            raise(ValueError('t must be finite: EphemerisService.query'))
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((rows, times, future))
+        self._npairs += rows.shape[0] * times.shape[0]
+        if self._npairs >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.window, self._flush)
+        try:
+            return await future
+        finally:
+            self._latency.append(time.perf_counter() - start)
+            self._counts['requests'] += 1
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._npairs = self._pending, [], 0
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch):
+        # One flat list of (body, time) pairs for the whole batch. It runs
+        # on the event loop thread; requests arriving meanwhile wait in the
+        # socket buffers and join the next batch. A failure is set on every
+        # future still waiting, so that none of them hangs
+        try:
+            rows = np.concatenate([np.repeat(r, t.shape[0])
+                                   for r, t, f in batch])
+            times = np.concatenate([np.tile(t, r.shape[0])
+                                    for r, t, f in batch])
+            pos, vel = self.compute(rows, times)
+            self._counts['batches'] += 1
+            self._counts['states'] += rows.shape[0]
+            offset = 0
+            for r, t, future in batch:
+                n = r.shape[0] * t.shape[0]
+                shape = (r.shape[0], t.shape[0], 3)
+                if not future.done():
+                    future.set_result((pos[offset:offset + n].reshape(shape),
+                                       vel[offset:offset + n].reshape(shape)))
+                offset += n
+        except Exception as exc:
+            for r, t, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+
+    def metrics(self):
+        """Returns a dictionary of latency and throughput metrics
+        """
+        elapsed = time.perf_counter() - self._started
+        lat = np.array(self._latency) * 1000.0
+        result = dict(self._counts)
+        result['uptime'] = elapsed
+        result['states_per_second'] = self._counts['states'] / elapsed
+        result['requests_per_batch'] = self._counts['requests'] \
+            / max(self._counts['batches'], 1)
+        for q in (50, 95, 99):
+            result['latency_p{}_ms'.format(q)] = float(
+                np.percentile(lat, q)) if lat.size else 0.0
+        return result
+
+    async def handle(self, reader, writer):
+        """Serves one client connection
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self._reply(line)
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _reply(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self._counts['errors'] += 1
+            return {'error': 'invalid JSON'}
+        if not isinstance(request, dict):
+            self._counts['errors'] += 1
+            return {'error': 'request must be a JSON object'}
+        rid = request.get('id')
+        if request.get('metrics'):
+            return {'id': rid, 'metrics': self.metrics()}
+        if request.get('list'):
+            return {'id': rid, 'names': self.names}
+        bodies = request.get('bodies')
+        try:
+            pos, vel = await self.query(bodies, request['t'])
+        except KeyError as exc:
+            self._counts['errors'] += 1
+            return {'id': rid, 'error': 'unknown body or field: {}'.format(
+                exc.args[0])}
+        except (TypeError, ValueError, RuntimeError) as exc:
+            # RuntimeError: the solver failed for a (body, time) pair
+            self._counts['errors'] += 1
+            return {'id': rid, 'error': str(exc)}
+        names = self.names if bodies is None else bodies
+        return {'id': rid, 'names': names, 'pos': pos.tolist(),
+                'vel': vel.tolist()}
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """Starts the server and returns the asyncio.Server
+        """
+        return await asyncio.start_server(self.handle, host, port,
+                                          limit=2 ** 24)
+
+
+async def _main(args):
+    service = EphemerisService(window=args.window)
+    server = await service.serve(args.host, args.port)
+    print('serving {} bodies on {}:{}'.format(len(service.names), args.host,
+                                             args.port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ephemeris query service')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--window', type=float, default=0.005,
+                        help='Batching window (seconds)')
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        sys.exit(0)
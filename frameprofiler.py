@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Per-frame stage timing for the viewer
+
+FrameProfiler measures named stages of each frame (e.g. 'kepler',
+'pipeline', 'render'), keeps rolling statistics (FPS, percentiles of the
+frame and stage times) and records trace events that can be written as a
+Chrome trace / Perfetto JSON file (chrome://tracing, ui.perfetto.dev).
+
+When the profiler is disabled, stage() returns a shared no-op context
+manager and frame boundaries return immediately, so instrumented code
+costs one attribute lookup and one call per stage.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.add(self.name, self.start, time.perf_counter())
+        return False
+
+
+class FrameProfiler:
+    """Rolling per-stage frame timings and a trace recorder
+
+    """
+    def __init__(self, enabled=False, window=240, max_events=200000):
+        """
+        Args:
+            enabled: Start with profiling on
+            window: Number of frames in the rolling statistics
+            max_events: Largest number of trace events kept (oldest are
+                dropped)
+        """
+        self.enabled = enabled
+        self.window = window
+        self._origin = time.perf_counter()
+        self._frames = collections.deque(maxlen=window)
+        self._stages = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+        self._events = collections.deque(maxlen=max_events)
+        self._current = {}
+        self._frame_start = None
+        self._last_end = None
+        # Frames recorded since the start; unlike the rolling statistics it
+        # only ever increases
+        self.total = 0
+
+    def set_enabled(self, enabled):
+        """Turns profiling on or off. Statistics are kept
+        """
+        self.enabled = enabled
+        self._current = {}
+        self._frame_start = None
+        self._last_end = None
+
+    def stage(self, name):
+        """Returns a context manager that times one stage of the frame
+
+        Usage:
+            with profiler.stage('kepler'):
+                ...
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name, start, end):
+        """Records a stage that ran from start to end (perf_counter)
+        """
+        if not self.enabled:
+            return
+        if self._frame_start is None:
+            self._frame_start = start
+        self._current[name] = self._current.get(name, 0.0) + end - start
+        self._events.append((name, start, end, threading.get_ident()))
+
+    def begin_frame(self):
+        """Marks the start of a frame
+
+        Optional: without it a frame starts with its first stage, so work
+        done in event callbacks before a render counts for that frame.
+        """
+        if not self.enabled:
+            return
+        if self._frame_start is None:
+            self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Marks the end of a frame and updates the statistics
+        """
+        if not self.enabled or self._frame_start is None:
+            return
+        end = time.perf_counter()
+        self._events.append(('frame', self._frame_start, end,
+                             threading.get_ident()))
+        interval = end - self._last_end if self._last_end is not None \
+            else end - self._frame_start
+        self._frames.append((end - self._frame_start, interval))
+        for name, seconds in self._current.items():
+            self._stages[name].append(seconds)
+        self._last_end = end
+        self._current = {}
+        self._frame_start = None
+        self.total += 1
+
+    def summary(self):
+        """Returns rolling statistics
+
+        Returns: stats
+            stats: Dictionary with 'frames', 'fps', 'frame_ms' (p50, p95,
+                p99) and 'stages' {name: (mean ms, p95 ms)}
+        """
+        stats = {'frames': len(self._frames), 'fps': 0.0,
+                 'frame_ms': (0.0, 0.0, 0.0), 'stages': {}}
+        if not self._frames:
+            return stats
+        frames = np.array(self._frames) * 1000.0
+        stats['fps'] = 1000.0 / max(frames[:, 1].mean(), 1e-9)
+        stats['frame_ms'] = tuple(float(v) for v in
+                                  np.percentile(frames[:, 0], (50, 95, 99)))
+        for name, values in self._stages.items():
+            values = np.array(values) * 1000.0
+            stats['stages'][name] = (float(values.mean()),
+                                     float(np.percentile(values, 95)))
+        return stats
+
+    def text(self):
+        """Returns the statistics as lines of text for an overlay
+        """
+        stats = self.summary()
+        lines = ['{:.1f} fps  frame p50 {:.1f} / p95 {:.1f} / p99 {:.1f} ms'
+                 .format(stats['fps'], *stats['frame_ms'])]
+        for name, (mean, p95) in sorted(stats['stages'].items()):
+            lines.append('{:10s} {:7.2f} ms  p95 {:7.2f} ms'.format(
+                name, mean, p95))
+        return '\n'.join(lines)
+
+    def dump_trace(self, filename):
+        """Writes the recorded events as a Chrome trace (JSON) file
+
+        Args:
+            filename: Output path
+        """
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': (start - self._origin) * 1e6,
+                   'dur': (end - start) * 1e6}
+                  for name, start, end, tid in self._events]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Numba kernels of twobodykernels
+
+JIT-compiled, parallel versions of the propagation and Lambert kernels,
+and of the cell index of densitygrid.
+This module is imported by twobodykernels the first time the 'numba'
+backend is used, so that importing twobodykernels does not pay for
+importing numba.
+"""
+
+import math
+import numba
+import numpy as np
+
+from twobodykernels import _SERIES_LIMIT, _CCOEF, _SCOEF, _ZMAX, \
+    _PARABOLIC_LIMITS, _PARABOLIC_ECC, GUESS_LINEAR, GUESS_KEPLER
+
+# Numba cannot read the dict; the limits are unpacked by kind of guess
+_LINEAR_LIMITS = _PARABOLIC_LIMITS[GUESS_LINEAR]
+_KEPLER_LIMITS = _PARABOLIC_LIMITS[GUESS_KEPLER]
+
+_jit = numba.njit(cache=True)
+_pjit = numba.njit(cache=True, parallel=True)
+
+
+@_jit
+def _stumpff_nb(z):
+    if z > _SERIES_LIMIT:
+        sz = math.sqrt(z)
+        return (1.0 - math.cos(sz)) / z, (sz - math.sin(sz)) / sz ** 3
+    elif z < (-1.0) * _SERIES_LIMIT:
+        sz = math.sqrt((-1.0) * z)
+        return (1.0 - math.cosh(sz)) / z, (math.sinh(sz) - sz) / sz ** 3
+    cs = 0.0
+    ss = 0.0
+    for k in range(6, -1, -1):
+        cs = cs * (-z) + _CCOEF[k]
+        ss = ss * (-z) + _SCOEF[k]
+    return cs, ss
+
+
+@_jit
+def _parabolic_nb(rlen, sig0, sqmu, dt):
+    # Root of Barker's equation, as in twobodykernels._parabolic_guess
+    p = 6.0 * rlen - 3.0 * sig0 * sig0
+    q = 2.0 * sig0 ** 3 - 6.0 * rlen * sig0 - 6.0 * sqmu * dt
+    disc = 0.25 * q * q + p ** 3 / 27.0
+    if disc < 0.0:
+        return np.nan
+    u = (0.5 * abs(q) + math.sqrt(disc)) ** (1.0 / 3.0)
+    if q > 0.0:
+        u = (-1.0) * u
+    if u == 0.0:
+        return (-1.0) * sig0
+    return u - p / (3.0 * u) - sig0
+
+
+@_jit
+def _kepler_one(r0, v0, mu, dt, tol, rtol, maxiter, guess):
+    sqmu = math.sqrt(mu)
+    rlen = math.sqrt(r0[0] ** 2 + r0[1] ** 2 + r0[2] ** 2)
+    vlen2 = v0[0] ** 2 + v0[1] ** 2 + v0[2] ** 2
+    rdv = r0[0] * v0[0] + r0[1] * v0[1] + r0[2] * v0[2]
+    hx = r0[1] * v0[2] - r0[2] * v0[1]
+    hy = r0[2] * v0[0] - r0[0] * v0[2]
+    hz = r0[0] * v0[1] - r0[1] * v0[0]
+    p = (hx * hx + hy * hy + hz * hz) / mu
+    alpha = 2.0 / rlen - vlen2 / mu
+    ecc = math.sqrt(max(1.0 - p * alpha, 0.0))
+    q = p / (1.0 + ecc)
+    sig0 = rdv / sqmu
+
+    nrev = 0.0
+    if alpha > 0.0:
+        per = math.pi * 2.0 / sqmu / alpha ** 1.5
+        nrev = math.floor(dt / per + 0.5)
+        dt = dt - per * nrev
+
+    xb = sqmu * dt / q
+    lo = min(xb, 0.0)
+    hi = max(xb, 0.0)
+
+    x = sqmu * dt * alpha
+    if alpha < 0.0 and dt != 0.0:
+        a = 1.0 / alpha
+        sgn = 1.0 if dt > 0.0 else -1.0
+        arg = (-2.0) * mu * alpha * dt / (rdv + sgn * math.sqrt(
+            (-1.0) * mu * a) * (1.0 - rlen * alpha))
+        if arg > 0.0:
+            x = sgn * math.sqrt((-1.0) * a) * math.log(arg)
+        else:
+            x = sqmu * dt / rlen
+    if guess == GUESS_KEPLER and alpha > 0.0:
+        # Series solution of Kepler's equation, as in _anomaly_numpy
+        sqa = 1.0 / math.sqrt(alpha)
+        ecos0 = 1.0 - rlen * alpha
+        esin0 = sig0 * math.sqrt(alpha)
+        ecc0 = math.sqrt(ecos0 * ecos0 + esin0 * esin0)
+        ea0 = math.atan2(esin0, ecos0)
+        ma = ea0 - esin0 + sqmu * alpha / sqa * dt
+        x = sqa * (ma + ecc0 * math.sin(ma)
+                   + 0.5 * ecc0 * ecc0 * math.sin(2.0 * ma) - ea0)
+    # Near the parabola, start from the parabola
+    if ecc >= _PARABOLIC_ECC:
+        xp = _parabolic_nb(rlen, sig0, sqmu, dt)
+        limits = _KEPLER_LIMITS if guess == GUESS_KEPLER else _LINEAR_LIMITS
+        if abs(alpha) * xp * xp < (limits[0] if alpha > 0.0 else limits[1]):
+            x = xp
+    if not math.isfinite(x):
+        x = sqmu * dt / rlen
+    x = min(max(x, lo), hi)
+
+    niter = 0
+    for it in range(maxiter):
+        niter = it + 1
+        z = alpha * x * x
+        c, s = _stumpff_nb(z)
+        x2 = x * x
+        fx = (sig0 * x2 * c + (1.0 - rlen * alpha) * x2 * x * s
+              + rlen * x) / sqmu - dt
+        r = x2 * c + sig0 * x * (1.0 - z * s) + rlen * (1.0 - z * c)
+        if fx < 0.0:
+            lo = x
+        else:
+            hi = x
+        xn = x - fx * sqmu / r
+        if not (xn >= lo and xn <= hi):
+            xn = 0.5 * (lo + hi)
+        done = abs(xn - x) <= tol + rtol * abs(xn)
+        x = xn
+        if done:
+            break
+
+    z = alpha * x * x
+    c, s = _stumpff_nb(z)
+    x2 = x * x
+    r = x2 * c + sig0 * x * (1.0 - z * s) + rlen * (1.0 - z * c)
+    val_f = 1.0 - x2 / rlen * c
+    val_g = dt - x2 * x / sqmu * s
+    val_fd = sqmu / r / rlen * x * (z * s - 1.0)
+    val_gd = 1.0 - x2 / r * c
+    return val_f, val_g, val_fd, val_gd, niter, x, dt, nrev
+
+
+@_pjit
+def _kepler_nb(r0, v0, mu, dt, tol, rtol, maxiter, guess, pos, vel, iters):
+    m, k = dt.shape
+    for i in numba.prange(m):
+        nmax = 0
+        for j in range(k):
+            f, g, fd, gd, n, x, dtr, nrev = _kepler_one(
+                r0[i], v0[i], mu[i], dt[i, j], tol, rtol, maxiter, guess)
+            for d in range(3):
+                pos[i, j, d] = f * r0[i, d] + g * v0[i, d]
+                vel[i, j, d] = fd * r0[i, d] + gd * v0[i, d]
+            nmax = max(nmax, n)
+        iters[i] = nmax
+
+
+@_pjit
+def _anomaly_nb(r0, v0, mu, dt, tol, rtol, maxiter, guess, xs, dtrs, nrevs):
+    m, k = dt.shape
+    for i in numba.prange(m):
+        for j in range(k):
+            f, g, fd, gd, n, x, dtr, nrev = _kepler_one(
+                r0[i], v0[i], mu[i], dt[i, j], tol, rtol, maxiter, guess)
+            xs[i, j] = x
+            dtrs[i, j] = dtr
+            nrevs[i, j] = nrev
+
+
+@_jit
+def _lambert_time(z, r1pr2, A, sqmu):
+    c, s = _stumpff_nb(z)
+    val_y = r1pr2 - A * (1.0 - z * s) / math.sqrt(c)
+    if not (val_y >= 0.0):
+        return -1.0, val_y
+    val_x = math.sqrt(val_y / c)
+    return (val_x ** 3 * s + A * math.sqrt(val_y)) / sqmu, val_y
+
+
+@_pjit
+def _lambert_nb(ipos, tpos, targett, mu, ccw, xtol, rtol, maxiter,
+                ivel, tvel):
+    n = ipos.shape[0]
+    for i in numba.prange(n):
+        r1 = math.sqrt(ipos[i, 0] ** 2 + ipos[i, 1] ** 2 + ipos[i, 2] ** 2)
+        r2 = math.sqrt(tpos[i, 0] ** 2 + tpos[i, 1] ** 2 + tpos[i, 2] ** 2)
+        cx = ipos[i, 1] * tpos[i, 2] - ipos[i, 2] * tpos[i, 1]
+        cy = ipos[i, 2] * tpos[i, 0] - ipos[i, 0] * tpos[i, 2]
+        cz = ipos[i, 0] * tpos[i, 1] - ipos[i, 1] * tpos[i, 0]
+        dot = ipos[i, 0] * tpos[i, 0] + ipos[i, 1] * tpos[i, 1] \
+            + ipos[i, 2] * tpos[i, 2]
+        sindnu = math.sqrt(cx * cx + cy * cy + cz * cz) / r1 / r2
+        if cz < 0.0:
+            sindnu = (-1.0) * sindnu
+        if not ccw[i]:
+            sindnu = (-1.0) * sindnu
+        cosdnu = dot / r1 / r2
+        A = math.sqrt(r1 * r2) * sindnu / math.sqrt(1.0 - cosdnu)
+        r1pr2 = r1 + r2
+        sqmu = math.sqrt(mu[i])
+        dnu = math.atan2(sindnu, cosdnu)
+        if dnu < 0.0:
+            dnu += math.pi * 2.0
+        for d in range(3):
+            ivel[i, d] = np.nan
+            tvel[i, d] = np.nan
+        if dnu < 0.001 or dnu > (math.pi * 2.0 - 0.001):
+            continue
+        if (dnu - math.pi) ** 2 < 0.00001 ** 2:
+            continue
+        lo = (-1.0) * _ZMAX
+        hi = _ZMAX - 1e-6
+        thi, y = _lambert_time(hi, r1pr2, A, sqmu)
+        tlo, y = _lambert_time(lo, r1pr2, A, sqmu)
+        if not (thi - targett[i] > 0.0) or not (tlo - targett[i] <= 0.0):
+            continue
+        for it in range(maxiter):
+            mid = 0.5 * (lo + hi)
+            tm, y = _lambert_time(mid, r1pr2, A, sqmu)
+            if tm - targett[i] < 0.0:
+                lo = mid
+            else:
+                hi = mid
+            if hi - lo <= xtol + rtol * abs(mid):
+                break
+        zn = 0.5 * (lo + hi)
+        c, s = _stumpff_nb(zn)
+        val_y = r1pr2 - A * (1.0 - zn * s) / math.sqrt(c)
+        val_f = 1.0 - val_y / r1
+        val_g = A * math.sqrt(val_y) / sqmu
+        val_gd = 1.0 - val_y / r2
+        for d in range(3):
+            ivel[i, d] = (tpos[i, d] - val_f * ipos[i, d]) / val_g
+            tvel[i, d] = (val_gd * tpos[i, d] - ipos[i, d]) / val_g
+
+
+@numba.njit(cache=True, inline='always')
+def _count_nb(values, buckets, v):
+    # np.searchsorted(values, v, side='right') through the bucket index of
+    # densitygrid._edge_table
+    k = buckets.shape[0]
+    u = (v + 1.0) * (0.5 * k)
+    if u != u:
+        # NaN starts from bucket 0, as np.nan_to_num does there
+        u = 0.0
+    n = buckets[int(min(max(u, 0.0), k - 1.0))]
+    while n < values.shape[0] and values[n] <= v:
+        n += 1
+    return n
+
+
+@_pjit
+def _cell_index_nb(pos, spherical, low, inv, shape, lon_upper, upper_buckets,
+                   lon_lower, lower_buckets, lat_sin, lat_buckets, out):
+    # Cell numbers of densitygrid.DensityGrid, axis 0 fastest; shape[0] *
+    # shape[1] * shape[2] outside the grid. See densitygrid._cell_index_numpy
+    n0, n1, n2 = shape[0], shape[1], shape[2]
+    size = n0 * n1 * n2
+    for i in numba.prange(pos.shape[0]):
+        x, y, z = pos[i, 0], pos[i, 1], pos[i, 2]
+        if spherical:
+            rho = math.sqrt(x * x + y * y)
+            rlen = math.sqrt(rho * rho + z * z)
+            c = x / rho if rho > 0.0 else 1.0
+            if y < 0.0:
+                i1 = lon_upper.shape[0] - 1 + _count_nb(lon_lower,
+                                                        lower_buckets, c)
+            else:
+                i1 = _count_nb(lon_upper, upper_buckets, -c) - 1
+            s = z / rlen if rlen > 0.0 else 0.0
+            i2 = _count_nb(lat_sin, lat_buckets, s) - 1
+            u0 = (rlen - low[0]) * inv[0]
+            if u0 >= 0.0 and u0 < n0 and i1 >= 0 and i1 < n1 and \
+                    i2 >= 0 and i2 < n2:
+                out[i] = int(u0) + n0 * (i1 + n1 * i2)
+            else:
+                out[i] = size
+            continue
+        u0 = (x - low[0]) * inv[0]
+        u1 = (y - low[1]) * inv[1]
+        u2 = (z - low[2]) * inv[2]
+        if u0 >= 0.0 and u0 < n0 and u1 >= 0.0 and u1 < n1 and \
+                u2 >= 0.0 and u2 < n2:
+            out[i] = int(u0) + n0 * (int(u1) + n1 * int(u2))
+        else:
+            out[i] = size
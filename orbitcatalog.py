@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""Compact storage for large populations of two-body orbits
+
+OrbitCatalog keeps the orbits of many objects around one central body in a
+single float64 array, one row per object. Indexing the catalog returns an
+OrbitRow, a TwoBodyOrbit whose attributes read and write that row, so
+setOrbCart, setOrbKepl, posvelatt, points, elmKepl etc. work unchanged.
+
+Each row holds 19 floats (152 bytes). Attributes that follow from them
+(hv, ev, pr, mm) are computed on access. A TwoBodyOrbit object defined by
+setOrbKepl takes about 1.3 kB, a row about 160 bytes with its name and
+flag; run this module to measure both. The other stored fields (evd, ma,
+T, ta0) are not derived from the rest because TwoBodyOrbit sets them
+differently depending on how the orbit was defined, and rows must return
+the same values.
+"""
+
+import math
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import TwoBodyOrbit
+
+# Column layout of OrbitCatalog.data
+_T0, _T, _A, _E, _I, _LAN, _PARG, _TA0, _MA, _P = range(10)
+_POS = slice(10, 13)
+_VEL = slice(13, 16)
+_EVD = slice(16, 19)
+NFIELDS = 19
+_COLUMNS = {'t0': _T0, 'T': _T, 'a': _A, 'e': _E, 'i': _I, 'lan': _LAN,
+            'parg': _PARG, 'ta0': _TA0, 'ma': _MA, 'p': _P, 'pos': _POS,
+            'vel': _VEL, 'evd': _EVD}
+
+
+def _scalar(col, optional=False):
+    def fget(self):
+        val = float(self._catalog.data[self._row, col])
+        if optional and val != val:
+            return None
+        return val
+
+    def fset(self, val):
+        self._catalog.data[self._row, col] = np.nan if val is None else val
+    return property(fget, fset)
+
+
+def _vector(cols):
+    def fget(self):
+        return self._catalog.data[self._row, cols]
+
+    def fset(self, val):
+        self._catalog.data[self._row, cols] = val
+    return property(fget, fset)
+
+
+def _derived(fget):
+    # Assignments by TwoBodyOrbit methods are ignored; the value is
+    # recomputed from the stored row
+    return property(fget, lambda self, val: None)
+
+
+class OrbitRow(TwoBodyOrbit):
+    """A TwoBodyOrbit stored in one row of an OrbitCatalog
+
+    """
+    __slots__ = ('_catalog', '_row')
+
+    def __init__(self, catalog, row):
+        self._catalog = catalog
+        self._row = row
+
+    t0 = _scalar(_T0)
+    T = _scalar(_T)
+    a = _scalar(_A)
+    e = _scalar(_E)
+    i = _scalar(_I)
+    lan = _scalar(_LAN)
+    parg = _scalar(_PARG)
+    ta0 = _scalar(_TA0)
+    ma = _scalar(_MA, optional=True)
+    p = _scalar(_P)
+    pos = _vector(_POS)
+    vel = _vector(_VEL)
+    evd = _vector(_EVD)
+
+    @property
+    def _setOrb(self):
+        return bool(self._catalog.defined[self._row])
+
+    @_setOrb.setter
+    def _setOrb(self, val):
+        self._catalog.defined[self._row] = val
+
+    @property
+    def bodyname(self):
+        return self._catalog.names[self._row]
+
+    @bodyname.setter
+    def bodyname(self, val):
+        self._catalog.names[self._row] = val
+
+    @property
+    def mothername(self):
+        return self._catalog.mothername
+
+    @property
+    def mu(self):
+        return self._catalog.mu
+
+    @_derived
+    def hv(self):
+        # Unit normal of the orbital plane from inclination and node
+        i = self.i
+        lan = self.lan
+        return math.sqrt(self.p * self.mu) * np.array(
+            [math.sin(lan) * math.sin(i), (-1.0) * math.cos(lan) * math.sin(i),
+             math.cos(i)])
+
+    @_derived
+    def ev(self):
+        return self.evd * self.e
+
+    @_derived
+    def pr(self):
+        if self.e < 1.0:
+            return math.pi * 2.0 / math.sqrt(self.mu) * self.a ** 1.5
+        return None
+
+    @_derived
+    def mm(self):
+        if self.e < 1.0:
+            return math.pi * 2.0 / self.pr
+        return None
+
+
+class OrbitCatalog:
+    """Orbits of many objects around one central body, stored row-wise
+
+    """
+    def __init__(self, mname='Sun', mu=1.32712440041e20, capacity=0,
+                 data=None):
+        """
+        Args:
+            mname: Name of the central body
+            mu: Gravitational parameter of the central body
+            capacity: Number of rows to preallocate
+            data: Optional float64 array of shape (n, NFIELDS) to use as
+                storage, e.g. a view of a multiprocessing.shared_memory
+                buffer. Its rows are taken as n defined orbits
+        """
+        self.mothername = mname
+        self.mu = mu
+        if data is None:
+            self.data = np.full((capacity, NFIELDS), np.nan)
+            self.defined = np.zeros(capacity, dtype=bool)
+            self.names = []
+        else:
+            if data.ndim != 2 or data.shape[1] != NFIELDS:
+                raise(ValueError('data must have shape (n, {}): '.format(
+                    NFIELDS) + 'OrbitCatalog'))
+            self.data = data
+            self.defined = np.ones(data.shape[0], dtype=bool)
+            self.names = [''] * data.shape[0]
+
+    @classmethod
+    def from_orbits(cls, orbits):
+        """Returns a catalog holding copies of TwoBodyOrbit objects
+
+        Args:
+            orbits: Sequence of defined TwoBodyOrbit objects sharing one
+                central body
+        """
+        orbits = list(orbits)
+        if orbits:
+            catalog = cls(orbits[0].mothername, orbits[0].mu, len(orbits))
+        else:
+            catalog = cls()
+        for orbit in orbits:
+            if orbit.mu != catalog.mu:
+                raise(ValueError('Orbits have different central bodies: ' +
+                                 'OrbitCatalog.from_orbits'))
+            row = catalog.append(orbit.bodyname)
+            for key in ('t0', 'T', 'a', 'e', 'i', 'lan', 'parg', 'ta0', 'ma',
+                        'p', 'pos', 'vel', 'evd', '_setOrb'):
+                setattr(row, key, getattr(orbit, key))
+        return catalog
+
+    @classmethod
+    def from_csv(cls, filename, mname='Sun', mu=1.32712440041e20,
+                 au=1.496e11):
+        """Reads orbits from a file like Data/asteroids_keplerian_elements.csv
+
+        Args:
+            filename: Path of the file. Columns are Num, Name, Epoch (MJD),
+                a (AU), e, i, w, Node, M (degrees), ...
+            mname: Name of the central body
+            mu: Gravitational parameter of the central body
+            au: Length of the astronomical unit in the units of mu
+        """
+        with open(filename, 'r', encoding='utf-8-sig') as f:
+            lines = f.readlines()[1:]
+        catalog = cls(mname, mu, len(lines))
+        for line in lines:
+            row = line.strip('\n').split(',')
+            if len(row) < 9:
+                continue
+            epoch, a, e, i, w, node, ma = [float(v) for v in row[2:9]]
+            catalog.append(row[1]).setOrbKepl(epoch * 86400.0, a * au, e, i,
+                                              node, w, MA=ma)
+        return catalog
+
+    @classmethod
+    def from_perihelion(cls, names, q, e, i, node, w, T, mname='Sun',
+                        mu=1.32712440041e20):
+        """Returns a catalog of orbits given by perihelion elements
+
+        All rows are computed at once, without a TwoBodyOrbit per object.
+        The epoch of each orbit is its perihelion passage, where the state
+        follows from the elements in closed form. e can be 1.0 (parabolic
+        orbits have a = inf) or above 1.0.
+
+        Args:
+            names: Names of the m objects
+            q: Perihelion distances, shape (m,)
+            e: Eccentricities, shape (m,)
+            i: Inclinations (degrees), shape (m,)
+            node: Longitudes of the ascending node (degrees), shape (m,)
+            w: Arguments of perihelion (degrees), shape (m,)
+            T: Perihelion passage times, shape (m,)
+            mname: Name of the central body
+            mu: Gravitational parameter of the central body
+        Exception:
+            ValueError: If some q <= 0 or e < 0, raises ValueError
+        """
+        q, e, i, node, w, T = [np.asarray(v, dtype=float).reshape(-1)
+                               for v in (q, e, i, node, w, T)]
+        if (q <= 0.0).any() or (e < 0.0).any():
+            raise(ValueError('Invalid orbital elements (q<=0.0 or e<0.0): ' +
+                             'OrbitCatalog.from_perihelion'))
+        m = q.shape[0]
+        catalog = cls(mname, mu, m)
+        catalog.names = list(names)
+        catalog.defined[:m] = True
+        data = catalog.data
+        i, lan, parg = np.radians(i), np.radians(node), np.radians(w)
+        # Periapsis direction P and the direction of motion there, Q
+        co, so = np.cos(lan), np.sin(lan)
+        cw, sw = np.cos(parg), np.sin(parg)
+        ci, si = np.cos(i), np.sin(i)
+        pv = np.stack([co * cw - so * sw * ci, so * cw + co * sw * ci,
+                       sw * si], axis=1)
+        qv = np.stack([(-1.0) * co * sw - so * cw * ci,
+                       (-1.0) * so * sw + co * cw * ci, cw * si], axis=1)
+        data[:, _T0] = T
+        data[:, _T] = T
+        with np.errstate(divide='ignore'):
+            data[:, _A] = np.where(e == 1.0, np.inf, q / (1.0 - e))
+        data[:, _E] = e
+        data[:, _I] = i
+        data[:, _LAN] = lan
+        data[:, _PARG] = parg
+        data[:, _TA0] = 0.0
+        data[:, _MA] = np.where(e < 1.0, 0.0, np.nan)
+        data[:, _P] = q * (1.0 + e)
+        data[:, _POS] = q[:, None] * pv
+        data[:, _VEL] = np.sqrt(mu * (1.0 + e) / q)[:, None] * qv
+        data[:, _EVD] = pv
+        return catalog
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        n = len(self.names)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('OrbitCatalog index out of range')
+        return OrbitRow(self, index)
+
+    def __iter__(self):
+        for index in range(len(self.names)):
+            yield OrbitRow(self, index)
+
+    def append(self, bname):
+        """Adds an undefined orbit and returns it
+
+        Args:
+            bname: Name of the object
+        Returns: row
+            row: OrbitRow to define with setOrbCart or setOrbKepl
+        """
+        n = len(self.names)
+        if n == self.data.shape[0]:
+            grow = max(16, n)
+            self.data = np.concatenate([self.data,
+                                        np.full((grow, NFIELDS), np.nan)])
+            self.defined = np.concatenate([self.defined,
+                                           np.zeros(grow, dtype=bool)])
+        self.names.append(bname)
+        return OrbitRow(self, n)
+
+    def column(self, name):
+        """Returns one attribute of all orbits as a view of the storage
+
+        Args:
+            name: One of 't0', 'T', 'a', 'e', 'i', 'lan', 'parg', 'ta0',
+                'ma', 'p', 'pos', 'vel', 'evd'
+        Returns: values
+            values: View of shape (m,) for scalars, (m, 3) for vectors
+        """
+        n = len(self.names)
+        return self.data[:n, _COLUMNS[name]]
+
+    @property
+    def nbytes(self):
+        """Bytes used by the orbit arrays
+        """
+        n = len(self.names)
+        return self.data[:n].nbytes + self.defined[:n].nbytes
+
+    def states(self):
+        """Returns epoch states of all objects as arrays
+
+        Returns: r0, v0, t0, mu
+            r0: Positions at epoch, view of shape (m, 3)
+            v0: Velocities at epoch, view of shape (m, 3)
+            t0: Epochs, view of shape (m,)
+            mu: Gravitational parameters, shape (m,)
+        Exception:
+            RuntimeError: If an orbit has not been defined, raises
+                RuntimeError
+        """
+        n = len(self.names)
+        if not self.defined[:n].all():
+            raise(RuntimeError('Orbit has not been defined: ' +
+                               'OrbitCatalog.states'))
+        data = self.data[:n]
+        return data[:, _POS], data[:, _VEL], data[:, _T0], \
+            np.full(n, self.mu)
+
+    def propagate(self, t):
+        """Returns positions and velocities of all objects at times t
+
+        Args:
+            t: Times. Scalar, shape (k,), or shape (m, k)
+        Returns: pos, vel
+            pos: Positions, Numpy array of shape (m, k, 3)
+            vel: Velocities, Numpy array of shape (m, k, 3)
+        """
+        r0, v0, t0, mu = self.states()
+        ts = np.asarray(t, dtype=float)
+        if ts.ndim < 2:
+            ts = ts.reshape(1, -1)
+        return twobodykernels.kepler(r0, v0, mu, ts - t0[:, None])
+
+
+def _measure(n=2000):
+    """Returns bytes per orbit for TwoBodyOrbit objects and an OrbitCatalog
+    """
+    import tracemalloc
+    rng = np.random.default_rng(0)
+    elements = np.column_stack([rng.uniform(1.0, 4.0, n) * 1.496e11,
+                                rng.uniform(0.0, 0.3, n),
+                                rng.uniform(0.0, 30.0, n),
+                                rng.uniform(0.0, 360.0, (n, 3))])
+    names = ['{}'.format(j) for j in range(n)]
+    # One orbit first, so that the modules its methods import on first use
+    # are not counted
+    TwoBodyOrbit('warm-up').setOrbKepl(59200 * 86400.0, *elements[0, :5],
+                                       MA=elements[0, 5])
+    result = []
+    for kind in ('TwoBodyOrbit', 'OrbitCatalog'):
+        tracemalloc.start()
+        if kind == 'TwoBodyOrbit':
+            keep = []
+            for name, el in zip(names, elements):
+                orbit = TwoBodyOrbit(name)
+                orbit.setOrbKepl(59200 * 86400.0, *el[:5], MA=el[5])
+                keep.append(orbit)
+        else:
+            keep = OrbitCatalog(capacity=n)
+            for name, el in zip(names, elements):
+                keep.append(name).setOrbKepl(59200 * 86400.0, *el[:5],
+                                             MA=el[5])
+        result.append((kind, tracemalloc.get_traced_memory()[0] / n))
+        tracemalloc.stop()
+        del keep
+    return result
+
+
+if __name__ == '__main__':
+    for kind, size in _measure():
+        print('{:13s} {:8.1f} bytes/orbit'.format(kind, size))
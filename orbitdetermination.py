@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""Orbit determination of many objects from angles-only observations
+
+Observations of m objects, k per object, are given as arrays: times t
+(m, k), unit line-of-sight vectors los (m, k, 3) in the ecliptic frame of
+the other modules, and heliocentric observer positions (m, k, 3). Missing
+observations can be padded and given an infinite sigma.
+
+This module provides:
+  gauss_iod: Gauss's method on three observations of each object. The
+      eighth-degree polynomial of every object is solved at once through
+      the eigenvalues of its companion matrix; each positive real root
+      gives a candidate orbit, and the candidate fitting all observations
+      best is kept.
+  differential_correction: Weighted least squares of the epoch states
+      (Levenberg-Marquardt), with residuals and Jacobians of all objects
+      evaluated together. The partial derivatives of the line of sight
+      come from the analytic state transition matrices of
+      twobodykernels.kepler_stm, not from finite differences.
+  fit_orbits: Both in sequence, with throughput statistics.
+
+Light time is taken into account: a body is observed where it was at
+t - distance / c. Aberration and observer-dependent corrections are left
+to the caller.
+
+Run this module to fit a synthetic set of objects:
+  python orbitdetermination.py [number of objects] [observations]
+"""
+
+import sys
+import math
+import time
+import numpy as np
+
+import twobodykernels
+from ephemeris import OBLIQUITY_J2000
+
+LIGHT_SPEED = 299792458.0
+ARCSEC = math.radians(1.0 / 3600.0)
+
+
+def radec_to_los(ra, dec):
+    """Converts J2000 equatorial RA, Dec to ecliptic unit vectors
+
+    Args:
+        ra, dec: Right ascension and declination in radians (arrays)
+    Returns: los
+        los: Numpy array of shape ra.shape + (3,)
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    x = np.cos(dec) * np.cos(ra)
+    y = np.cos(dec) * np.sin(ra)
+    z = np.sin(dec)
+    c = math.cos(OBLIQUITY_J2000)
+    s = math.sin(OBLIQUITY_J2000)
+    return np.stack([x, c * y + s * z, (-1.0) * s * y + c * z], axis=-1)
+
+
+def _normalize(v):
+    return v / np.sqrt((v * v).sum(axis=-1))[..., None]
+
+
+def _predict(r0, v0, mu, t0, t, observer, stm=False):
+    # Lines of sight and distances of the objects seen at t, with light
+    # time. With stm, also the partial derivatives of the emitted position
+    # with respect to the epoch state, light time included (n, k, 3, 6)
+    dt = t - t0[:, None]
+    pos, vel = twobodykernels.kepler(r0, v0, mu, dt)
+    rho = np.sqrt(((pos - observer) ** 2).sum(axis=-1))
+    dte = dt - rho / LIGHT_SPEED
+    if stm:
+        pos, vel, phi = twobodykernels.kepler_stm(r0, v0, mu, dte)
+    else:
+        pos, vel = twobodykernels.kepler(r0, v0, mu, dte)
+    # One Newton step on c (t - te) = |r(te) - observer|
+    rel = pos - observer
+    rho = np.sqrt((rel * rel).sum(axis=-1))
+    rate = LIGHT_SPEED + (rel * vel).sum(axis=-1) / rho
+    step = (LIGHT_SPEED * (dt - dte) - rho) / rate
+    rel = rel + vel * step[..., None]
+    rho = np.sqrt((rel * rel).sum(axis=-1))
+    los = rel / rho[..., None]
+    if not stm:
+        return los, rho, None
+    # d te = -u . d r / (c + u . v)
+    prow = phi[..., :3, :]
+    dte = (-1.0) * np.einsum('nki,nkij->nkj', los, prow) / rate[..., None]
+    return los, rho, prow + vel[..., :, None] * dte[..., None, :]
+
+
+def _tangent_basis(los):
+    # Two unit vectors normal to each line of sight, shape (m, k, 2, 3)
+    ref = np.where(np.abs(los[..., 2:3]) < 0.9, [0.0, 0.0, 1.0],
+                   [1.0, 0.0, 0.0])
+    e1 = _normalize(np.cross(ref, los))
+    e2 = np.cross(los, e1)
+    return np.stack([e1, e2], axis=-2)
+
+
+def _scales(state):
+    # |r| for the position and |v| for the velocity components, (m, 6)
+    return np.repeat(np.stack([np.sqrt((state[:, :3] ** 2).sum(axis=1)),
+                               np.sqrt((state[:, 3:] ** 2).sum(axis=1))],
+                              axis=1), 3, axis=1)
+
+
+def _weights(sigma, shape):
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), shape)
+    with np.errstate(divide='ignore'):
+        return np.where(np.isfinite(sigma), 1.0 / sigma ** 2, 0.0)
+
+
+def gauss_iod(t, los, observer, mu=1.32712440041e20, triplet=None):
+    """Initial orbits by Gauss's method
+
+    Args:
+        t: Observation times, shape (m, k)
+        los: Unit lines of sight, shape (m, k, 3)
+        observer: Heliocentric observer positions, shape (m, k, 3)
+        mu: Gravitational parameter of the central body
+        triplet: Indices (i1, i2, i3) of the observations used. Default is
+            the first, middle and last observation
+    Returns: pos, vel, t0, ok
+        pos, vel: States at the time of the middle observation, (m, 3)
+        t0: Time of the middle observation, shape (m,)
+        ok: Boolean Numpy array of shape (m,); False where no solution
+            was found (states are NaN there)
+    """
+    t = np.asarray(t, dtype=float)
+    los = np.asarray(los, dtype=float)
+    observer = np.asarray(observer, dtype=float)
+    m, k = t.shape
+    if triplet is None:
+        triplet = (0, k // 2, k - 1)
+    i1, i2, i3 = triplet
+    tau1 = t[:, i1] - t[:, i2]
+    tau3 = t[:, i3] - t[:, i2]
+    tau = tau3 - tau1
+    u1, u2, u3 = los[:, i1], los[:, i2], los[:, i3]
+    big_r = (observer[:, i1], observer[:, i2], observer[:, i3])
+    p = (np.cross(u2, u3), np.cross(u1, u3), np.cross(u1, u2))
+    d0 = (u1 * p[0]).sum(axis=1)
+    d = [[(big_r[a] * p[b]).sum(axis=1) for b in range(3)] for a in range(3)]
+    aa = ((-1.0) * d[0][1] * tau3 / tau + d[1][1] + d[2][1] * tau1 / tau) \
+        / d0
+    bb = (d[0][1] * (tau3 ** 2 - tau ** 2) * tau3 / tau
+          + d[2][1] * (tau ** 2 - tau1 ** 2) * tau1 / tau) / (6.0 * d0)
+    ee = (big_r[1] * u2).sum(axis=1)
+    r2sq = (big_r[1] ** 2).sum(axis=1)
+
+    # x^8 + a x^6 + b x^3 + c = 0 for x = |r2|, scaled by the observer
+    # distance to keep the companion matrices well conditioned
+    scale = np.sqrt(r2sq)
+    coef = np.zeros((m, 8))
+    coef[:, 1] = (-1.0) * (aa * aa + 2.0 * aa * ee + r2sq) / scale ** 2
+    coef[:, 4] = (-2.0) * mu * bb * (aa + ee) / scale ** 5
+    coef[:, 7] = (-1.0) * mu ** 2 * bb * bb / scale ** 8
+    companion = np.zeros((m, 8, 8))
+    companion[:, 0, :] = (-1.0) * coef
+    companion[:, np.arange(1, 8), np.arange(7)] = 1.0
+    good = np.isfinite(companion).all(axis=(1, 2))
+    companion[~good] = 0.0
+    roots = np.linalg.eigvals(companion)
+    real = (np.abs(roots.imag) <= 1e-8 * np.abs(roots)) & (roots.real > 0.0) \
+        & good[:, None]
+
+    # One candidate orbit per positive real root
+    obj, col = np.nonzero(real)
+    r2 = roots.real[obj, col] * scale[obj]
+    r23 = r2 ** 3
+    t1, t3, tt = tau1[obj], tau3[obj], tau[obj]
+    dd = [[d[a][b][obj] for b in range(3)] for a in range(3)]
+    dz = d0[obj]
+    with np.errstate(all='ignore'):
+        rho1 = ((6.0 * (dd[2][0] * t1 / t3 + dd[1][0] * tt / t3) * r23
+                 + mu * dd[2][0] * (tt ** 2 - t1 ** 2) * t1 / t3)
+                / (6.0 * r23 + mu * (tt ** 2 - t3 ** 2)) - dd[0][0]) / dz
+        rho2 = aa[obj] + mu * bb[obj] / r23
+        rho3 = ((6.0 * (dd[0][2] * t3 / t1 - dd[1][2] * tt / t1) * r23
+                 + mu * dd[0][2] * (tt ** 2 - t3 ** 2) * t3 / t1)
+                / (6.0 * r23 + mu * (tt ** 2 - t1 ** 2)) - dd[2][2]) / dz
+        pos1 = big_r[0][obj] + rho1[:, None] * u1[obj]
+        pos2 = big_r[1][obj] + rho2[:, None] * u2[obj]
+        pos3 = big_r[2][obj] + rho3[:, None] * u3[obj]
+        f1 = 1.0 - 0.5 * mu * t1 ** 2 / r23
+        f3 = 1.0 - 0.5 * mu * t3 ** 2 / r23
+        g1 = t1 - mu * t1 ** 3 / (6.0 * r23)
+        g3 = t3 - mu * t3 ** 3 / (6.0 * r23)
+        vel2 = (f1[:, None] * pos3 - f3[:, None] * pos1) \
+            / (f1 * g3 - f3 * g1)[:, None]
+    valid = (rho1 > 0.0) & (rho2 > 0.0) & (rho3 > 0.0) & \
+        np.isfinite(vel2).all(axis=1)
+    obj, pos2, vel2 = obj[valid], pos2[valid], vel2[valid]
+
+    # Keep the candidate with the smallest residuals over all observations
+    t0 = t[:, i2].copy()
+    cost = np.full(obj.shape[0], np.inf)
+    if obj.shape[0]:
+        pred, rho, dpos = _predict(pos2, vel2, np.full(obj.shape[0], mu),
+                                  t0[obj], t[obj], observer[obj])
+        cost = ((pred - los[obj]) ** 2).sum(axis=(1, 2))
+        cost = np.where(np.isfinite(cost), cost, np.inf)
+    order = np.lexsort((cost, obj))
+    first = np.ones(order.shape[0], dtype=bool)
+    first[1:] = obj[order][1:] != obj[order][:-1]
+    best = order[first & np.isfinite(cost[order])]
+    pos = np.full((m, 3), np.nan)
+    vel = np.full((m, 3), np.nan)
+    pos[obj[best]] = pos2[best]
+    vel[obj[best]] = vel2[best]
+    ok = np.zeros(m, dtype=bool)
+    ok[obj[best]] = True
+    return pos, vel, t0, ok
+
+
+def differential_correction(t, los, observer, pos, vel, t0,
+                            mu=1.32712440041e20, sigma=ARCSEC, maxiter=20,
+                            tol=1e-11):
+    """Least-squares correction of the epoch states of many objects
+
+    The residuals of an observation are the offsets of the observed line
+    of sight from the computed one along two directions normal to it
+    (radians). Their partial derivatives with respect to the epoch state
+    are (I - u u^T) / rho times the position rows of the analytic state
+    transition matrix, corrected for the change of the light time. All
+    objects take Levenberg-Marquardt steps together; an object stops when
+    its scaled step falls below tol or an undamped step no longer lowers
+    the chi-square (short arcs leave the distance poorly determined, and
+    the steps along it stay large).
+
+    Args:
+        t: Observation times, shape (m, k)
+        los: Unit lines of sight, shape (m, k, 3)
+        observer: Heliocentric observer positions, shape (m, k, 3)
+        pos, vel: Initial states at t0, shape (m, 3)
+        t0: Epochs of the states, shape (m,)
+        mu: Gravitational parameter of the central body
+        sigma: Standard deviation of the observations in radians, scalar
+            or shape (m, k). np.inf marks missing observations
+        maxiter: Largest number of iterations
+        tol: Convergence threshold of the step, relative to |r| and |v|
+    Returns: fit
+        fit: Dictionary of Numpy arrays:
+            'pos', 'vel': Fitted states at t0, shape (m, 3)
+            't0': Epochs, shape (m,)
+            'cov': Formal covariance of (pos, vel), shape (m, 6, 6)
+            'rms': RMS of the residuals in radians, shape (m,)
+            'niter': Iterations used, shape (m,)
+            'converged': Boolean, shape (m,)
+    """
+    t = np.asarray(t, dtype=float)
+    los = np.asarray(los, dtype=float)
+    observer = np.asarray(observer, dtype=float)
+    m, k = t.shape
+    x = np.concatenate([np.asarray(pos, dtype=float),
+                        np.asarray(vel, dtype=float)], axis=1)
+    t0 = np.asarray(t0, dtype=float)
+    mus = np.full(m, float(mu))
+    w = _weights(sigma, (m, k))
+    basis = _tangent_basis(los)
+    nobs = np.maximum(w.astype(bool).sum(axis=1), 1)
+
+    def evaluate(idx, state):
+        # Residuals (n, k, 2), chi-square and normal equations of objects
+        pred, rho, dpos = _predict(state[:, :3], state[:, 3:], mus[idx],
+                                   t0[idx], t[idx], observer[idx], stm=True)
+        res = np.einsum('nkci,nki->nkc', basis[idx], los[idx] - pred)
+        a = dpos / rho[..., None, None]
+        a = a - pred[..., :, None] * np.einsum('nki,nkij->nkj', pred, a)[
+            ..., None, :]
+        jac = (-1.0) * np.einsum('nkci,nkij->nkcj', basis[idx], a)
+        wi = w[idx][..., None]
+        chi2 = (wi * res * res).sum(axis=(1, 2))
+        normal = np.einsum('nkci,nkc,nkcj->nij', jac, wi.repeat(2, axis=-1),
+                           jac)
+        grad = np.einsum('nkci,nkc,nkc->ni', jac, wi.repeat(2, axis=-1), res)
+        rms = np.sqrt((np.where(wi > 0.0, res * res, 0.0)).sum(axis=(1, 2))
+                      / (2.0 * nobs[idx]))
+        return chi2, normal, grad, rms
+
+    valid = np.isfinite(x).all(axis=1)
+    idx = np.nonzero(valid)[0]
+    chi2 = np.full(m, np.inf)
+    normal = np.zeros((m, 6, 6))
+    grad = np.zeros((m, 6))
+    rms = np.full(m, np.nan)
+    if idx.shape[0]:
+        chi2[idx], normal[idx], grad[idx], rms[idx] = evaluate(idx, x[idx])
+    lam = np.full(m, 1e-3)
+    niter = np.zeros(m, dtype=int)
+    converged = np.zeros(m, dtype=bool)
+    active = valid & np.isfinite(chi2)
+    for it in range(maxiter):
+        idx = np.nonzero(active)[0]
+        if idx.shape[0] == 0:
+            break
+        # Scale positions and velocities to comparable magnitudes
+        s = _scales(x[idx])
+        ns = normal[idx] * s[:, :, None] * s[:, None, :]
+        ns = ns + lam[idx, None, None] * np.eye(6) * \
+            np.diagonal(ns, axis1=1, axis2=2)[:, None, :]
+        step = (-1.0) * np.linalg.solve(ns, (grad[idx] * s)[..., None])[..., 0]
+        trial = x[idx] + step * s
+        niter[idx] += 1
+        tchi2, tnormal, tgrad, trms = evaluate(idx, trial)
+        better = np.isfinite(tchi2) & (tchi2 <= chi2[idx])
+        # Accepted near Gauss-Newton steps that no longer lower chi-square
+        flat = better & (lam[idx] <= 1e-2) & \
+            (chi2[idx] - tchi2 <= 1e-8 * chi2[idx])
+        acc = idx[better]
+        x[acc] = trial[better]
+        chi2[acc], normal[acc], grad[acc], rms[acc] = tchi2[better], \
+            tnormal[better], tgrad[better], trms[better]
+        lam[acc] = np.maximum(lam[acc] * 0.1, 1e-12)
+        lam[idx[~better]] *= 10.0
+        small = (np.abs(step).max(axis=1) < tol) | flat
+        converged[idx[small]] = True
+        active[idx[small | (lam[idx] > 1e8)]] = False
+
+    cov = np.full((m, 6, 6), np.nan)
+    fitted = np.nonzero(np.isfinite(chi2))[0]
+    if fitted.shape[0]:
+        s = _scales(x[fitted])
+        with np.errstate(all='ignore'):
+            cov[fitted] = np.linalg.pinv(normal[fitted] * s[:, :, None]
+                                         * s[:, None, :], hermitian=True) \
+                * s[:, :, None] * s[:, None, :]
+    return {'pos': x[:, :3], 'vel': x[:, 3:], 't0': t0, 'cov': cov,
+            'rms': rms, 'niter': niter, 'converged': converged}
+
+
+def fit_orbits(t, los, observer, mu=1.32712440041e20, sigma=ARCSEC,
+               maxiter=20):
+    """Initial orbit determination and differential correction
+
+    Args:
+        t, los, observer: Observations (see differential_correction)
+        mu: Gravitational parameter of the central body
+        sigma: Standard deviation of the observations in radians
+        maxiter: Largest number of correction iterations
+    Returns: fit, stats
+        fit: See differential_correction; fit['iod'] is the boolean mask
+            of the objects for which Gauss's method gave a start
+        stats: Dictionary with 'objects', 'observations', 'converged',
+            'seconds' and 'fits_per_second'
+    """
+    start = time.perf_counter()
+    pos, vel, t0, ok = gauss_iod(t, los, observer, mu)
+    fit = differential_correction(t, los, observer, pos, vel, t0, mu, sigma,
+                                  maxiter)
+    fit['iod'] = ok
+    seconds = time.perf_counter() - start
+    m = fit['t0'].shape[0]
+    stats = {'objects': m, 'observations': int(np.size(t)),
+             'converged': int(fit['converged'].sum()), 'seconds': seconds,
+             'fits_per_second': m / seconds if seconds > 0 else np.inf}
+    return fit, stats
+
+
+def to_catalog(fit, names=None, mname='Sun', mu=1.32712440041e20):
+    """Returns the converged orbits of a fit as an OrbitCatalog
+
+    Args:
+        fit: Result of differential_correction or fit_orbits
+        names: Names of the objects. Default is their indices
+        mname: Name of the central body
+        mu: Gravitational parameter of the central body
+    """
+    from orbitcatalog import OrbitCatalog
+    index = np.nonzero(fit['converged'])[0]
+    catalog = OrbitCatalog(mname, mu, index.shape[0])
+    for j in index:
+        name = names[j] if names is not None else str(j)
+        catalog.append(name).setOrbCart(fit['t0'][j], fit['pos'][j],
+                                        fit['vel'][j])
+    return catalog
+
+
+def _synthetic(m, nobs, observer, t_start, span, sigma, seed=1,
+               mu=1.32712440041e20):
+    # Main-belt-like orbits and their noisy observations from observer(t)
+    from ensemble import elements_to_states
+    rng = np.random.default_rng(seed)
+    times = t_start + np.linspace(0.0, span, nobs)
+    elements = np.column_stack([rng.uniform(2.1, 3.3, m) * 1.496e11,
+                                rng.uniform(0.0, 0.25, m),
+                                rng.uniform(0.0, 20.0, m),
+                                rng.uniform(0.0, 360.0, (3, m)).T])
+    pos, vel = elements_to_states(elements, mu)
+    t = np.broadcast_to(times, (m, nobs)).copy()
+    obs = np.broadcast_to(observer(times), (m, nobs, 3)).copy()
+    t0 = np.full(m, times[nobs // 2])
+    los, rho, dpos = _predict(pos, vel, np.full(m, mu), t0, t, obs)
+    basis = _tangent_basis(los)
+    noise = rng.standard_normal((m, nobs, 2)) * sigma
+    los = _normalize(los + np.einsum('mkci,mkc->mki', basis, noise))
+    return t, los, obs, pos, vel
+
+
+if __name__ == '__main__':
+    from secularelements import SecularElements
+    m = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    nobs = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    planets = SecularElements.from_csv('Data/planets_keplerian_elements.csv')
+    earth = planets.names.index('EM Bary')
+
+    def observer(times):
+        return planets.posvelatt(times)[0][earth]
+
+    sigma = 0.5 * ARCSEC
+    t, los, obs, pos, vel = _synthetic(m, nobs, observer, 59200.0 * 86400.0,
+                                       40.0 * 86400.0, sigma)
+    fit, stats = fit_orbits(t, los, obs, sigma=sigma)
+    err = np.sqrt(((fit['pos'] - pos) ** 2).sum(axis=1))
+    ok = fit['converged']
+    print('{} objects x {} observations: {:.2f} s, {:.0f} fits/s'.format(
+        m, nobs, stats['seconds'], stats['fits_per_second']))
+    print('converged {} / {}, median iterations {:.0f}'.format(
+        stats['converged'], m, np.median(fit['niter'])))
+    print('median RMS {:.3f} arcsec, median position error {:.0f} km'.format(
+        np.median(fit['rms'][ok]) / ARCSEC, np.median(err[ok]) / 1000.0))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""Event tables for many orbits: periapsis passages, nodes, conjunctions
+
+This module provides:
+  periapsis_passages: Times of periapsis passage, from T and the period.
+  node_crossings: Ascending and descending node crossings. The node is
+      where the argument of latitude is 0 or 180 degrees, so the true
+      anomaly at the node is known and its time follows from Kepler's
+      equation.
+  conjunctions: Conjunctions with and oppositions to the Sun as seen by an
+      observer (e.g. the Earth). These depend on two bodies, so they are
+      bracketed on a time grid for all objects at once and the roots are
+      refined by a vectorized Illinois (regula falsi) iteration.
+  find_events: All of the above in one sorted table.
+
+Orbits can be given as sequences of TwoBodyOrbit objects or as an
+OrbitCatalog. Events are returned as structured Numpy arrays with fields
+'i' (index of the object), 'event' (name of the event) and 't' (time),
+sorted by time.
+"""
+
+import math
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits, propagate
+
+EVENT_DTYPE = np.dtype([('i', int), ('event', 'U16'), ('t', float)])
+
+
+def _elements(orbits):
+    """Returns a, e, p, i, parg, T, mu of the orbits as arrays
+    """
+    if hasattr(orbits, 'column'):
+        cols = [orbits.column(key) for key in ('a', 'e', 'p', 'i', 'parg',
+                                               'T')]
+        return tuple(cols) + (np.full(len(orbits), orbits.mu),)
+    for orbit in orbits:
+        if not orbit._setOrb:
+            raise(RuntimeError('Orbit has not been defined: ' +
+                               'orbitevents'))
+    return tuple(np.array([getattr(orbit, key) for orbit in orbits],
+                          dtype=float)
+                 for key in ('a', 'e', 'p', 'i', 'parg', 'T', 'mu'))
+
+
+def _period(a, e, mu):
+    with np.errstate(invalid='ignore'):
+        return np.where(e < 1.0, math.pi * 2.0 * np.sqrt(a ** 3 / mu), np.inf)
+
+
+def time_from_periapsis(a, e, p, mu, ta):
+    """Vectorized TwoBodyOrbit.timeFperi
+
+    Args:
+        a, e, p, mu: Semi-major axis, eccentricity, semi-latus rectum and
+            gravitational parameter (array-like objects)
+        ta: True anomaly in radians (array-like object, broadcast with the
+            elements)
+    Returns: sec_from_peri
+        sec_from_peri: Time from periapsis passage. For elliptic orbits it
+            is in [0, period); for hyperbolic orbits it is negative before
+            periapsis and NaN beyond the asymptotes
+    """
+    a, e, p, mu, ta = np.broadcast_arrays(*(np.asarray(v, dtype=float)
+                                            for v in (a, e, p, mu, ta)))
+    half = ta * 0.5
+    result = np.full(ta.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ell = e < 1.0
+        ecc_anm = 2.0 * np.arctan2(np.sqrt(1.0 - e[ell]) * np.sin(half[ell]),
+                                   np.sqrt(1.0 + e[ell]) * np.cos(half[ell]))
+        ma = np.remainder(ecc_anm - e[ell] * np.sin(ecc_anm), math.pi * 2.0)
+        result[ell] = np.sqrt(a[ell] ** 3 / mu[ell]) * ma
+
+        par = e == 1.0
+        d = np.tan(half[par])
+        result[par] = np.sqrt(p[par] ** 3 / mu[par]) * 0.5 \
+            * (d + d ** 3 / 3.0)
+
+        hyp = e > 1.0
+        x = np.sqrt((e[hyp] - 1.0) / (e[hyp] + 1.0)) * np.tan(half[hyp])
+        lf = 2.0 * np.arctanh(x)
+        result[hyp] = np.sqrt((-1.0) * a[hyp] ** 3 / mu[hyp]) \
+            * (e[hyp] * np.sinh(lf) - lf)
+    return result
+
+
+def _repeat(index, name, t0, period, tstart, tend):
+    """Events at t0 + n * period inside [tstart, tend] as a structured array
+    """
+    ok = np.isfinite(t0)
+    index, t0, period = index[ok], t0[ok], period[ok]
+    periodic = np.isfinite(period)
+    first = np.where(periodic, np.ceil((tstart - t0) / np.where(
+        periodic, period, 1.0)), 0.0)
+    last = np.where(periodic, np.floor((tend - t0) / np.where(
+        periodic, period, 1.0)), 0.0)
+    count = np.maximum(last - first + 1.0, 0.0).astype(int)
+    rows = np.repeat(np.arange(index.shape[0]), count)
+    # n runs from first to last for each row
+    offset = np.arange(rows.shape[0]) - np.repeat(np.cumsum(count) - count,
+                                                  count)
+    n = first[rows] + offset
+    t = t0[rows] + n * np.where(periodic, period, 0.0)[rows]
+    inside = (t >= tstart) & (t <= tend)
+    events = np.zeros(int(inside.sum()), dtype=EVENT_DTYPE)
+    events['i'] = index[rows][inside]
+    events['event'] = name
+    events['t'] = t[inside]
+    return events
+
+
+def periapsis_passages(orbits, tstart, tend):
+    """Returns all periapsis passages between tstart and tend
+
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        tstart, tend: Time window
+    Returns: events
+        events: Structured Numpy array (EVENT_DTYPE) sorted by time. The
+            event name is 'periapsis'
+    """
+    a, e, p, i, parg, T, mu = _elements(orbits)
+    events = _repeat(np.arange(a.shape[0]), 'periapsis', T,
+                     _period(a, e, mu), tstart, tend)
+    return np.sort(events, order=['t', 'i'])
+
+
+def node_crossings(orbits, tstart, tend):
+    """Returns all ascending and descending node crossings
+
+    Orbits in the reference plane (inclination 0 or 180 degrees) have no
+    nodes and are skipped.
+
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        tstart, tend: Time window
+    Returns: events
+        events: Structured Numpy array (EVENT_DTYPE) sorted by time. The
+            event names are 'ascending_node' and 'descending_node'
+    """
+    a, e, p, i, parg, T, mu = _elements(orbits)
+    period = _period(a, e, mu)
+    index = np.arange(a.shape[0])
+    inclined = np.abs(np.sin(i)) > 1e-12
+    result = []
+    for name, u in (('ascending_node', 0.0), ('descending_node', math.pi)):
+        # True anomaly where the argument of latitude is u
+        ta = np.remainder(u - parg + math.pi, math.pi * 2.0) - math.pi
+        t0 = T + time_from_periapsis(a, e, p, mu, ta)
+        result.append(_repeat(index[inclined], name, t0[inclined],
+                              period[inclined], tstart, tend))
+    return np.sort(np.concatenate(result), order=['t', 'i'])
+
+
+def _elongation(r0, v0, mu, t0, obs, t):
+    """Returns (cross, dot) of the geocentric directions to object and Sun
+
+    The cross product is taken in the reference plane, so its sign changes
+    at conjunctions and oppositions in longitude.
+    """
+    dt = np.asarray(t, dtype=float).reshape(r0.shape[0], -1)
+    pos, vel = twobodykernels.kepler(r0, v0, mu, dt - t0[:, None])
+    opos, ovel = twobodykernels.kepler(obs[0], obs[1], obs[3],
+                                       dt.reshape(1, -1) - obs[2][:, None])
+    opos = opos[0].reshape(pos.shape)
+    geo = pos - opos
+    sun = (-1.0) * opos
+    cross = geo[..., 0] * sun[..., 1] - geo[..., 1] * sun[..., 0]
+    dot = (geo * sun).sum(axis=-1)
+    return cross.reshape(np.shape(t)), dot.reshape(np.shape(t))
+
+
+def conjunctions(orbits, observer, tstart, tend, step=86400.0 * 5.0,
+                 tol=1.0, maxiter=60, epochs_per_block=16):
+    """Returns conjunctions with and oppositions to the Sun
+
+    Events are times when the longitude of the object seen from the
+    observer equals that of the central body (conjunction) or differs by
+    180 degrees (opposition). Longitudes are measured in the reference
+    plane of the orbits.
+
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        observer: TwoBodyOrbit of the observer around the same central body
+        tstart, tend: Time window
+        step: Sampling step for bracketing. Events closer together than
+            one step may be missed
+        tol: Time tolerance of the refined events
+        maxiter: Maximum number of refinement iterations
+        epochs_per_block: Number of epochs propagated at once
+    Returns: events
+        events: Structured Numpy array (EVENT_DTYPE) sorted by time. The
+            event names are 'conjunction' and 'opposition'
+    Exception:
+        RuntimeError: If a position could not be computed, raises
+            RuntimeError
+    """
+    r0, v0, t0, mu = stack_orbits(orbits)
+    obs = stack_orbits([observer])
+    times = np.arange(tstart, tend + step * 0.5, step, dtype=float)
+    times[-1] = min(times[-1], tend)
+    opos, ovel = propagate([observer], times)
+
+    # Brackets: sign changes between consecutive samples. The objects are
+    # propagated a block of epochs at a time; the last sample of a block
+    # is carried over to bracket with the first one of the next
+    rows, cols, flos, fhis = [], [], [], []
+    last = None
+    for b in range(0, times.shape[0], epochs_per_block):
+        tb = times[b:b + epochs_per_block]
+        pos, vel = twobodykernels.kepler(r0, v0, mu,
+                                         tb[None, :] - t0[:, None])
+        if not np.isfinite(pos).all():
+            raise(RuntimeError('Could not compute position and velocity: ' +
+                               'orbitevents.conjunctions'))
+        geo = pos - opos[:, b:b + epochs_per_block]
+        sun = (-1.0) * opos[:, b:b + epochs_per_block]
+        cross = geo[..., 0] * sun[..., 1] - geo[..., 1] * sun[..., 0]
+        # The observer itself (or a copy of it) has no direction
+        apart = (np.abs(geo) > np.abs(sun) * 1e-9).any(axis=-1)
+        first = b
+        if last is not None:
+            cross = np.concatenate([last[0], cross], axis=1)
+            apart = np.concatenate([last[1], apart], axis=1)
+            first = b - 1
+        row, col = np.nonzero((np.signbit(cross[:, :-1])
+                               != np.signbit(cross[:, 1:]))
+                              & apart[:, :-1] & apart[:, 1:])
+        rows.append(row)
+        cols.append(col + first)
+        flos.append(cross[row, col])
+        fhis.append(cross[row, col + 1])
+        last = cross[:, -1:], apart[:, -1:]
+    row = np.concatenate(rows)
+    col = np.concatenate(cols)
+    lo = times[col]
+    hi = times[col + 1]
+    flo = np.concatenate(flos)
+    fhi = np.concatenate(fhis)
+    args = (r0[row], v0[row], mu[row], t0[row], obs)
+    side = np.zeros(row.shape[0], dtype=int)
+    for it in range(maxiter):
+        if row.shape[0] == 0 or np.all(hi - lo <= tol):
+            break
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tm = (lo * fhi - hi * flo) / (fhi - flo)
+        tm = np.where(np.isfinite(tm), np.clip(tm, lo, hi), 0.5 * (lo + hi))
+        fm, dm = _elongation(*args, tm)
+        right = np.signbit(fm) == np.signbit(fhi)
+        # Illinois step: halve the value kept at the stale end
+        flo = np.where(right, np.where(side == 1, flo * 0.5, flo), fm)
+        fhi = np.where(right, fm, np.where(side == -1, fhi * 0.5, fhi))
+        lo = np.where(right, lo, tm)
+        hi = np.where(right, tm, hi)
+        side = np.where(right, 1, -1)
+    t = 0.5 * (lo + hi)
+    events = np.zeros(row.shape[0], dtype=EVENT_DTYPE)
+    if row.shape[0]:
+        fm, dm = _elongation(*args, t)
+        events['i'] = row
+        events['event'] = np.where(dm > 0.0, 'conjunction', 'opposition')
+        events['t'] = t
+    return np.sort(events, order=['t', 'i'])
+
+
+def find_events(orbits, tstart, tend, observer=None, step=86400.0 * 5.0):
+    """Returns periapsis passages, node crossings and, if an observer is
+    given, conjunctions and oppositions of all orbits in one table
+
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        tstart, tend: Time window
+        observer: TwoBodyOrbit of the observer for conjunctions and
+            oppositions. If None, they are not searched
+        step: Sampling step for conjunctions and oppositions
+    Returns: events
+        events: Structured Numpy array (EVENT_DTYPE) sorted by time
+    """
+    result = [periapsis_passages(orbits, tstart, tend),
+              node_crossings(orbits, tstart, tend)]
+    if observer is not None:
+        result.append(conjunctions(orbits, observer, tstart, tend, step))
+    return np.sort(np.concatenate(result), order=['t', 'i'])
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""Planetary perturbations of many massless bodies (Encke's method)
+
+PerturbedOrbits follows a set of test particles (asteroids) under the
+attraction of the Sun and the major planets. Initial states are taken
+from the two-body orbits at a common start time. Each particle is written
+as r = rho + delta, where rho is its osculating two-body orbit at the
+start of the current segment (propagated by twobodykernels) and delta is
+integrated:
+
+  delta'' = -mu / rho^3 (delta + f(q) r) + a_planets(r)
+  q = delta . (delta - 2 r) / r^2,  f(q) = q (3 + 3q + q^2) / (1 + (1 + q)^1.5)
+
+a_planets is the direct and indirect heliocentric acceleration of the
+planets, whose positions come from SecularElements. delta is small, so
+the 8th order Dormand-Prince integrator of scipy.integrate.solve_ivp takes
+large steps; the accelerations of all particles are computed at once. At
+the end of every segment the reference orbits are rectified to the
+current states and delta is reset to zero.
+
+Run this module to compare perturbed and two-body positions of the
+asteroids of Data/ and to time a synthetic set of particles:
+  python perturbation.py [years] [number of particles]
+"""
+
+import sys
+import time
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits, propagate
+from secularelements import SecularElements
+
+# Gravitational parameters (m^3/s^2) of the bodies of
+# Data/planets_keplerian_elements.csv (DE440). The Earth-Moon barycenter
+# carries the mass of both
+PLANET_GM = {'Mercury': 2.2031868551e13, 'Venus': 3.24858592000e14,
+             'EM Bary': 4.03503235502e14, 'Mars': 4.2828375816e13,
+             'Jupiter': 1.26712764100e17, 'Saturn': 3.7940584841e16,
+             'Uranus': 5.794556400e15, 'Neptune': 6.836527100e15,
+             'Pluto': 9.75500000e11}
+
+YEAR = 365.25 * 86400.0
+
+
+def encke_f(q):
+    """Returns f(q) = (1 + q)^1.5 - 1 in a form without cancellation
+
+    With rho^2 = r^2 (1 + q), rho^3 / r^3 = 1 + f(q).
+    """
+    return q * (3.0 + 3.0 * q + q * q) / (1.0 + (1.0 + q) ** 1.5)
+
+
+def planet_acceleration(r, planet_pos, planet_gm):
+    """Returns the heliocentric perturbing acceleration of the planets
+
+    Args:
+        r: Positions of the particles, shape (m, 3)
+        planet_pos: Heliocentric positions of the planets, shape (n, 3)
+        planet_gm: Gravitational parameters of the planets, shape (n,)
+    Returns: acc
+        acc: Accelerations, Numpy array of shape (m, 3)
+    """
+    d = planet_pos[None, :, :] - r[:, None, :]
+    d3 = ((d ** 2).sum(axis=2)) ** 1.5
+    p3 = ((planet_pos ** 2).sum(axis=1)) ** 1.5
+    direct = (d * (planet_gm / d3)[:, :, None]).sum(axis=1)
+    indirect = (planet_pos * (planet_gm / p3)[:, None]).sum(axis=0)
+    return direct - indirect[None, :]
+
+
+class PerturbedOrbits:
+    """States of many test particles perturbed by the planets
+
+    """
+    def __init__(self, pos, vel, t0, mu=1.32712440041e20, planets=None,
+                 perturbers=None, gm=None, rtol=1e-10, atol=1.0,
+                 segment=YEAR):
+        """
+        Args:
+            pos: Heliocentric positions at t0, shape (m, 3)
+            vel: Velocities at t0, shape (m, 3)
+            t0: Time of the states
+            mu: Gravitational parameter of the Sun, scalar or shape (m,)
+            planets: SecularElements of the perturbing planets. Default is
+                read from Data/planets_keplerian_elements.csv
+            perturbers: Names of the planets used. Default is all planets.
+                The inner planets set the step size through their short
+                periods; leaving out Mercury and Venus about halves the
+                cost for main-belt asteroids
+            gm: Gravitational parameters of the perturbers, shape (n,).
+                Default is PLANET_GM by name
+            rtol: Relative tolerance of the integrator
+            atol: Absolute tolerance of the positions (meters); the one of
+                the velocities is atol per day
+            segment: Longest time between rectifications (seconds)
+        Exception:
+            ValueError: If a perturber is not in planets, raises ValueError
+            KeyError: If gm is not given and a planet has no entry in
+                PLANET_GM, raises KeyError
+        """
+        self.pos = np.array(pos, dtype=float).reshape(-1, 3)
+        self.vel = np.array(vel, dtype=float).reshape(-1, 3)
+        self.t = float(t0)
+        self.mu = np.ascontiguousarray(np.broadcast_to(
+            np.asarray(mu, dtype=float), (self.pos.shape[0],)))
+        if planets is None:
+            planets = SecularElements.from_csv(
+                'Data/planets_keplerian_elements.csv', mu=float(
+                    self.mu[0]) if self.mu.shape[0] else 1.32712440041e20)
+        if perturbers is not None:
+            index = [planets.names.index(name) for name in perturbers]
+            planets = SecularElements(perturbers, planets.elements[index],
+                                      planets.rates[index], planets.mu)
+        if gm is None:
+            gm = [PLANET_GM[name] for name in planets.names]
+        self.planets = planets
+        self.gm = np.asarray(gm, dtype=float)
+        self.rtol = rtol
+        self.atol = atol
+        self.segment = segment
+        self.stats = {'evaluations': 0, 'segments': 0, 'seconds': 0.0}
+
+    @classmethod
+    def from_orbits(cls, orbits, t0, **kwargs):
+        """Starts from the two-body states of orbits at time t0
+
+        Args:
+            orbits: Sequence of TwoBodyOrbit objects about the Sun, or an
+                OrbitCatalog
+            t0: Start time
+            kwargs: Other arguments of PerturbedOrbits
+        """
+        r0, v0, t00, mu = stack_orbits(orbits)
+        pos, vel = propagate(orbits, [t0])
+        return cls(pos[:, 0], vel[:, 0], t0, mu, **kwargs)
+
+    def __len__(self):
+        return self.mu.shape[0]
+
+    def _reference(self, r_ref, v_ref, t_ref, t):
+        dt = np.full((len(self), 1), t - t_ref)
+        rho, vrho = twobodykernels.kepler(r_ref, v_ref, self.mu, dt)
+        return rho[:, 0], vrho[:, 0]
+
+    def _derivative(self, r_ref, v_ref, t_ref):
+        m = len(self)
+
+        def func(t, y):
+            y = y.reshape(m, 6)
+            delta = y[:, :3]
+            rho, vrho = self._reference(r_ref, v_ref, t_ref, t)
+            r = rho + delta
+            r2 = (r ** 2).sum(axis=1)
+            rho3 = ((rho ** 2).sum(axis=1)) ** 1.5
+            q = (delta * (delta - 2.0 * r)).sum(axis=1) / r2
+            ppos = self.planets.posvelatt(np.array([t]))[0][:, 0]
+            acc = (-1.0) * (self.mu / rho3)[:, None] \
+                * (delta + encke_f(q)[:, None] * r) \
+                + planet_acceleration(r, ppos, self.gm)
+            self.stats['evaluations'] += 1
+            return np.concatenate([y[:, 3:], acc], axis=1).ravel()
+        return func
+
+    def _segment(self, t1, t_eval):
+        # Integrates delta from self.t to t1 with the current states as
+        # reference orbits, returns the states at t_eval (sorted towards
+        # t1, the last one may be t1) and rectifies at t1
+        from scipy.integrate import solve_ivp
+        m = len(self)
+        r_ref, v_ref, t_ref = self.pos, self.vel, self.t
+        atol = np.tile([self.atol] * 3 + [self.atol / 86400.0] * 3, m)
+        times = t_eval if t_eval.shape[0] and t_eval[-1] == t1 else \
+            np.concatenate([t_eval, [t1]])
+        sol = solve_ivp(self._derivative(r_ref, v_ref, t_ref), (t_ref, t1),
+                        np.zeros(m * 6), method='DOP853', t_eval=times,
+                        rtol=self.rtol, atol=atol)
+        if not sol.success:
+            raise(RuntimeError('Integration failed: ' + sol.message +
+                               ': perturbation.PerturbedOrbits'))
+        y = sol.y.reshape(m, 6, -1).transpose(0, 2, 1)
+        rho, vrho = twobodykernels.kepler(r_ref, v_ref, self.mu, np.tile(
+            times - t_ref, (m, 1)))
+        pos = rho + y[:, :, :3]
+        vel = vrho + y[:, :, 3:]
+        self.t = float(t1)
+        self.pos = pos[:, -1].copy()
+        self.vel = vel[:, -1].copy()
+        self.stats['segments'] += 1
+        n = t_eval.shape[0]
+        return pos[:, :n], vel[:, :n]
+
+    def _run(self, times):
+        # times are distinct, sorted away from self.t and differ from it
+        m = len(self)
+        pos = np.empty((m, times.shape[0], 3))
+        vel = np.empty((m, times.shape[0], 3))
+        sign = 1.0 if times[-1] > self.t else -1.0
+        done = 0
+        while done < times.shape[0]:
+            if abs(times[-1] - self.t) <= self.segment:
+                t1 = times[-1]
+            else:
+                t1 = self.t + sign * self.segment
+            n = int(np.searchsorted(sign * times, sign * t1, side='right'))
+            pos[:, done:n], vel[:, done:n] = self._segment(t1,
+                                                           times[done:n])
+            done = n
+        return pos, vel
+
+    def propagate(self, t):
+        """Returns perturbed positions and velocities at times t
+
+        Integration starts from the current states and the current states
+        move to the last time requested (the latest one if times are on
+        both sides of the current time).
+
+        Args:
+            t: Time, or array-like object of times (any order)
+        Returns: pos, vel
+            pos: Positions, Numpy array of shape (m, k, 3)
+            vel: Velocities, Numpy array of shape (m, k, 3)
+        Exception:
+            RuntimeError: If the integration failed, raises RuntimeError
+        """
+        start = time.perf_counter()
+        ts, inverse = np.unique(np.atleast_1d(np.asarray(t, dtype=float)),
+                                return_inverse=True)
+        pos = np.empty((len(self), ts.shape[0], 3))
+        vel = np.empty((len(self), ts.shape[0], 3))
+        t_start, pos0, vel0 = self.t, self.pos, self.vel
+        same = ts == t_start
+        pos[:, same] = pos0[:, None]
+        vel[:, same] = vel0[:, None]
+        before = ts < t_start
+        if before.any():
+            p, v = self._run(ts[before][::-1])
+            pos[:, before] = p[:, ::-1]
+            vel[:, before] = v[:, ::-1]
+            self.t, self.pos, self.vel = t_start, pos0, vel0
+        after = ts > t_start
+        if after.any():
+            pos[:, after], vel[:, after] = self._run(ts[after])
+        self.stats['seconds'] += time.perf_counter() - start
+        return pos[:, inverse.ravel()], vel[:, inverse.ravel()]
+
+    def advance(self, t):
+        """Moves the states to time t and returns them
+
+        Returns: pos, vel
+            pos, vel: Numpy arrays of shape (m, 3)
+        """
+        pos, vel = self.propagate([t])
+        return pos[:, 0], vel[:, 0]
+
+
+def _synthetic_belt(m, mu=1.32712440041e20, seed=1):
+    # States of main-belt-like orbits
+    rng = np.random.default_rng(seed)
+    a = rng.uniform(2.1, 3.3, m) * 1.496e11
+    e = rng.uniform(0.0, 0.25, m)
+    inc = np.radians(rng.uniform(0.0, 20.0, m))
+    lan, parg, ma = rng.uniform(0.0, np.pi * 2.0, (3, m))
+    p = a * (1.0 - e * e)
+    nu = ma
+    r = p / (1.0 + e * np.cos(nu))
+    u = parg + nu
+    pos = np.stack([r * (np.cos(lan) * np.cos(u) - np.sin(lan) * np.sin(u)
+                         * np.cos(inc)),
+                    r * (np.sin(lan) * np.cos(u) + np.cos(lan) * np.sin(u)
+                         * np.cos(inc)),
+                    r * np.sin(u) * np.sin(inc)], axis=1)
+    h = np.sqrt(mu * p)
+    vr = mu / h * e * np.sin(nu)
+    vt = h / r
+    radial = pos / r[:, None]
+    normal = np.stack([np.sin(lan) * np.sin(inc),
+                       (-1.0) * np.cos(lan) * np.sin(inc), np.cos(inc)],
+                      axis=1)
+    vel = radial * vr[:, None] + np.cross(normal, radial) * vt[:, None]
+    return pos, vel
+
+
+if __name__ == '__main__':
+    from orbitcatalog import OrbitCatalog
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 50.0
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    catalog = OrbitCatalog.from_csv('Data/asteroids_keplerian_elements.csv')
+    t0 = 59200.0 * 86400.0
+    t1 = t0 + years * YEAR
+    perturbed = PerturbedOrbits.from_orbits(catalog, t0)
+    pos, vel = perturbed.propagate(t1)
+    kepler_pos, kepler_vel = propagate(catalog, [t1])
+    print('{:.0f} years from MJD 59200, two-body vs perturbed:'.format(years))
+    for name, d in zip(catalog.names,
+                       np.linalg.norm(pos - kepler_pos, axis=2)[:, 0]):
+        print('  {:10s} {:10.3g} km'.format(name, d / 1000.0))
+
+    pos, vel = _synthetic_belt(m)
+    belt = PerturbedOrbits(pos, vel, t0)
+    start = time.perf_counter()
+    belt.propagate(t0 + YEAR)
+    sec = time.perf_counter() - start
+    print('{} particles, 1 year: {:.3f} s ({} evaluations)'.format(
+        m, sec, belt.stats['evaluations']))
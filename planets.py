@@ -4,10 +4,6 @@
 # graphics pipelines. The vtkMergeFilter is used to merge the data
 # from each together.
 
-import vtk
-from vtk.util.misc import vtkGetDataRoot
-VTK_DATA_ROOT = vtkGetDataRoot()
-
 import sys
 import os
 
@@ -17,107 +13,59 @@ import os
 # Simple example showing how to use PyQt5 to manipulate
 # a visualization
 
-from PyQt5.QtCore import QDate
+from PyQt5.QtCore import QDate, QTimer
+from PyQt5.QtGui import QImage, QPainter, QPen
 from PyQt5.QtWidgets import QApplication, QWidget, QMainWindow, QSlider, QGridLayout, QLabel, QPushButton, QTextEdit, QComboBox, QDateTimeEdit
 import PyQt5.QtCore as QtCore
 from PyQt5.QtCore import Qt
 import vtk
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
-import sys
 from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
 import vtk.util.numpy_support
-from pytwobodyorbit import TwoBodyOrbit
+from solarsystem import date_to_mjd, Planet, Asteroid, Moon, asteroid_orbit, moon_orbit, sunmu
+from secularelements import SecularElements
+from visibility import VisibilityCuller
+from bodytree import BodyTree
+from bodypicker import BodyPicker, orbit_locator
+from frameprofiler import FrameProfiler
+from ensemble import CloneEnsemble
+from porkchop import Porkchop, shade
+from trails import TrailBuffer
+from catalogreload import CatalogWatcher
+from densitygrid import DensityGrid, PopulationDensity, VolumeImage, synthetic_belt, AU
+import time
+import itertools
+import numpy as np
 import math
 
 frame_counter = 0
-sunmu = 1.32712440041e20
-
-#taken from https://gist.github.com/jiffyclub/1294443
-def date_to_mjd(year,month,day):
-    """
-    Convert a date to Julian Day.
-    
-    Algorithm from 'Practical Astronomy with your Calculator or Spreadsheet', 
-        4th ed., Duffet-Smith and Zwart, 2011.
-    
-    Parameters
-    ----------
-    year : int
-        Year as integer. Years preceding 1 A.D. should be 0 or negative.
-        The year before 1 A.D. is 0, 10 B.C. is year -9.
-        
-    month : int
-        Month as integer, Jan = 1, Feb. = 2, etc.
-    
-    day : float
-        Day, may contain fractional part.
-    
-    Returns
-    -------
-    jd : float
-        Julian Day
-        
-    Examples
-    --------
-    Convert 6 a.m., February 17, 1985 to Julian Day
-    
-    >>> date_to_jd(1985,2,17.25)
-    2446113.75
-    
-    """
-    if month == 1 or month == 2:
-        yearp = year - 1
-        monthp = month + 12
-    else:
-        yearp = year
-        monthp = month
-    
-    # this checks where we are in relation to October 15, 1582, the beginning
-    # of the Gregorian calendar.
-    if ((year < 1582) or
-        (year == 1582 and month < 10) or
-        (year == 1582 and month == 10 and day < 15)):
-        # before start of Gregorian calendar
-        B = 0
-    else:
-        # after start of Gregorian calendar
-        A = math.trunc(yearp / 100.)
-        B = 2 - A + math.trunc(A / 4.)
-        
-    if yearp < 0:
-        C = math.trunc((365.25 * yearp) - 0.75)
-    else:
-        C = math.trunc(365.25 * yearp)
-    D = math.trunc(30.6001 * (monthp + 1))
-    jd = B + C + D + day + 1720994.5
-    return jd - 2400000.5
-
-class Planet():
-	def __init__(self, physical_array, kepler_array):
-		self.name = physical_array[0]
-		self.equatorial_radius = float(physical_array[1]) *1000 #change km to meters
-		self.mean_radius = float(physical_array[2]) *1000 #change km to meters
-		self.texture_file = physical_array[11]
-		self.a = float(kepler_array[1])*1.496e11 #change au to meters
-		self.e = float(kepler_array[2])
-		self.i = float(kepler_array[3])
-		self.l = float(kepler_array[4])
-		self.long_peri = float(kepler_array[5])
-		self.long_node = float(kepler_array[6])
-
-class Asteroid():
-	def __init__(self, physical_array, kepler_array):
-		self.name = physical_array[0]
-		self.diameter = float(physical_array[3])*1000 #change km to meters
-		self.texture_file = physical_array[7]
-		self.epoch = int(kepler_array[2])
-		self.a = float(kepler_array[3])*1.496e11 #change au to meters
-		self.e = float(kepler_array[4])
-		self.i = float(kepler_array[5])
-		self.w = float(kepler_array[6])
-		self.node = float(kepler_array[7])
-		self.m = float(kepler_array[8])
-		
+trace_counter = 0
+#Stage timings per frame; toggled with F3 in the viewer
+profiler = FrameProfiler()
+#Illustrative 1-sigma uncertainties of the asteroid elements (the catalog has
+#no covariances): a [m], e, i, node, argument of periapsis, mean anomaly [deg]
+CLOUD_SIGMAS = [1.0e6, 1.0e-6, 1.0e-5, 1.0e-5, 1.0e-4, 1.0e-4]
+CLOUD_CLONES = 10000
+#Samples kept in the trails of the planets and asteroids
+TRAIL_SAMPLES = 256
+#Porkchop panel: coarse cell [days], Lambert solves per timer tick, and the
+#shortest time between two redraws while refining [s]
+PORKCHOP_CELL = 50
+PORKCHOP_SOLVES = 2048
+PORKCHOP_REDRAW = 0.25
+#Interval between two checks of the catalog files [ms]
+CATALOG_POLL = 1000
+#Density volume of a synthetic main belt: number of bodies, voxels of the
+#image (also the cells of the box grid), half width and height of the image,
+#cells of the heliocentric grid (distance, longitude, latitude), and time
+#spent per frame bringing the belt to a new date [s]
+BELT_BODIES = 1000000
+BELT_VOXELS = (128, 128, 32)
+BELT_EXTENT = 4 * AU
+BELT_HEIGHT = 1 * AU
+BELT_CELLS = (48, 180, 30)
+BELT_BUDGET = 0.010
+
 class MySphere(VTKPythonAlgorithmBase):
 	def __init__(self):
 		VTKPythonAlgorithmBase.__init__(self,
@@ -167,8 +115,9 @@ class MySphere(VTKPythonAlgorithmBase):
 	def RequestData(self, request, inInfo, outInfo):
 		#print('Executing')
 		output = vtk.vtkPolyData.GetData(outInfo)
-		self.Update()
-		output.ShallowCopy(self.sphere)
+		with profiler.stage('pipeline'):
+			self.Update()
+			output.ShallowCopy(self.sphere)
 
 		#print('output\n{}'.format(output))
 
@@ -195,6 +144,27 @@ def save_frame(window, log):
 	frame_counter += 1
 	log.insertPlainText('Exported {}\n'.format(file_name))
 
+def profile_algorithm(algorithm, name):
+	# Times each execution of a VTK algorithm (or renderer) as a stage
+	start = [0.0]
+	def on_start(obj, event):
+		start[0] = time.perf_counter()
+	def on_end(obj, event):
+		profiler.add(name, start[0], time.perf_counter())
+	algorithm.AddObserver('StartEvent', on_start)
+	algorithm.AddObserver('EndEvent', on_end)
+
+def save_trace(log):
+	global trace_counter
+	# Save the recorded stage timings as a Chrome trace / Perfetto file
+	if not os.path.exists('screenshots'):
+		os.makedirs('screenshots')
+
+	file_name = "screenshots/trace_" + str(trace_counter).zfill(5) + ".json"
+	profiler.dump_trace(file_name)
+	trace_counter += 1
+	log.insertPlainText('Exported {}\n'.format(file_name))
+
 def make_sphere(textureFile, center, radius):
 	
 	# create and visualize sphere
@@ -214,6 +184,7 @@ def make_sphere(textureFile, center, radius):
 	text_to_sphere = vtk.vtkTextureMapToSphere()
 	text_to_sphere.SetInputConnection(sphere_source.GetOutputPort())
 	text_to_sphere.PreventSeamOff()
+	profile_algorithm(text_to_sphere, 'texture')
 	
 	mapper = vtk.vtkPolyDataMapper()
 	mapper.SetInputConnection(text_to_sphere.GetOutputPort())
@@ -225,6 +196,133 @@ def make_sphere(textureFile, center, radius):
 
 	return triang, sphere_source
 
+def make_orbit_line(orbit, color, samples):
+
+	# Closed polyline of an orbit in one color
+	xs, ys, zs, times = orbit.points(samples)
+	colors = vtk.vtkUnsignedCharArray()
+	colors.SetNumberOfComponents(3)
+	colors.SetName("Colors")
+	colors.InsertNextTypedTuple(color)
+
+	points = vtk.vtkPoints()
+	for i in range(samples):
+		points.InsertPoint(i, xs[i], ys[i], zs[i])
+
+	lines = vtk.vtkCellArray()
+	lines.InsertNextCell(samples)
+	for i in range(samples):
+		lines.InsertCellPoint(i)
+
+	polyData = vtk.vtkPolyData()
+	polyData.SetPoints(points)
+	polyData.SetLines(lines)
+	polyData.GetCellData().SetScalars(colors)
+
+	mapper = vtk.vtkPolyDataMapper()
+	mapper.SetInputData(polyData)
+	mapper.ScalarVisibilityOn()
+
+	actor = vtk.vtkActor()
+	actor.SetMapper(mapper)
+	return actor
+
+class PorkchopPanel(QWidget):
+	# Delta-v map of the transfers between two bodies, refined a little on
+	# every timer tick so that the viewer stays responsive. Drag to pan,
+	# wheel to zoom, double click to go back to the first view
+	def __init__(self, bodies = None, parent = None):
+		QWidget.__init__(self, parent)
+		self.bodies = bodies
+		self.chop = None
+		self.view = None
+		self.home = None
+		self.image = None
+		self.drag = None
+		self.drawn = 0.0
+		self.status = ''
+		self.timer = QTimer(self)
+		self.timer.timeout.connect(self.tick)
+		self.setMinimumSize(200, 200)
+
+	def start(self, body1, body2, t0):
+		# New plot: departures over two years from t0, flights of 60 days
+		# to three years
+		day = 86400.0
+		self.chop = Porkchop(self.bodies[body1], self.bodies[body2], (t0, t0), (PORKCHOP_CELL * day, PORKCHOP_CELL * day))
+		self.home = ((t0, t0 + 730 * day), (t0 + 60 * day, t0 + 1825 * day))
+		self.set_view(*self.home)
+
+	def set_view(self, departure, arrival):
+		self.view = (departure, arrival)
+		self.chop.set_view(departure, arrival, (max(self.width(), 1), max(self.height(), 1)))
+		self.redraw()
+		self.timer.start(0)
+
+	def tick(self):
+		self.chop.refine(PORKCHOP_SOLVES)
+		if self.chop.done():
+			self.timer.stop()
+		if self.chop.done() or time.perf_counter() - self.drawn > PORKCHOP_REDRAW:
+			self.redraw()
+
+	def redraw(self):
+		with profiler.stage('porkchop'):
+			rgb = shade(self.chop.raster(max(self.width(), 1), max(self.height(), 1)), self.chop.levels)
+		self.image = QImage(rgb.data, rgb.shape[1], rgb.shape[0], rgb.shape[1] * 3, QImage.Format_RGB888).copy()
+		dep, arr, dv = self.chop.minimum()
+		if dv == dv:
+			self.status = 'min {:.2f} km/s: MJD {:.0f}, {:.0f} days ({} solves)'.format(dv / 1000, dep / 86400, (arr - dep) / 86400, self.chop.solved)
+		self.drawn = time.perf_counter()
+		self.update()
+
+	def to_times(self, x, y):
+		(d0, d1), (a0, a1) = self.view
+		return d0 + (d1 - d0) * x / max(self.width(), 1), a1 - (a1 - a0) * y / max(self.height(), 1)
+
+	def paintEvent(self, event):
+		painter = QPainter(self)
+		if self.image is not None:
+			painter.drawImage(self.rect(), self.image)
+		painter.setPen(QPen(Qt.white))
+		painter.drawText(self.rect().adjusted(4, 4, -4, -4), Qt.AlignBottom | Qt.AlignLeft, self.status)
+		if self.view is not None:
+			(d0, d1), (a0, a1) = self.view
+			painter.drawText(self.rect().adjusted(4, 4, -4, -4), Qt.AlignTop | Qt.AlignLeft,
+				'departure MJD {:.0f}-{:.0f}\narrival MJD {:.0f}-{:.0f}'.format(d0 / 86400, d1 / 86400, a0 / 86400, a1 / 86400))
+
+	def resizeEvent(self, event):
+		if self.chop is not None:
+			self.set_view(*self.view)
+
+	def mousePressEvent(self, event):
+		self.drag = (event.x(), event.y(), self.view)
+
+	def mouseMoveEvent(self, event):
+		if self.drag is None or self.chop is None:
+			return
+		x, y, ((d0, d1), (a0, a1)) = self.drag
+		dx = (event.x() - x) * (d1 - d0) / max(self.width(), 1)
+		dy = (event.y() - y) * (a1 - a0) / max(self.height(), 1)
+		self.set_view((d0 - dx, d1 - dx), (a0 + dy, a1 + dy))
+
+	def mouseReleaseEvent(self, event):
+		self.drag = None
+
+	def mouseDoubleClickEvent(self, event):
+		if self.chop is not None:
+			self.set_view(*self.home)
+
+	def wheelEvent(self, event):
+		# Zooms around the cursor
+		if self.chop is None:
+			return
+		factor = 0.8 if event.angleDelta().y() > 0 else 1.25
+		dep, arr = self.to_times(event.x(), event.y())
+		(d0, d1), (a0, a1) = self.view
+		self.set_view((dep + (d0 - dep) * factor, dep + (d1 - dep) * factor),
+			(arr + (a0 - arr) * factor, arr + (a1 - arr) * factor))
+
 class Ui_MainWindow(object):
 	def setupUi(self, MainWindow):
 		MainWindow.setObjectName('The Main Window')
@@ -259,6 +357,12 @@ class Ui_MainWindow(object):
 		self.push_screenshot.setText('Save screenshot')
 		self.push_quit = QPushButton()
 		self.push_quit.setText('Quit')
+		#Porkchop panel; PyQtDemo gives it the bodies
+		self.porkchop = PorkchopPanel()
+		self.porkchop_from = QComboBox()
+		self.porkchop_to = QComboBox()
+		self.push_porkchop = QPushButton()
+		self.push_porkchop.setText('Porkchop')
 		# Text windows
 		self.log = QTextEdit()
 		self.log.setReadOnly(True)
@@ -281,6 +385,11 @@ class Ui_MainWindow(object):
 		self.gridlayout.addWidget(self.push_screenshot, 0, 5, 1, 1)
 		self.gridlayout.addWidget(self.log, 1, 4, 1, 2)
 		self.gridlayout.addWidget(self.push_quit, 5, 5, 1, 1)
+		#The porkchop panel sits to the right, with its controls below it
+		self.gridlayout.addWidget(self.porkchop, 0, 6, 4, 2)
+		self.gridlayout.addWidget(self.porkchop_from, 4, 6, 1, 1)
+		self.gridlayout.addWidget(self.porkchop_to, 4, 7, 1, 1)
+		self.gridlayout.addWidget(self.push_porkchop, 5, 6, 1, 2)
 		MainWindow.setCentralWidget(self.centralWidget)
 
 class PyQtDemo(QMainWindow):
@@ -293,19 +402,22 @@ class PyQtDemo(QMainWindow):
 		# Create the Renderer
 		self.ren = vtk.vtkRenderer()
 
-		planets_file = open("Data/planets_physical_characteristics.csv", "r")
-		planets_keplerian_file = open("Data/planets_keplerian_elements.csv", "r")
-
-		asteroids_file = open("Data/asteroids_physical_characteristics.csv", "r")
-		asteroids_keplerian_file = open("Data/asteroids_keplerian_elements.csv", "r")
-
 		self.planet_spheres = []
 		self.planet_objs = []
 		self.planet_orbits = []
+		self.planet_actors = []
 
 		self.asteroid_spheres = []
 		self.asteroid_objs = []
 		self.asteroid_orbits = []
+		self.asteroid_colors = []
+		self.asteroid_actors = []
+		self.planet_colors = []
+		self.size_scale = 1
+
+		#Catalog rows by body name; the files are polled and only the bodies
+		#whose rows change are rebuilt
+		self.catalog = CatalogWatcher()
 
 		#make the sun
 		self.sun_actor, self.sun_source = make_sphere("Data/2k_sun.jpg", [0,0,0], 696340000)
@@ -327,117 +439,84 @@ class PyQtDemo(QMainWindow):
 						[90, 150, 255], 
 						[255, 100, 255], 
 						]		
-		index = 0
+		#Planet elements vary with time; they are evaluated for all planets at once
+		self.planet_elements = SecularElements.from_csv("Data/planets_keplerian_elements.csv", mu=sunmu)
+
 		#Create all actors for planets
 
-		for p, k in zip(planets_file.readlines()[1:], planets_keplerian_file.readlines()[1:]):
-			
-			#Read attributes from file
-			planet = Planet(p.strip("\n").split(","), k.strip("\n").split(","))
+		for index, planet in enumerate([Planet(p, k) for p, k in self.catalog.rows['planets'].values()]):
 			
-			#Create orbit
-			orbit = TwoBodyOrbit(planet.name, mu=sunmu)
+			#Create orbit osculating at t0
 			t0 = 59200 * 86400                                      
-			orbit.setOrbKepl(t0, planet.a, planet.e, planet.i, planet.long_node, planet.long_peri,  0)
+			orbit = self.planet_elements.orbit(index, t0, planet.name)
 			pos, vel = orbit.posvelatt(t0)
-			xs, ys, zs, times = orbit.points(1000)
 			self.planet_orbits.append(orbit)
-			
-			# Setup the colors array
-			colors = vtk.vtkUnsignedCharArray()
-			colors.SetNumberOfComponents(3)
-			colors.SetName("Colors")
-
-			colors.InsertNextTypedTuple(color_scale[index])
-			index+=1
-			points = vtk.vtkPoints()
-			#Draw orbit from points
-			for i in range(1000):
-				points.InsertPoint(i, xs[i], ys[i], zs[i])
-			
-			lines = vtk.vtkCellArray()
-			lines.InsertNextCell(1000)
-
-			for i in range(1000):
-				lines.InsertCellPoint(i)
-
-			polyData = vtk.vtkPolyData()
-			polyData.SetPoints(points)
-			polyData.SetLines(lines)
-			polyData.GetCellData().SetScalars(colors)
+			self.planet_colors.append(color_scale[index % len(color_scale)])
 
-			# Create a mapper
-			planet_orbit_mapper = vtk.vtkPolyDataMapper()
-			planet_orbit_mapper.SetInputData(polyData)
-			planet_orbit_mapper.ScalarVisibilityOn()
-			
-			# Create an actor
-			planet_orbit_actor = vtk.vtkActor()
-			planet_orbit_actor.SetMapper(planet_orbit_mapper)
+			planet_orbit_actor = make_orbit_line(orbit, self.planet_colors[-1], 1000)
 			self.ren.AddActor(planet_orbit_actor)
 
 			sphere_actor, sphere_source = make_sphere(planet.texture_file, pos, planet.equatorial_radius)
 			self.planet_spheres.append(sphere_source)
 			self.planet_objs.append(planet)
+			self.planet_actors.append((planet_orbit_actor, sphere_actor))
 			print(pos)
 			self.ren.AddActor(sphere_actor)
 
-		#Create all actors for Asteroids
-		for a, k in zip(asteroids_file.readlines()[1:], asteroids_keplerian_file.readlines()[1:]):
-			
-			#Read attributes from file
-			asteroid = Asteroid(a.strip("\n").split(","), k.strip("\n").split(","))
-			
-			#Create orbit
-			orbit = TwoBodyOrbit(asteroid.name, mu=sunmu)
-			t0 = asteroid.epoch * 86400                                   
-			orbit.setOrbKepl(t0, asteroid.a, asteroid.e, asteroid.i, asteroid.node, asteroid.w,  asteroid.m)
-			pos, vel = orbit.posvelatt(t0)
-			xs, ys, zs, times = orbit.points(100)
-			points = vtk.vtkPoints()
-			self.asteroid_orbits.append(orbit)
-			
-			# Setup the colors array
-			colors = vtk.vtkUnsignedCharArray()
-			colors.SetNumberOfComponents(3)
-			colors.SetName("Colors")
-
-			colors.InsertNextTypedTuple(color_scale[index])
-			index+=1
-
-			#Draw orbit from points
-			for i in range(100):
-				points.InsertPoint(i, xs[i], ys[i], zs[i])
-			
-			lines = vtk.vtkCellArray()
-			lines.InsertNextCell(100)
-
-			for i in range(100):
-				lines.InsertCellPoint(i)
-
-			polyData = vtk.vtkPolyData()
-			polyData.SetPoints(points)
-			polyData.SetLines(lines)
-			polyData.GetCellData().SetScalars(colors)
-
-			# Create a mapper
-			asteroid_orbit_mapper = vtk.vtkPolyDataMapper()
-			asteroid_orbit_mapper.SetInputData(polyData)
-			asteroid_orbit_mapper.ScalarVisibilityOn()
-			
-			# Create an actor
-			asteroid_orbit_actor = vtk.vtkActor()
-			asteroid_orbit_actor.SetMapper(asteroid_orbit_mapper)
-			self.ren.AddActor(asteroid_orbit_actor)
-
-			sphere_actor, sphere_source = make_sphere(asteroid.texture_file, pos, asteroid.diameter/2)
-			self.asteroid_spheres.append(sphere_source)
-			self.asteroid_objs.append(asteroid)
-			#print(pos)
+		#Create all actors for Asteroids; their colors follow the planet ones
+		self.color_scale = color_scale
+		for asteroid in [Asteroid(p, k) for p, k in self.catalog.rows['asteroids'].values()]:
+			n = len(self.planet_objs) + len(self.asteroid_objs)
+			self.add_asteroid(asteroid, color_scale[n % len(color_scale)])
+
+		#Asteroids are only propagated while they can be seen, and only to
+		#screen accuracy
+		self.asteroid_culler = VisibilityCuller(self.asteroid_orbits, precision='render')
+		self.asteroid_radius = np.array([a.diameter / 2 for a in self.asteroid_objs])
+		self.current_time = 59200 * 86400
+		self.ren.AddObserver('StartEvent', self.visibility_callback)
+
+		#Moons orbit their planets; they are placed through the body tree and
+		#only drawn when their orbit spans a few pixels
+		self.moon_objs = [Moon(p, k) for p, k in self.catalog.rows['moons'].values()]
+		self.body_tree = BodyTree(self.planet_elements, [moon_orbit(moon) for moon in self.moon_objs], precision='render')
+		self.moon_spheres = []
+		self.moon_actors = []
+		self.moon_visible = np.zeros(len(self.moon_objs), dtype=bool)
+		for moon in self.moon_objs:
+			sphere_actor, sphere_source = make_sphere(moon.texture_file, [0, 0, 0], moon.mean_radius)
+			sphere_actor.SetVisibility(False)
+			self.moon_spheres.append(sphere_source)
+			self.moon_actors.append(sphere_actor)
 			self.ren.AddActor(sphere_actor)
 
-		objects = ["Sun","Mercury","Venus","Earth","Mars","Ceres","Vesta","Pallas","Hygiea","Interamnia","Jupiter","Saturn","Uranus","Neptune","Pluto"]
-		self.ui.obj_focus.addItems(objects)
+		#Uncertainty clouds of the asteroids, toggled with F5; built on first use
+		self.clouds = None
+		self.cloud_points = []
+		self.cloud_actors = []
+		self.cloud_time = None
+
+		#Trails of the planets and asteroids, toggled with F6; built on first use
+		self.trails = None
+		self.trail_actor = None
+		self.trail_time = None
+
+		#Density volume of a synthetic main belt, toggled with F7; F8 switches
+		#between the box and the heliocentric grid. Built on first use
+		self.belt = None
+		self.belt_volume = None
+		self.belt_time = None
+
+		#Bodies that can be focused, transfer ends of the porkchop panel and
+		#the picker
+		self.make_bodies()
+		self.ui.porkchop_from.setCurrentIndex(2)
+		self.ui.porkchop_to.setCurrentIndex(3)
+
+		#Edits of the catalog files are picked up while the viewer runs
+		self.catalog_timer = QTimer(self)
+		self.catalog_timer.timeout.connect(self.catalog_callback)
+		self.catalog_timer.start(CATALOG_POLL)
 
 		self.ren.GradientBackgroundOn()  # Set gradient for background
 		self.ren.SetBackground(0.25, 0.25, 0.25)  # Set background to silver
@@ -452,6 +531,21 @@ class PyQtDemo(QMainWindow):
 		
 		self.ui.vtkWidget.GetRenderWindow().AddRenderer(self.ren)
 		self.iren = self.ui.vtkWidget.GetRenderWindow().GetInteractor()
+		self.iren.AddObserver('LeftButtonPressEvent', self.pick_callback)
+
+		#Performance overlay: F3 toggles profiling, F4 saves a trace; F5 toggles
+		#the uncertainty clouds, F6 the trails and F7 the belt density
+		self.hud = vtk.vtkTextActor()
+		self.hud.GetTextProperty().SetFontFamilyToCourier()
+		self.hud.GetTextProperty().SetFontSize(14)
+		self.hud.GetTextProperty().SetVerticalJustificationToTop()
+		self.hud.GetPositionCoordinate().SetCoordinateSystemToNormalizedViewport()
+		self.hud.SetPosition(0.01, 0.98)
+		self.hud.SetVisibility(profiler.enabled)
+		self.ren.AddViewProp(self.hud)
+		profile_algorithm(self.ren, 'render')
+		self.ui.vtkWidget.GetRenderWindow().AddObserver('EndEvent', self.frame_callback)
+		self.iren.AddObserver('KeyPressEvent', self.key_callback)
 
 		# Setting up widgets
 		def slider_setup(slider, val, bounds, interv):
@@ -466,20 +560,272 @@ class PyQtDemo(QMainWindow):
 		slider_setup(self.ui.slider_orbit, 0, [59200, 70000], 1000)
 
 
+	def make_asteroid(self, asteroid, color):
+		# Creates the orbit and actors of an asteroid
+		orbit = asteroid_orbit(asteroid)
+		pos, vel = orbit.posvelatt(asteroid.epoch * 86400)
+		orbit_actor = make_orbit_line(orbit, color, 100)
+		self.ren.AddActor(orbit_actor)
+		sphere_actor, sphere_source = make_sphere(asteroid.texture_file, pos, asteroid.diameter * self.size_scale / 2)
+		self.ren.AddActor(sphere_actor)
+		return orbit, sphere_source, (orbit_actor, sphere_actor)
+
+	def add_asteroid(self, asteroid, color):
+		# Appends an asteroid to the lists
+		orbit, sphere_source, actors = self.make_asteroid(asteroid, color)
+		self.asteroid_orbits.append(orbit)
+		self.asteroid_colors.append(color)
+		self.asteroid_spheres.append(sphere_source)
+		self.asteroid_objs.append(asteroid)
+		self.asteroid_actors.append(actors)
+
+	def make_bodies(self):
+		# Lists of bodies shown in the widgets, built once; catalog reloads
+		# only edit the entries of the bodies they add, remove or change
+		self.bodies = [("Sun", self.sun_source)]
+		self.bodies += [(planet.name, sphere) for planet, sphere in zip(self.planet_objs, self.planet_spheres)]
+		self.bodies += [(asteroid.name, sphere) for asteroid, sphere in zip(self.asteroid_objs, self.asteroid_spheres)]
+		#Moons come last; the picker only covers the bodies before them
+		self.bodies += [(moon.name, sphere) for moon, sphere in zip(self.moon_objs, self.moon_spheres)]
+		names = [name for name, sphere in self.bodies]
+		self.ui.obj_focus.blockSignals(True)
+		self.ui.obj_focus.addItems(names)
+		self.ui.obj_focus.blockSignals(False)
+		self.obj_sphere = 0
+
+		#Transfers of the porkchop panel can join any two planets or asteroids
+		self.ui.porkchop.bodies = [(self.planet_elements, i) for i in range(len(self.planet_objs))] + self.asteroid_orbits
+		names = names[1:1 + len(self.ui.porkchop.bodies)]
+		for combo in (self.ui.porkchop_from, self.ui.porkchop_to):
+			combo.addItems(names)
+
+		#Spatial index over the same bodies for picking with a double click;
+		#the asteroids are located from the epoch states of the culler
+		planet_locate, planet_vmax = orbit_locator(self.planet_orbits)
+		#Planet elements drift slowly; allow some margin on their speed
+		self.picker = BodyPicker(self.locate_bodies, np.concatenate([[0.0], planet_vmax * 1.05, self.asteroid_culler.vmax]))
+
+	def edit_combo(self, combo, gone, at, names):
+		# Removes the items gone (sorted) and inserts names at position at,
+		# keeping the selection by name. Returns the index of the selection,
+		# -1 if it was removed (the first item is selected then)
+		current = combo.currentText()
+		combo.blockSignals(True)
+		for i in reversed(gone):
+			combo.removeItem(i)
+		combo.insertItems(at, names)
+		index = combo.findText(current)
+		combo.setCurrentIndex(max(index, 0))
+		combo.blockSignals(False)
+		return index
+
+	def catalog_callback(self):
+		# Rebuilds the bodies added, removed or changed in the catalog files.
+		# A file that does not parse is left for the next edit
+		previous = dict(self.catalog.rows)
+		changes = self.catalog.poll()
+		for kind, (rows, added, removed, changed) in changes.items():
+			try:
+				getattr(self, 'reload_' + kind)(rows, added, removed, changed)
+			except (ValueError, IndexError) as e:
+				self.catalog.rows[kind] = previous[kind]
+				self.ui.log.insertPlainText('Cannot reload the {}: {}\n'.format(kind, e))
+				continue
+			self.ui.log.insertPlainText('Reloaded {}: {} added, {} removed, {} changed\n'.format(kind, len(added), len(removed), len(changed)))
+		if changes:
+			self.ui.vtkWidget.GetRenderWindow().Render()
+
+	def reload_asteroids(self, rows, added, removed, changed):
+		# Records are parsed first, so that a bad row changes nothing. The
+		# changed asteroids are rebuilt in place, the removed ones filtered
+		# out in one pass and the added ones appended; the lists, widgets,
+		# picker and overlays are edited for these bodies only
+		records = {name: Asteroid(*rows[name]) for name in added + changed}
+		position = {asteroid.name.strip(): i for i, asteroid in enumerate(self.asteroid_objs)}
+		index = np.array([position[name] for name in changed], dtype=int)
+		gone = np.array(sorted(position[name] for name in removed), dtype=int)
+		nplanets = len(self.planet_objs)
+		offset = 1 + nplanets
+		for i, name in zip(index, changed):
+			for actor in self.asteroid_actors[i]:
+				self.ren.RemoveActor(actor)
+			orbit, sphere_source, actors = self.make_asteroid(records[name], self.asteroid_colors[i])
+			self.asteroid_orbits[i] = orbit
+			self.asteroid_objs[i] = records[name]
+			self.asteroid_spheres[i] = sphere_source
+			self.asteroid_actors[i] = actors
+			self.bodies[offset + i] = (records[name].name, sphere_source)
+			self.ui.porkchop.bodies[nplanets + i] = orbit
+		if index.shape[0]:
+			self.asteroid_culler.replace(index, [self.asteroid_orbits[i] for i in index])
+			self.asteroid_radius[index] = [records[name].diameter / 2 for name in changed]
+			self.picker.replace(offset + index, self.asteroid_culler.vmax[index])
+
+		keep = np.ones(len(self.asteroid_objs), dtype=bool)
+		keep[gone] = False
+		if gone.shape[0]:
+			for i in gone:
+				for actor in self.asteroid_actors[i]:
+					self.ren.RemoveActor(actor)
+			for name in ('asteroid_orbits', 'asteroid_colors', 'asteroid_spheres', 'asteroid_objs', 'asteroid_actors'):
+				setattr(self, name, [item for item, k in zip(getattr(self, name), keep) if k])
+			end = offset + keep.shape[0]
+			self.bodies = self.bodies[:offset] + [body for body, k in zip(self.bodies[offset:end], keep) if k] + self.bodies[end:]
+			self.ui.porkchop.bodies = self.ui.porkchop.bodies[:nplanets] + self.asteroid_orbits
+			self.asteroid_culler.delete(gone)
+			self.asteroid_radius = self.asteroid_radius[keep]
+			self.picker.delete(offset + gone)
+
+		first = len(self.asteroid_objs)
+		for name in added:
+			n = nplanets + len(self.asteroid_objs)
+			self.add_asteroid(records[name], self.color_scale[n % len(self.color_scale)])
+		if added:
+			self.asteroid_culler.extend(self.asteroid_orbits[first:])
+			self.asteroid_radius = np.concatenate([self.asteroid_radius, [a.diameter / 2 for a in self.asteroid_objs[first:]]])
+			self.picker.extend(self.asteroid_culler.vmax[first:])
+			self.bodies[offset + first:offset + first] = [(a.name, s) for a, s in zip(self.asteroid_objs[first:], self.asteroid_spheres[first:])]
+			self.ui.porkchop.bodies += self.asteroid_orbits[first:]
+		names = [a.name for a in self.asteroid_objs[first:]]
+
+		focus = self.edit_combo(self.ui.obj_focus, offset + gone, offset + first, names)
+		self.obj_sphere = self.bodies[focus][1] if focus > 0 else 0
+		for combo in (self.ui.porkchop_from, self.ui.porkchop_to):
+			self.edit_combo(combo, nplanets + gone, nplanets + first, names)
+		self.reload_clouds(index, gone, first)
+		#Rows of the changed asteroids once the removed ones are gone
+		moved = np.cumsum(keep) - 1
+		self.reload_trails(nplanets + moved[index], nplanets + gone, len(added))
+
+	def reload_planets(self, rows, added, removed, changed):
+		# The planets are rows of the secular elements, shared with the moons
+		# and the porkchop panel; only their values can change while running
+		if added or removed:
+			self.ui.log.insertPlainText('Planets were added or removed: restart to load them\n')
+			return
+		records = {name: Planet(*rows[name]) for name in changed}
+		self.planet_elements = SecularElements.from_csv(self.catalog.catalogs['planets'][1], mu=sunmu)
+		positions, velocities = self.planet_elements.posvelatt(self.current_time)
+		position = {planet.name.strip(): i for i, planet in enumerate(self.planet_objs)}
+		index = [position[name] for name in records]
+		for i, planet in zip(index, records.values()):
+			orbit = self.planet_elements.orbit(i, 59200 * 86400, planet.name)
+			for actor in self.planet_actors[i]:
+				self.ren.RemoveActor(actor)
+			orbit_actor = make_orbit_line(orbit, self.planet_colors[i], 1000)
+			sphere_actor, sphere_source = make_sphere(planet.texture_file, positions[i], planet.equatorial_radius * self.planet_scale(i, self.size_scale))
+			self.ren.AddActor(orbit_actor)
+			self.ren.AddActor(sphere_actor)
+			if self.obj_sphere is self.planet_spheres[i]:
+				self.obj_sphere = sphere_source
+			self.planet_orbits[i] = orbit
+			self.planet_objs[i] = planet
+			self.planet_spheres[i] = sphere_source
+			self.planet_actors[i] = (orbit_actor, sphere_actor)
+			self.bodies[1 + i] = (planet.name, sphere_source)
+		self.body_tree = BodyTree(self.planet_elements, [moon_orbit(moon) for moon in self.moon_objs], precision='render')
+		nplanets = len(self.planet_objs)
+		self.ui.porkchop.bodies[:nplanets] = [(self.planet_elements, i) for i in range(nplanets)]
+		if index:
+			planet_locate, planet_vmax = orbit_locator([self.planet_orbits[i] for i in index])
+			self.picker.replace(np.array(index) + 1, planet_vmax * 1.05)
+		self.reload_trails(np.array(index, dtype=int), np.zeros(0, dtype=int), 0)
+
+	def reload_moons(self, rows, added, removed, changed):
+		# Moons hang below the planets in the body tree, which is small and
+		# rebuilt whole; only the spheres of the changed moons are replaced
+		if added or removed:
+			self.ui.log.insertPlainText('Moons were added or removed: restart to load them\n')
+			return
+		position = {moon.name.strip(): i for i, moon in enumerate(self.moon_objs)}
+		for name in changed:
+			self.moon_objs[position[name]] = Moon(*rows[name])
+		# The tree first: the size of a moon follows the planet it belongs to
+		self.body_tree = BodyTree(self.planet_elements, [moon_orbit(moon) for moon in self.moon_objs], precision='render')
+		offset = 1 + len(self.planet_objs) + len(self.asteroid_objs)
+		for name in changed:
+			i = position[name]
+			moon = self.moon_objs[i]
+			self.ren.RemoveActor(self.moon_actors[i])
+			sphere_actor, sphere_source = make_sphere(moon.texture_file, [0, 0, 0], moon.mean_radius * self.moon_scale(i, self.size_scale))
+			sphere_actor.SetVisibility(False)
+			self.ren.AddActor(sphere_actor)
+			if self.obj_sphere is self.moon_spheres[i]:
+				self.obj_sphere = sphere_source
+			self.moon_spheres[i] = sphere_source
+			self.moon_actors[i] = sphere_actor
+			self.moon_visible[i] = False
+			self.bodies[offset + i] = (moon.name, sphere_source)
+
+	def reload_clouds(self, index, gone, first):
+		# Clones are drawn for the changed asteroids (index, before the
+		# removal of gone) and the added ones (from first on); the clouds of
+		# the others are kept
+		if self.clouds is None:
+			return
+		if index.shape[0]:
+			self.clouds.replace(index, CloneEnsemble.from_elements([self.asteroid_orbits[i] for i in index], CLOUD_SIGMAS, CLOUD_CLONES, seed=0))
+		if gone.shape[0]:
+			for i in gone:
+				self.ren.RemoveActor(self.cloud_actors[i])
+			keep = np.ones(len(self.cloud_actors), dtype=bool)
+			keep[gone] = False
+			self.cloud_points = [points for points, k in zip(self.cloud_points, keep) if k]
+			self.cloud_actors = [actor for actor, k in zip(self.cloud_actors, keep) if k]
+			self.clouds.delete(gone)
+		if first < len(self.asteroid_orbits):
+			shown = self.cloud_shown()
+			self.clouds.extend(CloneEnsemble.from_elements(self.asteroid_orbits[first:], CLOUD_SIGMAS, CLOUD_CLONES, seed=0))
+			for color in self.asteroid_colors[first:]:
+				self.add_cloud(color)
+				self.cloud_actors[-1].SetVisibility(shown)
+		self.cloud_time = None
+
+	def reload_trails(self, restart, gone, added):
+		# The trails of the bodies in restart (rows once those in gone are
+		# removed; the planets come first) start anew at their current
+		# position, the trails of gone are dropped and the last added rows
+		# get new ones
+		if self.trails is None:
+			return
+		if gone.shape[0]:
+			self.trails.delete(gone)
+		if restart.shape[0]:
+			self.trails.restart(restart, self.trail_centers(restart))
+		if added:
+			m = len(self.planet_spheres) + len(self.asteroid_spheres)
+			self.trails.extend(self.trail_centers(np.arange(m - added, m)))
+		if gone.shape[0] or added:
+			self.bind_trails()
+		self.trail_points.Modified()
+		self.trail_stamps.Modified()
+
+	def planet_scale(self, i, val):
+		# Size factor of planet i for the scale val; the planets are capped
+		# lower than the small bodies
+		if i >= 4 and val > 2500 and i != 8:
+			return 2500
+		elif i < 4 and val > 3800:
+			return 3500
+		return val
+
+	def moon_scale(self, i, val):
+		# Size factor of moon i for the scale val: the factor of the planet
+		# it belongs to, so that a moon is capped with its parent and keeps
+		# its size relative to it
+		return self.planet_scale(self.body_tree.planet_of[self.body_tree.first + i] - 1, val)
+
 	def scale_callback(self, val):
 		for i in range(len(self.planet_objs)):
 			#print(val)
-			if i >= 4 and val > 2500 and i != 8:
-				self.planet_spheres[i].SetRadius(self.planet_objs[i].equatorial_radius * 2500)
-				continue
-			elif i < 4 and val > 3800:
-				self.planet_spheres[i].SetRadius(self.planet_objs[i].equatorial_radius * 3500)
-				continue
-			self.planet_spheres[i].SetRadius(self.planet_objs[i].equatorial_radius * val)
+			self.planet_spheres[i].SetRadius(self.planet_objs[i].equatorial_radius * self.planet_scale(i, val))
 		
 		for i in range(len(self.asteroid_objs)):
 			#print(val)
 			self.asteroid_spheres[i].SetRadius(self.asteroid_objs[i].diameter* val/2 )
+		for i, (moon, sphere) in enumerate(zip(self.moon_objs, self.moon_spheres)):
+			sphere.SetRadius(moon.mean_radius * self.moon_scale(i, val))
+		self.size_scale = val
 		
 		if val < 25:
 			self.sun_source.SetRadius(696340000 * val)
@@ -491,16 +837,15 @@ class PyQtDemo(QMainWindow):
 
 	def date_callback(self,val):
 		mjd = date_to_mjd(val.year(), val.month(), val.day())
+		with profiler.stage('kepler'):
+			positions, velocities = self.planet_elements.posvelatt(mjd * 86400)
 		for i in range(len(self.planet_orbits)):
-			#print(val)
-			pos, vel = self.planet_orbits[i].posvelatt(mjd * 86400)
-			self.planet_spheres[i].SetCenter(pos)
-			#print (pos, vel)
+			self.planet_spheres[i].SetCenter(positions[i])
 		
-		for i in range(len(self.asteroid_objs)):
-			#print(val)
-			pos, vel = self.asteroid_orbits[i].posvelatt(mjd * 86400)
-			self.asteroid_spheres[i].SetCenter(pos)
+		#Only asteroids that can be seen are moved
+		self.current_time = mjd * 86400
+		self.refresh_asteroids()
+		self.refresh_moons()
 
 		self.ui.log.insertPlainText('Date set to {}\n'.format(self.ui.date_textbox.text()))
 		
@@ -513,7 +858,6 @@ class PyQtDemo(QMainWindow):
 
 	def focus_callback(self, val):
 		print(val)
-		objects = ["Sun","Mercury","Venus","Earth","Mars","Ceres","Vesta","Pallas","Hygiea","Interamnia","Jupiter","Saturn","Uranus","Neptune","Pluto"]
 		if val == 0:
 
 			cam1 = self.ren.GetActiveCamera()
@@ -525,40 +869,23 @@ class PyQtDemo(QMainWindow):
 			self.ui.vtkWidget.GetRenderWindow().Render()
 			return
 
-		switcher = {
-			1 : self.planet_spheres[0],
-			2 : self.planet_spheres[1],
-			3 : self.planet_spheres[2],
-			4 : self.planet_spheres[3],
-			5 : self.asteroid_spheres[0],
-			6 : self.asteroid_spheres[1],
-			7 : self.asteroid_spheres[2],
-			8 : self.asteroid_spheres[3],
-			9 : self.asteroid_spheres[4],
-			10 : self.planet_spheres[4],
-			11 : self.planet_spheres[5],
-			12 : self.planet_spheres[6],
-			13 : self.planet_spheres[7],
-			14 : self.planet_spheres[8]
-		}
-
-		self.obj_sphere = switcher.get(val)
+		self.obj_sphere = self.bodies[val][1]
+		self.refresh_asteroids()
+		self.refresh_moons()
 		cam1 = self.ren.GetActiveCamera()
 		cam1.SetFocalPoint(self.obj_sphere.center)
 		self.ren.ResetCameraClippingRange()
 		self.ui.vtkWidget.GetRenderWindow().Render()
 
 	def orbit_callback(self, val):
+		with profiler.stage('kepler'):
+			positions, velocities = self.planet_elements.posvelatt(val * 86400)
 		for i in range(len(self.planet_orbits)):
-			#print(val)
-			pos, vel = self.planet_orbits[i].posvelatt(val * 86400)
-			self.planet_spheres[i].SetCenter(pos)
-			#print (pos, vel)
+			self.planet_spheres[i].SetCenter(positions[i])
 		
-		for i in range(len(self.asteroid_objs)):
-			#print(val)
-			pos, vel = self.asteroid_orbits[i].posvelatt(val * 86400)
-			self.asteroid_spheres[i].SetCenter(pos)
+		self.current_time = val * 86400
+		self.refresh_asteroids()
+		self.refresh_moons()
 
 		
 		if self.obj_sphere != 0:
@@ -570,6 +897,363 @@ class PyQtDemo(QMainWindow):
 
 		
 
+	def visibility_callback(self, obj, event):
+		# Called before each render
+		self.refresh_asteroids()
+		self.refresh_moons()
+		self.refresh_clouds()
+		self.refresh_trails()
+		self.refresh_belt()
+
+	def refresh_asteroids(self):
+		# Moves the asteroids that can be in the view frustum (and the one
+		# the camera follows) to the current time. The others keep their
+		# last position until they become visible
+		cam = self.ren.GetActiveCamera()
+		planes = [0.0] * 24
+		cam.GetFrustumPlanes(self.ren.GetTiledAspectRatio(), planes)
+		height = max(self.ui.vtkWidget.GetRenderWindow().GetSize()[1], 1)
+		mask = self.asteroid_culler.visible(planes, self.current_time,
+			self.asteroid_radius * self.size_scale, cam.GetPosition(),
+			math.radians(cam.GetViewAngle()) / height)
+		if self.obj_sphere in self.asteroid_spheres:
+			mask[self.asteroid_spheres.index(self.obj_sphere)] = True
+		with profiler.stage('kepler'):
+			index, positions = self.asteroid_culler.update(self.current_time, mask)
+		for i, pos in zip(index, positions):
+			self.asteroid_spheres[i].SetCenter(pos)
+		revived = self.asteroid_culler.revived
+		if self.trails is not None and self.trail_actor.GetVisibility() and revived.shape[0]:
+			# Culled asteroids kept a stale position; their trails restart
+			# where they come back into view instead of jumping from there
+			self.trails.restart(revived + len(self.planet_spheres), self.asteroid_culler.pos[revived])
+			self.trail_points.Modified()
+			self.trail_stamps.Modified()
+
+	def refresh_moons(self):
+		# Shows the moons whose orbits are resolved at the current zoom (and
+		# the one the camera follows) and moves them in one pass over the tree
+		cam = self.ren.GetActiveCamera()
+		height = max(self.ui.vtkWidget.GetRenderWindow().GetSize()[1], 1)
+		mask = self.body_tree.resolved(self.current_time, cam.GetPosition(),
+			math.radians(cam.GetViewAngle()) / height)
+		if self.obj_sphere in self.moon_spheres:
+			mask[self.moon_spheres.index(self.obj_sphere)] = True
+		for i in np.nonzero(mask != self.moon_visible)[0]:
+			self.moon_actors[i].SetVisibility(bool(mask[i]))
+		self.moon_visible = mask
+		index = np.nonzero(mask)[0]
+		if index.shape[0] == 0:
+			return
+		with profiler.stage('kepler'):
+			positions = self.body_tree.positions(self.current_time, index + self.body_tree.first)
+		for i, pos in zip(index, positions):
+			self.moon_spheres[i].SetCenter(pos)
+
+	def make_clouds(self):
+		# One point-cloud actor per asteroid, with the clones of all
+		# asteroids propagated together
+		self.clouds = CloneEnsemble.from_elements(self.asteroid_orbits, CLOUD_SIGMAS, CLOUD_CLONES, seed=0)
+		for color in self.asteroid_colors:
+			self.add_cloud(color)
+
+	def add_cloud(self, color):
+		# Appends the point-cloud actor of one asteroid, hidden
+		points = vtk.vtkPoints()
+		points.SetData(vtk.util.numpy_support.numpy_to_vtk(np.zeros((self.clouds.n, 3)), deep=True))
+		verts = vtk.vtkCellArray()
+		verts.InsertNextCell(self.clouds.n)
+		for i in range(self.clouds.n):
+			verts.InsertCellPoint(i)
+		polyData = vtk.vtkPolyData()
+		polyData.SetPoints(points)
+		polyData.SetVerts(verts)
+		mapper = vtk.vtkPolyDataMapper()
+		mapper.SetInputData(polyData)
+		mapper.ScalarVisibilityOff()
+		actor = vtk.vtkActor()
+		actor.SetMapper(mapper)
+		actor.GetProperty().SetColor([c / 255 for c in color])
+		actor.GetProperty().SetPointSize(2)
+		actor.SetVisibility(False)
+		self.cloud_points.append(points)
+		self.cloud_actors.append(actor)
+		self.ren.AddActor(actor)
+
+	def cloud_shown(self):
+		# Whether the clouds are drawn; none are left without asteroids
+		return bool(self.cloud_actors) and bool(self.cloud_actors[0].GetVisibility())
+
+	def refresh_clouds(self):
+		# Moves the clones when the time has changed since the last frame
+		if self.clouds is None or not self.cloud_shown():
+			return
+		if self.cloud_time == self.current_time:
+			return
+		with profiler.stage('kepler'):
+			positions = self.clouds.positions(self.current_time).reshape(self.clouds.m, self.clouds.n, 3)
+		for points, pos in zip(self.cloud_points, positions):
+			points.SetData(vtk.util.numpy_support.numpy_to_vtk(pos, deep=True))
+			points.Modified()
+		self.cloud_time = self.current_time
+
+	def toggle_clouds(self):
+		if self.clouds is None:
+			self.make_clouds()
+		visible = not self.cloud_shown()
+		for actor in self.cloud_actors:
+			actor.SetVisibility(visible)
+		self.cloud_time = None
+		if visible:
+			self.refresh_clouds()
+			stats = self.clouds.spread(self.current_time)
+			for name, major in zip(self.clouds.names, stats['major']):
+				self.ui.log.insertPlainText('{} cloud: {:.0f} km\n'.format(name.strip(), major / 1000))
+		self.ui.vtkWidget.GetRenderWindow().Render()
+
+	def trail_positions(self):
+		# Current sphere centers of the planets and asteroids, gathered into
+		# a preallocated array
+		m = len(self.planet_spheres) + len(self.asteroid_spheres)
+		if self.trail_pos.shape[0] != m:
+			self.trail_pos = np.zeros((m, 3))
+		for i, sphere in enumerate(itertools.chain(self.planet_spheres, self.asteroid_spheres)):
+			self.trail_pos[i] = sphere.center
+		return self.trail_pos
+
+	def trail_centers(self, rows):
+		# Sphere centers of some trail rows (the planets come first)
+		nplanets = len(self.planet_spheres)
+		return np.array([self.planet_spheres[k].center if k < nplanets else self.asteroid_spheres[k - nplanets].center for k in rows]).reshape(-1, 3)
+
+	def make_trails(self):
+		# One actor for all trails. The points and scalars are views of the
+		# ring buffer, which is written in place; each body has a band of
+		# the lookup table, with opacity fading along the band
+		self.trail_pos = np.zeros((0, 3))
+		self.trails = TrailBuffer(len(self.planet_spheres) + len(self.asteroid_spheres), TRAIL_SAMPLES)
+		self.trails.reset(self.trail_positions())
+		self.trail_data = vtk.vtkPolyData()
+		self.trail_mapper = vtk.vtkPolyDataMapper()
+		self.trail_mapper.SetInputData(self.trail_data)
+		self.trail_mapper.SetColorModeToMapScalars()
+		self.bind_trails()
+		self.trail_actor = vtk.vtkActor()
+		self.trail_actor.SetMapper(self.trail_mapper)
+		self.trail_actor.GetProperty().SetLineWidth(2)
+		self.trail_actor.SetVisibility(False)
+		self.ren.AddActor(self.trail_actor)
+
+	def bind_trails(self):
+		# Hands the ring buffer to the mapper without copying; done again
+		# when bodies are added or removed, which reallocates the buffer
+		self.trail_points = vtk.util.numpy_support.numpy_to_vtk(self.trails.points, deep=False)
+		self.trail_stamps = vtk.util.numpy_support.numpy_to_vtk(self.trails.stamps, deep=False)
+		points = vtk.vtkPoints()
+		points.SetData(self.trail_points)
+		lines = vtk.vtkCellArray()
+		lines.SetCells(self.trails.m * self.trails.n, vtk.util.numpy_support.numpy_to_vtkIdTypeArray(self.trails.lines(), deep=True))
+		self.trail_data.SetPoints(points)
+		self.trail_data.SetLines(lines)
+		self.trail_data.GetPointData().SetScalars(self.trail_stamps)
+		table = self.trails.lookup_table(self.planet_colors + self.asteroid_colors)
+		lut = vtk.vtkLookupTable()
+		lut.SetTable(vtk.util.numpy_support.numpy_to_vtk(np.round(table * 255).astype(np.uint8), deep=True))
+		self.trail_mapper.SetLookupTable(lut)
+		self.trail_mapper.SetScalarRange(*self.trails.scalar_range())
+
+	def refresh_trails(self):
+		# Adds a sample when the time has changed since the last frame; only
+		# the new points are written
+		if self.trails is None or not self.trail_actor.GetVisibility():
+			return
+		if self.trail_time == self.current_time:
+			return
+		with profiler.stage('trails'):
+			self.trails.append(self.trail_positions())
+			self.trail_points.Modified()
+			self.trail_stamps.Modified()
+			self.trail_mapper.SetScalarRange(*self.trails.scalar_range())
+		self.trail_time = self.current_time
+
+	def toggle_trails(self):
+		if self.trails is None:
+			self.make_trails()
+		visible = not self.trail_actor.GetVisibility()
+		if visible:
+			#Trails start from the current positions
+			self.trails.reset(self.trail_positions())
+			self.trail_points.Modified()
+			self.trail_stamps.Modified()
+			self.trail_mapper.SetScalarRange(*self.trails.scalar_range())
+			self.trail_time = self.current_time
+		self.trail_actor.SetVisibility(visible)
+		self.ui.log.insertPlainText('Trails {}\n'.format('on' if visible else 'off'))
+		self.ui.vtkWidget.GetRenderWindow().Render()
+
+	def make_belt(self):
+		# One volume for the whole population. Its scalars are a view of the
+		# image values, which the grid updates are written into
+		r0, v0, t0, mu = synthetic_belt(BELT_BODIES)
+		self.belt_grids = [DensityGrid.cartesian(BELT_VOXELS, BELT_EXTENT, BELT_HEIGHT),
+			DensityGrid.heliocentric(BELT_CELLS, BELT_EXTENT, 1.5 * AU, 30.0)]
+		self.belt = PopulationDensity(r0, v0, t0, mu, self.belt_grids[0], chunk=8192)
+		#Image of each grid and the VTK view of its values, made on first use
+		#and kept across switches
+		self.belt_images = [None] * len(self.belt_grids)
+		self.belt_arrays = [None] * len(self.belt_grids)
+		self.belt_image = vtk.vtkImageData()
+		self.belt_color = vtk.vtkColorTransferFunction()
+		self.belt_opacity = vtk.vtkPiecewiseFunction()
+		prop = vtk.vtkVolumeProperty()
+		prop.SetColor(self.belt_color)
+		prop.SetScalarOpacity(self.belt_opacity)
+		prop.SetInterpolationTypeToLinear()
+		prop.ShadeOff()
+		mapper = vtk.vtkSmartVolumeMapper()
+		mapper.SetInputData(self.belt_image)
+		self.belt_volume = vtk.vtkVolume()
+		self.belt_volume.SetMapper(mapper)
+		self.belt_volume.SetProperty(prop)
+		self.belt_volume.SetVisibility(False)
+		self.set_belt_grid(0)
+		self.ren.AddVolume(self.belt_volume)
+
+	def set_belt_grid(self, k):
+		# Bins the belt on grid k and scales the transfer functions to its
+		# densest voxel
+		self.belt_grid = k
+		self.belt.set_grid(self.belt_grids[k])
+		if self.belt_images[k] is None:
+			self.belt_images[k] = VolumeImage(self.belt_grids[k], BELT_VOXELS, BELT_EXTENT, BELT_HEIGHT)
+			self.belt_arrays[k] = vtk.util.numpy_support.numpy_to_vtk(self.belt_images[k].values, deep=False)
+		self.belt_values = self.belt_images[k]
+		self.belt_array = self.belt_arrays[k]
+		peak = max(self.belt_values.refresh(), 1.0)
+		self.belt_array.Modified()
+		self.belt_image.SetDimensions(*self.belt_values.dimensions)
+		self.belt_image.SetOrigin(*self.belt_values.origin)
+		self.belt_image.SetSpacing(*self.belt_values.spacing)
+		self.belt_image.GetPointData().SetScalars(self.belt_array)
+		self.belt_color.RemoveAllPoints()
+		self.belt_color.AddRGBPoint(0.0, 0.4, 0.2, 0.1)
+		self.belt_color.AddRGBPoint(peak * 0.3, 0.9, 0.6, 0.3)
+		self.belt_color.AddRGBPoint(peak, 1.0, 1.0, 0.9)
+		self.belt_opacity.RemoveAllPoints()
+		self.belt_opacity.AddPoint(0.0, 0.0)
+		self.belt_opacity.AddPoint(peak * 0.02, 0.0)
+		self.belt_opacity.AddPoint(peak, 0.5)
+		#Opacities are per voxel rather than per meter
+		self.belt_volume.GetProperty().SetScalarOpacityUnitDistance(max(self.belt_values.spacing))
+		self.belt_time = None
+
+	def refresh_belt(self):
+		# Brings a few chunks of the belt to the current time; the frame is
+		# drawn again until the whole belt is there
+		if self.belt is None or not self.belt_volume.GetVisibility():
+			return
+		if self.belt_time == self.current_time:
+			return
+		self.belt.set_time(self.current_time)
+		with profiler.stage('density'):
+			pending = self.belt.step(BELT_BUDGET)
+			self.belt_values.refresh()
+			self.belt_array.Modified()
+			self.belt_image.Modified()
+		if pending:
+			QTimer.singleShot(0, self.ui.vtkWidget.GetRenderWindow().Render)
+		else:
+			self.belt_time = self.current_time
+
+	def toggle_belt(self):
+		if self.belt is None:
+			self.make_belt()
+		visible = not self.belt_volume.GetVisibility()
+		self.belt_volume.SetVisibility(visible)
+		self.belt_time = None
+		self.ui.log.insertPlainText('Belt density {}\n'.format('on' if visible else 'off'))
+		self.ui.vtkWidget.GetRenderWindow().Render()
+
+	def switch_belt_grid(self):
+		if self.belt is None or not self.belt_volume.GetVisibility():
+			return
+		start = time.perf_counter()
+		self.set_belt_grid(1 - self.belt_grid)
+		self.ui.log.insertPlainText('Belt density on the {} grid: {} bodies binned in {:.0f} ms\n'.format(
+			self.belt.grid.frame, len(self.belt), (time.perf_counter() - start) * 1000))
+		self.ui.vtkWidget.GetRenderWindow().Render()
+
+	def porkchop_callback(self):
+		# Transfers departing from the current date
+		body1 = self.ui.porkchop_from.currentIndex()
+		body2 = self.ui.porkchop_to.currentIndex()
+		if body1 == body2:
+			self.ui.log.insertPlainText('Porkchop needs two different bodies\n')
+			return
+		self.ui.porkchop.start(body1, body2, self.current_time)
+		self.ui.log.insertPlainText('Porkchop {} to {}\n'.format(self.ui.porkchop_from.currentText(), self.ui.porkchop_to.currentText()))
+
+	def locate_bodies(self, index, t):
+		# Positions of the Sun, planets and asteroids by index in self.bodies
+		nplanets = len(self.planet_objs)
+		pos = np.zeros((len(index), 3))
+		planet = (index >= 1) & (index <= nplanets)
+		if planet.any():
+			positions, velocities = self.planet_elements.posvelatt(t)
+			pos[planet] = positions[index[planet] - 1]
+		asteroid = index > nplanets
+		if asteroid.any():
+			pos[asteroid] = self.asteroid_culler.locate(index[asteroid] - nplanets - 1, t)
+		return pos
+
+	def pick_callback(self, obj, event):
+		# A double click focuses the body nearest to the clicked pixel
+		if self.iren.GetRepeatCount() == 0:
+			return
+		x, y = self.iren.GetEventPosition()
+		ends = []
+		for z in (0.0, 1.0):
+			self.ren.SetDisplayPoint(x, y, z)
+			self.ren.DisplayToWorld()
+			w = self.ren.GetWorldPoint()
+			ends.append(np.array(w[:3]) / w[3])
+		cam = self.ren.GetActiveCamera()
+		height = max(self.ui.vtkWidget.GetRenderWindow().GetSize()[1], 1)
+		self.picker.set_time(self.current_time)
+		index = self.picker.pick(cam.GetPosition(), ends[1] - ends[0],
+			4 * math.radians(cam.GetViewAngle()) / height)
+		if index is not None:
+			self.ui.log.insertPlainText('Picked {}\n'.format(self.bodies[index][0]))
+			self.ui.obj_focus.setCurrentIndex(index)
+
+	def frame_callback(self, obj, event):
+		# End of a frame: update the overlay and, every 60 frames, the log
+		if not profiler.enabled:
+			return
+		profiler.end_frame()
+		self.hud.SetInput(profiler.text())
+		if profiler.total % 60 == 0:
+			self.ui.log.insertPlainText(profiler.text() + '\n')
+
+	def key_callback(self, obj, event):
+		key = self.iren.GetKeySym()
+		if key == 'F3':
+			profiler.set_enabled(not profiler.enabled)
+			self.hud.SetInput('profiling...')
+			self.hud.SetVisibility(profiler.enabled)
+			self.ui.log.insertPlainText('Profiling {}\n'.format('on' if profiler.enabled else 'off'))
+			self.ui.vtkWidget.GetRenderWindow().Render()
+		elif key == 'F4':
+			save_trace(self.ui.log)
+		elif key == 'F5':
+			self.toggle_clouds()
+		elif key == 'F6':
+			self.toggle_trails()
+		elif key == 'F7':
+			self.toggle_belt()
+		elif key == 'F8':
+			self.switch_belt_grid()
+
 	def scale_release(self, val):
 		self.ui.log.insertPlainText('Scale set to {}\n'.format(val))
 		self.ui.log.insertPlainText('Sun Scale Max: 25\nInner Solar System Scale Max: 3800\nOuter Solar System Scale Max: 2500\nAsteroids and Pluto Scale Max: 50000\n')
@@ -608,5 +1292,6 @@ if __name__=="__main__":
 	window.ui.obj_focus.currentIndexChanged.connect(window.focus_callback)
 	window.ui.push_screenshot.clicked.connect(window.screenshot_callback)
 	window.ui.push_quit.clicked.connect(window.quit_callback)
+	window.ui.push_porkchop.clicked.connect(window.porkchop_callback)
 	window.ui.date_textbox.dateChanged.connect(window.date_callback)
 	sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""Adaptive porkchop plots
+
+A porkchop plot maps the delta-v of the Lambert transfer between two
+bodies over a departure date x arrival date plane. Instead of solving a
+uniform grid, Porkchop starts from coarse cells and splits a cell into
+four (a quadtree) only where
+  - a delta-v contour level crosses the cell,
+  - the cell holds the smallest delta-v found so far, or is close to it,
+  - the delta-v is far from linear over the cell (center vs corners), or
+  - the cell straddles the edge of the region where Lambert's problem can
+    be solved.
+Cells above the highest contour level, and cells smaller than a pixel of
+the current view, are not split.
+
+All cell corners lie on one fixed lattice, anchored at the origin of the
+plot, and every solved lattice node is cached. Panning and zooming only
+change which cells are refined; nodes already solved are reused.
+
+Refinement is incremental: refine() solves at most a given number of new
+nodes (one lambert_batch call per pass) and can be called repeatedly,
+e.g. from a GUI timer, while raster() renders the current state.
+
+Run this module for an Earth - Mars porkchop (optionally saving the
+shaded image as a .npy file):
+  python porkchop.py [image.npy]
+"""
+
+import sys
+import heapq
+import time
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits, lambert_batch
+
+DAY = 86400.0
+
+_OFFSET = 1 << 30
+
+
+def _key(i, j):
+    # Lattice node (i, j) as one integer
+    return (np.asarray(i, dtype=np.int64) + _OFFSET) * (1 << 32) \
+        + (np.asarray(j, dtype=np.int64) + _OFFSET)
+
+
+def body_states(body):
+    """Returns a function of times giving the states of a body
+
+    Args:
+        body: TwoBodyOrbit (anything accepted by stack_orbits), or a tuple
+            (SecularElements, index) for a planet
+    Returns: states
+        states: Function of an array of times (n,) returning positions and
+            velocities of shape (n, 3)
+    """
+    if isinstance(body, tuple):
+        planets, index = body
+
+        def states(t):
+            times, inverse = np.unique(t, return_inverse=True)
+            pos, vel = planets.posvelatt(times)
+            return pos[index][inverse.ravel()], vel[index][inverse.ravel()]
+        return states
+    r0, v0, t0, mu = stack_orbits([body])
+
+    def states(t):
+        pos, vel = twobodykernels.kepler(r0, v0, mu,
+                                         np.asarray(t, dtype=float)[None, :]
+                                         - t0[:, None])
+        return pos[0], vel[0]
+    return states
+
+
+class Porkchop:
+    """Quadtree-refined delta-v map of the transfers between two bodies
+
+    Cells are tuples (i, j, size) of lattice units: departure index,
+    arrival index and edge length. A node (i, j) is at departure
+    origin[0] + i * spacing[0] and arrival origin[1] + j * spacing[1].
+    """
+    def __init__(self, body1, body2, origin, step, levels=None, max_depth=6,
+                 mu=1.32712440041e20, arrival=True, min_tof=DAY):
+        """
+        Args:
+            body1, body2: Departure and arrival bodies (see body_states)
+            origin: Departure and arrival times of the lattice origin
+            step: Edge lengths of the coarse cells along departure and
+                arrival (seconds)
+            levels: Delta-v contour levels to refine along (m/s). Default
+                is every 1 km/s up to 20 km/s
+            max_depth: Number of times a coarse cell can be split
+            mu: Gravitational parameter of the central body
+            arrival: If True, the delta-v includes the arrival excess
+                velocity (rendezvous); otherwise only the departure excess
+                velocity is counted (flyby)
+            min_tof: Shortest time of flight; shorter transfers are not
+                solved
+        """
+        self.states1 = body_states(body1)
+        self.states2 = body_states(body2)
+        self.origin = np.asarray(origin, dtype=float)
+        self.root = 1 << max_depth
+        self.spacing = np.asarray(step, dtype=float) / self.root
+        if levels is None:
+            levels = np.arange(1000.0, 20001.0, 1000.0)
+        self.levels = np.sort(np.asarray(levels, dtype=float))
+        self.mu = mu
+        self.arrival = arrival
+        self.min_tof = min_tof
+
+        # Cache of solved nodes, and the leaves of the quadtree
+        self.values = {}
+        self.leaves = set()
+        self.roots = set()
+        self.best = np.inf
+        self.solved = 0
+        self.seconds = 0.0
+        self.queue = []
+        self.window = None
+        self.min_size = 1
+
+    def set_view(self, departure, arrival, pixels=None):
+        """Sets the window to refine and render
+
+        Args:
+            departure: Departure time range (start, end)
+            arrival: Arrival time range (start, end)
+            pixels: Size of the rendered image (width, height). Cells
+                smaller than one pixel are not split
+        """
+        lo = np.floor((np.array([departure[0], arrival[0]]) - self.origin)
+                      / self.spacing / self.root).astype(int)
+        hi = np.ceil((np.array([departure[1], arrival[1]]) - self.origin)
+                     / self.spacing / self.root).astype(int)
+        if (hi - lo).prod() > 1000000:
+            raise(ValueError('Too many coarse cells in the view: '
+                             'porkchop.Porkchop.set_view'))
+        self.window = (float(departure[0]), float(departure[1]),
+                       float(arrival[0]), float(arrival[1]))
+        for a in range(lo[0], hi[0]):
+            for b in range(lo[1], hi[1]):
+                if (a, b) not in self.roots:
+                    self.roots.add((a, b))
+                    self.leaves.add((a * self.root, b * self.root, self.root))
+        if pixels is None:
+            self.min_size = 1
+        else:
+            size = np.array([departure[1] - departure[0],
+                             arrival[1] - arrival[0]]) \
+                / np.asarray(pixels, dtype=float) / self.spacing
+            self.min_size = max(int(size.max()), 1)
+        # Cells too small to split are still queued until their corners
+        # are solved, so that raster() can fill them
+        self.queue = [self._priority(cell) for cell in self.leaves
+                      if self._visible(cell) and (cell[2] > self.min_size
+                                                  or not self._known(cell))]
+        heapq.heapify(self.queue)
+
+    def _known(self, cell):
+        # True if the corners of the cell are solved
+        i, j, size = cell
+        return all(node in self.values for node in
+                   ((i, j), (i + size, j), (i, j + size), (i + size, j + size)))
+
+    def _visible(self, cell):
+        i, j, size = cell
+        d0, d1, a0, a1 = self.window
+        t0 = self.origin[0] + i * self.spacing[0]
+        t1 = self.origin[1] + j * self.spacing[1]
+        return t0 < d1 and t0 + size * self.spacing[0] > d0 and \
+            t1 < a1 and t1 + size * self.spacing[1] > a0
+
+    def _priority(self, cell):
+        # Large cells first, then the lowest delta-v among the known
+        # corners, so that the map fills in coarse-to-fine around the
+        # minimum
+        i, j, size = cell
+        known = [self.values.get(node, np.inf) for node in
+                 ((i, j), (i + size, j), (i, j + size), (i + size, j + size))]
+        low = min([v for v in known if v == v] + [np.inf])
+        return (-size, low, cell)
+
+    def _solve(self, nodes):
+        # Solves Lambert's problems at lattice nodes and caches delta-v
+        nodes = np.array(nodes, dtype=np.int64).reshape(-1, 2)
+        t = self.origin + nodes * self.spacing
+        dv = np.full(nodes.shape[0], np.nan)
+        ok = t[:, 1] - t[:, 0] >= self.min_tof
+        if ok.any():
+            pos1, vel1 = self.states1(t[ok, 0])
+            pos2, vel2 = self.states2(t[ok, 1])
+            ivel, tvel = lambert_batch(pos1, pos2, t[ok, 1] - t[ok, 0],
+                                       self.mu, True)
+            total = np.sqrt(((ivel - vel1) ** 2).sum(axis=1))
+            if self.arrival:
+                total = total + np.sqrt(((vel2 - tvel) ** 2).sum(axis=1))
+            dv[ok] = total
+        for node, v in zip(map(tuple, nodes.tolist()), dv.tolist()):
+            self.values[node] = v
+        finite = dv[np.isfinite(dv)]
+        if finite.shape[0] > 0:
+            self.best = min(self.best, finite.min())
+        self.solved += nodes.shape[0]
+
+    def _split(self, cell):
+        # True if the cell should be divided into four
+        i, j, size = cell
+        h = size // 2
+        v = np.array([self.values[node] for node in
+                      ((i, j), (i + size, j), (i, j + size),
+                       (i + size, j + size), (i + h, j + h))])
+        finite = np.isfinite(v)
+        if not finite.any():
+            return False
+        if not finite.all():
+            return True
+        lo = v.min()
+        if lo > self.levels[-1]:
+            return False
+        hi = v.max()
+        if np.searchsorted(self.levels, lo) != np.searchsorted(self.levels,
+                                                               hi):
+            return True
+        if lo <= self.best + 0.5 * (hi - lo) + 1.0:
+            return True
+        # Bilinear interpolation misses the center by more than a tenth of
+        # the contour spacing
+        spacing = np.diff(self.levels).min() if self.levels.shape[0] > 1 \
+            else hi - lo
+        return abs(v[4] - v[:4].mean()) > 0.1 * spacing
+
+    def refine(self, max_solves=4096):
+        """Refines the cells of the view
+
+        Args:
+            max_solves: Most Lambert's problems solved in this call
+        Returns: solved
+            solved: Number of Lambert's problems solved (0 when the view
+                is fully refined)
+        """
+        if self.window is None:
+            raise(ValueError('set_view() must be called first: '
+                             'porkchop.Porkchop.refine'))
+        start = time.perf_counter()
+        solved = self.solved
+        while self.queue and self.solved - solved < max_solves:
+            # Pop cells until their new nodes fill the budget, keeping room
+            # for the edge midpoints of the cells that get split
+            cells = []
+            nodes = set()
+            budget = max_solves - (self.solved - solved)
+            while self.queue:
+                priority, low, cell = heapq.heappop(self.queue)
+                if cell not in self.leaves:
+                    continue
+                i, j, size = cell
+                h = size // 2
+                new = {node for node in
+                       ((i, j), (i + size, j), (i, j + size),
+                        (i + size, j + size), (i + h, j + h))
+                       if node not in self.values} - nodes
+                # The first cell of the call goes in whatever the budget
+                if len(nodes) + len(new) + 4 * (len(cells) + 1) > budget \
+                        and (cells or self.solved > solved):
+                    heapq.heappush(self.queue, (priority, low, cell))
+                    break
+                cells.append(cell)
+                nodes |= new
+            if not cells:
+                break
+            if nodes:
+                self._solve(list(nodes))
+            split = [cell for cell in cells
+                     if cell[2] > self.min_size and self._split(cell)]
+            # The corners of the children are the corners and the center of
+            # the cell, solved above, and its edge midpoints. Every leaf has
+            # its corners solved, including the children not queued (too
+            # small or out of the view)
+            nodes = set()
+            for i, j, size in split:
+                h = size // 2
+                for node in ((i + h, j), (i, j + h), (i + size, j + h),
+                             (i + h, j + size)):
+                    if node not in self.values:
+                        nodes.add(node)
+            if nodes:
+                self._solve(list(nodes))
+            for cell in split:
+                self.leaves.remove(cell)
+                i, j, size = cell
+                h = size // 2
+                for child in ((i, j, h), (i + h, j, h), (i, j + h, h),
+                              (i + h, j + h, h)):
+                    self.leaves.add(child)
+                    if h > self.min_size and self._visible(child):
+                        heapq.heappush(self.queue, self._priority(child))
+        self.seconds += time.perf_counter() - start
+        return self.solved - solved
+
+    def done(self):
+        """Returns True if the view is fully refined
+        """
+        return not self.queue
+
+    def minimum(self):
+        """Returns the smallest delta-v solved in the view
+
+        Returns: departure, arrival, dv
+            departure, arrival: Times of the transfer (NaN if none)
+            dv: Delta-v (m/s)
+        """
+        nodes = np.array(list(self.values.keys()), dtype=np.int64
+                         ).reshape(-1, 2)
+        dv = np.array(list(self.values.values()), dtype=float)
+        t = self.origin + nodes * self.spacing
+        d0, d1, a0, a1 = self.window
+        inside = (t[:, 0] >= d0) & (t[:, 0] <= d1) & (t[:, 1] >= a0) \
+            & (t[:, 1] <= a1) & np.isfinite(dv)
+        if not inside.any():
+            return np.nan, np.nan, np.nan
+        k = np.nonzero(inside)[0][dv[inside].argmin()]
+        return t[k, 0], t[k, 1], dv[k]
+
+    def raster(self, width, height):
+        """Renders the view
+
+        Each pixel is interpolated bilinearly from the corners of the leaf
+        cell it falls in.
+
+        Args:
+            width, height: Size of the image
+        Returns: image
+            image: Delta-v of shape (height, width); row 0 is the latest
+                arrival. NaN where no transfer was solved
+        """
+        d0, d1, a0, a1 = self.window
+        x = (d0 + (np.arange(width) + 0.5) * (d1 - d0) / width
+             - self.origin[0]) / self.spacing[0]
+        y = (a1 - (np.arange(height) + 0.5) * (a1 - a0) / height
+             - self.origin[1]) / self.spacing[1]
+        x, y = np.meshgrid(x, y)
+        image = np.full((height, width), np.nan)
+        if not self.values:
+            return image
+        nodes = np.array(list(self.values.keys()), dtype=np.int64
+                         ).reshape(-1, 2)
+        keys = _key(nodes[:, 0], nodes[:, 1])
+        order = np.argsort(keys)
+        keys = keys[order]
+        dv = np.array(list(self.values.values()), dtype=float)[order]
+
+        def lookup(i, j):
+            k = _key(i, j)
+            pos = np.minimum(np.searchsorted(keys, k), keys.shape[0] - 1)
+            return np.where(keys[pos] == k, dv[pos], np.nan)
+
+        leaves = np.array(list(self.leaves), dtype=np.int64).reshape(-1, 3)
+        todo = np.ones(x.shape, dtype=bool)
+        for size in np.unique(leaves[:, 2]):
+            mine = leaves[leaves[:, 2] == size]
+            leafkeys = np.sort(_key(mine[:, 0], mine[:, 1]))
+            px = x[todo]
+            py = y[todo]
+            i = (np.floor(px / size) * size).astype(np.int64)
+            j = (np.floor(py / size) * size).astype(np.int64)
+            k = _key(i, j)
+            pos = np.minimum(np.searchsorted(leafkeys, k),
+                             leafkeys.shape[0] - 1)
+            hit = leafkeys[pos] == k
+            if not hit.any():
+                continue
+            i = i[hit]
+            j = j[hit]
+            u = (px[hit] - i) / size
+            w = (py[hit] - j) / size
+            val = (lookup(i, j) * (1.0 - u) * (1.0 - w)
+                   + lookup(i + size, j) * u * (1.0 - w)
+                   + lookup(i, j + size) * (1.0 - u) * w
+                   + lookup(i + size, j + size) * u * w)
+            rows, cols = np.nonzero(todo)
+            image[rows[hit], cols[hit]] = val
+            todo[rows[hit], cols[hit]] = False
+        return image
+
+
+def shade(image, levels, vmin=None, vmax=None):
+    """Colors a delta-v image, with contour lines at the levels
+
+    Args:
+        image: Delta-v of shape (h, w), e.g. from Porkchop.raster
+        levels: Contour levels (m/s)
+        vmin, vmax: Delta-v of the ends of the color scale. Default is the
+            smallest value of the image and the highest level
+    Returns: rgb
+        rgb: Numpy array of uint8 of shape (h, w, 3); NaN pixels are black
+    """
+    levels = np.asarray(levels, dtype=float)
+    finite = np.isfinite(image)
+    if vmin is None:
+        vmin = image[finite].min() if finite.any() else levels[0]
+    if vmax is None:
+        vmax = levels[-1]
+    x = np.clip((np.where(finite, image, vmax) - vmin)
+                / max(vmax - vmin, 1e-9), 0.0, 1.0)
+    # Blue - cyan - yellow - red
+    rgb = np.stack([np.clip(2.0 * x - 0.5, 0.0, 1.0),
+                    np.clip(1.5 - np.abs(3.0 * x - 1.5), 0.0, 1.0),
+                    np.clip(1.0 - 2.0 * x, 0.0, 1.0)], axis=-1)
+    band = np.searchsorted(levels, np.where(finite, image, np.inf))
+    edge = np.zeros(image.shape, dtype=bool)
+    edge[:, 1:] |= band[:, 1:] != band[:, :-1]
+    edge[1:, :] |= band[1:, :] != band[:-1, :]
+    rgb[edge & finite] *= 0.3
+    rgb[~finite] = 0.0
+    return np.ascontiguousarray((rgb * 255.0).astype(np.uint8))
+
+
+if __name__ == '__main__':
+    from solarsystem import sunmu
+    from secularelements import SecularElements
+    planets = SecularElements.from_csv(
+        'Data/planets_keplerian_elements.csv', mu=sunmu)
+    earth = (planets, planets.names.index('EM Bary'))
+    mars = (planets, planets.names.index('Mars'))
+    t0 = 62502.0 * DAY
+    departure = (t0, t0 + 800.0 * DAY)
+    arrival = (t0 + 60.0 * DAY, t0 + 1200.0 * DAY)
+    width, height = 400, 400
+    chop = Porkchop(earth, mars, (t0, t0), (50.0 * DAY, 50.0 * DAY))
+    chop.set_view(departure, arrival, (width, height))
+    while chop.refine():
+        pass
+    uniform = int(np.prod((np.array([800.0, 1140.0]) / 50.0 * chop.root
+                           / chop.min_size + 1).astype(int)))
+    print('{} Lambert solves in {:.2f} s ({} leaves); a uniform grid at the '
+          'same resolution needs {}'.format(chop.solved, chop.seconds,
+                                            len(chop.leaves), uniform))
+    dep, arr, dv = chop.minimum()
+    print('Minimum {:.2f} km/s: departure MJD {:.1f}, {:.0f} days'.format(
+        dv / 1000.0, dep / DAY, (arr - dep) / DAY))
+    start = time.perf_counter()
+    rgb = shade(chop.raster(width, height), chop.levels)
+    print('Raster {}x{} in {:.3f} s'.format(width, height,
+                                            time.perf_counter() - start))
+    if len(sys.argv) > 1:
+        np.save(sys.argv[1], rgb)
+    # Zoom on the minimum: only the new, finer cells are solved
+    solved = chop.solved
+    chop.set_view((dep - 60.0 * DAY, dep + 60.0 * DAY),
+                  (arr - 60.0 * DAY, arr + 60.0 * DAY), (width, height))
+    while chop.refine():
+        pass
+    dep, arr, dv = chop.minimum()
+    print('Zoomed: {} more solves, minimum {:.2f} km/s: departure MJD '
+          '{:.1f}, {:.0f} days'.format(chop.solved - solved, dv / 1000.0,
+                                       dep / DAY, (arr - dep) / DAY))
@@ -9,60 +9,71 @@ This module provide computations about two-body orbits, including:
   Solve Lambert's problem  (From given two positions and flight time 
   between them, lambert() computes initial and terminal velocity of 
   the object)
+  Compute positions and velocities of many objects at many times at
+  once (propagate), and solve many Lambert's problems at once
+  (lambert_batch). These use the compiled kernels of twobodykernels when
+  numba is available, and pure NumPy kernels otherwise
+  Compute state transition matrices in closed form along with the states
+  (propagate), and propagate covariances of many objects with them
+  (propagate_covariance)
+  Trade accuracy for speed with the precision argument ('render',
+  'standard' or 'high'; see twobodykernels.PRECISIONS)
 
 @author: Shushi Uetsuki/whiskie14142
 """
 
 import numpy as np
 import math
-from scipy.optimize import newton
-from scipy.optimize import bisect
+import twobodykernels
 
   
 class TwoBodyOrbit:
     """A class of a two-body orbit of a celestial object
     
     """
+    __slots__ = ('_setOrb', 'bodyname', 'mothername', 'mu', 't0', 'pos',
+                 'vel', 'hv', 'p', 'ev', 'evd', 'e', 'a', 'i', 'lan', 'parg',
+                 'ta0', 'ma', 'pr', 'mm', 'T')
+
     def timeFperi(self, ta):
         """Computes time from periapsis passage for given true anomaly
         
         Args:
-            ta: True Anomaly in radians
+            ta: True Anomaly in radians, or Numpy array of them
         Returns: sec_from_peri
-            sec_from_peri: Time from periapsis passage (float). Unit of time
-                           depends on gravitational parameter (mu)
+            sec_from_peri: Time from periapsis passage (float, or array of
+                           the shape of ta). Unit of time depends on
+                           gravitational parameter (mu)
         """
         if not self._setOrb:
             raise(RuntimeError('Orbit has not been defined: in TwoBodyOrbit.timeFperi'))
             
-        r = self.a * (1.0 - self.e ** 2) / (1.0 + self.e * np.cos(ta))
+        # Universal anomaly x of the true anomaly, then Kepler's equation
+        # from periapsis: sqrt(mu) t = q x + e x^3 S(x^2 / a). Unlike
+        # E - e sin E (or e sinh F - F) this does not cancel near e = 1
+        w = np.sqrt(abs(1.0 - self.e) / (1.0 + self.e)) * np.tan(ta / 2.0)
         if self.e < 1.0:
-            b_over_a = np.sqrt(1.0 - self.e ** 2)
-            ecc_anm = np.arctan2(r * np.sin(ta) / b_over_a, self.a * self.e \
-                + r * np.cos(ta))
-            if ecc_anm < 0.0: ecc_anm += math.pi * 2.0
-            sec_from_peri = np.sqrt(self.a **3 / self.mu) * (ecc_anm - self.e \
-                * np.sin(ecc_anm))
+            ecc_anm = (2.0 * np.arctan(w)) % (math.pi * 2.0)
+            x = np.sqrt(self.a) * ecc_anm
         elif self.e == 1.0:
-            ecc_anm = np.sqrt(self.p) * np.tan(ta / 2.0)
-            sec_from_peri = (self.p * ecc_anm + ecc_anm ** 3 / 3.0) / 2.0 / \
-                np.sqrt(self.mu)
+            x = np.sqrt(self.p) * np.tan(ta / 2.0)
         else:
-            sy = (self.e + np.cos(ta)) / (1.0 + self.e * np.cos(ta))
-            lf = np.log(sy + np.sqrt(sy ** 2 - 1.0))
-            if (ta < 0.0) or (ta > math.pi): lf = lf * (-1.0)
-            sec_from_peri = np.sqrt((-1.0) * self.a ** 3 / self.mu) * (self.e \
-                * np.sinh(lf) - lf)
+            x = np.sqrt((-1.0) * self.a) * 2.0 * np.arctanh(w)
+        c, s = twobodykernels._stumpff(np.asarray(x * x / self.a))
+        sec_from_peri = (self.p / (1.0 + self.e) * x + self.e * x ** 3 * s) \
+            / np.sqrt(self.mu)
+        if np.ndim(sec_from_peri) == 0:
+            sec_from_peri = float(sec_from_peri)
         return sec_from_peri
         
     def posvel(self, ta):
         """Comuputs position and velocity for given true anomaly
         
         Args:
-            ta: True Anomaly in radians
+            ta: True Anomaly in radians, or Numpy array of shape (n,)
         Returns: rv, vv
-            rv: Position (x,y,z) as numpy array
-            vv: Velocity (xd,yd,zd) as numpy array
+            rv: Position (x,y,z) as numpy array, shape (n, 3) for an array
+            vv: Velocity (xd,yd,zd) as numpy array, shape (n, 3) for an array
                 Units are depend on gravitational parameter (mu)
         """
         if not self._setOrb:
@@ -71,9 +82,10 @@ class TwoBodyOrbit:
         PV = self.evd
         QV = np.cross(self.hv, PV) / np.sqrt(np.dot(self.hv, self.hv))
         r = self.p / (1.0 + self.e * np.cos(ta))
-        rv = r * np.cos(ta) * PV + r * np.sin(ta) * QV
-        vv = np.sqrt(self.mu / self.p) * ((-1.0) * np.sin(ta) * PV + (self.e \
-            + np.cos(ta)) * QV)
+        rv = np.multiply.outer(r * np.cos(ta), PV) \
+            + np.multiply.outer(r * np.sin(ta), QV)
+        vv = np.sqrt(self.mu / self.p) * (np.multiply.outer((-1.0) \
+            * np.sin(ta), PV) + np.multiply.outer(self.e + np.cos(ta), QV))
         return rv, vv
 
     def __init__(self, bname, mname='Sun', mu=1.32712440041e20):
@@ -113,7 +125,8 @@ class TwoBodyOrbit:
         Exceptions:
             ValueError: when angular momentum is zero, the method raises
                 ValueError
-                        when e becomes 1.0, the method raises ValueError
+
+        A parabolic orbit (e = 1.0) has a = inf.
         """
         self.t0 = t
         self.pos = np.array(pos)
@@ -175,9 +188,9 @@ class TwoBodyOrbit:
         self.evd = ev_norm                      # normalized eccentricity vector
         self.e = np.sqrt(np.dot(ev, ev))        # eccentricity
         if self.e == 1.0:
-            self._setOrb = False
-            raise(ValueError('Inappropriate pos and vel in TwoBodyOrbit.setOrbCart'))
-        self.a = self.p / (1.0 - self.e ** 2)   # semi-major axis
+            self.a = math.inf                   # parabola
+        else:
+            self.a = self.p / (1.0 - self.e ** 2)   # semi-major axis
         self.i = np.arccos(h[2] / hlen)         # inclination (radians)
         self.ta0 = np.arctan2(np.dot(he_norm, r0), np.dot(ev_norm, r0))     # true anomaly at epoch
         if self.ta0 < 0.0:
@@ -194,13 +207,14 @@ class TwoBodyOrbit:
             self.mm = 2.0 * math.pi / self.pr                           # mean motion (rad/time)
         self.T = self.t0 - timef                                        # periapsis passage time
 
-    def setOrbKepl(self, epoch, a, e, i, LoAN, AoP, TA=None, T=None, MA=None):
+    def setOrbKepl(self, epoch, a, e, i, LoAN, AoP, TA=None, T=None, MA=None,
+                   q=None):
         """Define the orbit by classical orbital elements
         
         Args:
             epoch:   Epoch
-            a:       Semi-major axis
-            e:       Eccentricity (should not be 1.0)
+            a:       Semi-major axis. Ignored (can be None) if q is given
+            e:       Eccentricity
             i:       Inclination (degrees)
             LoAN:    longitude of ascending node (degrees)
                      If inclination is zero, this value defines reference
@@ -224,6 +238,9 @@ class TwoBodyOrbit:
                  TA, T, and MA are mutually exclusive arguments. You should 
                  specify one of them.  If TA is specified, other arguments 
                  will be ignored. If T is specified, MA will be ignored.
+            q:       Periapsis distance, in place of a. Needed for a
+                     parabolic orbit (e = 1.0), and more accurate than a
+                     near it. Comet elements are usually q, e and T
         
         Exceptions:
             ValueError: If classical orbital element(s) are inconsistent, the
@@ -239,16 +256,20 @@ class TwoBodyOrbit:
         
         if e < 0.0:
             raise ValueError('Invalid orbital element (e<0.0) in TwoBodyOrbit.setOrbKepl')
-        if e == 1.0:
-            raise ValueError('Invalid orbital element (e=1.0) in TwoBodyOrbit.setOrbKepl')
-        if (e > 1.0 and a >= 0.0) or (e < 1.0 and a <= 0.0):
+        if q is not None:
+            if q <= 0.0:
+                raise ValueError('Invalid orbital element (q<=0.0) in TwoBodyOrbit.setOrbKepl')
+            a = math.inf if e == 1.0 else q / (1.0 - e)
+        elif e == 1.0:
+            raise ValueError('Missing Orbital Element (q for e=1.0) in TwoBodyOrbit.setOrbKepl')
+        elif (e > 1.0 and a >= 0.0) or (e < 1.0 and a <= 0.0):
             raise ValueError('Invalid Orbital Element(s) (inconsistent e and a) in TwoBodyOrbit.setOrbKepl')
-        if e > 1.0 and TAoE is None and T is None:
+        if e >= 1.0 and TAoE is None and T is None:
             raise ValueError('Missing Orbital Element (TA or T) in TwoBodyOrbit.setOrbKepl')
         if TAoE is None and T is None and ma is None:
             raise ValueError('Missing Orbital Elements (TA, T, or MA) in TwoBodyOrbit.setOrbKepl')
         taError = False
-        if TAoE is not None and e > 1.0:
+        if TAoE is not None and e >= 1.0:
             mta = math.degrees(math.acos((-1.0) / e))
             if TAoE >= mta and TAoE <= 180.0:
                 taError = True
@@ -273,7 +294,7 @@ class TwoBodyOrbit:
         self._setOrb = True
 
         # semi-latus rectum        
-        self.p = a * (1.0 - e * e)
+        self.p = a * (1.0 - e * e) if q is None else q * (1.0 + e)
             
         # orbital period and mean motion
         if e < 1.0:
@@ -364,11 +385,17 @@ class TwoBodyOrbit:
             v = np.array([[(-1.0)*math.sin(self.ta0)], [math.cos(self.ta0)], [0.0]]) * math.sqrt(self.mu / self.a)
             self.vel = (np.dot(R, v).T)[0]
     
-    def points(self, ndata):
+    def points(self, ndata, start=None, stop=None):
         """Returns points on orbital trajectory for visualization
         
         Args:
             ndata: Number of points
+            start: Optional start of a time window. With stop, the points
+                cover the arc flown from start to stop (at most one
+                revolution), evenly spaced in true anomaly. Without them,
+                the points cover one revolution, or nearly the whole
+                trajectory if it is open
+            stop: Optional end of the time window
         Returns: xs, ys, zs, times
             xs: Array of x-coordinates (Numpy array)
             ys: Array of y-coordinates (Numpy array)
@@ -380,66 +407,101 @@ class TwoBodyOrbit:
         if not self._setOrb:
             raise(RuntimeError('Orbit has not been defined: TwoBodyOrbit.points'))
 
-        times = np.zeros(ndata)
-        xs = np.zeros(ndata)
-        ys = np.zeros(ndata)
-        zs = np.zeros(ndata)
-        tas = np.zeros(ndata)
-        
-        if self.e < 1.0:
-            tas =np.linspace(0.0, math.pi * 2.0, ndata)
+        if start is not None:
+            # True anomalies at both ends of the window
+            PV = self.evd
+            QV = np.cross(self.hv, PV) / np.sqrt(np.dot(self.hv, self.hv))
+            ends = []
+            for t in (start, stop):
+                pos, vel = self.posvelatt(t, precision='high')
+                ends.append(math.atan2(np.dot(pos, QV), np.dot(pos, PV)))
+            if self.e < 1.0:
+                if stop - start >= self.pr:
+                    ends[1] = ends[0] + math.pi * 2.0
+                else:
+                    ends[1] = ends[0] + (ends[1] - ends[0]) % (math.pi * 2.0)
+            tas = np.linspace(ends[0], ends[1], ndata)
+            tfs = self.timeFperi(tas)
+            if self.e < 1.0:
+                # Times from start, on the revolution that starts there
+                times = (tfs - tfs[0]) % self.pr
+                if ends[1] - ends[0] >= math.pi * 2.0:
+                    times[-1] = self.pr
+                times = times + start
+            else:
+                times = tfs + self.T
         else:
-            stop = math.pi - np.arccos(1.0 / self.e)
-            start = (-1.) * stop
-            delta = (stop - start) / (ndata + 1)
-            tas = np.linspace(start + delta, stop - delta, ndata)
-        for j in range(ndata):
-            ta =tas[j]
-            times[j] = self.timeFperi(ta) + self.T
-            xyz, xdydzd =self.posvel(ta)
-            xs[j] = xyz[0]
-            ys[j] = xyz[1]
-            zs[j] = xyz[2]
+            if self.e < 1.0:
+                tas = np.linspace(0.0, math.pi * 2.0, ndata)
+            else:
+                stop = math.pi - np.arccos(1.0 / self.e)
+                start = (-1.) * stop
+                delta = (stop - start) / (ndata + 1)
+                tas = np.linspace(start + delta, stop - delta, ndata)
+            times = self.timeFperi(tas) + self.T
+        xyz, xdydzd = self.posvel(tas)
         
-        return xs, ys, zs, times
+        return xyz[:, 0].copy(), xyz[:, 1].copy(), xyz[:, 2].copy(), times
 
-    def posvelatt(self, t):
+    def posvelatt(self, t, precision=None):
         """Returns position and velocity of the object at given t
         
         Args:
-            t: Time
+            t: Time, or array-like object of times
+            precision: Accuracy tier ('render', 'standard' or 'high'; see
+                twobodykernels.PRECISIONS). Default is the tier set by
+                twobodykernels.set_precision()
         Returns: newpos, newvel
             newpos: Position of the object at t (x,y,z) (Numpy array)
             newvel: Velocity of the object at t (xd,yd,zd) (Numpy array)
+                If t is an array of shape (k,), newpos and newvel are
+                arrays of shape (k, 3) computed by the kernel backend
+                The dtype is that of the tier (float32 for 'render')
         Exception:
             RuntimeError: If it failed to the computation, raises RuntimeError
             
             Origin of coordinates are position of the central body
         """
+        # scipy is imported on first use to keep this module cheap to import
+        from scipy.optimize import newton, bisect
+
+        # Near z = 0 (near-parabolic orbits, short arcs) the closed forms
+        # lose all accuracy; power series are used instead
         def _Cz(z):
-            if z < 0:
+            if z < (-1.0) * twobodykernels._SERIES_LIMIT:
                 return (1.0 - np.cosh(np.sqrt((-1)*z))) / z
-            else:
+            elif z > twobodykernels._SERIES_LIMIT:
                 return (1.0 - np.cos(np.sqrt(z))) / z
+            val = 0.0
+            for coef in reversed(twobodykernels._CCOEF):
+                val = val * (-z) + coef
+            return val
             
         def _Sz(z):
-            if z < 0:
+            if z < (-1.0) * twobodykernels._SERIES_LIMIT:
                 sqz = np.sqrt((-1)*z)
                 return (np.sinh(sqz) - sqz) / sqz ** 3
-            else:
+            elif z > twobodykernels._SERIES_LIMIT:
                 sqz = np.sqrt(z)
                 return (sqz - np.sin(sqz)) / sqz ** 3
+            val = 0.0
+            for coef in reversed(twobodykernels._SCOEF):
+                val = val * (-z) + coef
+            return val
+
+        # reciprocal of the semi-major axis; zero for a parabola
+        alpha = 1.0 / self.a
 
         def _func(xn, targett):
-            z = xn * xn / self.a
+            z = xn * xn * alpha
             sr = np.sqrt(np.dot(self.pos, self.pos))
             tn = (np.dot(self.pos, self.vel) / np.sqrt(self.mu) * xn * xn \
-                * _Cz(z) + (1.0 - sr / self.a) * xn ** 3 * _Sz(z) + sr * xn) \
+                * _Cz(z) + (1.0 - sr * alpha) * xn ** 3 * _Sz(z) + sr * xn) \
                 / np.sqrt(self.mu) - targett
             return tn
         
         def _fprime(x, targett):
-            z = x * x / self.a
+            z = x * x * alpha
             sqmu = np.sqrt(self.mu)
             sr = np.sqrt(np.dot(self.pos, self.pos))
             dtdx = (x * x * _Cz(z) + np.dot(self.pos, self.vel) / sqmu * x \
@@ -449,14 +511,53 @@ class TwoBodyOrbit:
         if not self._setOrb:
             raise(RuntimeError('Orbit has not been defined: TwoBodyOrbit.posvelatt'))
 
+        if np.ndim(t) > 0:
+            ts = np.asarray(t, dtype=float)
+            newpos, newvel = propagate([self], ts.reshape(1, -1),
+                                       precision=precision)
+            return newpos[0].reshape(ts.shape + (3,)), \
+                newvel[0].reshape(ts.shape + (3,))
+
+        settings = twobodykernels.precision_settings(precision)
+        dtype = settings['dtype']
         delta_t = (t - self.t0)
         if delta_t == 0.0:
-            return self.pos + 0.0, self.vel + 0.0
+            return self.pos.astype(dtype), self.vel.astype(dtype)
             # you should not return self.pos. it can cause trouble!
-        x0 = np.sqrt(self.mu) * delta_t / self.a
+        x0 = np.sqrt(self.mu) * delta_t * alpha
+        if settings['guess'] == twobodykernels.GUESS_KEPLER and self.e < 1.0:
+            # Start from a series solution of Kepler's equation
+            ecos0 = 1.0 - np.sqrt(np.dot(self.pos, self.pos)) / self.a
+            esin0 = np.dot(self.pos, self.vel) / np.sqrt(self.mu * self.a)
+            ea0 = math.atan2(esin0, ecos0)
+            ma = ea0 - esin0 + self.mm * delta_t
+            x0 = np.sqrt(self.a) * (ma + self.e * math.sin(ma) + 0.5
+                * self.e ** 2 * math.sin(2.0 * ma) - ea0)
+        sr = np.sqrt(np.dot(self.pos, self.pos))
+        if alpha < 0.0:
+            # Hyperbolic orbits start from the logarithmic estimate of the
+            # kernels; the linear one overflows cosh on long arcs
+            sgn = math.copysign(1.0, delta_t)
+            with np.errstate(all='ignore'):
+                xh = sgn * np.sqrt(-self.a) * np.log((-2.0) * self.mu * alpha
+                    * delta_t / (np.dot(self.pos, self.vel) + sgn
+                    * np.sqrt(-self.mu * self.a) * (1.0 - sr * alpha)))
+            if np.isfinite(xh):
+                x0 = xh
+        # Near the parabola, start from the parabola (as the kernels do)
+        xp = float(twobodykernels._parabolic_guess(sr, np.dot(self.pos,
+            self.vel) / np.sqrt(self.mu), np.sqrt(self.mu), delta_t))
+        limits = twobodykernels._PARABOLIC_LIMITS[settings['guess']]
+        if abs(alpha) * xp * xp < (limits[0] if alpha > 0.0 else limits[1]) \
+                and self.e >= twobodykernels._PARABOLIC_ECC:
+            x0 = xp
         try:
             # compute with scipy.optimize.newton
-            xn = newton(_func, x0, args=(delta_t,), fprime=_fprime)
+            # (newton needs a positive tol)
+            xn = newton(_func, x0, args=(delta_t,), fprime=_fprime,
+                        tol=max(settings['kepler_tol'], 1e-300),
+                        rtol=settings['kepler_rtol'],
+                        maxiter=settings['kepler_maxiter'])
         except RuntimeError:
             # Configure boundaries for scipy.optimize.bisect
             # b1: Lower boundary
@@ -492,8 +593,7 @@ class TwoBodyOrbit:
             # compute with scipy.optimize.bisect
             xn = bisect(_func, b1, b2, args=(delta_t,), maxiter=200)
             
-        z = xn * xn / self.a
-        sr = np.sqrt(np.dot(self.pos, self.pos))
+        z = xn * xn * alpha
         sqmu = np.sqrt(self.mu)
         val_f = 1.0 - xn * xn / sr * _Cz(z)
         val_g = delta_t - xn ** 3 / sqmu * _Sz(z)
@@ -502,7 +602,7 @@ class TwoBodyOrbit:
         val_fd = sqmu / sr / newr * xn * (z * _Sz(z) - 1.0)
         val_gd = 1.0 - xn * xn / newr * _Cz(z)
         newvel = self.pos * val_fd + self.vel * val_gd
-        return newpos, newvel
+        return newpos.astype(dtype, copy=False), newvel.astype(dtype, copy=False)
     
     def elmKepl(self):
         """Returns Classical orbital element
@@ -556,27 +656,32 @@ class TwoBodyOrbit:
             
         return kepl
 
-def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True):
+def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True,
+            precision=None):
     """A function to solve 'Lambert's Problem'
     
     From given initial position, terminal position, and flight time, 
     compute initial velocity and terminal velocity.
-    Args: ipos, tpos, targett, mu, ccw
+    Args: ipos, tpos, targett, mu, ccw, precision
         ipos: Initial position of the object (x,y,z) (array-like object)
         tpos: Terminal position of the object (x,y,z) (array-like object)
         targett: Flight time
         mu: Gravitational parameter of the central body (default value is for the Sun)
         ccw: Flag for orbital direction. If True, counter clockwise
+        precision: Accuracy tier (see twobodykernels.PRECISIONS). Default
+            is the tier set by twobodykernels.set_precision()
     Returns: ivel, tvel
         ivel: Initial velocity of the object (xd,yd,zd) as Numpy array
         tvel: Terminal velocity of the object (xd,yd,zd) as Numpy array
+            The dtype is that of the tier (float32 for 'render')
     Exception:
         ValueError: When input data (ipos, tpos, targett) are inappropriate,
                     the function raises ValueError
                     
         Origin of coordinates are position of the central body
     """
-    
+    from scipy.optimize import bisect
+
     def _Cz(z):
         if z < 0:
             return (1.0 - np.cosh(np.sqrt((-1)*z))) / z
@@ -668,7 +773,11 @@ def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True):
     if not found:
         raise(ValueError("Could not solve Lambert's Plobrem: pytwobodyorbit.lambert"))        
     
-    zn = bisect(_func, b1, b2, args=(tsec, r1pr2, A, mu), maxiter=100)
+    settings = twobodykernels.precision_settings(precision)
+    zn = bisect(_func, b1, b2, args=(tsec, r1pr2, A, mu),
+                xtol=settings['lambert_xtol'],
+                rtol=max(settings['lambert_rtol'], 4.0 * np.finfo(float).eps),
+                maxiter=settings['lambert_maxiter'])
 
     val_y = r1pr2 - A * (1.0 - zn * _Sz(zn)) / np.sqrt(_Cz(zn))
     val_f = 1.0 - val_y / r1
@@ -678,6 +787,124 @@ def lambert(ipos, tpos, targett, mu=1.32712440041e20, ccw=True):
     ivel = (stpos - val_f * sipos) / val_g
     tvel = (val_gd * stpos - sipos) / val_g
     
-    return ivel, tvel
+    return ivel.astype(settings['dtype'], copy=False), \
+        tvel.astype(settings['dtype'], copy=False)
 
-    
\ No newline at end of file
+    
+
+
+def stack_orbits(orbits):
+    """Returns epoch states of many objects as arrays
+    
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+    Returns: r0, v0, t0, mu
+        r0: Positions at epoch, Numpy array of shape (m, 3)
+        v0: Velocities at epoch, Numpy array of shape (m, 3)
+        t0: Epochs, Numpy array of shape (m,)
+        mu: Gravitational parameters, Numpy array of shape (m,)
+    Exception:
+        RuntimeError: If an orbit has not been defined, raises RuntimeError
+    """
+    if hasattr(orbits, 'states'):
+        # OrbitCatalog keeps its states in arrays already
+        return orbits.states()
+    for orbit in orbits:
+        if not orbit._setOrb:
+            raise(RuntimeError('Orbit has not been defined: pytwobodyorbit.stack_orbits'))
+    r0 = np.array([orbit.pos for orbit in orbits], dtype=float).reshape(-1, 3)
+    v0 = np.array([orbit.vel for orbit in orbits], dtype=float).reshape(-1, 3)
+    t0 = np.array([orbit.t0 for orbit in orbits], dtype=float)
+    mu = np.array([orbit.mu for orbit in orbits], dtype=float)
+    return r0, v0, t0, mu
+
+def propagate(orbits, t, stm=False, precision=None):
+    """Returns positions and velocities of many objects at many times
+    
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        t: Times. Scalar, array-like object of shape (k,) common to all 
+           objects, or array-like object of shape (m, k) for m objects
+        stm: If True, state transition matrices are returned as well
+        precision: Accuracy tier (see twobodykernels.PRECISIONS). Default
+            is the tier set by twobodykernels.set_precision()
+    Returns: pos, vel (, phi)
+        pos: Positions, Numpy array of shape (m, k, 3)
+        vel: Velocities, Numpy array of shape (m, k, 3)
+        phi: Only if stm is True. Partial derivatives of (pos, vel) with
+             respect to the state at epoch, Numpy array of shape (m, k, 6, 6)
+    Exception:
+        RuntimeError: If an orbit has not been defined, or if it failed to
+                      the computation, raises RuntimeError
+        
+        Origin of coordinates are position of the central body
+    """
+    r0, v0, t0, mu = stack_orbits(orbits)
+    ts = np.asarray(t, dtype=float)
+    if ts.ndim < 2:
+        ts = ts.reshape(1, -1)
+    dt = ts - t0[:, None]
+    if stm:
+        pos, vel, phi = twobodykernels.kepler_stm(r0, v0, mu, dt,
+                                                  precision=precision)
+    else:
+        pos, vel = twobodykernels.kepler(r0, v0, mu, dt, precision=precision)
+    if not (np.isfinite(pos).all() and np.isfinite(vel).all()):
+        raise(RuntimeError('Could not compute position and velocity: ' +
+                           'pytwobodyorbit.propagate'))
+    if stm:
+        return pos, vel, phi
+    return pos, vel
+
+def propagate_covariance(orbits, t, cov):
+    """Propagates covariances of the epoch states of many objects
+    
+    The covariance at t is phi cov phi^T, with the analytic state
+    transition matrices phi of propagate(); no extra propagation is needed.
+    Args:
+        orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        t: Times (see propagate)
+        cov: Covariance of (pos, vel) at epoch, array-like object of shape
+             (6, 6) common to all objects, or (m, 6, 6)
+    Returns: pos, vel, covt
+        pos: Positions, Numpy array of shape (m, k, 3)
+        vel: Velocities, Numpy array of shape (m, k, 3)
+        covt: Covariances at t, Numpy array of shape (m, k, 6, 6)
+    Exception:
+        ValueError: If the shape of cov is inappropriate, raises ValueError
+        RuntimeError: See propagate
+    """
+    cov = np.asarray(cov, dtype=float)
+    if cov.shape[-2:] != (6, 6) or cov.ndim not in (2, 3):
+        raise(ValueError('Covariance must have shape (6, 6) or (m, 6, 6): ' +
+                         'pytwobodyorbit.propagate_covariance'))
+    pos, vel, phi = propagate(orbits, t, stm=True)
+    if cov.ndim == 3:
+        cov = cov[:, None]
+    covt = phi @ cov @ np.swapaxes(phi, -1, -2)
+    return pos, vel, covt
+
+def lambert_batch(ipos, tpos, targett, mu=1.32712440041e20, ccw=True,
+                  precision=None):
+    """A function to solve many 'Lambert's Problems' at once
+    
+    Vectorized version of lambert().
+    Args: ipos, tpos, targett, mu, ccw, precision
+        ipos: Initial positions (n, 3) (array-like object)
+        tpos: Terminal positions (n, 3) (array-like object)
+        targett: Flight time(s), scalar or shape (n,)
+        mu: Gravitational parameter of the central body (default value is for the Sun)
+        ccw: Flag(s) for orbital direction. If True, counter clockwise
+        precision: Accuracy tier (see twobodykernels.PRECISIONS). Default
+            is the tier set by twobodykernels.set_precision()
+    Returns: ivel, tvel
+        ivel: Initial velocities (n, 3) as Numpy array
+        tvel: Terminal velocities (n, 3) as Numpy array
+            Rows for which lambert() would raise ValueError are NaN
+        
+        Origin of coordinates are position of the central body
+    """
+    ipos = np.asarray(ipos, dtype=float).reshape(-1, 3)
+    tpos = np.asarray(tpos, dtype=float).reshape(-1, 3)
+    return twobodykernels.lambert(ipos, tpos, targett, mu, ccw,
+                                  precision=precision)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Planet positions from time-dependent (secular) orbital elements
+
+Data/planets_keplerian_elements.csv holds the JPL approximate elements of
+the planets (Standish, "Keplerian Elements for Approximate Positions of the
+Major Planets", table 1, valid 1800 AD - 2050 AD): for each planet the
+values of a, e, I, L, long.peri. and long.node. at J2000 and their rates
+per Julian century. SecularElements evaluates these elements at any epoch
+for all planets at once and solves Kepler's equation on arrays, so a whole
+set of planets is placed in one call.
+
+Times are in seconds from MJD 0, the same convention as the TwoBodyOrbit
+objects in planets.py (t = mjd * 86400).
+"""
+
+from collections import OrderedDict
+import math
+import numpy as np
+
+from pytwobodyorbit import TwoBodyOrbit
+
+AU = 1.496e11                   # meters, as used by planets.py
+MJD_J2000 = 51544.5
+DAYS_PER_CENTURY = 36525.0
+
+
+def solve_kepler(ma, e, tol=1e-12, maxiter=30):
+    """Solves Kepler's equation E - e sin E = M for arrays
+
+    Args:
+        ma: Mean anomaly in radians (array-like object)
+        e: Eccentricity, 0 <= e < 1 (array-like object, broadcast with ma)
+        tol: Convergence tolerance in radians
+        maxiter: Maximum number of Newton iterations
+    Returns: ecc_anm
+        ecc_anm: Eccentric anomaly in radians (Numpy array)
+    """
+    ma = np.remainder(np.asarray(ma, dtype=float) + math.pi, math.pi * 2.0) \
+        - math.pi
+    e = np.asarray(e, dtype=float)
+    ecc_anm = ma + e * np.sin(ma)
+    for i in range(maxiter):
+        delta = (ecc_anm - e * np.sin(ecc_anm) - ma) \
+            / (1.0 - e * np.cos(ecc_anm))
+        ecc_anm = ecc_anm - delta
+        if np.all(np.abs(delta) <= tol):
+            break
+    return ecc_anm
+
+
+class SecularElements:
+    """Orbital elements of a set of bodies varying linearly with time
+
+    """
+    def __init__(self, names, elements, rates, mu=1.32712440041e20,
+                 cachesize=256):
+        """
+        Args:
+            names: Names of the bodies
+            elements: Array (n, 6) of a (AU), e, I (deg), L (deg),
+                longitude of periapsis (deg), longitude of ascending node
+                (deg) at J2000
+            rates: Array (n, 6) of the rates of the same elements per
+                Julian century
+            mu: Gravitational parameter of the central body
+            cachesize: Number of epochs whose states are kept
+        """
+        self.names = list(names)
+        self.elements = np.asarray(elements, dtype=float).reshape(-1, 6)
+        self.rates = np.asarray(rates, dtype=float).reshape(-1, 6)
+        self.mu = mu
+        self.cachesize = cachesize
+        self._cache = OrderedDict()
+
+    @classmethod
+    def from_csv(cls, filename, mu=1.32712440041e20):
+        """Reads elements and rates from a planets_keplerian_elements.csv
+
+        Args:
+            filename: Path of the file. Columns 1-6 are the elements at
+                J2000 and columns 7-12 their rates. Missing rates are zero
+            mu: Gravitational parameter of the central body
+        """
+        names = []
+        elements = []
+        rates = []
+        with open(filename, 'r') as f:
+            for line in f.readlines()[1:]:
+                row = line.strip('\n').split(',')
+                if not row[0]:
+                    continue
+                names.append(row[0])
+                elements.append([float(v) for v in row[1:7]])
+                rates.append([float(v) for v in row[7:13]] or [0.0] * 6)
+        return cls(names, elements, rates, mu)
+
+    def __len__(self):
+        return len(self.names)
+
+    def elements_at(self, t):
+        """Returns the elements of all bodies at times t
+
+        Args:
+            t: Time in seconds from MJD 0, scalar or array-like of shape (k,)
+        Returns: a, e, i, lan, parg, ma
+            Arrays of shape (n, k): semi-major axis (meters), eccentricity,
+            inclination, longitude of ascending node, argument of
+            periapsis and mean anomaly (radians)
+        """
+        cy = (np.atleast_1d(np.asarray(t, dtype=float)) / 86400.0
+              - MJD_J2000) / DAYS_PER_CENTURY
+        el = self.elements[:, :, None] + self.rates[:, :, None] * cy
+        a = el[:, 0] * AU
+        e = el[:, 1]
+        i = np.radians(el[:, 2])
+        lmean = np.radians(el[:, 3])
+        lperi = np.radians(el[:, 4])
+        lan = np.radians(el[:, 5])
+        return a, e, i, lan, lperi - lan, lmean - lperi
+
+    def _states(self, t):
+        a, e, i, lan, parg, ma = self.elements_at(t)
+        ecc_anm = solve_kepler(ma, e)
+        cos_e = np.cos(ecc_anm)
+        sin_e = np.sin(ecc_anm)
+        b_over_a = np.sqrt(1.0 - e * e)
+        # position and velocity in the orbital plane
+        xp = a * (cos_e - e)
+        yp = a * b_over_a * sin_e
+        edot = np.sqrt(self.mu / a ** 3) / (1.0 - e * cos_e)
+        vxp = (-1.0) * a * sin_e * edot
+        vyp = a * b_over_a * cos_e * edot
+        # rotate to the reference frame
+        cl, sl = np.cos(lan), np.sin(lan)
+        cw, sw = np.cos(parg), np.sin(parg)
+        ci, si = np.cos(i), np.sin(i)
+        px = cl * cw - sl * sw * ci
+        py = sl * cw + cl * sw * ci
+        pz = sw * si
+        qx = (-1.0) * cl * sw - sl * cw * ci
+        qy = (-1.0) * sl * sw + cl * cw * ci
+        qz = cw * si
+        pos = np.stack([px * xp + qx * yp, py * xp + qy * yp,
+                        pz * xp + qz * yp], axis=-1)
+        vel = np.stack([px * vxp + qx * vyp, py * vxp + qy * vyp,
+                        pz * vxp + qz * vyp], axis=-1)
+        return pos, vel
+
+    def posvelatt(self, t):
+        """Returns positions and velocities of all bodies at t
+
+        Args:
+            t: Time in seconds from MJD 0, scalar or array-like of shape (k,)
+        Returns: pos, vel
+            pos: Positions, Numpy array of shape (n, 3) for a scalar t, or
+                 (n, k, 3) for an array of times
+            vel: Velocities, same shape as pos
+
+            States for scalar t are cached per epoch. Origin of coordinates
+            is the central body
+        """
+        if np.ndim(t) > 0:
+            return self._states(t)
+        key = float(t)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+        else:
+            pos, vel = self._states(key)
+            self._cache[key] = (pos[:, 0], vel[:, 0])
+            if len(self._cache) > self.cachesize:
+                self._cache.popitem(last=False)
+        pos, vel = self._cache[key]
+        return pos.copy(), vel.copy()
+
+    def orbit(self, index, t, bname=None):
+        """Returns the osculating TwoBodyOrbit of one body at epoch t
+
+        Args:
+            index: Index of the body
+            t: Epoch in seconds from MJD 0
+            bname: Name given to the orbit. Default is the catalog name
+        Returns: orbit
+            orbit: TwoBodyOrbit defined by the elements at t
+        """
+        a, e, i, lan, parg, ma = [v[index, 0] for v in self.elements_at(t)]
+        orbit = TwoBodyOrbit(bname or self.names[index], mu=self.mu)
+        orbit.setOrbKepl(t, a, e, math.degrees(i), math.degrees(lan),
+                         math.degrees(parg), MA=math.degrees(ma))
+        return orbit
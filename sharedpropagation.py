@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Multi-process propagation of large orbit catalogs
+
+PropagationExecutor shards a catalog of epoch states across a process pool.
+Element arrays and the output state buffer live in
+multiprocessing.shared_memory blocks; the tasks sent to the workers only
+carry block names and index ranges, so no large array is ever pickled.
+
+Run this module to measure scaling efficiency from 1 to N processes:
+  python sharedpropagation.py [number of orbits] [number of epochs]
+"""
+
+import os
+import sys
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits
+
+
+def _worker_init():
+    # One kernel thread per process; parallelism comes from the pool
+    twobodykernels.set_num_threads(1)
+
+
+def process_pool(processes, initializer=_worker_init):
+    """Returns a process pool whose workers are not forked from this process
+
+    Once a parallel numba kernel has run, its threading layer (e.g. TBB)
+    does not survive a fork: a pool of forked workers leaves the process
+    hanging at exit. Workers are started by a forkserver where there is
+    one, else spawned; either way they import the modules afresh.
+
+    Args:
+        processes: Number of worker processes
+        initializer: Function run in each worker at start. Default limits
+            the kernels to one thread per worker
+    Returns: pool
+        pool: multiprocessing.pool.Pool
+    """
+    method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() \
+        else 'spawn'
+    return mp.get_context(method).Pool(processes, initializer=initializer)
+
+
+def _attach(name):
+    # Only the parent unlinks the blocks
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _propagate_shard(spec, start, stop):
+    """Propagates orbits [start, stop) of the shared catalog described by spec
+    """
+    m, k = spec['m'], spec['k']
+    shapes = {'r0': (m, 3), 'v0': (m, 3), 't0': (m,), 'mu': (m,), 't': (k,),
+              'pos': (m, k, 3), 'vel': (m, k, 3)}
+    blocks = {key: _attach(spec[key]) for key in shapes}
+    try:
+        arr = {key: np.ndarray(shape, dtype=float, buffer=blocks[key].buf)
+               for key, shape in shapes.items()}
+        dt = arr['t'][None, :] - arr['t0'][start:stop, None]
+        pos, vel = twobodykernels.kepler(arr['r0'][start:stop],
+                                         arr['v0'][start:stop],
+                                         arr['mu'][start:stop], dt)
+        arr['pos'][start:stop] = pos
+        arr['vel'][start:stop] = vel
+        del arr
+    finally:
+        for shm in blocks.values():
+            shm.close()
+    return stop - start
+
+
+class PropagationExecutor:
+    """A process pool that propagates orbit catalogs in shards
+
+    """
+    def __init__(self, processes=None, chunksize=None):
+        """
+        Args:
+            processes: Number of worker processes. Default is os.cpu_count()
+            chunksize: Number of orbits per task. Default splits the catalog
+                into four tasks per process
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Terminates the worker processes
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = process_pool(self.processes)
+        return self._pool
+
+    def _shards(self, m):
+        chunk = self.chunksize
+        if chunk is None:
+            chunk = max(1, -(-m // (self.processes * 4)))
+        return [(i, min(i + chunk, m)) for i in range(0, m, chunk)]
+
+    def propagate(self, r0, v0, t0, mu, t):
+        """Returns positions and velocities of m objects at k common times
+
+        Args:
+            r0: Positions at epoch, shape (m, 3)
+            v0: Velocities at epoch, shape (m, 3)
+            t0: Epochs, shape (m,)
+            mu: Gravitational parameter, scalar or shape (m,)
+            t: Times, shape (k,)
+        Returns: pos, vel
+            pos: Positions, Numpy array of shape (m, k, 3)
+            vel: Velocities, Numpy array of shape (m, k, 3)
+        """
+        r0 = np.asarray(r0, dtype=float).reshape(-1, 3)
+        m = r0.shape[0]
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        k = t.shape[0]
+        inputs = {'r0': r0,
+                  'v0': np.asarray(v0, dtype=float).reshape(-1, 3),
+                  't0': np.broadcast_to(np.asarray(t0, dtype=float), (m,)),
+                  'mu': np.broadcast_to(np.asarray(mu, dtype=float), (m,)),
+                  't': t}
+        blocks = []
+        spec = {'m': m, 'k': k}
+        try:
+            for key, arr in inputs.items():
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(arr.nbytes, 1))
+                blocks.append(shm)
+                np.ndarray(arr.shape, dtype=float, buffer=shm.buf)[...] = arr
+                spec[key] = shm.name
+            for key in ('pos', 'vel'):
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(m * k * 3 * 8, 1))
+                blocks.append(shm)
+                spec[key] = shm.name
+
+            pool = self._get_pool()
+            tasks = [(spec, start, stop) for start, stop in self._shards(m)]
+            pool.starmap(_propagate_shard, tasks, chunksize=1)
+
+            pos = np.ndarray((m, k, 3), dtype=float,
+                             buffer=blocks[-2].buf).copy()
+            vel = np.ndarray((m, k, 3), dtype=float,
+                             buffer=blocks[-1].buf).copy()
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+        if not (np.isfinite(pos).all() and np.isfinite(vel).all()):
+            raise(RuntimeError('Could not compute position and velocity: ' +
+                               'PropagationExecutor.propagate'))
+        return pos, vel
+
+    def propagate_orbits(self, orbits, t):
+        """Returns positions and velocities of TwoBodyOrbit objects
+
+        Args:
+            orbits: Sequence of TwoBodyOrbit objects
+            t: Times, shape (k,)
+        Returns: pos, vel
+            pos: Positions, Numpy array of shape (m, k, 3)
+            vel: Velocities, Numpy array of shape (m, k, 3)
+        """
+        r0, v0, t0, mu = stack_orbits(orbits)
+        return self.propagate(r0, v0, t0, mu, t)
+
+
+def scaling(r0, v0, t0, mu, t, processes=None, chunksize=None, repeat=3):
+    """Measures scaling efficiency of PropagationExecutor
+
+    Args:
+        r0, v0, t0, mu, t: Catalog and times as in PropagationExecutor.propagate
+        processes: Largest number of processes. Default is os.cpu_count()
+        chunksize: Number of orbits per task
+        repeat: Number of timed runs per process count (best is kept)
+    Returns: rows
+        rows: List of (processes, seconds, states per second, speedup,
+              efficiency) tuples for 1 to processes workers
+    """
+    nmax = processes or os.cpu_count() or 1
+    r0 = np.asarray(r0, dtype=float).reshape(-1, 3)
+    v0 = np.asarray(v0, dtype=float).reshape(-1, 3)
+    m = r0.shape[0]
+    t0 = np.broadcast_to(np.asarray(t0, dtype=float), (m,))
+    mu = np.broadcast_to(np.asarray(mu, dtype=float), (m,))
+    nstates = m * np.size(t)
+    rows = []
+    base = None
+    for n in range(1, nmax + 1):
+        with PropagationExecutor(n, chunksize) as executor:
+            # Start the workers and compile the kernels before timing
+            w = min(m, 64 * n)
+            executor.propagate(r0[:w], v0[:w], t0[:w], mu[:w], t)
+            best = float('inf')
+            for i in range(repeat):
+                start = time.perf_counter()
+                executor.propagate(r0, v0, t0, mu, t)
+                best = min(best, time.perf_counter() - start)
+        if base is None:
+            base = best
+        speedup = base / best
+        rows.append((n, best, nstates / best, speedup, speedup / n))
+    return rows
+
+
+def _synthetic_catalog(m, seed=0):
+    """Returns epoch states of m random main-belt like orbits
+    """
+    mu = 1.32712440041e20
+    rng = np.random.default_rng(seed)
+    rlen = rng.uniform(2.1, 3.3, m) * 1.496e11
+    direction = rng.normal(size=(m, 3)) * np.array([1.0, 1.0, 0.1])
+    direction /= np.linalg.norm(direction, axis=1)[:, None]
+    r0 = direction * rlen[:, None]
+    tangent = np.cross(np.array([0.0, 0.0, 1.0]), direction)
+    tangent /= np.linalg.norm(tangent, axis=1)[:, None]
+    v0 = tangent * (np.sqrt(mu / rlen) * rng.uniform(0.9, 1.1, m))[:, None]
+    return r0, v0, np.full(m, 59200 * 86400.0), mu
+
+
+if __name__ == '__main__':
+    m = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    r0, v0, t0, mu = _synthetic_catalog(m)
+    t = t0[0] + np.linspace(0.0, 3650.0, k) * 86400
+    print('backend: {}, orbits: {}, epochs: {}'.format(
+        twobodykernels.get_backend(), m, k))
+    print('procs  seconds  states/s  speedup  efficiency')
+    for n, sec, rate, speedup, eff in scaling(r0, v0, t0, mu, t):
+        print('{:5d}  {:7.3f}  {:8.3g}  {:7.2f}  {:10.2f}'.format(
+            n, sec, rate, speedup, eff))
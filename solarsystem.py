@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""GUI-free model of the bodies shown by the viewer
+
+Time conversion, the Planet, Asteroid and Moon records read from the
+files in Data/, and the orbits built from them. Nothing here imports VTK or
+Qt (or SciPy), so batch jobs can use it without the viewer's start-up cost.
+"""
+
+import math
+import numpy as np
+
+from ephemeris import OBLIQUITY_J2000
+from pytwobodyorbit import TwoBodyOrbit
+
+sunmu = 1.32712440041e20
+
+
+#taken from https://gist.github.com/jiffyclub/1294443
+def date_to_mjd(year,month,day):
+    """
+    Convert a date to Julian Day.
+    
+    Algorithm from 'Practical Astronomy with your Calculator or Spreadsheet', 
+        4th ed., Duffet-Smith and Zwart, 2011.
+    
+    Parameters
+    ----------
+    year : int
+        Year as integer. Years preceding 1 A.D. should be 0 or negative.
+        The year before 1 A.D. is 0, 10 B.C. is year -9.
+        
+    month : int
+        Month as integer, Jan = 1, Feb. = 2, etc.
+    
+    day : float
+        Day, may contain fractional part.
+    
+    Returns
+    -------
+    jd : float
+        Julian Day
+        
+    Examples
+    --------
+    Convert 6 a.m., February 17, 1985 to Julian Day
+    
+    >>> date_to_jd(1985,2,17.25)
+    2446113.75
+    
+    """
+    if month == 1 or month == 2:
+        yearp = year - 1
+        monthp = month + 12
+    else:
+        yearp = year
+        monthp = month
+    
+    # this checks where we are in relation to October 15, 1582, the beginning
+    # of the Gregorian calendar.
+    if ((year < 1582) or
+        (year == 1582 and month < 10) or
+        (year == 1582 and month == 10 and day < 15)):
+        # before start of Gregorian calendar
+        B = 0
+    else:
+        # after start of Gregorian calendar
+        A = math.trunc(yearp / 100.)
+        B = 2 - A + math.trunc(A / 4.)
+        
+    if yearp < 0:
+        C = math.trunc((365.25 * yearp) - 0.75)
+    else:
+        C = math.trunc(365.25 * yearp)
+    D = math.trunc(30.6001 * (monthp + 1))
+    jd = B + C + D + day + 1720994.5
+    return jd - 2400000.5
+
+
+class Planet():
+    def __init__(self, physical_array, kepler_array):
+        self.name = physical_array[0]
+        self.orbit_name = kepler_array[0] #name in the elements file (EM Bary for the Earth)
+        self.equatorial_radius = float(physical_array[1]) *1000 #change km to meters
+        self.mean_radius = float(physical_array[2]) *1000 #change km to meters
+        self.texture_file = physical_array[11]
+        self.a = float(kepler_array[1])*1.496e11 #change au to meters
+        self.e = float(kepler_array[2])
+        self.i = float(kepler_array[3])
+        self.l = float(kepler_array[4])
+        self.long_peri = float(kepler_array[5])
+        self.long_node = float(kepler_array[6])
+        #rates per Julian century, zero if the file has none
+        rates = [float(v) for v in kepler_array[7:13]] or [0.0] * 6
+        self.a_rate = rates[0]*1.496e11 #change au to meters
+        self.e_rate = rates[1]
+        self.i_rate = rates[2]
+        self.l_rate = rates[3]
+        self.long_peri_rate = rates[4]
+        self.long_node_rate = rates[5]
+
+
+class Asteroid():
+    def __init__(self, physical_array, kepler_array):
+        self.name = physical_array[0]
+        self.diameter = float(physical_array[3])*1000 #change km to meters
+        self.texture_file = physical_array[7]
+        self.epoch = int(kepler_array[2])
+        self.a = float(kepler_array[3])*1.496e11 #change au to meters
+        self.e = float(kepler_array[4])
+        self.i = float(kepler_array[5])
+        self.w = float(kepler_array[6])
+        self.node = float(kepler_array[7])
+        self.m = float(kepler_array[8])
+
+
+class Moon():
+    def __init__(self, physical_array, kepler_array):
+        self.name = physical_array[0]
+        self.mean_radius = float(physical_array[1])*1000 #change km to meters
+        self.gm = float(physical_array[2])*1e9 #change km^3/s^2 to m^3/s^2
+        self.texture_file = physical_array[3]
+        self.parent = kepler_array[1]
+        self.epoch = float(kepler_array[2])
+        self.a = float(kepler_array[3])*1000 #change km to meters
+        self.e = float(kepler_array[4])
+        self.i = float(kepler_array[5])
+        self.w = float(kepler_array[6])
+        self.node = float(kepler_array[7])
+        self.m = float(kepler_array[8])
+        #pole (RA, Dec) of the reference plane; None for the ecliptic
+        self.pole = (float(kepler_array[9]), float(kepler_array[10])) if kepler_array[9] else None
+        self.parent_gm = float(kepler_array[11])*1e9 #change km^3/s^2 to m^3/s^2
+
+
+def _read_rows(filename):
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        return [line.strip('\n').split(',') for line in f.readlines()[1:]
+                if line.strip()]
+
+
+def read_planets(physical='Data/planets_physical_characteristics.csv',
+                 keplerian='Data/planets_keplerian_elements.csv'):
+    """Returns the list of Planet records of the two planet files
+    """
+    return [Planet(p, k) for p, k in zip(_read_rows(physical),
+                                         _read_rows(keplerian))]
+
+
+def read_asteroids(physical='Data/asteroids_physical_characteristics.csv',
+                   keplerian='Data/asteroids_keplerian_elements.csv'):
+    """Returns the list of Asteroid records of the two asteroid files
+    """
+    return [Asteroid(a, k) for a, k in zip(_read_rows(physical),
+                                           _read_rows(keplerian))]
+
+
+def read_moons(physical='Data/moons_physical_characteristics.csv',
+               keplerian='Data/moons_keplerian_elements.csv'):
+    """Returns the list of Moon records of the two moon files
+    """
+    return [Moon(p, k) for p, k in zip(_read_rows(physical),
+                                       _read_rows(keplerian))]
+
+
+def plane_to_ecliptic(ra, dec):
+    """Returns the rotation from a reference plane to the ecliptic
+
+    The plane is given by its pole (RA, Dec in degrees, J2000 equator);
+    its x axis is the ascending node of the plane on the equator, as for
+    the Laplace-plane elements of planetary satellites.
+
+    Returns: rot
+        rot: Numpy array (3, 3); ecliptic vector = rot @ plane vector
+    """
+    ra = math.radians(ra)
+    dec = math.radians(dec)
+    zaxis = np.array([math.cos(dec) * math.cos(ra),
+                      math.cos(dec) * math.sin(ra), math.sin(dec)])
+    xaxis = np.array([(-1.0) * math.sin(ra), math.cos(ra), 0.0])
+    yaxis = np.cross(zaxis, xaxis)
+    c = math.cos(OBLIQUITY_J2000)
+    s = math.sin(OBLIQUITY_J2000)
+    equatorial_to_ecliptic = np.array([[1.0, 0.0, 0.0], [0.0, c, s],
+                                       [0.0, (-1.0) * s, c]])
+    return equatorial_to_ecliptic @ np.stack([xaxis, yaxis, zaxis], axis=1)
+
+
+def moon_orbit(moon):
+    """Returns the TwoBodyOrbit of a Moon record about its parent
+
+    Args:
+        moon: Moon
+    Returns: orbit
+        orbit: TwoBodyOrbit with mname set to the parent body, in ecliptic
+            coordinates relative to the parent
+    """
+    orbit = TwoBodyOrbit(moon.name, mname=moon.parent,
+                         mu=moon.parent_gm + moon.gm)
+    orbit.setOrbKepl(moon.epoch * 86400, moon.a, moon.e, moon.i, moon.node,
+                     moon.w, MA=moon.m)
+    if moon.pole is not None:
+        rot = plane_to_ecliptic(*moon.pole)
+        orbit.setOrbCart(orbit.t0, rot @ orbit.pos, rot @ orbit.vel)
+    return orbit
+
+
+def asteroid_orbit(asteroid, mu=sunmu):
+    """Returns the TwoBodyOrbit of an Asteroid record
+
+    Args:
+        asteroid: Asteroid
+        mu: Gravitational parameter of the Sun
+    Returns: orbit
+        orbit: TwoBodyOrbit osculating at the epoch of the record
+    """
+    orbit = TwoBodyOrbit(asteroid.name, mu=mu)
+    orbit.setOrbKepl(asteroid.epoch * 86400, asteroid.a, asteroid.e,
+                     asteroid.i, asteroid.node, asteroid.w, asteroid.m)
+    return orbit
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Start-up time benchmark of the batch modules
+
+Imports each module in a fresh interpreter, several times, and reports the
+median import time and the heavy packages (SciPy, numba, VTK, Qt, pyarrow)
+that the import pulled in. The batch modules should import none of them;
+they are loaded on first use.
+
+Run:
+  python startupbench.py [--repeat 5] [--max-ms MS] [--detail MODULE]
+      [module ...]
+With --max-ms the exit status is 1 if a module is slower than MS or loads
+a heavy package. --detail prints the slowest imports of one module
+(python -X importtime).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import numpy as np
+
+MODULES = ('solarsystem', 'pytwobodyorbit', 'twobodykernels',
+           'orbitcatalog', 'secularelements', 'ephemeris', 'orbitevents',
+           'closeapproach', 'visibility', 'bodypicker', 'ephemerisexport',
+           'ephemerisservice', 'ensemble', 'orbitdetermination',
+           'trajectorysearch', 'porkchop', 'trails', 'catalogreload',
+           'comets', 'densitygrid')
+
+HEAVY = ('scipy', 'numba', 'vtk', 'PyQt5', 'pyarrow')
+
+_PROBE = """import sys, time
+start = time.perf_counter()
+import {0}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {1!r} if m in sys.modules]
+print(elapsed, ','.join(heavy))
+"""
+
+
+def _run(code, *flags):
+    here = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.run([sys.executable] + list(flags) + ['-c', code],
+                          cwd=here, capture_output=True, text=True,
+                          check=True)
+
+
+def import_time(module, repeat=5):
+    """Measures the import of a module in fresh interpreters
+
+    Args:
+        module: Module name
+        repeat: Number of interpreters
+    Returns: seconds, heavy
+        seconds: Median import time
+        heavy: List of heavy packages loaded by the import
+    """
+    times = []
+    heavy = []
+    for k in range(repeat):
+        out = _run(_PROBE.format(module, HEAVY)).stdout.split()
+        times.append(float(out[0]))
+        heavy = out[1].split(',') if len(out) > 1 else []
+    return float(np.median(times)), heavy
+
+
+def import_detail(module, count=15):
+    """Returns the slowest imports of a module as (microseconds, name)
+
+    Cumulative times reported by python -X importtime.
+    """
+    rows = []
+    for line in _run('import ' + module, '-X', 'importtime').stderr \
+            .splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time benchmark')
+    parser.add_argument('modules', nargs='*', default=list(MODULES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail if an import is slower (milliseconds)')
+    parser.add_argument('--detail', type=str, default=None,
+                        help='Print the slowest imports of a module')
+    args = parser.parse_args()
+    if args.detail:
+        for usec, name in import_detail(args.detail):
+            print('{:9.1f} ms  {}'.format(usec / 1000.0, name))
+        sys.exit(0)
+
+    base, heavy = import_time('numpy', args.repeat)
+    print('numpy (baseline)    {:7.1f} ms'.format(base * 1000.0))
+    failed = False
+    for module in args.modules:
+        seconds, heavy = import_time(module, args.repeat)
+        slow = args.max_ms is not None and seconds * 1000.0 > args.max_ms
+        if args.max_ms is not None and (slow or heavy):
+            failed = True
+        print('{:18s}  {:7.1f} ms  {}{}'.format(
+            module, seconds * 1000.0,
+            'loads ' + ', '.join(heavy) if heavy else '',
+            '  SLOW' if slow else ''))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository and read Data/ relative to it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def _repository_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture(params=('numpy', 'numba'))
+def backend(request):
+    """Runs a test once per kernel backend that can be used here"""
+    import twobodykernels
+    if request.param not in twobodykernels.BACKENDS:
+        pytest.skip('backend {} is not available'.format(request.param))
+    previous = twobodykernels.get_backend()
+    twobodykernels.set_backend(request.param)
+    yield request.param
+    twobodykernels.set_backend(previous)
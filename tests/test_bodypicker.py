@@ -0,0 +1,84 @@
+"""Incremental updates of the body picker against a fresh index"""
+
+import numpy as np
+import pytest
+
+from bodypicker import BodyPicker
+
+
+class Bodies:
+    # Bodies in straight-line motion, edited like a catalog
+    def __init__(self, rng, m):
+        self.rng = rng
+        self.pos = np.zeros((0, 3))
+        self.vel = np.zeros((0, 3))
+        self.extend(m)
+
+    def _draw(self, m):
+        return self.rng.normal(size=(m, 3)) * 1.0e11, \
+            self.rng.normal(size=(m, 3)) * 1.0e4
+
+    def locate(self, index, t):
+        return self.pos[index] + self.vel[index] * t
+
+    def vmax(self, index=slice(None)):
+        return np.sqrt((self.vel[index] ** 2).sum(axis=1))
+
+    def extend(self, m):
+        pos, vel = self._draw(m)
+        self.pos = np.concatenate([self.pos, pos])
+        self.vel = np.concatenate([self.vel, vel])
+
+    def replace(self, index):
+        self.pos[index], self.vel[index] = self._draw(len(index))
+
+    def delete(self, index):
+        self.pos = np.delete(self.pos, index, axis=0)
+        self.vel = np.delete(self.vel, index, axis=0)
+
+
+def _rays(rng, bodies, t, n=200):
+    eye = np.array([0.0, -5.0e11, 3.0e11])
+    targets = bodies.locate(rng.integers(len(bodies.pos), size=n), t)
+    return eye, targets - eye + rng.normal(size=(n, 3)) * 1.0e8
+
+
+@pytest.mark.parametrize('t', [0.0, 1.0e5])
+def test_updates_match_a_fresh_picker(t):
+    rng = np.random.default_rng(0)
+    bodies = Bodies(rng, 2000)
+    picker = BodyPicker(bodies.locate, bodies.vmax(), max_loose=10 ** 6)
+    picker.set_time(0.0)
+    changed = rng.choice(2000, 50, replace=False)
+    bodies.replace(changed)
+    picker.replace(changed, bodies.vmax(changed))
+    removed = rng.choice(2000, 80, replace=False)
+    bodies.delete(removed)
+    picker.delete(removed)
+    bodies.extend(30)
+    picker.extend(bodies.vmax(slice(-30, None)))
+    assert len(picker) == len(bodies.pos)
+
+    picker.set_time(t)
+    assert picker.rebuilds == 1
+    fresh = BodyPicker(bodies.locate, bodies.vmax())
+    fresh.set_time(t)
+    eye, directions = _rays(rng, bodies, t)
+    for direction in directions:
+        assert picker.pick(eye, direction, 1.0e-3) == \
+            fresh.pick(eye, direction, 1.0e-3)
+
+
+def test_rebuild_after_many_changes():
+    rng = np.random.default_rng(1)
+    bodies = Bodies(rng, 500)
+    picker = BodyPicker(bodies.locate, bodies.vmax(), max_loose=20)
+    picker.set_time(0.0)
+    bodies.extend(10)
+    picker.extend(bodies.vmax(slice(-10, None)))
+    picker.set_time(0.0)
+    assert picker.rebuilds == 1
+    bodies.replace(np.arange(30))
+    picker.replace(np.arange(30), bodies.vmax(np.arange(30)))
+    picker.set_time(0.0)
+    assert picker.rebuilds == 2 and not picker.loose.any()
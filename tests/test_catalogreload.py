@@ -0,0 +1,102 @@
+"""Catalog diffs and the incremental updates of the bodies they change"""
+
+import numpy as np
+
+from catalogreload import diff_catalog
+from ensemble import CloneEnsemble
+from pytwobodyorbit import TwoBodyOrbit
+from trails import TrailBuffer
+
+AU = 1.496e11
+
+OLD = {'Ceres': (['Ceres', '939.4'], ['1', 'Ceres', '2.766']),
+       'Pallas': (['Pallas', '512.0'], ['2', 'Pallas', '2.774']),
+       'Vesta': (['Vesta', '525.4'], ['4', 'Vesta', '2.362'])}
+
+
+def test_added():
+    new = dict(OLD, Hygiea=(['Hygiea', '434.0'], ['10', 'Hygiea', '3.142']))
+    assert diff_catalog(OLD, new) == (['Hygiea'], [], [])
+
+
+def test_removed():
+    new = {name: OLD[name] for name in ('Ceres', 'Vesta')}
+    assert diff_catalog(OLD, new) == ([], ['Pallas'], [])
+
+
+def test_modified():
+    new = dict(OLD, Vesta=(['Vesta', '525.4'], ['4', 'Vesta', '2.400']),
+               Ceres=(['Ceres', '940.0'], ['1', 'Ceres', '2.766']))
+    assert diff_catalog(OLD, new) == ([], [], ['Ceres', 'Vesta'])
+
+
+def test_renamed():
+    # A body is known by its name: a rename is a removal and an addition
+    p, k = OLD['Pallas']
+    new = {'Ceres': OLD['Ceres'], 'Pallas II': (['Pallas II'] + p[1:], k),
+           'Vesta': OLD['Vesta']}
+    assert diff_catalog(OLD, new) == (['Pallas II'], ['Pallas'], [])
+
+
+def test_unchanged():
+    assert diff_catalog(OLD, dict(OLD)) == ([], [], [])
+
+
+def _orbits(names):
+    orbits = []
+    for k, name in enumerate(names):
+        orbit = TwoBodyOrbit(name)
+        orbit.setOrbKepl(0.0, (1.0 + 0.1 * k) * AU, 0.1, 5.0, 10.0 * k,
+                         20.0, MA=30.0 * k)
+        orbits.append(orbit)
+    return orbits
+
+
+def test_clone_updates_match_a_fresh_ensemble():
+    sigmas = [1.0e6, 1.0e-6, 1.0e-5, 1.0e-5, 1.0e-4, 1.0e-4]
+    orbits = _orbits('abcdef')
+    clones = CloneEnsemble.from_elements(orbits[:4], sigmas, 20, seed=0)
+    # Replace b by e, remove a and c, append f
+    clones.replace([1], CloneEnsemble.from_elements([orbits[4]], sigmas, 20,
+                                                    seed=1))
+    clones.delete([0, 2])
+    clones.extend(CloneEnsemble.from_elements([orbits[5]], sigmas, 20,
+                                              seed=2))
+    assert clones.m == 3 and len(clones) == 60 and clones.names == list('edf')
+    # d keeps its clones, object 3 of the first sample
+    first = CloneEnsemble.from_elements(orbits[:4], sigmas, 20, seed=0)
+    first.delete([0, 1, 2])
+    fresh = [CloneEnsemble.from_elements([orbits[4]], sigmas, 20, seed=1),
+             first,
+             CloneEnsemble.from_elements([orbits[5]], sigmas, 20, seed=2)]
+    for name in ('r0', 'v0', 't0', 'mu'):
+        assert (getattr(clones, name) == np.concatenate(
+            [getattr(f, name) for f in fresh])).all()
+    for k in range(4):
+        assert (clones.nominal[k] == np.concatenate(
+            [f.nominal[k] for f in fresh])).all()
+
+
+def test_trail_updates_keep_the_bands():
+    rng = np.random.default_rng(0)
+    trails = TrailBuffer(4, 8)
+    for k in range(11):
+        trails.append(rng.normal(size=(4, 3)))
+    before = trails.points.copy().reshape(4, 16, 3)
+    ages = trails.stamps.reshape(4, 16) - np.arange(4)[:, None] * 8
+    trails.delete([0, 2])
+    trails.extend(np.array([[1.0, 2.0, 3.0]]))
+    assert len(trails) == 3 and trails.points.shape == (3 * 16, 3)
+    points = trails.points.reshape(3, 16, 3)
+    assert (points[:2] == before[[1, 3]]).all()
+    assert (points[2] == np.array([1.0, 2.0, 3.0], dtype=np.float32)).all()
+    # The kept trails have the same ages in their new bands
+    stamps = trails.stamps.reshape(3, 16)
+    assert (stamps[:2] - np.arange(2)[:, None] * 8 == ages[[1, 3]]).all()
+    low, high = trails.scalar_range()
+    band = np.floor((stamps - low) / 8)
+    assert (band == np.arange(3)[:, None]).all()
+    # Samples go on in place
+    trails.append(rng.normal(size=(3, 3)))
+    assert (np.floor((trails.stamps.reshape(3, 16) - trails.scalar_range()[0])
+                     / 8) == np.arange(3)[:, None]).all()
@@ -0,0 +1,156 @@
+"""MOIDs and close approaches against brute-force scans of the orbits"""
+
+import itertools
+
+import numpy as np
+import pytest
+
+from closeapproach import close_approaches, moid, moid_batch
+from pytwobodyorbit import TwoBodyOrbit
+
+AU = 1.496e11
+DAY = 86400.0
+
+
+def _kepl(name, a, e, i, node, peri, ma):
+    orbit = TwoBodyOrbit(name)
+    orbit.setOrbKepl(0.0, a, e, i, node, peri, MA=ma)
+    return orbit
+
+
+def _cart(name, t, pos, vel):
+    orbit = TwoBodyOrbit(name)
+    orbit.setOrbCart(t, pos, vel)
+    return orbit
+
+
+def _crossing(orbit, name, t, dpos, dvel):
+    # An orbit through (or dpos from) the position of orbit at t
+    pos, vel = orbit.posvelatt(t)
+    return _cart(name, t, pos + np.asarray(dpos), vel + np.asarray(dvel))
+
+
+EARTH = _kepl('earth', AU, 0.0167, 0.0, 0.0, 102.9, 357.0)
+ORBITS = [EARTH,
+          _kepl('a', 1.3 * AU, 0.3, 5.0, 10.0, 250.0, 20.0),
+          _kepl('b', 2.7 * AU, 0.08, 10.6, 80.3, 73.6, 291.4),
+          _kepl('c', 0.9 * AU, 0.2, 2.0, 80.0, 30.0, 300.0),
+          _crossing(EARTH, 'crossing', 40.0 * DAY, [0.0, 0.0, 0.0],
+                    [3.0e3, -2.0e3, 4.0e3])]
+
+
+def _brute_moid(orbit1, orbit2, n=1440):
+    """MOID from a grid of true anomalies on both orbits, refined from the
+    best grid cells by Nelder-Mead"""
+    from scipy.optimize import minimize
+    ta = np.linspace(0.0, 2.0 * np.pi, n, endpoint=False)
+    p1 = orbit1.posvel(ta)[0]
+    p2 = orbit2.posvel(ta)[0]
+    d2 = ((p1[:, None, :] - p2[None, :, :]) ** 2).sum(axis=-1)
+
+    def dist(x):
+        return np.linalg.norm(orbit1.posvel(x[0])[0] - orbit2.posvel(x[1])[0])
+    best = np.inf
+    for k in np.argsort(d2, axis=None)[:20]:
+        x0 = np.array([ta[k // n], ta[k % n]])
+        res = minimize(dist, x0, method='Nelder-Mead',
+                       options={'xatol': 1e-12, 'fatol': 1e-3,
+                                'maxiter': 4000})
+        best = min(best, res.fun)
+    return best, np.sqrt(d2.min())
+
+
+@pytest.mark.parametrize('k, l', list(itertools.combinations(range(5), 2)))
+def test_moid_matches_brute_force(k, l):
+    dist = moid(ORBITS[k], ORBITS[l])
+    refined, grid = _brute_moid(ORBITS[k], ORBITS[l])
+    assert dist <= grid
+    assert abs(dist - refined) <= max(1e-9 * refined, 1.0)
+
+
+def test_crossing_orbits():
+    # The orbits share the position of the Earth at t = 40 days
+    assert moid(EARTH, ORBITS[-1]) < 1.0e3
+
+
+def test_moid_batch_pairs_and_threshold():
+    expected = {(k, l): moid(ORBITS[k], ORBITS[l])
+                for k, l in itertools.combinations(range(5), 2)}
+    i, j, dist, stats = moid_batch(ORBITS)
+    assert stats['pairs'] == 10 and stats['refined'] == 10
+    assert dict(zip(zip(i.tolist(), j.tolist()), dist.tolist())) == \
+        pytest.approx(expected, rel=1e-12, abs=1e-3)
+    # Pairs pruned by their distance ranges are not missed
+    threshold = 0.1 * AU
+    i, j, dist, stats = moid_batch(ORBITS, threshold=threshold)
+    assert sorted(zip(i.tolist(), j.tolist())) == \
+        sorted(key for key, value in expected.items() if value <= threshold)
+    assert stats['refined'] < 10
+    # Two sets, each one the larger
+    i, j, dist, stats = moid_batch(ORBITS[:2], ORBITS[2:])
+    assert dict(zip(zip(i.tolist(), j.tolist()), dist.tolist())) == \
+        pytest.approx({(k, l - 2): expected[k, l] for k in range(2)
+                       for l in range(2, 5)}, rel=1e-12, abs=1e-3)
+    i, j, dist, stats = moid_batch(ORBITS[2:], ORBITS[:2])
+    assert dict(zip(zip(i.tolist(), j.tolist()), dist.tolist())) == \
+        pytest.approx({(l - 2, k): expected[k, l] for k in range(2)
+                       for l in range(2, 5)}, rel=1e-12, abs=1e-3)
+
+
+# Encounters with the Earth at 30 and 75 days, 2e8 m and 5e8 m away,
+# and one object that stays far from the others
+TEND = 120.0 * DAY
+ENCOUNTERS = [EARTH,
+              _crossing(EARTH, 'near', 30.0 * DAY, [2.0e8, 0.0, 0.0],
+                        [0.0, 3.0e3, 1.0e3]),
+              _crossing(EARTH, 'far', 75.0 * DAY, [0.0, 0.0, 5.0e8],
+                        [-2.0e3, 0.0, 2.5e3]),
+              ORBITS[2]]
+
+
+def _brute_approaches(orbits, distance, step=600.0):
+    """Local minima of the separation below distance, from a posvelatt
+    scan refined on a one-second grid"""
+    times = np.arange(0.0, TEND + step * 0.5, step)
+    pos = [orbit.posvelatt(times)[0] for orbit in orbits]
+    result = []
+    for k, l in itertools.combinations(range(len(orbits)), 2):
+        d = np.linalg.norm(pos[k] - pos[l], axis=1)
+        for m in np.nonzero((d[1:-1] <= d[:-2]) & (d[1:-1] <= d[2:]))[0] + 1:
+            fine = np.arange(times[m] - step, times[m] + step + 0.5, 1.0)
+            df = np.linalg.norm(orbits[k].posvelatt(fine)[0]
+                                - orbits[l].posvelatt(fine)[0], axis=1)
+            if df.min() <= distance:
+                result.append((k, l, fine[df.argmin()], df.min()))
+    return sorted(result, key=lambda event: event[2])
+
+
+@pytest.mark.parametrize('epochs_per_block', [1, 16])
+def test_close_approaches_match_scan(epochs_per_block):
+    distance = 1.0e9
+    expected = _brute_approaches(ENCOUNTERS, distance)
+    assert [(k, l) for k, l, t, d in expected] == [(0, 1), (0, 2)]
+    events, stats = close_approaches(ENCOUNTERS, None, 0.0, TEND, DAY,
+                                     distance,
+                                     epochs_per_block=epochs_per_block)
+    assert len(events) == len(expected)
+    for event, (k, l, t, d) in zip(events, expected):
+        assert (event['i'], event['j']) == (k, l)
+        assert abs(event['t'] - t) <= 2.0
+        assert event['dist'] == pytest.approx(d, rel=1e-7)
+    assert stats['pair_epochs'] == 6 * (int(TEND / DAY) + 1)
+
+
+def test_close_approaches_between_two_sets():
+    distance = 1.0e9
+    expected = _brute_approaches(ENCOUNTERS, distance)
+    events, stats = close_approaches(ENCOUNTERS[1:], ENCOUNTERS[:1], 0.0,
+                                     TEND, DAY, distance)
+    assert [(e['i'], e['j']) for e in events] == [(0, 0), (1, 0)]
+    for event, (k, l, t, d) in zip(events, expected):
+        assert abs(event['t'] - t) <= 2.0
+        assert event['dist'] == pytest.approx(d, rel=1e-7)
+    # Only the closer one within a smaller distance
+    events, stats = close_approaches(ENCOUNTERS[1:], ENCOUNTERS[:1], 0.0,
+                                     TEND, DAY, 3.0e8)
+    assert [(e['i'], e['j']) for e in events] == [(0, 0)]
@@ -0,0 +1,56 @@
+"""Cells of density grids on both backends, non-finite positions included"""
+
+import math
+
+import numpy as np
+import pytest
+
+import densitygrid
+import twobodykernels
+from densitygrid import AU, DensityGrid
+
+GRIDS = [DensityGrid.cartesian((32, 32, 8), 4 * AU, 1 * AU),
+         DensityGrid.heliocentric((24, 90, 15), 4 * AU, 1.5 * AU, 30.0)]
+
+
+def _positions():
+    rng = np.random.default_rng(0)
+    pos = rng.normal(size=(2000, 3)) * np.array([2.5, 2.5, 0.5]) * AU
+    bad = np.array([np.nan, np.inf, -np.inf])
+    # Non-finite values in one, two or all three components
+    odd = pos[:27].copy()
+    for i in range(27):
+        for k in range(3):
+            if (i // 3 ** k) % 3:
+                odd[i, k] = bad[(i // 3 ** k) % 3 - 1]
+    return np.concatenate([pos, odd, np.array([[0.0, 0.0, 0.0],
+                                               [AU, 0.0, 0.0],
+                                               [-AU, -0.0, 0.0]])])
+
+
+@pytest.mark.parametrize('grid', GRIDS, ids=['cartesian', 'heliocentric'])
+def test_indices_match_numpy(backend, grid):
+    pos = _positions()
+    expected = np.empty(pos.shape[0], dtype=np.int64)
+    with np.errstate(invalid='ignore'):
+        densitygrid._cell_index_numpy(pos, grid.frame == 'heliocentric',
+                                      grid.low, grid._inv, grid._shape,
+                                      grid._tables, expected)
+    index = grid.indices(pos)
+    assert (index == expected).all()
+    finite = np.isfinite(pos).all(axis=1)
+    assert (index[~finite] == grid.size).all()
+    assert (index[finite] < grid.size).any()
+
+
+@pytest.mark.skipif('numba' not in twobodykernels.BACKENDS,
+                    reason='numba is not available')
+def test_count_of_non_finite_values():
+    kernels = twobodykernels._kernels()
+    values = np.sin(np.linspace(-0.5 * math.pi, 0.5 * math.pi, 31))
+    table = densitygrid._edge_table(values)
+    v = np.array([np.nan, np.inf, -np.inf, -1.0, 0.3, 1.0, 2.0])
+    with np.errstate(invalid='ignore'):
+        expected = densitygrid._count_numpy(table, v)
+    assert [kernels._count_nb(values, table[1], x) for x in v] == \
+        list(expected)
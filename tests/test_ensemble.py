@@ -0,0 +1,47 @@
+"""Closest approach of clone ensembles"""
+
+import numpy as np
+
+import twobodykernels
+from ensemble import CloneEnsemble
+from pytwobodyorbit import TwoBodyOrbit
+
+AU = 1.496e11
+DAY = 86400.0
+
+
+def _orbit(name, a, e, i, node, peri, ma):
+    orbit = TwoBodyOrbit(name)
+    orbit.setOrbKepl(0.0, a, e, i, node, peri, MA=ma)
+    return orbit
+
+
+def test_distance_belongs_to_its_time():
+    target = _orbit('target', AU, 0.017, 0.0, 0.0, 100.0, 0.0)
+    objects = [_orbit('a', 1.3 * AU, 0.3, 5.0, 10.0, 250.0, 20.0),
+               _orbit('b', 0.9 * AU, 0.2, 2.0, 80.0, 30.0, 300.0),
+               _orbit('c', 3.0 * AU, 0.6, 2.0, 80.0, 30.0, 300.0)]
+    clouds = CloneEnsemble.from_elements(
+        objects, [1.0e9, 1.0e-2, 1.0, 1.0, 1.0, 5.0], 200, seed=1)
+    # Long steps, so that some brackets hold two minima
+    step = 200.0 * DAY
+    t, dist = clouds.closest_approach(target, 0.0, 730.0 * DAY, step)
+
+    # The distance is the separation at the time returned with it
+    pos, vel = twobodykernels.kepler(clouds.r0, clouds.v0, clouds.mu,
+                                     t.reshape(-1, 1) - clouds.t0[:, None])
+    ref, vel = twobodykernels.kepler(
+        np.repeat(target.pos[None], t.size, axis=0),
+        np.repeat(target.vel[None], t.size, axis=0), target.mu,
+        t.reshape(-1, 1) - target.t0)
+    sep = np.linalg.norm(pos[:, 0] - ref[:, 0], axis=1).reshape(t.shape)
+    assert np.allclose(dist, sep, rtol=1e-9)
+
+    # and no farther than any of the samples
+    times = np.arange(0.0, 730.0 * DAY + step * 0.5, step)
+    pos, vel = twobodykernels.kepler(clouds.r0, clouds.v0, clouds.mu,
+                                     times[None, :] - clouds.t0[:, None])
+    ref, vel = twobodykernels.kepler(target.pos[None], target.vel[None],
+                                     target.mu, times[None, :] - target.t0)
+    coarse = np.linalg.norm(pos - ref, axis=-1).min(axis=1)
+    assert (dist.ravel() <= coarse * (1.0 + 1e-12)).all()
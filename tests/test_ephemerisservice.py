@@ -0,0 +1,107 @@
+"""Replies of the ephemeris service to valid and malformed requests"""
+
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from ephemerisservice import EphemerisService
+
+
+@pytest.fixture(scope='module')
+def service():
+    return EphemerisService(window=0.0)
+
+
+def _reply(service, line):
+    return asyncio.run(service._reply(line))
+
+
+def test_list_bodies(service):
+    reply = _reply(service, b'{"id": 3, "list": true}\n')
+    assert reply == {'id': 3, 'names': service.names}
+
+
+def test_query(service):
+    name = service.names[0]
+    reply = _reply(service, json.dumps({'id': 1, 'bodies': [name],
+                                        't': [5.0e9, 5.1e9]}).encode())
+    assert reply['names'] == [name]
+    assert len(reply['pos']) == 1 and len(reply['pos'][0]) == 2
+
+
+@pytest.mark.parametrize('line', [b'[1]\n', b'3\n', b'"x"\n', b'null\n'])
+def test_non_object(service, line):
+    assert 'error' in _reply(service, line)
+
+
+@pytest.mark.parametrize('line', [b'{nope\n', b'{"id": 2, "bodies": ["?"], '
+                                  b'"t": 0.0}\n', b'{"id": 2}\n'])
+def test_invalid(service, line):
+    assert 'error' in _reply(service, line)
+
+
+def test_solver_failure(service, monkeypatch):
+    def fail(rows, t):
+        raise(RuntimeError('Failed to converge'))
+    monkeypatch.setattr(service, 'compute', fail)
+    reply = _reply(service, b'{"id": 4, "t": 0.0}\n')
+    assert reply == {'id': 4, 'error': 'Failed to converge'}
+
+
+@pytest.mark.parametrize('request_', [{'t': [[5.0e9, 5.1e9]]},
+                                      {'t': [5.0e9, float('nan')]},
+                                      {'t': float('inf')},
+                                      {'bodies': 'Mars', 't': 5.0e9}])
+def test_rejected_before_batching(service, request_):
+    line = json.dumps(dict(request_, id=5)).encode()
+    reply = _reply(service, line)
+    assert set(reply) == {'id', 'error'}
+    assert not service._pending
+    # The reply is valid JSON, without NaN or Infinity tokens
+    json.loads(json.dumps(reply, allow_nan=False))
+
+
+def _batched(service, lines):
+    async def run():
+        return await asyncio.gather(*[service._reply(line)
+                                      for line in lines])
+    window, service.window = service.window, 0.05
+    try:
+        return asyncio.run(asyncio.wait_for(run(), 10.0))
+    finally:
+        service.window = window
+
+
+def test_bad_request_in_a_batch(service):
+    name = service.names[0]
+    good = json.dumps({'id': 6, 'bodies': [name], 't': [5.0e9]}).encode()
+    bad = json.dumps({'id': 7, 't': [[5.0e9, 5.1e9]]}).encode()
+    replies = _batched(service, [bad, good, b'{"id": 8, "t": NaN}\n'])
+    assert 'error' in replies[0] and 'error' in replies[2]
+    assert replies[1]['names'] == [name] and len(replies[1]['pos'][0]) == 1
+
+
+def test_batch_failure_reaches_every_request(service, monkeypatch):
+    # A batch that fails as a whole answers all its requests with the error
+    def fail(rows, t):
+        raise(RuntimeError('Failed to converge'))
+    monkeypatch.setattr(service, 'compute', fail)
+    lines = [json.dumps({'id': k, 't': [5.0e9]}).encode() for k in range(3)]
+    replies = _batched(service, lines)
+    assert replies == [{'id': k, 'error': 'Failed to converge'}
+                       for k in range(3)]
+
+
+def test_malformed_batch_sets_every_future(service):
+    # Entries that bypassed query: the batch cannot be built, and both
+    # futures get the exception instead of waiting forever
+    async def run():
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future(), loop.create_future()]
+        service._run([(np.array([0]), np.array([[5.0e9, 5.1e9]]),
+                       futures[0]),
+                      (np.array([0]), np.array([5.0e9]), futures[1])])
+        return [f.exception() for f in futures]
+    assert all(isinstance(exc, ValueError) for exc in asyncio.run(run()))
@@ -0,0 +1,13 @@
+"""Frame counting of the profiler"""
+
+from frameprofiler import FrameProfiler
+
+
+def test_total_keeps_counting_past_the_window():
+    profiler = FrameProfiler(enabled=True, window=8)
+    for k in range(20):
+        with profiler.stage('kepler'):
+            pass
+        profiler.end_frame()
+    assert profiler.summary()['frames'] == 8
+    assert profiler.total == 20
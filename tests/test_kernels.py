@@ -0,0 +1,91 @@
+"""Batch kernels of both backends against the scalar TwoBodyOrbit solvers"""
+
+import numpy as np
+import pytest
+
+import twobodykernels
+from pytwobodyorbit import TwoBodyOrbit, lambert
+
+AU = 1.496e11
+DAY = 86400.0
+
+# a, e, q: elliptic, near-parabolic, parabolic and hyperbolic orbits
+ORBITS = [(1.5 * AU, 0.2, None), (2.0 * AU, 0.9, None),
+          (None, 0.9999, 0.5 * AU), (None, 1.0, 0.3 * AU),
+          (None, 1.0001, 0.8 * AU), (-3.0 * AU, 1.5, None),
+          (None, 3.0, 1.2 * AU)]
+# From a few minutes to a century, before and after the epoch
+TIMES = np.array([-1.0e3, 1.0e5, -3.0e7, 5.0e8, 3.0e9])
+
+
+def _orbit(a, e, q):
+    orbit = TwoBodyOrbit('test')
+    orbit.setOrbKepl(0.0, a, e, 20.0, 40.0, 60.0, TA=10.0, q=q)
+    return orbit
+
+
+def _relative(x, y):
+    return np.linalg.norm(x - y, axis=-1) / np.linalg.norm(y, axis=-1)
+
+
+@pytest.mark.parametrize('a, e, q', ORBITS)
+def test_kepler_matches_posvelatt(backend, a, e, q):
+    orbit = _orbit(a, e, q)
+    pos, vel = twobodykernels.kepler(orbit.pos[None], orbit.vel[None],
+                                     orbit.mu, TIMES[None],
+                                     precision='standard')
+    for t, p, v in zip(TIMES, pos[0], vel[0]):
+        ps, vs = orbit.posvelatt(float(t))
+        assert _relative(p, ps) < 1e-10
+        assert _relative(v, vs) < 1e-10
+
+
+def test_kepler_backends_agree():
+    rng = np.random.default_rng(0)
+    m = 200
+    orbits = [_orbit(*ORBITS[j]) for j in rng.integers(len(ORBITS), size=m)]
+    r0 = np.array([orbit.pos for orbit in orbits])
+    v0 = np.array([orbit.vel for orbit in orbits])
+    dt = rng.uniform(-100.0, 100.0, (m, 8)) * 365.25 * DAY
+    results = []
+    for name in twobodykernels.BACKENDS:
+        previous = twobodykernels.get_backend()
+        twobodykernels.set_backend(name)
+        try:
+            results.append(twobodykernels.kepler(r0, v0, orbits[0].mu, dt))
+        finally:
+            twobodykernels.set_backend(previous)
+    for pos, vel in results[1:]:
+        assert _relative(pos, results[0][0]).max() < 1e-10
+        assert _relative(vel, results[0][1]).max() < 1e-10
+
+
+# Transfers between two points: short (hyperbolic), ordinary, long, and
+# clockwise
+TRANSFERS = [([AU, 0.0, 0.0], [0.0, 1.5 * AU, 0.1 * AU], 5.0, True),
+             ([AU, 0.0, 0.0], [0.0, 1.5 * AU, 0.1 * AU], 200.0, True),
+             ([AU, 0.0, 0.0], [-2.0 * AU, 0.5 * AU, 0.0], 800.0, True),
+             ([AU, 0.2 * AU, 0.0], [-1.0 * AU, -1.2 * AU, 0.3 * AU], 300.0,
+              False)]
+
+
+@pytest.mark.parametrize('ipos, tpos, days, ccw', TRANSFERS)
+def test_lambert_matches_scalar(backend, ipos, tpos, days, ccw):
+    ivel, tvel = twobodykernels.lambert(np.array([ipos]), np.array([tpos]),
+                                        days * DAY, 1.32712440041e20, ccw,
+                                        precision='standard')
+    ivs, tvs = lambert(np.array(ipos), np.array(tpos), days * DAY, ccw=ccw)
+    assert _relative(ivel[0], ivs) < 1e-9
+    assert _relative(tvel[0], tvs) < 1e-9
+
+
+@pytest.mark.parametrize('ipos, tpos, days, ccw', TRANSFERS)
+def test_lambert_reaches_target(backend, ipos, tpos, days, ccw):
+    # Propagating the departure state over the flight time ends at tpos
+    ivel, tvel = twobodykernels.lambert(np.array([ipos]), np.array([tpos]),
+                                        days * DAY, 1.32712440041e20, ccw)
+    pos, vel = twobodykernels.kepler(np.array([ipos]), ivel,
+                                     1.32712440041e20,
+                                     np.array([[days * DAY]]))
+    assert _relative(pos[0, 0], np.array(tpos)) < 1e-9
+    assert _relative(vel[0, 0], tvel[0]) < 1e-9
@@ -0,0 +1,112 @@
+"""Rows of an OrbitCatalog against TwoBodyOrbit objects defined alike"""
+
+import math
+
+import numpy as np
+import pytest
+
+from orbitcatalog import OrbitCatalog
+from pytwobodyorbit import TwoBodyOrbit
+
+AU = 1.496e11
+DAY = 86400.0
+EPOCH = 59200.0 * DAY
+
+KEPLERIAN = {
+    'MA': ((2.766 * AU, 0.0785, 10.6, 80.3, 73.6), {'MA': 291.4}),
+    'negative MA': ((1.5 * AU, 0.2, 5.0, 30.0, 40.0), {'MA': -20.0}),
+    'TA': ((1.3 * AU, 0.3, 5.0, 10.0, 250.0), {'TA': 20.0}),
+    'T': ((2.2 * AU, 0.4, 8.0, 60.0, 120.0), {'T': EPOCH + 90.0 * DAY}),
+    'circular': ((1.0 * AU, 0.0, 3.0, 50.0, 70.0), {'TA': 10.0}),
+    'parabolic': ((None, 1.0, 20.0, 40.0, 60.0), {'TA': 10.0,
+                                                  'q': 0.3 * AU}),
+    'hyperbolic': ((-1.5 * AU, 1.4, 40.0, 200.0, 60.0), {'TA': -80.0})}
+
+CARTESIAN = {
+    'elliptic': ([1.2 * AU, 0.3 * AU, 0.1 * AU], [-8.0e3, 2.8e4, 1.5e3]),
+    'equatorial': ([AU, 0.2 * AU, 0.0], [-5.0e3, 3.2e4, 0.0]),
+    'retrograde': ([AU, 0.2 * AU, 0.0], [5.0e3, -3.2e4, 0.0]),
+    'hyperbolic': ([AU, 0.0, 0.1 * AU], [0.0, 5.0e4, 5.0e3])}
+
+ATTRIBUTES = ('t0', 'T', 'a', 'e', 'i', 'lan', 'parg', 'ta0', 'ma', 'p',
+              'pos', 'vel', 'evd', 'hv', 'ev', 'pr', 'mm')
+TIMES = EPOCH + np.array([-200.0, -3.0, 0.0, 0.5, 47.0, 900.0]) * DAY
+
+
+def _close(x, y):
+    # Relative to the length of vectors, whose components can be rounding
+    # errors of zero
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if (x == y).all():
+        return True
+    return (np.linalg.norm(np.atleast_1d(x - y), axis=-1)
+            <= 1e-12 * np.linalg.norm(np.atleast_1d(y), axis=-1)).all()
+
+
+def _assert_same(row, orbit):
+    for key in ATTRIBUTES:
+        value, expected = getattr(row, key), getattr(orbit, key)
+        if expected is None:
+            assert value is None, key
+        else:
+            assert _close(value, expected), key
+    for t in TIMES:
+        pos, vel = row.posvelatt(float(t))
+        rpos, rvel = orbit.posvelatt(float(t))
+        assert _close(pos, rpos) and _close(vel, rvel)
+    pos, vel = row.posvelatt(TIMES)
+    rpos, rvel = orbit.posvelatt(TIMES)
+    assert _close(pos, rpos) and _close(vel, rvel)
+    for window in ({}, {'start': TIMES[1], 'stop': TIMES[4]}):
+        for x, y in zip(row.points(50, **window), orbit.points(50, **window)):
+            assert np.allclose(x, y, rtol=1e-12, atol=1e-3)
+    assert row.elmKepl() == pytest.approx(orbit.elmKepl(), rel=1e-12)
+
+
+@pytest.mark.parametrize('name', sorted(KEPLERIAN))
+def test_setorbkepl(name):
+    elements, anomaly = KEPLERIAN[name]
+    orbit = TwoBodyOrbit(name)
+    orbit.setOrbKepl(EPOCH, *elements, **anomaly)
+    catalog = OrbitCatalog()
+    catalog.append('first')
+    row = catalog.append(name)
+    row.setOrbKepl(EPOCH, *elements, **anomaly)
+    _assert_same(row, orbit)
+    assert catalog[1].bodyname == name and not catalog[0]._setOrb
+
+
+@pytest.mark.parametrize('name', sorted(CARTESIAN))
+def test_setorbcart(name):
+    pos, vel = CARTESIAN[name]
+    orbit = TwoBodyOrbit(name)
+    orbit.setOrbCart(EPOCH, pos, vel)
+    row = OrbitCatalog(capacity=1).append(name)
+    row.setOrbCart(EPOCH, pos, vel)
+    _assert_same(row, orbit)
+
+
+def test_from_orbits_and_propagate():
+    orbits = []
+    for name, (elements, anomaly) in sorted(KEPLERIAN.items()):
+        orbit = TwoBodyOrbit(name)
+        orbit.setOrbKepl(EPOCH, *elements, **anomaly)
+        orbits.append(orbit)
+    catalog = OrbitCatalog.from_orbits(orbits)
+    assert len(catalog) == len(orbits)
+    for row, orbit in zip(catalog, orbits):
+        _assert_same(row, orbit)
+    pos, vel = catalog.propagate(TIMES)
+    for k, orbit in enumerate(orbits):
+        rpos, rvel = orbit.posvelatt(TIMES)
+        assert _close(pos[k], rpos) and _close(vel[k], rvel)
+
+
+def test_undefined_rows():
+    catalog = OrbitCatalog()
+    catalog.append('undefined')
+    with pytest.raises(RuntimeError):
+        catalog[0].posvel(0.0)
+    with pytest.raises(RuntimeError):
+        catalog.states()
+    assert catalog[0].ma is None and math.isnan(catalog[0].t0)
@@ -0,0 +1,64 @@
+"""Orbits fitted to synthetic observations of known orbits"""
+
+import numpy as np
+import pytest
+
+import orbitdetermination
+from orbitdetermination import ARCSEC
+from secularelements import SecularElements
+
+DAY = 86400.0
+SIGMA = 0.5 * ARCSEC
+NOBS = 8
+
+
+@pytest.fixture(scope='module')
+def observer():
+    planets = SecularElements.from_csv('Data/planets_keplerian_elements.csv')
+    earth = planets.names.index('EM Bary')
+
+    def positions(times):
+        return planets.posvelatt(times)[0][earth]
+    return positions
+
+
+def _synthetic(observer, sigma, m=60):
+    return orbitdetermination._synthetic(m, NOBS, observer, 59200.0 * DAY,
+                                         40.0 * DAY, sigma, seed=2)
+
+
+def test_round_trip(observer):
+    t, los, obs, pos, vel = _synthetic(observer, SIGMA)
+    fit, stats = orbitdetermination.fit_orbits(t, los, obs, sigma=SIGMA)
+    ok = fit['converged']
+    assert fit['iod'].all()
+    assert stats['converged'] == ok.sum() >= 0.95 * ok.shape[0]
+    # Six parameters fitted to 2 * NOBS residuals: the RMS is near
+    # sigma * sqrt(1 - 6 / (2 * NOBS))
+    rms = fit['rms'][ok] / SIGMA
+    assert np.median(rms) == pytest.approx(np.sqrt(1.0 - 6.0 / (2 * NOBS)),
+                                           rel=0.15)
+    assert rms.max() < 2.0
+    err = np.linalg.norm(fit['pos'] - pos, axis=1) \
+        / np.linalg.norm(pos, axis=1)
+    assert np.median(err[ok]) < 1e-3
+    # The true states are within the formal covariance
+    d = np.concatenate([fit['pos'] - pos, fit['vel'] - vel], axis=1)[ok]
+    chi2 = np.einsum('mi,mij,mj->m', d, np.linalg.pinv(fit['cov'][ok],
+                                                       hermitian=True), d)
+    assert np.median(chi2) < 12.0
+
+
+def test_correction_without_noise(observer):
+    # From states off by 1e-4, the exact observations are fitted again
+    t, los, obs, pos, vel = _synthetic(observer, 0.0, m=20)
+    rng = np.random.default_rng(0)
+    start = [x * (1.0 + 1e-4 * rng.standard_normal(x.shape))
+             for x in (pos, vel)]
+    t0 = t[:, NOBS // 2]
+    fit = orbitdetermination.differential_correction(t, los, obs, *start, t0,
+                                                     sigma=SIGMA)
+    assert fit['converged'].all()
+    assert (fit['rms'] < 1e-6 * ARCSEC).all()
+    assert np.allclose(fit['pos'], pos, rtol=1e-9, atol=0.0)
+    assert np.allclose(fit['vel'], vel, rtol=1e-9, atol=0.0)
@@ -0,0 +1,104 @@
+"""Event tables against a brute-force scan of posvelatt"""
+
+import numpy as np
+import pytest
+
+import orbitevents
+from pytwobodyorbit import TwoBodyOrbit
+
+AU = 1.496e11
+DAY = 86400.0
+TEND = 730.0 * DAY
+# One-day samples of the brute-force scan
+GRID = np.arange(0.0, TEND + 0.5 * DAY, DAY)
+
+
+def _orbit(name, a, e, i, node, peri, **anomaly):
+    orbit = TwoBodyOrbit(name)
+    orbit.setOrbKepl(0.0, a, e, i, node, peri, **anomaly)
+    return orbit
+
+
+ORBITS = [_orbit('a', 1.3 * AU, 0.3, 5.0, 10.0, 250.0, MA=20.0),
+          _orbit('b', 0.7 * AU, 0.2, 12.0, 80.0, 30.0, MA=300.0),
+          _orbit('c', 2.8 * AU, 0.6, 25.0, 140.0, 100.0, MA=170.0),
+          _orbit('d', -1.5 * AU, 1.4, 40.0, 200.0, 60.0, TA=-80.0)]
+EARTH = _orbit('earth', AU, 0.0167, 0.0, 0.0, 102.9, MA=357.0)
+
+
+def _scan(orbit):
+    states = [orbit.posvelatt(float(t)) for t in GRID]
+    return np.array([p for p, v in states]), np.array([v for p, v in states])
+
+
+def _crossings(f):
+    """Indices j where f changes sign between GRID[j] and GRID[j + 1]"""
+    return np.nonzero(np.signbit(f[:-1]) != np.signbit(f[1:]))[0]
+
+
+def _check(events, expected):
+    # One event per brute-force bracket, with its object and name
+    events = np.sort(events, order=['i', 't'])
+    expected = sorted(expected)
+    assert len(events) == len(expected)
+    for event, (i, j, name) in zip(events, expected):
+        assert event['i'] == i and event['event'] == name
+        assert GRID[j] <= event['t'] <= GRID[j + 1]
+
+
+def test_periapsis_passages():
+    events = orbitevents.periapsis_passages(ORBITS, 0.0, TEND)
+    expected = []
+    for i, orbit in enumerate(ORBITS):
+        pos, vel = _scan(orbit)
+        # The radial velocity goes from negative to positive
+        rdot = (pos * vel).sum(axis=1)
+        expected += [(i, j, 'periapsis') for j in _crossings(rdot)
+                     if rdot[j] < 0.0]
+    _check(events, expected)
+    for event in events:
+        pos, vel = ORBITS[event['i']].posvelatt(event['t'])
+        assert abs(np.dot(pos, vel)) < 1e-9 * np.linalg.norm(pos) \
+            * np.linalg.norm(vel)
+
+
+def test_node_crossings():
+    events = orbitevents.node_crossings(ORBITS, 0.0, TEND)
+    expected = []
+    for i, orbit in enumerate(ORBITS):
+        pos, vel = _scan(orbit)
+        expected += [(i, j, 'ascending_node' if pos[j, 2] < 0.0
+                      else 'descending_node')
+                     for j in _crossings(pos[:, 2])]
+    _check(events, expected)
+    for event in events:
+        pos, vel = ORBITS[event['i']].posvelatt(event['t'])
+        assert abs(pos[2]) < 1e-9 * np.linalg.norm(pos)
+
+
+@pytest.mark.parametrize('epochs_per_block', [1, 16, 1000])
+def test_conjunctions(epochs_per_block):
+    events = orbitevents.conjunctions(ORBITS, EARTH, 0.0, TEND, step=DAY,
+                                      epochs_per_block=epochs_per_block)
+    opos, ovel = _scan(EARTH)
+    expected = []
+    for i, orbit in enumerate(ORBITS):
+        pos, vel = _scan(orbit)
+        geo = pos - opos
+        cross = geo[:, 0] * (-opos[:, 1]) - geo[:, 1] * (-opos[:, 0])
+        dot = (geo * (-opos)).sum(axis=1)
+        expected += [(i, j, 'conjunction' if dot[j] > 0.0 else 'opposition')
+                     for j in _crossings(cross)]
+    assert expected
+    _check(events, expected)
+
+
+def test_conjunctions_do_not_depend_on_blocks():
+    full = orbitevents.conjunctions(ORBITS, EARTH, 0.0, TEND,
+                                    epochs_per_block=1000)
+    for epochs_per_block in (1, 2, 7):
+        events = orbitevents.conjunctions(ORBITS, EARTH, 0.0, TEND,
+                                          epochs_per_block=epochs_per_block)
+        assert (events['i'] == full['i']).all()
+        assert (events['event'] == full['event']).all()
+        assert (events['t'] == full['t']).all()
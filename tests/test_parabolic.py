@@ -0,0 +1,105 @@
+"""Parabolic and near-parabolic orbits against numerical integration"""
+
+import math
+
+import numpy as np
+import pytest
+
+import twobodykernels
+from pytwobodyorbit import TwoBodyOrbit
+
+AU = 1.496e11
+DAY = 86400.0
+
+# e, q: parabolic (a = inf) and both sides of it
+ORBITS = [(1.0, 0.3 * AU), (0.9999, 0.5 * AU), (1.0001, 0.8 * AU)]
+# From hours to a few years around the epoch, across the periapsis
+TIMES = np.array([-60.0, -5.0, 0.5, 20.0, 200.0, 1500.0]) * DAY
+
+
+def _orbit(e, q, **anomaly):
+    orbit = TwoBodyOrbit('comet')
+    orbit.setOrbKepl(0.0, None, e, 20.0, 40.0, 60.0, q=q, **anomaly)
+    return orbit
+
+
+def _integrate(orbit, times, q):
+    # DOP853 in units of q and of the periapsis time scale, one solution
+    # per time so that no dense output is interpolated
+    from scipy.integrate import solve_ivp
+    unit = math.sqrt(q ** 3 / orbit.mu)
+
+    def derivative(t, y):
+        r = y[:3]
+        return np.concatenate([y[3:], (-1.0) * r / np.dot(r, r) ** 1.5])
+
+    y0 = np.concatenate([orbit.pos / q, orbit.vel * unit / q])
+    states = []
+    for t in times:
+        sol = solve_ivp(derivative, (0.0, t / unit), y0, method='DOP853',
+                        rtol=2.5e-14, atol=1e-16)
+        states.append(np.concatenate([sol.y[:3, -1] * q,
+                                      sol.y[3:, -1] * q / unit]))
+    states = np.array(states)
+    return states[:, :3], states[:, 3:]
+
+
+def _relative(x, y):
+    return np.linalg.norm(x - y, axis=-1) / np.linalg.norm(y, axis=-1)
+
+
+@pytest.mark.parametrize('e, q', ORBITS)
+@pytest.mark.parametrize('precision', ['standard', 'high'])
+def test_kepler_matches_integration(backend, e, q, precision):
+    orbit = _orbit(e, q, TA=10.0)
+    rpos, rvel = _integrate(orbit, TIMES, q)
+    pos, vel = twobodykernels.kepler(orbit.pos[None], orbit.vel[None],
+                                     orbit.mu, TIMES[None],
+                                     precision=precision)
+    assert _relative(pos[0], rpos).max() < 3e-13
+    assert _relative(vel[0], rvel).max() < 3e-13
+
+
+@pytest.mark.parametrize('e, q', ORBITS)
+def test_posvelatt_matches_integration(e, q):
+    orbit = _orbit(e, q, TA=10.0)
+    rpos, rvel = _integrate(orbit, TIMES, q)
+    for t, p, v in zip(TIMES, rpos, rvel):
+        pos, vel = orbit.posvelatt(float(t))
+        assert _relative(pos, p) < 3e-13
+        assert _relative(vel, v) < 3e-13
+
+
+@pytest.mark.parametrize('e, q', ORBITS)
+def test_time_from_periapsis(e, q):
+    # Integrating from the periapsis for timeFperi(TA) reaches the state
+    # of true anomaly TA
+    orbit = _orbit(e, q, TA=25.0)
+    t = orbit.timeFperi(math.radians(25.0))
+    pos, vel = _integrate(_orbit(e, q, TA=0.0), [t], q)
+    assert _relative(orbit.pos, pos[0]) < 1e-13
+    assert _relative(orbit.vel, vel[0]) < 1e-13
+
+
+@pytest.mark.parametrize('e, q', ORBITS)
+def test_periapsis_passage_time(e, q):
+    # Elements given with the time of periapsis passage T instead of TA
+    orbit = _orbit(e, q, T=(-30.0) * DAY)
+    pos, vel = _integrate(_orbit(e, q, TA=0.0), [30.0 * DAY], q)
+    assert _relative(orbit.pos, pos[0]) < 1e-13
+    assert _relative(orbit.vel, vel[0]) < 1e-13
+
+
+@pytest.mark.parametrize('e, q', ORBITS)
+@pytest.mark.parametrize('guess', sorted(twobodykernels._PARABOLIC_LIMITS))
+def test_no_bisection_near_the_parabola(e, q, guess):
+    # Within _PARABOLIC_LIMITS the Barker solution starts the iteration
+    # close enough for Newton steps alone
+    orbit = _orbit(e, q, TA=10.0)
+    dt = np.linspace(-3000.0, 3000.0, 61)[None] * DAY
+    counts = np.zeros((2,) + dt.shape, dtype=int)
+    twobodykernels._anomaly_numpy(orbit.pos[None], orbit.vel[None],
+                                  np.array([orbit.mu]), dt, 0.0, 1e-14, 50,
+                                  guess, counts)
+    assert counts[1].max() == 0
+    assert counts[0].max() <= 4
@@ -0,0 +1,62 @@
+"""Leaves of the porkchop quadtree and the rendered view"""
+
+import numpy as np
+import pytest
+
+from porkchop import Porkchop, DAY
+from secularelements import SecularElements
+from solarsystem import sunmu
+
+T0 = 62502.0 * DAY
+
+
+@pytest.fixture(scope='module')
+def bodies():
+    planets = SecularElements.from_csv(
+        'Data/planets_keplerian_elements.csv', mu=sunmu)
+    return ((planets, planets.names.index('EM Bary')),
+            (planets, planets.names.index('Mars')))
+
+
+def _check(chop, departure, arrival, pixels):
+    chop.set_view(departure, arrival, (pixels, pixels))
+    while chop.refine(2048):
+        pass
+    for cell in chop.leaves:
+        if chop._visible(cell):
+            assert chop._known(cell)
+    image = chop.raster(pixels, pixels)
+    x = departure[0] + (np.arange(pixels) + 0.5) \
+        * (departure[1] - departure[0]) / pixels
+    y = arrival[1] - (np.arange(pixels) + 0.5) \
+        * (arrival[1] - arrival[0]) / pixels
+    x, y = np.meshgrid(x, y)
+    # Transfers shorter than about 40 days fail in Lambert's problem
+    # itself (NaN by design), and so do the pixels of a leaf with such a
+    # corner
+    valid = y - x >= 40.0 * DAY + chop.min_size * chop.spacing.sum()
+    assert valid.any()
+    assert np.isfinite(image[valid]).all()
+
+
+@pytest.mark.parametrize('pixels', [200, 60])
+def test_no_holes_in_the_view(bodies, pixels):
+    chop = Porkchop(*bodies, (T0, T0), (50.0 * DAY, 50.0 * DAY))
+    _check(chop, (T0, T0 + 800.0 * DAY), (T0 + 60.0 * DAY, T0 + 1200.0 * DAY),
+           pixels)
+    # Zoomed out until the coarse cells are smaller than a pixel, then in
+    _check(chop, (T0 - 1000.0 * DAY, T0 + 2000.0 * DAY),
+           (T0 - 1000.0 * DAY, T0 + 2500.0 * DAY), pixels)
+    _check(chop, (T0 + 300.0 * DAY, T0 + 500.0 * DAY),
+           (T0 + 500.0 * DAY, T0 + 800.0 * DAY), pixels)
+
+
+def test_budget(bodies):
+    chop = Porkchop(*bodies, (T0, T0), (50.0 * DAY, 50.0 * DAY))
+    chop.set_view((T0, T0 + 800.0 * DAY), (T0 + 60.0 * DAY,
+                                          T0 + 1200.0 * DAY), (200, 200))
+    while True:
+        solved = chop.refine(500)
+        assert solved <= 500
+        if not solved:
+            break
@@ -0,0 +1,40 @@
+"""Process pools started after the parallel kernels have run"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A parallel kernel call in the parent first, then the executor; the
+# workers must not inherit the kernel threads, or the process never exits
+SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+import numpy as np
+import twobodykernels
+from sharedpropagation import PropagationExecutor
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    m = 20000
+    r0 = rng.normal(size=(m, 3)) * 1.5e11
+    v0 = rng.normal(size=(m, 3)) * 2.0e4
+    mu = 1.32712440041e20
+    twobodykernels.kepler(r0, v0, mu, np.full((m, 4), 1.0e6))
+    with PropagationExecutor(2) as executor:
+        pos, vel = executor.propagate(r0[:1000], v0[:1000], 0.0, mu,
+                                      [1.0e6, 2.0e6])
+    ref, vel = twobodykernels.kepler(r0[:1000], v0[:1000], mu,
+                                     np.tile([1.0e6, 2.0e6], (1000, 1)))
+    print('match', bool(np.allclose(pos, ref, rtol=1e-12)))
+"""
+
+
+def test_executor_exits_after_parallel_kernel(tmp_path):
+    script = tmp_path / 'run.py'
+    script.write_text(SCRIPT.format(root=ROOT))
+    result = subprocess.run([sys.executable, str(script)], cwd=ROOT,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'match True' in result.stdout
@@ -0,0 +1,55 @@
+"""Analytic state transition matrices against finite differences"""
+
+import numpy as np
+import pytest
+
+import twobodykernels
+from pytwobodyorbit import TwoBodyOrbit
+
+AU = 1.496e11
+
+# a, e, q: elliptic, near-parabolic, parabolic and hyperbolic orbits
+ORBITS = [(1.5 * AU, 0.2, None), (2.0 * AU, 0.9, None),
+          (None, 0.9999, 0.5 * AU), (None, 1.0, 0.3 * AU),
+          (None, 1.0001, 0.8 * AU), (-3.0 * AU, 1.5, None),
+          (None, 3.0, 1.2 * AU)]
+# About a month back, most of a year and a few years ahead
+TIMES = np.array([-3.0e6, 2.0e7, 1.0e8])
+
+
+def _state(a, e, q):
+    orbit = TwoBodyOrbit('test')
+    orbit.setOrbKepl(0.0, a, e, 20.0, 40.0, 60.0, TA=10.0, q=q)
+    return np.concatenate([orbit.pos, orbit.vel]), orbit.mu
+
+
+def _finite_difference(x, mu, rel=1e-5):
+    # Fourth-order central differences, one column per epoch component
+    fd = np.empty((TIMES.shape[0], 6, 6))
+    for j in range(6):
+        h = rel * np.linalg.norm(x[:3] if j < 3 else x[3:])
+        f = {}
+        for s in (-2, -1, 1, 2):
+            xs = x.copy()
+            xs[j] += s * h
+            pos, vel = twobodykernels.kepler(xs[None, :3], xs[None, 3:], mu,
+                                             TIMES[None], precision='high')
+            f[s] = np.concatenate([pos[0], vel[0]], axis=1)
+        fd[:, :, j] = (8.0 * (f[1] - f[-1]) - (f[2] - f[-2])) / (12.0 * h)
+    return fd
+
+
+@pytest.mark.parametrize('a, e, q', ORBITS)
+def test_stm_matches_finite_differences(backend, a, e, q):
+    x, mu = _state(a, e, q)
+    pos, vel, phi = twobodykernels.kepler_stm(x[None, :3], x[None, 3:], mu,
+                                              TIMES[None], precision='high')
+    fd = _finite_difference(x, mu)
+    # Position and velocity blocks in comparable units
+    scale = np.repeat([np.linalg.norm(x[:3]), np.linalg.norm(x[3:])], 3)
+    analytic = phi[0] / scale[:, None] * scale[None, :]
+    numeric = fd / scale[:, None] * scale[None, :]
+    error = np.linalg.norm(analytic - numeric, axis=(1, 2)) \
+        / np.linalg.norm(analytic, axis=(1, 2))
+    assert error.max() < 1e-9
+
@@ -0,0 +1,77 @@
+"""Flyby radii of the sequence search, and its worker processes"""
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import trajectorysearch
+from secularelements import SecularElements
+from solarsystem import read_planets
+
+DAY = 86400.0
+
+
+@pytest.fixture(scope='module')
+def planets():
+    return SecularElements.from_csv('Data/planets_keplerian_elements.csv',
+                                    mu=1.32712440041e20)
+
+
+def test_records_named_as_the_elements(planets):
+    names = [planet.orbit_name for planet in read_planets()]
+    assert sorted(names) == sorted(planets.names)
+
+
+def test_missing_flyby_radius(planets):
+    with pytest.raises(ValueError, match='Mars'):
+        trajectorysearch.search(planets, [['EM Bary', 'Mars', 'Jupiter']],
+                                [59200.0 * DAY], rp_min={'Venus': 7.0e6},
+                                processes=1)
+
+
+def test_default_flyby_radius(planets):
+    front, fronts, stats = trajectorysearch.search(
+        planets, [['EM Bary', 'Venus', 'EM Bary']],
+        np.arange(59200.0, 59300.0, 20.0) * DAY, dv_max=np.inf,
+        processes=1)
+    assert stats['nodes'] > 0
+
+
+# A parallel kernel call in the parent first, then a search on two
+# processes; the workers must not inherit the kernel threads, or the
+# process never exits
+SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+import numpy as np
+import twobodykernels
+import trajectorysearch
+from secularelements import SecularElements
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    m = 20000
+    twobodykernels.kepler(rng.normal(size=(m, 3)) * 1.5e11,
+                          rng.normal(size=(m, 3)) * 2.0e4, 1.32712440041e20,
+                          np.full((m, 4), 1.0e6))
+    planets = SecularElements.from_csv('Data/planets_keplerian_elements.csv',
+                                       mu=1.32712440041e20)
+    departure = np.arange(59200.0, 59300.0, 20.0) * 86400.0
+    fronts = [trajectorysearch.search(
+        planets, [['EM Bary', 'Venus', 'EM Bary']], departure,
+        dv_max=np.inf, processes=processes)[0] for processes in (1, 2)]
+    print('match', bool((fronts[0]['dv'] == fronts[1]['dv']).all()))
+"""
+
+
+def test_pool_exits_after_parallel_kernel(tmp_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = tmp_path / 'run.py'
+    script.write_text(SCRIPT.format(root=root))
+    result = subprocess.run([sys.executable, str(script)], cwd=root,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert 'match True' in result.stdout
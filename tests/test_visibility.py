@@ -0,0 +1,77 @@
+"""Stale states of culled bodies and their trails"""
+
+import numpy as np
+
+from pytwobodyorbit import TwoBodyOrbit
+from trails import TrailBuffer
+from visibility import VisibilityCuller
+
+AU = 1.496e11
+DAY = 86400.0
+
+
+def _culler(m=4):
+    orbits = []
+    for k in range(m):
+        orbit = TwoBodyOrbit('{}'.format(k))
+        orbit.setOrbKepl(0.0, (1.0 + 0.5 * k) * AU, 0.1, 5.0, 10.0 * k,
+                         20.0, MA=30.0 * k)
+        orbits.append(orbit)
+    return VisibilityCuller(orbits)
+
+
+def _orbit_of(culler, k):
+    orbit = TwoBodyOrbit('copy')
+    orbit.setOrbCart(culler.t0[k], culler.r0[k], culler.v0[k])
+    return orbit
+
+
+def test_culled_rows_are_stale():
+    culler = _culler()
+    culler.update(10.0 * DAY)
+    assert not culler.stale.any()
+    mask = np.array([True, False, True, False])
+    culler.update(20.0 * DAY, mask)
+    assert (culler.stale == ~mask).all()
+    assert culler.revived.shape[0] == 0
+    # The time does not change: the culled rows stay behind
+    culler.update(20.0 * DAY, mask)
+    assert (culler.stale == ~mask).all()
+
+
+def test_revived_rows():
+    culler = _culler()
+    culler.update(10.0 * DAY, np.array([True, True, False, False]))
+    index, pos = culler.update(20.0 * DAY, np.array([True, False, True,
+                                                     False]))
+    assert list(index) == [0, 2]
+    assert list(culler.revived) == [2]
+    assert list(np.nonzero(culler.stale)[0]) == [1, 3]
+
+
+def test_stale_follows_catalog_changes():
+    culler = _culler()
+    culler.update(10.0 * DAY, np.array([True, False, True, True]))
+    culler.delete([0])
+    assert list(culler.stale) == [True, False, False]
+    culler.replace([1], [_orbit_of(culler, 0)])
+    assert list(culler.stale) == [True, True, False]
+    culler.extend([_orbit_of(culler, 0)])
+    assert list(culler.stale) == [True, True, False, True]
+
+
+def test_trail_restart():
+    trails = TrailBuffer(3, 8)
+    rng = np.random.default_rng(0)
+    for k in range(12):
+        trails.append(rng.normal(size=(3, 3)))
+    before = trails.points.copy().reshape(3, 16, 3)
+    trails.restart([1], np.array([[1.0, 2.0, 3.0]]))
+    points = trails.points.reshape(3, 16, 3)
+    assert (points[1] == np.array([1.0, 2.0, 3.0], dtype=np.float32)).all()
+    assert (points[[0, 2]] == before[[0, 2]]).all()
+    # The restarted trail is all newest samples, inside its own band
+    low, high = trails.scalar_range()
+    stamps = trails.stamps.reshape(3, 16)
+    assert (stamps[1] == trails.count + 8).all()
+    assert low + 8 <= stamps[1].min() and stamps[1].max() < low + 16
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Fading trails of moving bodies in one preallocated ring buffer
+
+TrailBuffer keeps the last n positions of m bodies in arrays that are
+allocated once and handed to VTK without copying (numpy_to_vtk with
+deep=False). Each new sample writes a few rows per body in place, so a
+frame costs O(m) whatever the trail length; the caller only marks the
+VTK arrays modified.
+
+Every trail is drawn as n line segments with their own two end points
+(2n points per body). Segment h joins samples h and h + 1 of the ring;
+the segment that would join the newest sample to the oldest one is kept
+at zero length, so the ring never needs new connectivity.
+
+Fading needs no per-frame rewrite of colors either: each point stores
+the number of the sample that wrote it, plus body * n. With the scalar
+range of scalar_range(), about [count - n, count - n + m * n], and the
+lookup table of lookup_table(), body b maps to band b of the table, and
+inside the band the opacity falls with the age of the point. Moving the
+scalar range by one each sample fades every trail at once.
+"""
+
+import numpy as np
+
+
+class TrailBuffer:
+    """Ring buffer of the last n positions of m bodies
+
+    """
+    def __init__(self, m, n, dtype=np.float32):
+        """
+        Args:
+            m: Number of bodies
+            n: Number of samples kept per body
+            dtype: dtype of the points (float32 is enough on screen)
+        """
+        if n < 2:
+            raise(ValueError('A trail needs at least two samples: '
+                             'trails.TrailBuffer'))
+        self.n = n
+        # Points 2k and 2k + 1 of a body are the ends of its segment k
+        self.points = np.zeros((m * 2 * n, 3), dtype=dtype)
+        self.stamps = np.zeros(m * 2 * n)
+        self.count = -1
+        self._bodies(m)
+
+    def _bodies(self, m):
+        # Per-body arrays for m bodies
+        self.m = m
+        self._base = np.arange(m) * 2 * self.n
+        self._offset = np.arange(m, dtype=float) * self.n
+        self._start = np.empty(m, dtype=np.int64)
+        self._end = np.empty(m, dtype=np.int64)
+        self._prev = np.empty(m, dtype=np.int64)
+        self._stamp = np.empty(m)
+
+    def __len__(self):
+        return self.m
+
+    def lines(self):
+        """Returns the segments as a legacy VTK cell array
+
+        Returns: cells
+            cells: Numpy array of int64 [2, a0, b0, 2, a1, b1, ...] for
+                vtkCellArray.SetCells(m * n, ...)
+        """
+        cells = np.empty((self.m * self.n, 3), dtype=np.int64)
+        cells[:, 0] = 2
+        cells[:, 1] = np.arange(self.m * self.n) * 2
+        cells[:, 2] = cells[:, 1] + 1
+        return cells.ravel()
+
+    def reset(self, pos):
+        """Starts all trails anew at the given positions
+
+        Args:
+            pos: Positions of the bodies, shape (m, 3)
+        """
+        self.points.reshape(self.m, 2 * self.n, 3)[:] = \
+            np.asarray(pos)[:, None, :]
+        self.count += self.n
+        self.stamps.reshape(self.m, 2 * self.n)[:] = \
+            (self.count + self._offset)[:, None]
+
+    def restart(self, index, pos):
+        """Starts the trails of some bodies anew, leaving the others
+
+        Args:
+            index: Indices of the bodies
+            pos: Their positions, shape (len(index), 3)
+        """
+        if self.count < 0:
+            return
+        index = np.asarray(index, dtype=int)
+        self.points.reshape(self.m, 2 * self.n, 3)[index] = \
+            np.asarray(pos)[:, None, :]
+        self.stamps.reshape(self.m, 2 * self.n)[index] = \
+            (self.count + self._offset[index])[:, None]
+
+    def extend(self, pos):
+        """Appends bodies after the existing ones, their trails starting at
+        the given positions
+
+        The points and stamps are new arrays: views of the old ones (e.g.
+        VTK arrays) must be made again.
+
+        Args:
+            pos: Positions of the new bodies, shape (k, 3)
+        """
+        pos = np.asarray(pos).reshape(-1, 3)
+        k = pos.shape[0]
+        self.points = np.concatenate([
+            self.points, np.repeat(pos, 2 * self.n, axis=0).astype(
+                self.points.dtype)])
+        self.stamps = np.concatenate([self.stamps,
+                                      np.zeros(k * 2 * self.n)])
+        self._bodies(self.m + k)
+        if self.count >= 0:
+            self.stamps.reshape(self.m, 2 * self.n)[self.m - k:] = \
+                (self.count + self._offset[self.m - k:])[:, None]
+
+    def delete(self, index):
+        """Removes bodies; the following ones move down to fill the gaps,
+        and their stamps to their new bands
+
+        The points and stamps are new arrays (see extend).
+
+        Args:
+            index: Indices of the bodies to remove
+        """
+        keep = np.ones(self.m, dtype=bool)
+        keep[np.asarray(index, dtype=int)] = False
+        shift = (np.arange(self.m) - (np.cumsum(keep) - 1))[keep] * self.n
+        self.points = self.points.reshape(self.m, 2 * self.n, 3)[keep] \
+            .reshape(-1, 3)
+        self.stamps = (self.stamps.reshape(self.m, 2 * self.n)[keep]
+                       - shift[:, None]).ravel()
+        self._bodies(int(keep.sum()))
+
+    def append(self, pos):
+        """Adds a sample of all bodies, writing 3 points per body in place
+
+        Args:
+            pos: Positions of the bodies, shape (m, 3)
+        """
+        if self.count < 0:
+            self.reset(pos)
+            return
+        self.count += 1
+        h = self.count % self.n
+        # Segment h - 1 ends at the new sample; segment h (from the new
+        # sample to the oldest one) has zero length until the next sample
+        np.add(self._base, 2 * h, out=self._start)
+        np.add(self._base, 2 * h + 1, out=self._end)
+        np.add(self._base, 2 * ((h - 1) % self.n) + 1, out=self._prev)
+        np.add(self._offset, self.count, out=self._stamp)
+        for index in (self._start, self._end, self._prev):
+            self.points[index] = pos
+            self.stamps[index] = self._stamp
+
+    def scalar_range(self):
+        """Returns the scalar range of the mapper for the current sample
+        """
+        # Half a sample off, so that the newest point of a body stays in
+        # its band and the oldest one does not fall in the band before
+        low = self.count - self.n + 0.5
+        return low, low + self.m * self.n
+
+    def lookup_table(self, colors, resolution=64, gamma=1.5):
+        """Returns RGBA values of the lookup table of the trails
+
+        Args:
+            colors: RGB colors of the bodies (0 to 255), shape (m, 3)
+            resolution: Number of table values per body
+            gamma: Exponent of the fading; 1 fades linearly with age
+        Returns: table
+            table: Numpy array of shape (m * resolution, 4), in 0 to 1
+        """
+        colors = np.asarray(colors, dtype=float).reshape(self.m, 3) / 255.0
+        alpha = (np.arange(resolution) / (resolution - 1.0)) ** gamma
+        table = np.empty((self.m, resolution, 4))
+        table[..., :3] = colors[:, None, :]
+        table[..., 3] = alpha[None, :]
+        return table.reshape(-1, 4)
+
+
+if __name__ == '__main__':
+    # Cost of one sample against the trail length
+    import time
+    m = 10000
+    for n in (64, 256, 1024):
+        trails = TrailBuffer(m, n)
+        pos = np.random.default_rng(0).normal(size=(m, 3))
+        trails.append(pos)
+        start = time.perf_counter()
+        for i in range(200):
+            trails.append(pos)
+        print('{} bodies, {:4d} samples: {:.1f} us per sample'.format(
+            m, n, (time.perf_counter() - start) / 200 * 1e6))
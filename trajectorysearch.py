@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""Multiple gravity-assist trajectory search
+
+A trajectory follows a sequence of planets, e.g. Earth - Venus - Earth -
+Jupiter: a launch from the first, a flyby of each intermediate planet
+and an arrival at the last. Every leg is a Lambert arc between planet
+positions from SecularElements (patched conics, no deep-space maneuvers).
+
+The search tree is expanded one leg at a time. All nodes of a level are
+combined with the time-of-flight grid of the next leg, and the resulting
+Lambert's problems are solved in batches by pytwobodyorbit.lambert_batch.
+A child is pruned as soon as
+  - its Lambert arc cannot be solved,
+  - its accumulated delta-v exceeds the budget dv_max,
+  - a hyperbolic excess velocity exceeds vinf_max, or
+  - the flyby needs a deflection that no pass above the minimum periapsis
+    radius can give.
+Flybys are powered: the delta-v is the periapsis impulse that matches
+the incoming and outgoing excess speeds at the periapsis radius that
+yields the required deflection.
+
+Departure dates are split into chunks that are searched by a process
+pool; each chunk returns its Pareto front of total delta-v versus flight
+time, and the fronts are merged.
+
+Run this module to search Earth - Jupiter transfers, direct and through
+Mars or Venus - Earth flybys:
+  python trajectorysearch.py [processes]
+"""
+
+import os
+import sys
+import math
+import time
+import numpy as np
+
+from pytwobodyorbit import lambert_batch
+from secularelements import AU
+from sharedpropagation import process_pool
+
+# Short names of the bodies of Data/planets_keplerian_elements.csv
+CODES = {'Me': 'Mercury', 'V': 'Venus', 'E': 'EM Bary', 'Ma': 'Mars',
+         'J': 'Jupiter', 'S': 'Saturn', 'U': 'Uranus', 'N': 'Neptune',
+         'P': 'Pluto'}
+
+DAY = 86400.0
+
+
+def parse_sequence(text):
+    """Returns the planet names of a sequence such as 'E-V-E-J'
+    """
+    return [CODES.get(code.strip(), code.strip()) for code in text.split('-')]
+
+
+def sequences(start, target, bodies, max_flybys):
+    """Enumerates flyby sequences from start to target
+
+    Args:
+        start, target: Names of the departure and arrival planets
+        bodies: Names of the planets that may be flown by
+        max_flybys: Largest number of flybys
+    Returns: seqs
+        seqs: List of lists of names, the direct transfer first
+    """
+    seqs = [[start, target]]
+    level = [[start]]
+    for n in range(max_flybys):
+        level = [seq + [body] for seq in level for body in bodies]
+        seqs += [seq + [target] for seq in level]
+    return seqs
+
+
+def tof_grid(planets, body1, body2, n=30, low=0.3, high=1.6):
+    """Times of flight around the Hohmann transfer time between two planets
+
+    Args:
+        planets: SecularElements
+        body1, body2: Names of the planets
+        n: Number of grid points
+        low, high: Range as multiples of the Hohmann time
+    Returns: tofs
+        tofs: Numpy array of shape (n,)
+    """
+    a1 = planets.elements[planets.names.index(body1), 0] * AU
+    a2 = planets.elements[planets.names.index(body2), 0] * AU
+    hohmann = math.pi * math.sqrt((0.5 * (a1 + a2)) ** 3 / planets.mu)
+    return np.linspace(low, high, n) * hohmann
+
+
+def flyby_dv(vin, vout, mu, rp_min, nbisect=40):
+    """Delta-v of powered flybys
+
+    Args:
+        vin, vout: Incoming and outgoing hyperbolic excess velocities,
+            shape (n, 3)
+        mu: Gravitational parameter of the planet
+        rp_min: Smallest periapsis radius
+        nbisect: Number of bisection steps on the periapsis radius
+    Returns: dv, feasible
+        dv: Periapsis impulse, shape (n,)
+        feasible: Boolean, shape (n,); False where the deflection is larger
+            than a pass at rp_min gives
+    """
+    a = np.sqrt((vin * vin).sum(axis=1))
+    b = np.sqrt((vout * vout).sum(axis=1))
+    with np.errstate(all='ignore'):
+        turn = np.arccos(np.clip((vin * vout).sum(axis=1) / (a * b), -1.0,
+                                 1.0))
+
+        def deflection(rp):
+            return np.arcsin(1.0 / (1.0 + rp * a * a / mu)) + \
+                np.arcsin(1.0 / (1.0 + rp * b * b / mu))
+
+        feasible = turn <= deflection(rp_min)
+        # The deflection decreases with rp; bisect on log(rp)
+        lo = np.full(a.shape, math.log(rp_min))
+        hi = lo + math.log(1e8)
+        for it in range(nbisect):
+            mid = 0.5 * (lo + hi)
+            above = deflection(np.exp(mid)) > turn
+            lo = np.where(above, mid, lo)
+            hi = np.where(above, hi, mid)
+        rp = np.exp(0.5 * (lo + hi))
+        dv = np.abs(np.sqrt(b * b + 2.0 * mu / rp) -
+                    np.sqrt(a * a + 2.0 * mu / rp))
+    return dv, feasible & np.isfinite(dv)
+
+
+def _states(planets, index, t):
+    # Positions and velocities of one planet at many times, computed once
+    # per distinct time
+    times, inverse = np.unique(t, return_inverse=True)
+    pos, vel = planets.posvelatt(times)
+    return pos[index][inverse.ravel()], vel[index][inverse.ravel()]
+
+
+def _search(planets, sequence, departure, tofs, dv_max, vinf_max, gm,
+            rp_min, arrival, batch):
+    """Searches one sequence for the given departure times
+
+    Returns: nodes, pruned, found
+        nodes: Number of Lambert arcs solved
+        pruned: Number of them that were pruned
+        found: Structured array of complete trajectories (_front_dtype of
+               the number of legs)
+    """
+    index = [planets.names.index(name) for name in sequence]
+    nlegs = len(sequence) - 1
+    t = np.asarray(departure, dtype=float)
+    dv = np.zeros(t.shape[0])
+    vinf_in = np.full((t.shape[0], 3), np.nan)
+    legs = np.zeros((t.shape[0], 0))
+    nodes = 0
+    pruned = 0
+    for leg in range(nlegs):
+        grid = np.asarray(tofs[leg], dtype=float)
+        kids_t, kids_dv, kids_vin, kids_legs = [], [], [], []
+        parents_per_batch = max(1, batch // grid.shape[0])
+        for s in range(0, t.shape[0], parents_per_batch):
+            sl = slice(s, s + parents_per_batch)
+            n = t[sl].shape[0]
+            t1 = np.repeat(t[sl], grid.shape[0])
+            tof = np.tile(grid, n)
+            t2 = t1 + tof
+            r1, v1p = _states(planets, index[leg], t1)
+            r2, v2p = _states(planets, index[leg + 1], t2)
+            with np.errstate(all='ignore'):
+                v1, v2 = lambert_batch(r1, r2, tof, planets.mu)
+            vout = v1 - v1p
+            vin = v2 - v2p
+            speed_out = np.sqrt((vout * vout).sum(axis=1))
+            if leg == 0:
+                cost = speed_out
+                ok = np.isfinite(cost)
+            else:
+                name = sequence[leg]
+                cost, ok = flyby_dv(np.repeat(vinf_in[sl], grid.shape[0],
+                                              axis=0), vout, gm[name],
+                                    rp_min[name])
+            total = np.repeat(dv[sl], grid.shape[0]) + cost
+            speed_in = np.sqrt((vin * vin).sum(axis=1))
+            if leg == nlegs - 1 and arrival:
+                total = total + speed_in
+            with np.errstate(invalid='ignore'):
+                ok &= (total <= dv_max) & (speed_out <= vinf_max) & \
+                    (speed_in <= vinf_max)
+            nodes += t1.shape[0]
+            pruned += int((~ok).sum())
+            kids_t.append(t2[ok])
+            kids_dv.append(total[ok])
+            kids_vin.append(vin[ok])
+            kids_legs.append(np.column_stack([np.repeat(legs[sl],
+                grid.shape[0], axis=0)[ok], tof[ok]]))
+        t = np.concatenate(kids_t) if kids_t else np.zeros(0)
+        dv = np.concatenate(kids_dv) if kids_dv else np.zeros(0)
+        vinf_in = np.concatenate(kids_vin) if kids_vin else np.zeros((0, 3))
+        legs = np.concatenate(kids_legs) if kids_legs \
+            else np.zeros((0, leg + 1))
+        if t.shape[0] == 0:
+            break
+    found = np.zeros(t.shape[0], dtype=_front_dtype(nlegs))
+    if t.shape[0]:
+        found['dv'] = dv
+        found['legs'] = legs
+        found['tof'] = legs.sum(axis=1)
+        found['departure'] = t - found['tof']
+    return nodes, pruned, found
+
+
+def _front_dtype(nlegs):
+    return np.dtype([('sequence', int), ('dv', float), ('tof', float),
+                     ('departure', float), ('legs', float, (nlegs,))])
+
+
+def pareto_front(dv, tof):
+    """Returns the indices of the points not dominated in (dv, tof)
+
+    Sorted by time of flight
+    """
+    order = np.lexsort((dv, tof))
+    best = np.minimum.accumulate(dv[order])
+    keep = np.ones(order.shape[0], dtype=bool)
+    keep[1:] = dv[order][1:] < best[:-1]
+    return order[keep]
+
+
+def _front(found):
+    if found.shape[0] == 0:
+        return found
+    return found[pareto_front(found['dv'], found['tof'])]
+
+
+def _search_chunk(planets, seqs, departure, tofs, dv_max, vinf_max, gm,
+                  rp_min, arrival, batch):
+    # Pareto front of every sequence over a chunk of departure times
+    nodes = 0
+    pruned = 0
+    fronts = []
+    for k, (sequence, grids) in enumerate(zip(seqs, tofs)):
+        n, p, found = _search(planets, sequence, departure, grids, dv_max,
+                              vinf_max, gm, rp_min, arrival, batch)
+        nodes += n
+        pruned += p
+        found['sequence'] = k
+        fronts.append(_front(found))
+    return nodes, pruned, fronts
+
+
+def search(planets, seqs, departure, tofs=None, dv_max=15000.0,
+           vinf_max=np.inf, gm=None, rp_min=None, arrival=True,
+           processes=None, chunks=None, batch=200000):
+    """Searches flyby sequences over departure and time-of-flight grids
+
+    Args:
+        planets: SecularElements of the planets
+        seqs: List of sequences of planet names (see sequences and
+            parse_sequence)
+        departure: Departure times, shape (n,)
+        tofs: For each sequence, a list of time-of-flight grids, one per
+            leg. Default is tof_grid for every leg
+        dv_max: Delta-v budget (launch excess speed, flybys and arrival)
+        vinf_max: Largest hyperbolic excess speed at any planet
+        gm: Gravitational parameters of the planets by name. Default is
+            perturbation.PLANET_GM
+        rp_min: Smallest flyby periapsis radius by name. Default is 1.1
+            times the equatorial radius
+        arrival: If True, the arrival excess speed counts in the delta-v
+            (rendezvous); if False, the last planet is flown by
+        processes: Number of worker processes. Default is os.cpu_count();
+            1 searches in this process
+        chunks: Number of departure chunks. Default is four per process
+        batch: Largest number of Lambert's problems solved at once
+    Returns: front, fronts, stats
+        front: Structured Numpy array with fields 'sequence' (index in
+            seqs), 'dv', 'tof', 'departure' and 'legs' (times of flight of
+            the legs, NaN past the last leg), sorted by flight time. The
+            Pareto front over all sequences
+        fronts: Pareto front of each sequence in the same format
+        stats: Dictionary with 'nodes' (Lambert arcs solved), 'pruned',
+            'pruning_rate', 'seconds' and 'nodes_per_second'
+    Exception:
+        ValueError: If gm or rp_min has no entry for a planet flown by,
+            raises ValueError
+    """
+    start = time.perf_counter()
+    seqs = [list(seq) for seq in seqs]
+    if tofs is None:
+        tofs = [[tof_grid(planets, a, b) for a, b in zip(seq[:-1], seq[1:])]
+                for seq in seqs]
+    if gm is None:
+        from perturbation import PLANET_GM
+        gm = PLANET_GM
+    if rp_min is None:
+        from solarsystem import read_planets
+        rp_min = {planet.orbit_name: planet.equatorial_radius * 1.1
+                  for planet in read_planets()}
+    missing = sorted({name for seq in seqs for name in seq[1:-1]
+                      if name not in gm or name not in rp_min})
+    if missing:
+        raise(ValueError('No GM or flyby radius for {}: '.format(
+            ', '.join(missing)) + 'trajectorysearch.search'))
+    departure = np.atleast_1d(np.asarray(departure, dtype=float))
+    processes = processes or os.cpu_count() or 1
+    nchunks = min(chunks or processes * 4, departure.shape[0])
+    parts = np.array_split(departure, max(nchunks, 1))
+    args = [(planets, seqs, part, tofs, dv_max, vinf_max, gm, rp_min,
+             arrival, batch) for part in parts]
+    if processes == 1:
+        results = [_search_chunk(*arg) for arg in args]
+    else:
+        with process_pool(processes) as pool:
+            results = pool.starmap(_search_chunk, args, chunksize=1)
+
+    nodes = sum(r[0] for r in results)
+    pruned = sum(r[1] for r in results)
+    nmax = max(len(seq) - 1 for seq in seqs)
+    dtype = _front_dtype(nmax)
+    fronts = []
+    for k in range(len(seqs)):
+        found = np.concatenate([r[2][k] for r in results])
+        merged = np.zeros(found.shape[0], dtype=dtype)
+        for key in ('sequence', 'dv', 'tof', 'departure'):
+            merged[key] = found[key]
+        merged['legs'] = np.nan
+        merged['legs'][:, :found['legs'].shape[1]] = found['legs']
+        fronts.append(_front(merged))
+    front = _front(np.concatenate(fronts)) if fronts else \
+        np.zeros(0, dtype=dtype)
+    seconds = time.perf_counter() - start
+    stats = {'nodes': nodes, 'pruned': pruned,
+             'pruning_rate': pruned / nodes if nodes else 0.0,
+             'seconds': seconds,
+             'nodes_per_second': nodes / seconds if seconds > 0 else np.inf}
+    return front, fronts, stats
+
+
+if __name__ == '__main__':
+    from secularelements import SecularElements
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    planets = SecularElements.from_csv('Data/planets_keplerian_elements.csv')
+    seqs = [parse_sequence('E-J'), parse_sequence('E-Ma-J'),
+            parse_sequence('E-V-E-J')]
+    tofs = [[np.linspace(500.0, 1800.0, 27) * DAY],
+            [np.linspace(100.0, 400.0, 31) * DAY,
+             np.linspace(400.0, 1600.0, 25) * DAY],
+            [np.linspace(80.0, 400.0, 33) * DAY,
+             np.linspace(100.0, 500.0, 41) * DAY,
+             np.linspace(500.0, 1800.0, 27) * DAY]]
+    # 2030 - 2033, every 4 days; Jupiter is flown by (no arrival burn)
+    departure = np.arange(62502.0, 63597.0, 4.0) * DAY
+    front, fronts, stats = search(planets, seqs, departure, tofs,
+                                  dv_max=9000.0, arrival=False,
+                                  processes=processes)
+    print('{} Lambert arcs in {:.2f} s: {:.0f} nodes/s, {:.1%} pruned'.format(
+        stats['nodes'], stats['seconds'], stats['nodes_per_second'],
+        stats['pruning_rate']))
+    for seq, f in zip(seqs, fronts):
+        label = '-'.join(name[:2] for name in seq)
+        if f.shape[0]:
+            print('{:14s} {:3d} points, best {:.2f} km/s'.format(
+                label, f.shape[0], f['dv'].min() / 1000.0))
+        else:
+            print('{:14s} none'.format(label))
+    print('Pareto front (all sequences):')
+    for row in front:
+        print('  {:14s} MJD {:8.1f}  {:6.2f} years  {:6.2f} km/s'.format(
+            '-'.join(name[:2] for name in seqs[row['sequence']]),
+            row['departure'] / DAY, row['tof'] / DAY / 365.25,
+            row['dv'] / 1000.0))
@@ -0,0 +1,766 @@
+# -*- coding: utf-8 -*-
+"""Array kernels for two-body propagation and Lambert's problem
+
+This module provides the inner loops used by the batch interfaces of
+pytwobodyorbit:
+  Propagate many states to many times (universal variable formulation)
+  State transition matrices of the propagation, in closed form
+  Solve many Lambert's problems at once
+
+Two backends implement the same kernels:
+  'numba': JIT-compiled kernels parallelized over bodies. Used when numba
+           can be imported.
+  'numpy': Pure NumPy kernels vectorized over bodies and times. Always
+           available.
+
+The backend is selected automatically on import. Set the environment
+variable PYTWOBODYORBIT_BACKEND to 'numpy' or 'numba' to override it, or
+call set_backend() at run time. The numba kernels live in numbakernels,
+which is imported on first use, so importing this module stays cheap.
+"""
+
+import os
+import math
+import importlib.util
+import numpy as np
+
+# Tolerances of the universal anomaly iteration. They follow the defaults
+# of scipy.optimize.newton used by TwoBodyOrbit.posvelatt
+KEPLER_TOL = 1.48e-8
+KEPLER_RTOL = 4.0 * np.finfo(float).eps
+KEPLER_MAXITER = 100
+
+# Tolerances of the z iteration for Lambert's problem. They follow the
+# defaults of scipy.optimize.bisect used by lambert
+LAMBERT_XTOL = 2e-12
+LAMBERT_RTOL = 8.88e-16
+LAMBERT_MAXITER = 100
+
+# Initial guesses of the universal anomaly: linear in the flight time, or
+# (elliptic orbits) from a series solution of Kepler's equation, which
+# saves one or two Newton steps
+GUESS_LINEAR = 0
+GUESS_KEPLER = 1
+
+# Accuracy tiers. A tier sets the convergence control of the universal
+# anomaly and Lambert iterations, the initial guess and the dtype of the
+# results. Worst relative errors (against 'high') and throughput measured
+# with `python twobodykernels.py` (10000 orbits from 0.5 to 5 au, some of
+# them hyperbolic, 16 epochs within 10 years; one CPU):
+#   tier      backend  position  velocity  Lambert  kepler/s  lambert/s
+#   render    numba    6e-8      6e-8      1e-6     2.6e6     4.3e5
+#   standard  numba    2e-14     1e-14     2e-11    2.2e6     2.6e5
+#   high      numba    -         -         -        2.2e6     2.1e5
+#   render    numpy    6e-8      6e-8      4e-7     1.4e6     3.1e5
+#   standard  numpy    3e-14     1e-14     6e-11    8.9e5     1.6e5
+#   high      numpy    -         -         -        1.1e6     1.7e5
+# 'render' is meant for placing bodies on the screen: its error is that of
+# float32, 9 km at 1 au. 'standard' is the default and matches the scipy
+# based TwoBodyOrbit.posvelatt and lambert.
+PRECISIONS = {
+    'render': dict(kepler_tol=0.0, kepler_rtol=1e-7, kepler_maxiter=50,
+                   lambert_xtol=1e-7, lambert_rtol=1e-7, lambert_maxiter=40,
+                   guess=GUESS_KEPLER, dtype=np.float32),
+    'standard': dict(kepler_tol=KEPLER_TOL, kepler_rtol=KEPLER_RTOL,
+                     kepler_maxiter=KEPLER_MAXITER,
+                     lambert_xtol=LAMBERT_XTOL, lambert_rtol=LAMBERT_RTOL,
+                     lambert_maxiter=LAMBERT_MAXITER, guess=GUESS_LINEAR,
+                     dtype=np.float64),
+    'high': dict(kepler_tol=0.0, kepler_rtol=1e-14,
+                 kepler_maxiter=KEPLER_MAXITER, lambert_xtol=1e-15,
+                 lambert_rtol=LAMBERT_RTOL, lambert_maxiter=200,
+                 guess=GUESS_KEPLER, dtype=np.float64)}
+
+# Below this |z| Stumpff functions are evaluated by their power series
+_SERIES_LIMIT = 0.1
+_CCOEF = tuple(1.0 / math.factorial(2 * k + 2) for k in range(7))
+_SCOEF = tuple(1.0 / math.factorial(2 * k + 3) for k in range(7))
+_C4COEF = tuple(1.0 / math.factorial(2 * k + 4) for k in range(7))
+_C5COEF = tuple(1.0 / math.factorial(2 * k + 5) for k in range(7))
+_ZMAX = (math.pi * 2.0) ** 2
+# The parabolic solution (Barker's equation) replaces the initial guess
+# where its |z| is below these limits, for elliptic and hyperbolic states
+# and each kind of guess: the hyperbolic guess is only good far from the
+# parabola, the series solution of Kepler's equation up to e ~ 0.9. With
+# them no element of a comet catalog needs bisection steps (see comets.py)
+_PARABOLIC_LIMITS = {GUESS_LINEAR: (2.0, 10.0), GUESS_KEPLER: (1.0, 10.0)}
+# Below this eccentricity the parabolic guess hardly ever helps and is not
+# computed
+_PARABOLIC_ECC = 0.5
+
+
+def _stumpff(z):
+    """Returns Stumpff functions C(z) and S(z) for an array of z
+    """
+    z = np.asarray(z, dtype=float)
+    c = np.empty_like(z)
+    s = np.empty_like(z)
+    pos = z > _SERIES_LIMIT
+    neg = z < (-1.0) * _SERIES_LIMIT
+    small = ~(pos | neg)
+    if pos.any():
+        zp = z[pos]
+        sz = np.sqrt(zp)
+        c[pos] = (1.0 - np.cos(sz)) / zp
+        s[pos] = (sz - np.sin(sz)) / sz ** 3
+    if neg.any():
+        zn = z[neg]
+        sz = np.sqrt((-1.0) * zn)
+        c[neg] = (1.0 - np.cosh(sz)) / zn
+        s[neg] = (np.sinh(sz) - sz) / sz ** 3
+    if small.any():
+        zs = z[small]
+        # C(z) = sum (-z)^k / (2k+2)!,  S(z) = sum (-z)^k / (2k+3)!
+        cs = np.zeros_like(zs)
+        ss = np.zeros_like(zs)
+        for k in range(6, -1, -1):
+            cs = cs * (-zs) + _CCOEF[k]
+            ss = ss * (-zs) + _SCOEF[k]
+        c[small] = cs
+        s[small] = ss
+    return c, s
+
+
+def _stumpff45(z, c, s):
+    """Returns the Stumpff functions c4(z) and c5(z) from C(z) and S(z)
+    """
+    with np.errstate(all='ignore'):
+        c4 = (0.5 - c) / z
+        c5 = (1.0 / 6.0 - s) / z
+    small = np.abs(z) <= _SERIES_LIMIT
+    if small.any():
+        zs = z[small]
+        c4s = np.zeros_like(zs)
+        c5s = np.zeros_like(zs)
+        for k in range(6, -1, -1):
+            c4s = c4s * (-zs) + _C4COEF[k]
+            c5s = c5s * (-zs) + _C5COEF[k]
+        c4[small] = c4s
+        c5[small] = c5s
+    return c4, c5
+
+
+def _parabolic_guess(r0, sig0, sqmu, dt):
+    """Returns the universal anomaly of the parabola through the same state
+
+    With alpha = 0 the universal Kepler equation is Barker's equation, the
+    cubic x^3 + 3 sig0 x^2 + 6 r0 x - 6 sqrt(mu) dt = 0, solved here in
+    closed form. NaN where the cubic has three real roots (only for
+    hyperbolic states far from the parabola).
+    """
+    # x = y - sig0 gives y^3 + p y + q = 0, with p >= 0 for alpha >= 0
+    p = 6.0 * r0 - 3.0 * sig0 * sig0
+    q = 2.0 * sig0 ** 3 - 6.0 * r0 * sig0 - 6.0 * sqmu * dt
+    with np.errstate(all='ignore'):
+        # Cardano's formula without cancellation: u is the larger term
+        u = (-1.0) * np.copysign(np.cbrt(0.5 * np.abs(q) + np.sqrt(
+            0.25 * q * q + p ** 3 / 27.0)), q)
+        y = np.where(u != 0.0, u - p / (3.0 * u), 0.0)
+    return y - sig0
+
+
+def _anomaly_numpy(r0, v0, mu, dt, tol, rtol, maxiter, guess=GUESS_LINEAR,
+                   counts=None):
+    """Solves the universal Kepler equation, vectorized over all elements
+
+    Args:
+        r0, v0: Initial positions and velocities, shape (m, 3)
+        mu: Gravitational parameters, shape (m,)
+        dt: Time from epoch, shape (m, k)
+        guess: GUESS_LINEAR or GUESS_KEPLER (see PRECISIONS)
+        counts: Optional int array of shape (2, m, k), filled with the
+            number of iterations and of bisection steps of each element
+    Returns: x, dt, nrev, niter
+        x: Universal anomaly at the reduced time, shape (m, k)
+        dt: Time from epoch less whole periods, shape (m, k)
+        nrev: Number of periods taken off dt, shape (m, k)
+        niter: Number of iterations spent
+    """
+    sqmu = np.sqrt(mu)[:, None]
+    rlen = np.sqrt(np.einsum('ij,ij->i', r0, r0))
+    vlen2 = np.einsum('ij,ij->i', v0, v0)
+    rdv = np.einsum('ij,ij->i', r0, v0)
+    h = np.cross(r0, v0)
+    p = np.einsum('ij,ij->i', h, h) / mu
+    alpha = 2.0 / rlen - vlen2 / mu       # reciprocal of semi-major axis
+    ecc = np.sqrt(np.maximum(1.0 - p * alpha, 0.0))
+    q = p / (1.0 + ecc)                   # periapsis distance
+
+    sig0 = (rdv / np.sqrt(mu))[:, None]
+    r0c = rlen[:, None]
+    alc = alpha[:, None]
+
+    # Reduce elliptic flight times to (-P/2, P/2]
+    dt = np.array(dt, dtype=float)
+    ell = alpha > 0.0
+    if ell.any():
+        per = np.ones(alpha.shape)
+        per[ell] = math.pi * 2.0 / np.sqrt(mu[ell]) / alpha[ell] ** 1.5
+        perc = per[:, None]
+        nrev = np.where(ell[:, None], np.floor(dt / perc + 0.5), 0.0)
+        dt = dt - nrev * perc
+
+    # Bracket the root: q <= r along the trajectory, so |x| <= sqmu*|dt|/q
+    xb = sqmu * dt / q[:, None]
+    lo = np.minimum(xb, 0.0)
+    hi = np.maximum(xb, 0.0)
+
+    # Initial guess
+    x = sqmu * dt * alc
+    hyp = (alc < 0.0) & (dt != 0.0)
+    if hyp.any():
+        with np.errstate(all='ignore'):
+            a = 1.0 / alc
+            sgn = np.sign(dt)
+            xh = sgn * np.sqrt((-1.0) * a) * np.log((-2.0) * sqmu ** 2 * alc
+                * dt / (rdv[:, None] + sgn * np.sqrt((-1.0) * sqmu ** 2 * a)
+                * (1.0 - r0c * alc)))
+        x = np.where(hyp, xh, x)
+    if guess == GUESS_KEPLER and ell.any():
+        # Eccentric anomaly from the mean anomaly by the second order
+        # series E = M + e sin M + e^2 sin 2M / 2
+        with np.errstate(all='ignore'):
+            sqa = 1.0 / np.sqrt(alc)
+            ecos0 = 1.0 - r0c * alc
+            esin0 = sig0 * np.sqrt(alc)
+            ecc0 = np.sqrt(ecos0 ** 2 + esin0 ** 2)
+            ea0 = np.arctan2(esin0, ecos0)
+            ma = ea0 - esin0 + sqmu * alc / sqa * dt
+            ea = ma + ecc0 * np.sin(ma) + 0.5 * ecc0 ** 2 * np.sin(2.0 * ma)
+            x = np.where(ell[:, None], sqa * (ea - ea0), x)
+    # Near the parabola the other guesses are poor (or overflow); start
+    # from the parabola instead
+    xp = _parabolic_guess(r0c, sig0, sqmu, dt)
+    with np.errstate(invalid='ignore'):
+        limits = _PARABOLIC_LIMITS[guess]
+        near = (np.abs(alc) * xp * xp < np.where(alc > 0.0, limits[0],
+                                                 limits[1])) \
+            & (ecc[:, None] >= _PARABOLIC_ECC)
+    x = np.where(near, xp, x)
+    x = np.where(np.isfinite(x), x, sqmu * dt / r0c)
+    x = np.clip(x, lo, hi)
+
+    # Elements leave the iteration as soon as they converge (as in the
+    # numba kernel), so a few slow ones do not hold up the rest
+    shape = x.shape
+    xs = x.ravel().copy()
+    act = np.arange(xs.shape[0])
+    ax = xs.copy()
+    asqmu, asig0, ar0c, aalc = [np.broadcast_to(v, shape).ravel()
+                                for v in (sqmu, sig0, r0c, alc)]
+    adt = dt.ravel()
+    alo = lo.ravel()
+    ahi = hi.ravel()
+    if counts is not None:
+        counts[:] = 0
+        ccounts = counts.reshape(2, -1)
+    niter = 0
+    for niter in range(1, maxiter + 1):
+        z = aalc * ax * ax
+        c, s = _stumpff(z)
+        x2 = ax * ax
+        fx = (asig0 * x2 * c + (1.0 - ar0c * aalc) * x2 * ax * s
+              + ar0c * ax) / asqmu - adt
+        r = x2 * c + asig0 * ax * (1.0 - z * s) + ar0c * (1.0 - z * c)
+        below = fx < 0.0
+        alo = np.where(below, ax, alo)
+        ahi = np.where(below, ahi, ax)
+        xn = ax - fx * asqmu / r
+        outside = ~((xn >= alo) & (xn <= ahi))
+        xn = np.where(outside, 0.5 * (alo + ahi), xn)
+        done = np.abs(xn - ax) <= tol + rtol * np.abs(xn)
+        if counts is not None:
+            ccounts[0, act] += 1
+            ccounts[1, act] += outside
+        ax = xn
+        if done.any():
+            xs[act[done]] = xn[done]
+            keep = ~done
+            act, ax, asqmu, asig0, ar0c, aalc, adt, alo, ahi = [
+                v[keep] for v in (act, ax, asqmu, asig0, ar0c, aalc, adt,
+                                  alo, ahi)]
+            if act.shape[0] == 0:
+                break
+    xs[act] = ax
+    x = xs.reshape(shape)
+    if not ell.any():
+        nrev = np.zeros(dt.shape)
+    return x, dt, nrev, niter
+
+
+def _kepler_numpy(r0, v0, mu, dt, tol, rtol, maxiter, guess=GUESS_LINEAR):
+    """Universal variable propagation, vectorized over all elements
+
+    Args:
+        r0, v0: Initial positions and velocities, shape (m, 3)
+        mu: Gravitational parameters, shape (m,)
+        dt: Time from epoch, shape (m, k)
+    Returns: pos, vel, niter
+        pos, vel: States at dt, shape (m, k, 3)
+        niter: Number of iterations spent
+    """
+    x, dt, nrev, niter = _anomaly_numpy(r0, v0, mu, dt, tol, rtol, maxiter,
+                                        guess)
+    sqmu = np.sqrt(mu)[:, None]
+    r0c = np.sqrt(np.einsum('ij,ij->i', r0, r0))[:, None]
+    sig0 = (np.einsum('ij,ij->i', r0, v0) / np.sqrt(mu))[:, None]
+    alc = (2.0 / r0c[:, 0] - np.einsum('ij,ij->i', v0, v0) / mu)[:, None]
+    z = alc * x * x
+    c, s = _stumpff(z)
+    x2 = x * x
+    r = x2 * c + sig0 * x * (1.0 - z * s) + r0c * (1.0 - z * c)
+    val_f = 1.0 - x2 / r0c * c
+    val_g = dt - x2 * x / sqmu * s
+    val_fd = sqmu / r / r0c * x * (z * s - 1.0)
+    val_gd = 1.0 - x2 / r * c
+    pos = val_f[..., None] * r0[:, None, :] + val_g[..., None] * v0[:, None, :]
+    vel = val_fd[..., None] * r0[:, None, :] + val_gd[..., None] * v0[:, None, :]
+    return pos, vel, niter
+
+
+def _stm_numpy(r0, v0, mu, x, dt, nrev):
+    """States and state transition matrices from solved universal anomalies
+
+    The f and g functions depend on the initial state through |r0|,
+    r0.v0 / sqrt(mu), the reciprocal semi-major axis alpha and the
+    universal anomaly x; x in turn depends on them through Kepler's
+    equation. The matrices are assembled from the partial derivatives of
+    f, g, fdot and gdot with respect to these scalars, with the universal
+    functions U0 to U5 and dU/dalpha = -(x U[k+1] - k U[k+2]) / 2.
+
+    Args:
+        r0, v0: Initial positions and velocities, shape (m, 3)
+        mu: Gravitational parameters, shape (m,)
+        x, dt, nrev: Results of the anomaly kernel, shape (m, k)
+    Returns: pos, vel, stm
+        pos, vel: States at dt, shape (m, k, 3)
+        stm: d(pos, vel) / d(r0, v0), shape (m, k, 6, 6)
+    """
+    sqmu = np.sqrt(mu)[:, None]
+    rlen = np.sqrt(np.einsum('ij,ij->i', r0, r0))
+    r0c = rlen[:, None]
+    sig0 = (np.einsum('ij,ij->i', r0, v0) / np.sqrt(mu))[:, None]
+    alpha = 2.0 / rlen - np.einsum('ij,ij->i', v0, v0) / mu
+    alc = alpha[:, None]
+
+    # The anomaly of the whole flight time, with the periods taken off dt
+    with np.errstate(all='ignore'):
+        xrev = np.where(nrev != 0.0, nrev * math.pi * 2.0 / np.sqrt(alc), 0.0)
+    xf = x + xrev
+    z = alc * xf * xf
+    c, s = _stumpff(z)
+    c4, c5 = _stumpff45(z, c, s)
+    x2 = xf * xf
+    u2 = x2 * c
+    u3 = x2 * xf * s
+    u4 = x2 * x2 * c4
+    u5 = x2 * x2 * xf * c5
+    u1 = xf - alc * u3
+    u0 = 1.0 - alc * u2
+    du0 = (-0.5) * xf * u1
+    du1 = (-0.5) * (xf * u2 - u3)
+    du2 = (-0.5) * (xf * u3 - 2.0 * u4)
+    du3 = (-0.5) * (xf * u4 - 3.0 * u5)
+    r = r0c * u0 + sig0 * u1 + u2
+
+    # Values of f, g, fdot, gdot as in _kepler_numpy
+    zr = alc * x * x
+    cr, sr = _stumpff(zr)
+    rr = x * x * cr + sig0 * x * (1.0 - zr * sr) + r0c * (1.0 - zr * cr)
+    val_f = 1.0 - x * x / r0c * cr
+    val_g = dt - x * x * x / sqmu * sr
+    val_fd = sqmu / rr / r0c * x * (zr * sr - 1.0)
+    val_gd = 1.0 - x * x / rr * cr
+
+    # Partial derivatives of x, then total derivatives of r, f, g, fdot,
+    # gdot with respect to (alpha, |r0|, sig0)
+    dx = ((-1.0) * (r0c * du1 + sig0 * du2 + du3) / r,
+          (-1.0) * u1 / r, (-1.0) * u2 / r)
+    r_x = (-1.0) * r0c * alc * u1 + sig0 * u0 + u1
+    dr = (r0c * du0 + sig0 * du1 + du2 + r_x * dx[0],
+          u0 + r_x * dx[1], u1 + r_x * dx[2])
+    du1t = (du1 + u0 * dx[0], u0 * dx[1], u0 * dx[2])
+    du2t = (du2 + u1 * dx[0], u1 * dx[1], u1 * dx[2])
+    df = ((-1.0) * du2t[0] / r0c, (-1.0) * du2t[1] / r0c + u2 / r0c ** 2,
+          (-1.0) * du2t[2] / r0c)
+    dg = ((-1.0) * (du3 + u2 * dx[0]) / sqmu, (-1.0) * u2 * dx[1] / sqmu,
+          (-1.0) * u2 * dx[2] / sqmu)
+    dfd = [(-1.0) * sqmu / r0c * (du1t[q] / r - u1 * dr[q] / r ** 2)
+           for q in range(3)]
+    dfd[1] = dfd[1] + sqmu * u1 / r / r0c ** 2
+    dgd = [(-1.0) * (du2t[q] / r - u2 * dr[q] / r ** 2) for q in range(3)]
+
+    # Gradients of (alpha, |r0|, sig0) with respect to r0 and v0
+    ga_r = ((-2.0) / rlen ** 3)[:, None] * r0
+    gr_r = r0 / rlen[:, None]
+    gs = (r0 / np.sqrt(mu)[:, None], v0 / np.sqrt(mu)[:, None])
+    ga_v = ((-2.0) / mu)[:, None] * v0
+
+    def grads(d):
+        gr0 = d[0][..., None] * ga_r[:, None, :] + \
+            d[1][..., None] * gr_r[:, None, :] + d[2][..., None] * gs[1][:, None, :]
+        gv0 = d[0][..., None] * ga_v[:, None, :] + \
+            d[2][..., None] * gs[0][:, None, :]
+        return gr0, gv0
+
+    eye = np.eye(3)
+    rc = r0[:, None, :, None]
+    vc = v0[:, None, :, None]
+    m, k = x.shape
+    stm = np.empty((m, k, 6, 6))
+    for row, (h1, h2, d1, d2) in enumerate(((val_f, val_g, df, dg),
+                                            (val_fd, val_gd, dfd, dgd))):
+        g1r, g1v = grads(d1)
+        g2r, g2v = grads(d2)
+        sl = slice(row * 3, row * 3 + 3)
+        stm[:, :, sl, :3] = h1[..., None, None] * eye \
+            + rc * g1r[..., None, :] + vc * g2r[..., None, :]
+        stm[:, :, sl, 3:] = h2[..., None, None] * eye \
+            + rc * g1v[..., None, :] + vc * g2v[..., None, :]
+    pos = val_f[..., None] * r0[:, None, :] + val_g[..., None] * v0[:, None, :]
+    vel = val_fd[..., None] * r0[:, None, :] + val_gd[..., None] * v0[:, None, :]
+    return pos, vel, stm
+
+
+def _lambert_numpy(ipos, tpos, targett, mu, ccw, xtol, rtol, maxiter):
+    """Lambert's problem, vectorized over all elements
+
+    Args:
+        ipos, tpos: Initial and terminal positions, shape (n, 3)
+        targett: Flight times, shape (n,)
+        mu: Gravitational parameters, shape (n,)
+        ccw: Orbital direction flags, shape (n,)
+    Returns: ivel, tvel
+        ivel, tvel: Velocities, shape (n, 3). NaN where unsolvable
+    """
+    r1 = np.sqrt(np.einsum('ij,ij->i', ipos, ipos))
+    r2 = np.sqrt(np.einsum('ij,ij->i', tpos, tpos))
+    r1cr2 = np.cross(ipos, tpos)
+    r1dr2 = np.einsum('ij,ij->i', ipos, tpos)
+    sindnu = np.sqrt(np.einsum('ij,ij->i', r1cr2, r1cr2)) / r1 / r2
+    sindnu = np.where(r1cr2[:, 2] < 0.0, (-1.0) * sindnu, sindnu)
+    sindnu = np.where(ccw, sindnu, (-1.0) * sindnu)
+    cosdnu = r1dr2 / r1 / r2
+    with np.errstate(all='ignore'):
+        A = np.sqrt(r1 * r2) * sindnu / np.sqrt(1.0 - cosdnu)
+    r1pr2 = r1 + r2
+    sqmu = np.sqrt(mu)
+
+    dnu = np.arctan2(sindnu, cosdnu)
+    dnu = np.where(dnu < 0.0, dnu + math.pi * 2.0, dnu)
+    bad = (dnu < 0.001) | (dnu > (math.pi * 2.0 - 0.001)) \
+        | ((dnu - math.pi) ** 2 < 0.00001 ** 2)
+
+    def _func(z):
+        c, s = _stumpff(z)
+        with np.errstate(invalid='ignore'):
+            val_y = r1pr2 - A * (1.0 - z * s) / np.sqrt(c)
+            val_x = np.sqrt(val_y / c)
+            t = (val_x ** 3 * s + A * np.sqrt(val_y)) / sqmu
+        # Where y < 0, the flight time is shorter than any solution
+        return np.where(np.isfinite(t), t - targett, -1.0)
+
+    lo = np.full(r1.shape, (-1.0) * _ZMAX)
+    hi = np.full(r1.shape, _ZMAX - 1e-6)
+    bad |= ~(_func(hi) > 0.0) | ~(_func(lo) <= 0.0)
+    for i in range(maxiter):
+        mid = 0.5 * (lo + hi)
+        below = _func(mid) < 0.0
+        lo = np.where(below, mid, lo)
+        hi = np.where(below, hi, mid)
+        if np.all(hi - lo <= xtol + rtol * np.abs(mid)):
+            break
+    zn = 0.5 * (lo + hi)
+
+    c, s = _stumpff(zn)
+    with np.errstate(all='ignore'):
+        val_y = r1pr2 - A * (1.0 - zn * s) / np.sqrt(c)
+        val_f = 1.0 - val_y / r1
+        val_g = A * np.sqrt(val_y) / sqmu
+        val_gd = 1.0 - val_y / r2
+        ivel = (tpos - val_f[:, None] * ipos) / val_g[:, None]
+        tvel = (val_gd[:, None] * tpos - ipos) / val_g[:, None]
+    ivel[bad] = np.nan
+    tvel[bad] = np.nan
+    return ivel, tvel
+
+
+BACKENDS = ('numba', 'numpy') if importlib.util.find_spec('numba') \
+    is not None else ('numpy',)
+_backend = BACKENDS[0]
+_numba_kernels = None
+
+
+def _kernels():
+    # Imports (and compiles or loads from cache) the numba kernels
+    global _numba_kernels
+    if _numba_kernels is None:
+        import numbakernels
+        _numba_kernels = numbakernels
+    return _numba_kernels
+
+
+def set_backend(name):
+    """Selects the kernel backend
+
+    Args:
+        name: 'numba' or 'numpy'
+    Exceptions:
+        ValueError: If the backend is not available, raises ValueError
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise(ValueError('Backend {} is not available: '.format(name) +
+                         'twobodykernels.set_backend'))
+    _backend = name
+
+
+def get_backend():
+    """Returns the name of the current kernel backend
+    """
+    return _backend
+
+
+def set_num_threads(n):
+    """Sets the number of threads of the numba kernels
+
+    Has no effect with the 'numpy' backend.
+    """
+    if _backend == 'numba':
+        _kernels().numba.set_num_threads(n)
+
+
+if os.environ.get('PYTWOBODYORBIT_BACKEND'):
+    set_backend(os.environ['PYTWOBODYORBIT_BACKEND'])
+
+_precision = 'standard'
+
+
+def set_precision(name):
+    """Selects the default accuracy tier of the kernels
+
+    Args:
+        name: 'render', 'standard' or 'high' (see PRECISIONS)
+    Exceptions:
+        ValueError: If the tier is unknown, raises ValueError
+    """
+    global _precision
+    if name not in PRECISIONS:
+        raise(ValueError('Unknown precision {}: '.format(name) +
+                         'twobodykernels.set_precision'))
+    _precision = name
+
+
+def get_precision():
+    """Returns the name of the default accuracy tier
+    """
+    return _precision
+
+
+def precision_settings(precision=None):
+    """Returns the settings of an accuracy tier
+
+    Args:
+        precision: Name of the tier. Default is the tier set by
+            set_precision()
+    Returns: settings
+        settings: dict with kepler_tol, kepler_rtol, kepler_maxiter,
+            lambert_xtol, lambert_rtol, lambert_maxiter, guess and dtype
+    Exceptions:
+        ValueError: If the tier is unknown, raises ValueError
+    """
+    name = _precision if precision is None else precision
+    if name not in PRECISIONS:
+        raise(ValueError('Unknown precision {}: '.format(name) +
+                         'twobodykernels.precision_settings'))
+    return PRECISIONS[name]
+
+
+if os.environ.get('PYTWOBODYORBIT_PRECISION'):
+    set_precision(os.environ['PYTWOBODYORBIT_PRECISION'])
+
+
+def _kepler_control(precision, tol, rtol, maxiter):
+    # Tier settings, overridden by the arguments that are given
+    settings = precision_settings(precision)
+    return (settings['kepler_tol'] if tol is None else tol,
+            settings['kepler_rtol'] if rtol is None else rtol,
+            settings['kepler_maxiter'] if maxiter is None else maxiter,
+            settings['guess'], settings['dtype'])
+
+
+def kepler(r0, v0, mu, dt, tol=None, rtol=None, maxiter=None,
+           precision=None):
+    """Propagates m states to k times each
+
+    Args:
+        r0: Positions at epoch, shape (m, 3)
+        v0: Velocities at epoch, shape (m, 3)
+        mu: Gravitational parameter, scalar or shape (m,)
+        dt: Time from epoch, shape (m, k)
+        tol, rtol, maxiter: Convergence control of the universal anomaly.
+            Default is that of the accuracy tier
+        precision: Accuracy tier ('render', 'standard' or 'high'). Default
+            is the tier set by set_precision()
+    Returns: pos, vel
+        pos: Positions, shape (m, k, 3)
+        vel: Velocities, shape (m, k, 3)
+        The dtype is that of the tier (float32 for 'render')
+    """
+    tol, rtol, maxiter, guess, dtype = _kepler_control(precision, tol, rtol,
+                                                       maxiter)
+    r0 = np.ascontiguousarray(r0, dtype=float)
+    v0 = np.ascontiguousarray(v0, dtype=float)
+    dt = np.ascontiguousarray(dt, dtype=float)
+    mu = np.ascontiguousarray(np.broadcast_to(np.asarray(mu, dtype=float),
+                                              (r0.shape[0],)))
+    if _backend == 'numba':
+        m, k = dt.shape
+        pos = np.empty((m, k, 3))
+        vel = np.empty((m, k, 3))
+        iters = np.empty(m, dtype=np.int64)
+        _kernels()._kepler_nb(r0, v0, mu, dt, tol, rtol, maxiter, guess, pos,
+                              vel, iters)
+    else:
+        pos, vel, niter = _kepler_numpy(r0, v0, mu, dt, tol, rtol, maxiter,
+                                        guess)
+    return pos.astype(dtype, copy=False), vel.astype(dtype, copy=False)
+
+
+def kepler_stm(r0, v0, mu, dt, tol=None, rtol=None, maxiter=None,
+               precision=None):
+    """Propagates m states to k times each, with state transition matrices
+
+    Args:
+        r0: Positions at epoch, shape (m, 3)
+        v0: Velocities at epoch, shape (m, 3)
+        mu: Gravitational parameter, scalar or shape (m,)
+        dt: Time from epoch, shape (m, k)
+        tol, rtol, maxiter: Convergence control of the universal anomaly.
+            Default is that of the accuracy tier
+        precision: Accuracy tier. Default is the tier set by set_precision()
+    Returns: pos, vel, stm
+        pos: Positions, shape (m, k, 3)
+        vel: Velocities, shape (m, k, 3)
+        stm: Partial derivatives of (pos, vel) with respect to (r0, v0),
+             shape (m, k, 6, 6)
+        The dtype is that of the tier (float32 for 'render')
+    """
+    tol, rtol, maxiter, guess, dtype = _kepler_control(precision, tol, rtol,
+                                                       maxiter)
+    r0 = np.ascontiguousarray(r0, dtype=float)
+    v0 = np.ascontiguousarray(v0, dtype=float)
+    dt = np.ascontiguousarray(dt, dtype=float)
+    mu = np.ascontiguousarray(np.broadcast_to(np.asarray(mu, dtype=float),
+                                              (r0.shape[0],)))
+    if _backend == 'numba':
+        x = np.empty(dt.shape)
+        dtr = np.empty(dt.shape)
+        nrev = np.empty(dt.shape)
+        _kernels()._anomaly_nb(r0, v0, mu, dt, tol, rtol, maxiter, guess, x,
+                               dtr, nrev)
+    else:
+        x, dtr, nrev, niter = _anomaly_numpy(r0, v0, mu, dt, tol, rtol,
+                                             maxiter, guess)
+    return tuple(v.astype(dtype, copy=False)
+                 for v in _stm_numpy(r0, v0, mu, x, dtr, nrev))
+
+
+def lambert(ipos, tpos, targett, mu, ccw=True, xtol=None, rtol=None,
+            maxiter=None, precision=None):
+    """Solves n Lambert's problems
+
+    Args:
+        ipos: Initial positions, shape (n, 3)
+        tpos: Terminal positions, shape (n, 3)
+        targett: Flight times, shape (n,)
+        mu: Gravitational parameter, scalar or shape (n,)
+        ccw: Flag(s) for orbital direction, scalar or shape (n,)
+        xtol, rtol, maxiter: Convergence control of the z iteration.
+            Default is that of the accuracy tier
+        precision: Accuracy tier. Default is the tier set by set_precision()
+    Returns: ivel, tvel
+        ivel: Initial velocities, shape (n, 3)
+        tvel: Terminal velocities, shape (n, 3)
+        Rows for which the problem could not be solved are NaN. The dtype
+        is that of the tier (float32 for 'render')
+    """
+    settings = precision_settings(precision)
+    xtol = settings['lambert_xtol'] if xtol is None else xtol
+    rtol = settings['lambert_rtol'] if rtol is None else rtol
+    maxiter = settings['lambert_maxiter'] if maxiter is None else maxiter
+    dtype = settings['dtype']
+    ipos = np.ascontiguousarray(ipos, dtype=float)
+    tpos = np.ascontiguousarray(tpos, dtype=float)
+    n = ipos.shape[0]
+    targett = np.ascontiguousarray(np.broadcast_to(
+        np.asarray(targett, dtype=float), (n,)))
+    mu = np.ascontiguousarray(np.broadcast_to(np.asarray(mu, dtype=float),
+                                              (n,)))
+    ccw = np.ascontiguousarray(np.broadcast_to(np.asarray(ccw, dtype=bool),
+                                               (n,)))
+    if _backend == 'numba':
+        ivel = np.empty((n, 3))
+        tvel = np.empty((n, 3))
+        _kernels()._lambert_nb(ipos, tpos, targett, mu, ccw, xtol, rtol,
+                               maxiter, ivel, tvel)
+    else:
+        ivel, tvel = _lambert_numpy(ipos, tpos, targett, mu, ccw, xtol, rtol,
+                                    maxiter)
+    return ivel.astype(dtype, copy=False), tvel.astype(dtype, copy=False)
+
+
+if __name__ == '__main__':
+    # Throughput and worst errors of the accuracy tiers, with 'high' as the
+    # reference:  python twobodykernels.py [orbits] [epochs]
+    import sys
+    import time
+    m = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    rng = np.random.default_rng(0)
+    mu = 1.32712440041e20
+    rlen = rng.uniform(0.5, 5.0, m) * 1.496e11
+    direction = rng.normal(size=(m, 3)) * np.array([1.0, 1.0, 0.2])
+    direction /= np.linalg.norm(direction, axis=1)[:, None]
+    r0 = direction * rlen[:, None]
+    v0 = np.cross(np.array([0.0, 0.0, 1.0]), direction)
+    v0 = (v0 / np.linalg.norm(v0, axis=1)[:, None] + rng.normal(
+        scale=0.2, size=(m, 3))) * (np.sqrt(mu / rlen)
+                                    * rng.uniform(0.7, 1.25, m))[:, None]
+    dt = rng.uniform(-3650.0, 3650.0, (m, k)) * 86400.0
+    ipos = r0
+    tpos = np.roll(r0, 1, axis=0)
+    tof = rng.uniform(50.0, 1000.0, m) * 86400.0
+
+    def best_time(func, repeat=3):
+        func()
+        seconds = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    print('{} orbits x {} epochs, {} Lambert problems'.format(m, k, m))
+    print('tier      backend  pos err  vel err  lambert err  '
+          'kepler/s   lambert/s')
+    for backend in BACKENDS:
+        set_backend(backend)
+        rpos, rvel = kepler(r0, v0, mu, dt, precision='high')
+        rivel, rtvel = lambert(ipos, tpos, tof, mu, precision='high')
+        for tier in PRECISIONS:
+            pos, vel = kepler(r0, v0, mu, dt, precision=tier)
+            ivel, tvel = lambert(ipos, tpos, tof, mu, precision=tier)
+            perr = (np.linalg.norm(pos - rpos, axis=-1)
+                    / np.linalg.norm(rpos, axis=-1)).max()
+            verr = (np.linalg.norm(vel - rvel, axis=-1)
+                    / np.linalg.norm(rvel, axis=-1)).max()
+            ok = np.isfinite(rivel[:, 0])
+            lerr = (np.linalg.norm(ivel - rivel, axis=-1)[ok]
+                    / np.linalg.norm(rivel, axis=-1)[ok]).max()
+            kt = best_time(lambda: kepler(r0, v0, mu, dt, precision=tier))
+            lt = best_time(lambda: lambert(ipos, tpos, tof, mu,
+                                           precision=tier))
+            print('{:9s} {:7s}  {:7.1e}  {:7.1e}  {:11.1e}  {:9.3g}  '
+                  '{:9.3g}'.format(tier, backend, perr, verr, lerr,
+                                   m * k / kt, m / lt))
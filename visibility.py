@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Visibility culling for large sets of orbiting bodies
+
+VisibilityCuller decides which bodies can appear in the current view
+frustum without propagating them. Each body has two cached bounding
+spheres:
+  - the apoapsis sphere around the central body (radius Q = a(1 + e)),
+    which always contains the body;
+  - a motion sphere around its last computed position, with radius
+    v_max * |t - t_last| (v_max is the speed at periapsis), which contains
+    the body at time t.
+A body is culled if either sphere is outside one of the frustum planes,
+or if it would be smaller than a pixel even at the nearest point of the
+bounds. Only the remaining bodies are propagated; the culled ones keep
+their last state and are brought up to date when they become visible.
+
+The frustum is given as six planes (a, b, c, d) with normals pointing
+inside, as returned by vtkCamera.GetFrustumPlanes().
+"""
+
+import math
+import numpy as np
+
+import twobodykernels
+from pytwobodyorbit import stack_orbits
+
+
+def _bounds(r0, v0, mu):
+    """Returns the apoapsis distance and largest speed of epoch states
+    """
+    rlen = np.sqrt((r0 ** 2).sum(axis=1))
+    v2 = (v0 ** 2).sum(axis=1)
+    energy = v2 * 0.5 - mu / rlen
+    hlen = np.sqrt((np.cross(r0, v0) ** 2).sum(axis=1))
+    ecc = np.sqrt(np.maximum(1.0 + 2.0 * energy * hlen ** 2 / mu ** 2, 0.0))
+    with np.errstate(divide='ignore'):
+        sma = np.where(energy < 0.0, (-0.5) * mu / energy, np.inf)
+        peri = hlen ** 2 / mu / (1.0 + ecc)
+    apoapsis = np.where(ecc < 1.0, sma * (1.0 + ecc), np.inf)
+    vmax = np.sqrt(mu * (1.0 + ecc) / peri)
+    return apoapsis, vmax
+
+
+class VisibilityCuller:
+    """Cached bounding volumes and lazily updated states of many orbits
+
+    """
+    def __init__(self, orbits, precision=None):
+        """
+        Args:
+            orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+            precision: Accuracy tier of the propagation (see
+                twobodykernels.PRECISIONS), e.g. 'render' for display
+        """
+        self.precision = precision
+        self.r0, self.v0, self.t0, self.mu = [
+            np.array(v, dtype=float) for v in stack_orbits(orbits)]
+        m = self.r0.shape[0]
+        self.apoapsis, self.vmax = _bounds(self.r0, self.v0, self.mu)
+        # Last computed states
+        self.pos = self.r0.copy()
+        self.vel = self.v0.copy()
+        self.t = self.t0.copy()
+        # Bodies left behind at their last state by culling, and the ones
+        # the last update brought back up to date
+        self.stale = np.zeros(m, dtype=bool)
+        self.revived = np.zeros(0, dtype=int)
+        self.stats = {'bodies': m, 'visible': m, 'propagated': 0}
+
+    def __len__(self):
+        return self.r0.shape[0]
+
+    def replace(self, index, orbits):
+        """Replaces the orbits of some bodies, e.g. after a catalog update
+
+        Args:
+            index: Indices of the bodies, shape (n,)
+            orbits: Their new orbits, sequence of n TwoBodyOrbit objects
+                or an OrbitCatalog
+        """
+        index = np.asarray(index, dtype=int)
+        r0, v0, t0, mu = [np.array(v, dtype=float)
+                          for v in stack_orbits(orbits)]
+        if r0.shape[0] != index.shape[0]:
+            raise(ValueError('One orbit is needed per index: '
+                             'visibility.VisibilityCuller.replace'))
+        self.r0[index], self.v0[index] = r0, v0
+        self.t0[index], self.mu[index] = t0, mu
+        self.apoapsis[index], self.vmax[index] = _bounds(r0, v0, mu)
+        self.pos[index], self.vel[index] = r0, v0
+        self.t[index] = t0
+        self.stale[index] = True
+
+    def extend(self, orbits):
+        """Appends bodies after the existing ones
+
+        Args:
+            orbits: Sequence of TwoBodyOrbit objects, or an OrbitCatalog
+        """
+        r0, v0, t0, mu = [np.array(v, dtype=float)
+                          for v in stack_orbits(orbits)]
+        apoapsis, vmax = _bounds(r0, v0, mu)
+        self.r0 = np.concatenate([self.r0, r0])
+        self.v0 = np.concatenate([self.v0, v0])
+        self.t0 = np.concatenate([self.t0, t0])
+        self.mu = np.concatenate([self.mu, mu])
+        self.apoapsis = np.concatenate([self.apoapsis, apoapsis])
+        self.vmax = np.concatenate([self.vmax, vmax])
+        self.pos = np.concatenate([self.pos, r0])
+        self.vel = np.concatenate([self.vel, v0])
+        self.t = np.concatenate([self.t, t0])
+        self.stale = np.concatenate([self.stale,
+                                     np.ones(r0.shape[0], dtype=bool)])
+        self.stats['bodies'] = len(self)
+
+    def delete(self, index):
+        """Removes bodies; the following ones move down to fill the gaps
+
+        Args:
+            index: Indices of the bodies to remove
+        """
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(index, dtype=int)] = False
+        for name in ('r0', 'v0', 't0', 'mu', 'apoapsis', 'vmax',
+                     'pos', 'vel', 't', 'stale'):
+            setattr(self, name, getattr(self, name)[keep])
+        self.stats['bodies'] = len(self)
+
+    def visible(self, planes, t, radius=0.0, eye=None, pixel_angle=0.0):
+        """Returns a mask of the bodies that can be visible at time t
+
+        Args:
+            planes: Frustum planes, array-like object of 24 floats or (6, 4)
+            t: Time
+            radius: Drawn radius of the bodies, scalar or shape (m,)
+            eye: Camera position, needed for the pixel size test
+            pixel_angle: Angle subtended by one pixel (radians). Bodies
+                smaller than this at their nearest possible distance are
+                culled
+        Returns: mask
+            mask: Boolean Numpy array of shape (m,)
+        """
+        planes = np.asarray(planes, dtype=float).reshape(6, 4)
+        normal = planes[:, :3]
+        scale = np.sqrt((normal ** 2).sum(axis=1))
+        normal = normal / scale[:, None]
+        offset = planes[:, 3] / scale
+        radius = np.broadcast_to(np.asarray(radius, dtype=float),
+                                 (len(self),))
+
+        # Apoapsis spheres are centered on the central body
+        apo = self.apoapsis + radius
+        mask = (offset[None, :] >= (-1.0) * apo[:, None]).all(axis=1)
+        # Motion spheres around the last computed positions
+        reach = self.vmax * np.abs(t - self.t) + radius
+        dist = self.pos @ normal.T + offset[None, :]
+        mask &= (dist >= (-1.0) * reach[:, None]).all(axis=1)
+
+        if eye is not None and pixel_angle > 0.0:
+            eye = np.asarray(eye, dtype=float)
+            near = np.sqrt(((self.pos - eye) ** 2).sum(axis=1)) - reach
+            elen = math.sqrt(float(eye @ eye))
+            near = np.maximum(near, elen - apo)
+            with np.errstate(divide='ignore'):
+                mask &= (near <= 0.0) | (radius / np.maximum(near, 0.0)
+                                         >= pixel_angle)
+        self.stats['visible'] = int(mask.sum())
+        return mask
+
+    def update(self, t, mask=None):
+        """Propagates the selected bodies to time t
+
+        Args:
+            t: Time
+            mask: Boolean mask or index array of the bodies to propagate.
+                Bodies already at time t are skipped. Default is all
+        Returns: index, pos
+            index: Indices of the propagated bodies
+            pos: Their positions, Numpy array of shape (n, 3)
+
+            Bodies not propagated are marked in stale; the stale ones that
+            this update propagates are listed in revived (their trails,
+            for instance, would jump from the old position)
+        """
+        index = np.arange(len(self)) if mask is None else \
+            np.arange(len(self))[mask]
+        index = index[self.t[index] != t]
+        self.revived = index[self.stale[index]]
+        if index.shape[0]:
+            dt = np.full((index.shape[0], 1), float(t)) \
+                - self.t0[index, None]
+            pos, vel = twobodykernels.kepler(self.r0[index], self.v0[index],
+                                             self.mu[index], dt,
+                                             precision=self.precision)
+            self.pos[index] = pos[:, 0]
+            self.vel[index] = vel[:, 0]
+            self.t[index] = t
+        self.stale = self.t != t
+        self.stats['propagated'] = int(index.shape[0])
+        return index, self.pos[index]
+
+    def locate(self, index, t):
+        """Returns positions of some bodies at time t, leaving the cache
+
+        Args:
+            index: Indices of the bodies, shape (n,)
+            t: Time
+        Returns: pos
+            pos: Numpy array of shape (n, 3)
+        """
+        index = np.asarray(index, dtype=int)
+        dt = np.full((index.shape[0], 1), float(t)) - self.t0[index, None]
+        pos, vel = twobodykernels.kepler(self.r0[index], self.v0[index],
+                                         self.mu[index], dt)
+        return pos[:, 0]